@@ -0,0 +1,138 @@
+"""
+Synthetic Chromium-like browser profiles for benchmarks.
+
+Profiles are generated from a seed, so every run and every machine works on
+the same bytes. File sizes follow a log-normal distribution, which matches
+real profiles well: thousands of small cache and LevelDB files plus a few
+large ones.
+"""
+import math
+import os
+import random
+from typing import List, NamedTuple, Tuple
+
+
+class ProfileSpec(NamedTuple):
+    """Shape of a synthetic profile."""
+    files: int
+    median_size: int
+    sigma: float = 1.5
+    max_size: int = 8 * 1024 * 1024
+    # Fraction of each file that compresses well (the rest is random bytes)
+    compressible: float = 0.5
+    # Size of a component file that is identical in every generated profile
+    shared_size: int = 0
+
+
+PROFILE_SIZES = {
+    "small": ProfileSpec(files=300, median_size=4 * 1024, shared_size=2 * 1024 * 1024),
+    "medium": ProfileSpec(files=2000, median_size=8 * 1024, shared_size=16 * 1024 * 1024),
+    "large": ProfileSpec(files=8000, median_size=16 * 1024, shared_size=64 * 1024 * 1024),
+}
+
+# Directories files are spread over, with their share of the files
+_LAYOUT = [
+    ("Default/Cache/Cache_Data", 0.45),
+    ("Default/Code Cache/js", 0.2),
+    ("Default/Service Worker/CacheStorage", 0.1),
+    ("Default/IndexedDB/https_www.example.com_0.indexeddb.leveldb", 0.1),
+    ("Default/Local Storage/leveldb", 0.05),
+    ("Default/Session Storage", 0.05),
+    ("Default/GPUCache", 0.05),
+]
+
+# Small files a browser rewrites on every run
+_STATE_FILES = [
+    "Local State",
+    "Default/Cookies",
+    "Default/History",
+    "Default/Login Data",
+    "Default/Preferences",
+    "Default/Web Data",
+]
+
+SHARED_FILE = "WidevineCdm/4.10.2710.0/_platform_specific/libwidevinecdm.so"
+
+
+def generate_profile(path: str, spec: ProfileSpec, seed: int = 0) -> Tuple[int, int]:
+    """
+    Write a synthetic profile.
+
+    Args:
+        path: Profile directory (created if missing)
+        spec: Shape of the profile
+        seed: Seed of the file names, sizes and contents
+
+    Returns:
+        Tuple[int, int]: Number of files and total bytes written
+    """
+    rng = random.Random(seed)
+    files = 0
+    total = 0
+    for rel_path, size in _plan(spec, rng):
+        total += _write(os.path.join(path, rel_path), _content(rng, size, spec.compressible))
+        files += 1
+    if spec.shared_size:
+        # Same bytes in every profile, whatever the seed
+        total += _write(os.path.join(path, SHARED_FILE), _content(random.Random(-1), spec.shared_size, 0.0))
+        files += 1
+    return files, total
+
+
+def churn_profile(path: str, fraction: float, seed: int = 0) -> int:
+    """
+    Simulate a browser run: rewrite the state files and a fraction of the other files.
+
+    Args:
+        path: Profile directory
+        fraction: Share of the non-state files to rewrite
+        seed: Seed of the choice of files and their new contents
+
+    Returns:
+        int: Bytes written
+    """
+    rng = random.Random(seed)
+    candidates = []
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            rel_path = os.path.relpath(os.path.join(dirpath, name), path).replace(os.sep, "/")
+            if rel_path not in _STATE_FILES and rel_path != SHARED_FILE:
+                candidates.append(rel_path)
+    candidates.sort()
+    chosen = rng.sample(candidates, int(len(candidates) * fraction)) + _STATE_FILES
+    written = 0
+    for rel_path in chosen:
+        file_path = os.path.join(path, rel_path)
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 16 * 1024
+        written += _write(file_path, _content(rng, size, 0.5))
+    return written
+
+
+def _plan(spec: ProfileSpec, rng: random.Random) -> List[Tuple[str, int]]:
+    plan = [(rel_path, 16 * 1024) for rel_path in _STATE_FILES]
+    remaining = max(0, spec.files - len(plan) - (1 if spec.shared_size else 0))
+    mu = math.log(spec.median_size)
+    counts = [int(remaining * share) for _, share in _LAYOUT]
+    # Rounding leftovers go to the cache, the biggest directory
+    counts[0] += remaining - sum(counts)
+    for (directory, _), count in zip(_LAYOUT, counts):
+        for number in range(count):
+            size = min(spec.max_size, max(1, int(rng.lognormvariate(mu, spec.sigma))))
+            plan.append((f"{directory}/{number:06x}", size))
+    return plan
+
+
+def _content(rng: random.Random, size: int, compressible: float) -> bytes:
+    random_size = size - int(size * compressible)
+    pattern = rng.getrandbits(64 * 8).to_bytes(64, "little")
+    repeated = (pattern * (size // 64 + 1))[:size - random_size]
+    if not random_size:
+        return repeated
+    return rng.getrandbits(random_size * 8).to_bytes(random_size, "little") + repeated
+
+
+def _write(path: str, data: bytes) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
@@ -0,0 +1,383 @@
+"""
+Mount/unmount benchmarks across providers, storage formats and profile sizes.
+
+Every scenario runs in its own process, so that the reported peak RSS
+belongs to that scenario alone. Results are written as JSON; with
+--baseline the run fails when a scenario got slower or bigger than the
+baseline by more than --max-regression, which makes it usable as a
+regression gate in CI.
+
+Usage:
+    python -m benchmarks.run --profile small --iterations 20 --output results.json
+    python -m benchmarks.run --scenarios "local*" --baseline results.json
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Sequence
+
+from benchmarks.profiles import PROFILE_SIZES, ProfileSpec, churn_profile, generate_profile
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+# Scenario name -> with_browserstate options on top of the provider configuration
+SCENARIOS = {
+    "local": {"provider": "local"},
+    "local-delta": {"provider": "local", "delta": True},
+    "local-cache": {"provider": "local", "cache": True},
+    "local-archive": {"provider": "local", "storage_format": "archive"},
+    "local-dedup": {"provider": "local", "storage_format": "dedup"},
+    "redis": {"provider": "redis"},
+    "redis-cache": {"provider": "redis", "cache": True},
+    "redis-archive": {"provider": "redis", "storage_format": "archive"},
+    "redis-dedup": {"provider": "redis", "storage_format": "dedup"},
+    "s3": {"provider": "s3"},
+    "s3-serial": {"provider": "s3", "s3_options": {"max_concurrency": 1}},
+}
+
+# Metrics compared against a baseline; all of them are "lower is better"
+GATED_METRICS = [("mount", "p95"), ("unmount", "p95"), ("cycle", "p95"), ("peak_rss_mb", None)]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    Percentile with linear interpolation between the closest ranks.
+
+    Args:
+        values: Samples
+        q: Percentile between 0 and 100
+
+    Returns:
+        float: The percentile, or 0.0 without samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(seconds: Sequence[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    return {
+        "p50": round(1000 * percentile(seconds, 50), 3),
+        "p95": round(1000 * percentile(seconds, 95), 3),
+        "p99": round(1000 * percentile(seconds, 99), 3),
+        "mean": round(1000 * sum(seconds) / len(seconds), 3) if seconds else 0.0,
+        "max": round(1000 * max(seconds), 3) if seconds else 0.0,
+    }
+
+
+def run_scenario(
+    name: str,
+    options: dict,
+    spec: ProfileSpec,
+    workdir: str,
+    iterations: int = 10,
+    warmup: int = 1,
+    churn: float = 0.05,
+    users: int = 1
+) -> dict:
+    """
+    Run mount/unmount cycles of one scenario in the current process.
+
+    Every user's session is seeded with a generated profile first. Each
+    cycle then mounts a session, rewrites part of it like a browser run
+    would, and unmounts it.
+
+    Args:
+        name: Scenario name
+        options: with_browserstate options; "cache": True is replaced by a MountCache in workdir
+        spec: Shape of the generated profiles
+        workdir: Directory for storage, mounts and caches
+        iterations: Number of measured cycles
+        warmup: Number of unmeasured cycles run first
+        churn: Share of the profile files rewritten per cycle
+        users: Number of users the cycles rotate over
+
+    Returns:
+        dict: Results of the scenario
+    """
+    from browserstate_nova_adapter import MountCache, mount_browserstate_session
+
+    options = dict(options)
+    options.setdefault("storage_path", os.path.join(workdir, "storage"))
+    options.setdefault("temp_dir", os.path.join(workdir, "mounts"))
+    if options.get("cache") is True:
+        options["cache"] = MountCache(os.path.join(workdir, "cache"))
+
+    user_ids = [f"user{number}" for number in range(users)]
+    profile_files = profile_bytes = 0
+    seed_seconds = []
+    for number, user_id in enumerate(user_ids):
+        session = mount_browserstate_session(user_id=user_id, session_id="default", **options)
+        shutil.rmtree(session.path)
+        profile_files, profile_bytes = generate_profile(session.path, spec, seed=number)
+        start = time.perf_counter()
+        session.unmount()
+        seed_seconds.append(time.perf_counter() - start)
+
+    mount_seconds: List[float] = []
+    unmount_seconds: List[float] = []
+    cycle_seconds: List[float] = []
+    for cycle in range(warmup + iterations):
+        user_id = user_ids[cycle % users]
+        start = time.perf_counter()
+        session = mount_browserstate_session(user_id=user_id, session_id="default", **options)
+        mounted = time.perf_counter()
+        churn_profile(session.path, churn, seed=cycle)
+        churned = time.perf_counter()
+        session.unmount()
+        done = time.perf_counter()
+        if cycle >= warmup:
+            mount_seconds.append(mounted - start)
+            unmount_seconds.append(done - churned)
+            cycle_seconds.append((mounted - start) + (done - churned))
+
+    transfer_seconds = sum(cycle_seconds)
+    return {
+        "scenario": name,
+        "options": {key: value for key, value in options.items() if key in ("provider", "delta", "storage_format")},
+        "cache": options.get("cache") is not None,
+        "profile": {"files": profile_files, "bytes": profile_bytes},
+        "iterations": iterations,
+        "users": users,
+        "seed_upload": summarize(seed_seconds),
+        "mount": summarize(mount_seconds),
+        "unmount": summarize(unmount_seconds),
+        "cycle": summarize(cycle_seconds),
+        "cycles_per_s": round(iterations / transfer_seconds, 3) if transfer_seconds else None,
+        "throughput_mb_s": round(2 * profile_bytes * iterations / transfer_seconds / 1e6, 3) if transfer_seconds else None,
+        "storage_bytes": _directory_size(options["storage_path"]) if options["provider"] == "local" else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def compare(results: List[dict], baseline: List[dict], max_regression: float) -> List[str]:
+    """
+    Find results that regressed against a baseline run.
+
+    Args:
+        results: Results of this run
+        baseline: Results of the baseline run
+        max_regression: Allowed relative increase, e.g. 0.2 for 20%
+
+    Returns:
+        List[str]: One message per regressed metric
+    """
+    previous = {_result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get(_result_key(result))
+        if base is None:
+            continue
+        for metric, stat in GATED_METRICS:
+            old = base.get(metric) if stat is None else base.get(metric, {}).get(stat)
+            new = result.get(metric) if stat is None else result.get(metric, {}).get(stat)
+            if old and new is not None and new > old * (1 + max_regression):
+                label = metric if stat is None else f"{metric} {stat}"
+                regressions.append(
+                    f"{result['scenario']} ({result['profile_name']}): {label} {old} -> {new} (+{100 * (new / old - 1):.0f}%)"
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default="*",
+                        help=f"Comma separated scenario names or globs out of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILE_SIZES),
+                        help="Profile size preset; repeat for several (default: small)")
+    parser.add_argument("--files", type=int, help="Override the number of files per profile")
+    parser.add_argument("--median-size", type=int, help="Override the median file size in bytes")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--churn", type=float, default=0.05, help="Share of files rewritten per cycle")
+    parser.add_argument("--users", type=int, default=1, help="Number of users the cycles rotate over")
+    parser.add_argument("--redis", metavar="HOST:PORT",
+                        help="Redis server for the redis scenarios (default: an in-process fakeredis server)")
+    parser.add_argument("--s3", metavar="ENDPOINT",
+                        help="S3-compatible endpoint for the s3 scenarios (default: an in-process moto server)")
+    parser.add_argument("--workdir", help="Directory for storage and mounts (default: a temporary directory)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    patterns = [pattern.strip() for pattern in args.scenarios.split(",")]
+    names = [name for name in SCENARIOS if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+    if not names:
+        parser.error(f"No scenario matches {args.scenarios!r}")
+
+    redis_server = None
+    redis_options = None
+    if any(SCENARIOS[name]["provider"] == "redis" for name in names):
+        if args.redis:
+            host, _, port = args.redis.rpartition(":")
+            redis_options = {"host": host or "localhost", "port": int(port)}
+        else:
+            redis_server, redis_options = _start_redis_stand_in()
+            if redis_server is None:
+                names = [name for name in names if SCENARIOS[name]["provider"] != "redis"]
+                print("fakeredis is not installed, skipping the redis scenarios", file=sys.stderr)
+
+    s3_server = None
+    s3_options = None
+    if any(SCENARIOS[name]["provider"] == "s3" for name in names):
+        if args.s3:
+            s3_options = {"endpoint": args.s3}
+        else:
+            s3_server, s3_options = _start_s3_stand_in()
+            if s3_server is None:
+                names = [name for name in names if SCENARIOS[name]["provider"] != "s3"]
+                print("moto is not installed, skipping the s3 scenarios", file=sys.stderr)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="browserstate-nova-bench-")
+    results = []
+    try:
+        for profile_name in args.profile or ["small"]:
+            spec = PROFILE_SIZES[profile_name]
+            if args.files:
+                spec = spec._replace(files=args.files)
+            if args.median_size:
+                spec = spec._replace(median_size=args.median_size)
+            for name in names:
+                options = dict(SCENARIOS[name])
+                if options["provider"] == "redis":
+                    options["redis_options"] = dict(redis_options, key_prefix=f"bench-{profile_name}-{name}")
+                if options["provider"] == "s3":
+                    options["s3_options"] = dict(
+                        s3_options, bucket_name=_create_bucket(s3_options, f"bench-{profile_name}-{name}"),
+                        **options.get("s3_options", {})
+                    )
+                scenario_dir = os.path.join(workdir, f"{profile_name}-{name}")
+                print(f"Running {name} with the {profile_name} profile", file=sys.stderr)
+                # A fresh process per scenario keeps peak RSS and warm state apart
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(
+                        run_scenario, name, options, spec, scenario_dir,
+                        args.iterations, args.warmup, args.churn, args.users,
+                    ).result()
+                result["profile_name"] = profile_name
+                results.append(result)
+                shutil.rmtree(scenario_dir, ignore_errors=True)
+    finally:
+        if redis_server is not None:
+            redis_server.shutdown()
+            redis_server.server_close()
+        if s3_server is not None:
+            s3_server.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def _start_redis_stand_in():
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        return None, None
+    import threading
+
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, {"host": host, "port": port}
+
+
+def _start_s3_stand_in():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return None, None
+
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, {
+        "endpoint": f"http://{host}:{port}",
+        "region": "us-east-1",
+        "access_key_id": "testing",
+        "secret_access_key": "testing",
+    }
+
+
+def _create_bucket(s3_options: dict, bucket_name: str) -> str:
+    import boto3
+
+    client = boto3.client(
+        "s3",
+        endpoint_url=s3_options["endpoint"],
+        region_name=s3_options.get("region", "us-east-1"),
+        aws_access_key_id=s3_options.get("access_key_id"),
+        aws_secret_access_key=s3_options.get("secret_access_key"),
+    )
+    try:
+        client.create_bucket(Bucket=bucket_name)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return bucket_name
+
+
+def _result_key(result: dict):
+    return result["scenario"], result.get("profile_name")
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(peak * scale / (1024 * 1024), 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,296 @@
-from contextlib import contextmanager
-from typing import Optional, Literal, Dict, Any
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Executor, Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, Literal, Dict, Any, Iterable, List, Tuple, Union
 from browserstate import BrowserState, BrowserStateOptions
 
-_user_browserstate_instance = None  # Global so unmount can access it
+from .cache import MountCache
+from .compaction import ProfileCompactor
+from .filters import ProfileFilter
+from .uploader import BackgroundUploader
+from .clients import ClientPool
+from .manifest import FileEntry, ManifestDiff, build_manifest, diff_manifests
+from .integrity import IntegrityError, IntegrityStore, create_record, verify_profile
+from .lease import (
+    DEFAULT_LEASE_TTL,
+    Lease,
+    LeaseLostError,
+    LeaseStore,
+    LeaseTimeoutError,
+    LocalLeaseStore,
+    RedisLeaseStore,
+    acquire_lease,
+    create_lease_store,
+)
+from .blobs import BlobStore, LocalBlobStore, RedisBlobStore
+from .dedup import ChunkStore
+from .objects import GCSObjectStore, LocalObjectStore, ObjectStore, S3ObjectStore, create_object_store
+from .metrics import (
+    OperationMetrics,
+    LoggingHook,
+    MetricsRegistry,
+    add_metrics_hook,
+    remove_metrics_hook,
+    start_operation,
+)
+from .storage import (
+    SessionStorage,
+    LocalSessionStorage,
+    RedisSessionStorage,
+    ArchiveSessionStorage,
+    DedupSessionStorage,
+    ObjectSessionStorage,
+    create_blob_store,
+    create_session_storage,
+    _HydrationPhase,
+    _copy_profile,
+)
+from .tiered import TieredSessionStorage
+from .sweeper import SessionSweeper, SessionUsage, SweepResult, _mark_mount, _unmark_mount
+
+# Sessions mounted in this process, oldest first. Every mount gets its own
+# MountedSession handle so concurrent mounts never overwrite each other.
+_mounted_sessions: List["MountedSession"] = []
+_registry_lock = threading.Lock()
+
+
+class MountedSession:
+    """
+    Handle to a browser session mounted with mount_browserstate_session.
+
+    The handle owns the BrowserState instance (or direct session storage)
+    used for the mount, so several sessions can be mounted at the same time
+    and each one is unmounted independently of the others.
+
+    Attributes:
+        user_id: Unique identifier for the user
+        session_id: Identifier for this specific browser session
+        path: Path to the mounted browser session directory to use with Nova
+        compacted_bytes: Bytes saved by compacting the profile before its upload, None if it was not compacted
+    """
+
+    def __init__(
+        self,
+        user_id: str,
+        session_id: str,
+        path: str,
+        browserstate: Optional[BrowserState] = None,
+        storage: Optional[SessionStorage] = None,
+        cache: Optional[MountCache] = None
+    ):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.path = path
+        self._browserstate = browserstate
+        self._storage = storage
+        self._cache = cache
+        self._base_version: Optional[str] = None
+        self._manifest: Optional[Dict[str, FileEntry]] = None
+        self._profile_filter: Optional[ProfileFilter] = None
+        self._storage_config: Optional[Dict[str, Any]] = None
+        self._uploader: Optional[BackgroundUploader] = None
+        self._provider: Optional[str] = None
+        self._client_pool: Optional[ClientPool] = None
+        # Storage and clients of _client_pool retained until the session is persisted
+        self._pooled: List[Any] = []
+        self._browserstate_options: Optional[Dict[str, Any]] = None
+        self._hydration: Optional[Future] = None
+        self._integrity_storage: Optional[SessionStorage] = None
+        self._verified_record: Optional[dict] = None
+        self._checked_manifest: Optional[Dict[str, FileEntry]] = None
+        self._lease: Optional[Lease] = None
+        self._compactor: Optional[ProfileCompactor] = None
+        self.compacted_bytes: Optional[int] = None
+        self._mounted = True
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """Identity of this session: (user_id, session_id)."""
+        return (self.user_id, self.session_id)
+
+    @property
+    def mounted(self) -> bool:
+        """Whether the session is still mounted."""
+        return self._mounted
+
+    @property
+    def lease(self) -> Optional[Lease]:
+        """Lease held on this session if it was mounted with lease=True, e.g. for its (advisory) fencing number."""
+        return self._lease
+
+    def unmount(self, discard_on_error: bool = False):
+        """
+        Unmount this session, persisting its state to the storage provider.
+
+        Sessions mounted with a BackgroundUploader are handed to it and this
+        returns without waiting for the upload. Calling unmount more than
+        once is a no-op.
+
+        If the upload fails, the profile is left at path so its changes can
+        still be recovered, unless discard_on_error is set.
+
+        Args:
+            discard_on_error: Delete the profile when its upload fails
+        """
+        if not _detach_session(self):
+            return
+        mount_path = self.path
+        if self._hydration is not None:
+            try:
+                self._hydration.result()
+            except BaseException:
+                # Uploading a partial profile would delete the missing files from storage
+                logging.error(f"Session {self.session_id} was never fully downloaded; discarding its changes")
+                shutil.rmtree(self.path, ignore_errors=True)
+                _unmark_mount(mount_path)
+                if self._lease is not None:
+                    self._lease.release()
+                _release_pooled(self)
+                raise
+        try:
+            if self._uploader is not None:
+                self._uploader.submit(self)
+            else:
+                self._persist(discard_on_error)
+        finally:
+            # Gone once uploaded, cached or staged for a background upload
+            if not os.path.lexists(mount_path):
+                _unmark_mount(mount_path)
+
+    def wait_hydrated(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until a lazily mounted session is completely downloaded.
+
+        Only needed before the browser touches files outside the critical
+        set; sessions that were not mounted lazily are complete right away.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            bool: True once every file is in place, False on timeout
+
+        Raises:
+            Exception: The error that stopped the background download
+        """
+        if self._hydration is None:
+            return True
+        try:
+            self._hydration.result(timeout)
+        except FutureTimeoutError:
+            return False
+        return True
+
+    def _persist(self, discard_on_error: bool = False, final: bool = True):
+        _persist_session(self, discard_on_error, final)
+
+    async def async_unmount(self, executor: Optional[Executor] = None):
+        """
+        Unmount this session without blocking the event loop.
+
+        Args:
+            executor: Executor to run the upload in (defaults to the loop's default executor)
+        """
+        await _run_in_executor(executor, self.unmount)
+
+    def __enter__(self) -> "MountedSession":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unmount()
+
+    def __repr__(self) -> str:
+        state = "mounted" if self._mounted else "unmounted"
+        return f"<MountedSession {self.user_id}/{self.session_id} {state} at {self.path!r}>"
+
 
 def create_session_config(
     user_id: str,
     session_id: str,
-    provider: Literal["local", "s3", "gcs", "redis"] = "local",
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
     storage_path: Optional[str] = None,
     temp_dir: Optional[str] = None,
-    redis_options: Optional[dict] = None
+    redis_options: Optional[dict] = None,
+    cache: Optional[MountCache] = None,
+    delta: bool = False,
+    profile_filter: Optional[ProfileFilter] = None,
+    uploader: Optional[BackgroundUploader] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None,
+    lazy: Union[bool, ProfileFilter] = False,
+    verify: bool = True,
+    lease: bool = False,
+    lease_options: Optional[dict] = None,
+    s3_options: Optional[dict] = None,
+    gcs_options: Optional[dict] = None,
+    tier_options: Optional[dict] = None,
+    compact: Union[bool, ProfileCompactor] = False,
+    streaming: bool = False
 ) -> Dict[str, Any]:
     """
     Create a reusable session configuration for with_browserstate.
-    
+
     This helper function creates a configuration dictionary that can be
     passed to with_browserstate or mount_browserstate using ** unpacking.
-    
+
     Args:
         user_id: Unique identifier for the user
         session_id: Identifier for this specific browser session
-        provider: Storage provider ("local", "s3", "gcs", "redis")
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
         storage_path: Path for local storage (used with "local" provider)
         temp_dir: Path for temporary directory to mount session
         redis_options: Configuration for Redis connection (used with "redis" provider)
-        
+        cache: Warm profile cache to reuse unchanged sessions from (local and redis providers)
+        delta: Upload only files that changed while mounted (local provider; others upload fully)
+        profile_filter: Rules for which profile files are persisted, e.g. ProfileFilter.auth_state_only()
+        uploader: Background uploader that persists the session after unmount instead of blocking
+        storage_format: "browserstate" (BrowserState's layout), "archive" (a few compressed chunks per
+            session) or "dedup" (content-addressed chunks shared by all sessions)
+        format_options: Options of the storage format, e.g. {"compression": "zstd", "chunk_size": 8388608}
+        client_pool: Pool reusing BrowserState instances and provider clients across mounts
+        lazy: Return once the critical files are downloaded and fetch the rest in the background;
+            True uses ProfileFilter.auth_state_only() as the critical set (local and redis providers)
+        verify: Check the profile against the checksums recorded when it was uploaded, falling back to
+            the previous generation if it is corrupt (local and redis providers)
+        lease: Hold a lease on the session while it is mounted, so that no other worker using leases
+            mounts it at the same time (local and redis providers). The lease is advisory: it is checked
+            before the upload, but storage does not verify it, so a worker stalled past the lease ttl
+            during its upload can still overwrite the next holder
+        lease_options: {"ttl": seconds the lease survives without renewal (30), "timeout": seconds
+            to wait for the lease, or None to wait as long as it takes (default)}
+        s3_options: Bucket and transfer settings of the "s3" provider, e.g. {"bucket_name": "profiles",
+            "max_concurrency": 16, "part_size": 8388608}; profile files are then transferred in parallel
+        gcs_options: Bucket and transfer settings of the "gcs" provider, as for s3_options
+        tier_options: Tiers of the "tiered" provider, e.g. {"hot": "local", "cold": "s3", "max_bytes": 21474836480,
+            "max_age": 86400}; sessions are read from storage_path (or redis_options) while fresh, and
+            copied to s3_options (or gcs_options) in the background after unmount
+        compact: Vacuum SQLite databases and drop obsolete LevelDB files before uploading; True uses
+            ProfileCompactor(), which only compacts profiles of 16 MiB or more
+        streaming: Always mount through the adapter's storage code, which streams profiles with buffers of
+            format_options["buffer_size"] bytes (1 MiB) however large they are; BrowserState itself holds
+            Redis sessions in memory whole
+
     Returns:
         Dict[str, Any]: Configuration dictionary for browser session
-        
+
     Example:
         ```python
         # Create config once
         my_config = create_session_config(
-            user_id="user1", 
+            user_id="user1",
             session_id="session1",
             provider="redis",
             redis_options={"host": "localhost"}
         )
-        
+
         # Use in multiple places
         with with_browserstate(**my_config) as user_data_dir:
             # Use user_data_dir with Nova
@@ -50,87 +302,1252 @@ def create_session_config(
         "provider": provider,
         "storage_path": storage_path,
         "temp_dir": temp_dir,
-        "redis_options": redis_options
+        "redis_options": redis_options,
+        "cache": cache,
+        "delta": delta,
+        "profile_filter": profile_filter,
+        "uploader": uploader,
+        "storage_format": storage_format,
+        "format_options": format_options,
+        "client_pool": client_pool,
+        "lazy": lazy,
+        "verify": verify,
+        "lease": lease,
+        "lease_options": lease_options,
+        "s3_options": s3_options,
+        "gcs_options": gcs_options,
+        "tier_options": tier_options,
+        "compact": compact,
+        "streaming": streaming
     }
 
+
+def create_snapshot(
+    user_id: str,
+    session_id: str,
+    snapshot_id: Optional[str] = None,
+    provider: Literal["local", "redis"] = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None
+) -> str:
+    """
+    Freeze the stored state of a session as a snapshot new sessions can be branched from.
+
+    The copy is made inside the storage provider without downloading the
+    profile: hard links for local storage, a server-side COPY for Redis and
+    chunk references for the "dedup" format; "archive" copies its packed
+    chunks as they are. Changes of a session that is still mounted become
+    part of a snapshot only once the session is unmounted.
+
+    Args:
+        user_id: Unique identifier for the user
+        session_id: Session to take the snapshot of
+        snapshot_id: Name of the snapshot, replacing an existing snapshot of that name (defaults to a new random name)
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        storage_format: "browserstate", "archive" or "dedup", as the session was stored
+        format_options: Options of the storage format, e.g. {"compression": "zstd"}
+        client_pool: Pool reusing provider clients across calls
+
+    Returns:
+        str: Identifier of the snapshot
+
+    Raises:
+        ValueError: If the session does not exist or the provider has no direct storage support
+    """
+    storage = _direct_storage(
+        _storage_config(provider, storage_path, redis_options, storage_format, format_options), client_pool
+    )
+    snapshot_id = snapshot_id or uuid.uuid4().hex
+    if _copy_session(storage, user_id, session_id, storage.snapshots, snapshot_id) is None:
+        raise ValueError(f"Session {session_id} for user {user_id} does not exist")
+    logging.info(f"Took snapshot {snapshot_id} of session {session_id} for user {user_id}")
+    return snapshot_id
+
+
+def branch_session(
+    user_id: str,
+    snapshot_id: str,
+    session_id: str,
+    provider: Literal["local", "redis"] = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None
+) -> str:
+    """
+    Create a session from a snapshot, replacing any stored session of that name.
+
+    The session is copied inside the storage provider like the snapshot
+    itself, and from then on it is an ordinary session that is mounted and
+    unmounted independently of the snapshot and of other branches.
+
+    Args:
+        user_id: Unique identifier for the user
+        snapshot_id: Snapshot from create_snapshot
+        session_id: Identifier of the new session
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        storage_format: "browserstate", "archive" or "dedup", as the snapshot was stored
+        format_options: Options of the storage format, e.g. {"compression": "zstd"}
+        client_pool: Pool reusing provider clients across calls
+
+    Returns:
+        str: Version of the new session
+
+    Raises:
+        ValueError: If the snapshot does not exist or the provider has no direct storage support
+    """
+    storage = _direct_storage(
+        _storage_config(provider, storage_path, redis_options, storage_format, format_options), client_pool
+    )
+    version = _copy_session(storage.snapshots, user_id, snapshot_id, storage, session_id)
+    if version is None:
+        raise ValueError(f"Snapshot {snapshot_id} for user {user_id} does not exist")
+    return version
+
+
+def list_snapshots(
+    user_id: str,
+    provider: Literal["local", "redis"] = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None
+) -> List[str]:
+    """
+    List the snapshots of a user.
+
+    Args:
+        user_id: Unique identifier for the user
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        storage_format: "browserstate", "archive" or "dedup"
+        format_options: Options of the storage format
+        client_pool: Pool reusing provider clients across calls
+
+    Returns:
+        List[str]: Snapshot identifiers, sorted
+    """
+    storage = _direct_storage(
+        _storage_config(provider, storage_path, redis_options, storage_format, format_options), client_pool
+    )
+    return storage.snapshots.list_sessions(user_id)
+
+
+def delete_snapshot(
+    user_id: str,
+    snapshot_id: str,
+    provider: Literal["local", "redis"] = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None
+) -> bool:
+    """
+    Delete a snapshot. Sessions branched from it are not affected.
+
+    Args:
+        user_id: Unique identifier for the user
+        snapshot_id: Snapshot from create_snapshot
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        storage_format: "browserstate", "archive" or "dedup"
+        format_options: Options of the storage format
+        client_pool: Pool reusing provider clients across calls
+
+    Returns:
+        bool: False if the snapshot did not exist
+    """
+    storage = _direct_storage(
+        _storage_config(provider, storage_path, redis_options, storage_format, format_options), client_pool
+    )
+    storage.snapshots.integrity.delete(user_id, snapshot_id)
+    return storage.snapshots.delete(user_id, snapshot_id)
+
+
+def mount_branches(
+    user_id: str,
+    snapshot_id: str,
+    session_ids: Iterable[str],
+    provider: Literal["local", "redis"] = "local",
+    storage_path: Optional[str] = None,
+    temp_dir: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    delta: bool = False,
+    profile_filter: Optional[ProfileFilter] = None,
+    uploader: Optional[BackgroundUploader] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None,
+    verify: bool = True
+) -> List[MountedSession]:
+    """
+    Branch many sessions from a snapshot and mount all of them, downloading the snapshot only once.
+
+    Every session is created with branch_session. The snapshot is then
+    downloaded (and verified) once, and every mount gets its own copy of it:
+    a reflink where the file system supports copy-on-write, a regular local
+    copy otherwise. Each returned session is unmounted on its own and
+    uploads only to its own session_id.
+
+    Args:
+        user_id: Unique identifier for the user
+        snapshot_id: Snapshot from create_snapshot
+        session_ids: Identifiers of the new sessions, e.g. one per worker
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        temp_dir: Path for temporary directory to mount sessions
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        delta: Upload only files that changed while mounted (local provider; others upload fully)
+        profile_filter: Rules for which profile files are persisted, e.g. ProfileFilter.auth_state_only()
+        uploader: Background uploader that persists the sessions after unmount instead of blocking
+        storage_format: "browserstate", "archive" or "dedup", as the snapshot was stored
+        format_options: Options of the storage format, e.g. {"compression": "zstd"}
+        client_pool: Pool reusing provider clients across calls
+        verify: Check the snapshot against the checksums recorded when it was uploaded
+
+    Returns:
+        List[MountedSession]: Handles to the mounted sessions, in the order of session_ids
+
+    Raises:
+        ValueError: If the snapshot does not exist or the provider has no direct storage support
+        IntegrityError: If the downloaded snapshot does not match its checksums
+
+    Example:
+        ```python
+        snapshot_id = create_snapshot(user_id="shopper", session_id="logged-in")
+        sessions = mount_branches("shopper", snapshot_id, [f"worker-{n}" for n in range(50)])
+        ...
+        unmount_many(sessions)
+        ```
+    """
+    session_ids = list(session_ids)
+    storage_config = _storage_config(provider, storage_path, redis_options, storage_format, format_options)
+    storage = _direct_storage(storage_config, client_pool)
+    snapshots = storage.snapshots
+    seed_path = _new_mount_path(temp_dir, user_id, f"{snapshot_id}.snapshot")
+    sessions: List[MountedSession] = []
+    try:
+        version = snapshots.download(user_id, snapshot_id, seed_path, profile_filter)
+        if version is None:
+            raise ValueError(f"Snapshot {snapshot_id} for user {user_id} does not exist")
+        record = snapshots.integrity.read(user_id, snapshot_id) if verify else None
+        manifest = None
+        if record is not None and record["version"] == version:
+            manifest, problems = verify_profile(seed_path, record, profile_filter)
+            if problems:
+                raise IntegrityError(
+                    f"Snapshot {snapshot_id} for user {user_id} is corrupt: {len(problems)} files differ "
+                    f"from their checksums, e.g. {problems[0]}"
+                )
+        else:
+            record = None
+        if delta and manifest is None:
+            manifest = build_manifest(seed_path)
+
+        for number, session_id in enumerate(session_ids):
+            metrics = start_operation("mount", user_id, session_id, provider, storage_format)
+            try:
+                if uploader is not None:
+                    with metrics.phase("wait_upload"):
+                        uploader.wait_for(user_id, session_id)
+                with metrics.phase("branch"):
+                    base_version = _copy_session(snapshots, user_id, snapshot_id, storage, session_id)
+                if base_version is None:
+                    raise ValueError(f"Snapshot {snapshot_id} for user {user_id} was deleted")
+                path = _new_mount_path(temp_dir, user_id, session_id)
+                with metrics.phase("download"):
+                    if number == len(session_ids) - 1:
+                        # The last branch takes over the downloaded snapshot itself
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.rename(seed_path, path)
+                    else:
+                        _copy_profile(seed_path, path, None)
+                if metrics.enabled:
+                    metrics.add_directory(path)
+            except BaseException as e:
+                metrics.finish(e)
+                raise
+            metrics.finish()
+
+            session = MountedSession(user_id, session_id, path, storage=storage)
+            if client_pool is not None:
+                client_pool.retain(storage)
+                session._client_pool = client_pool
+                session._pooled = [storage]
+            session._storage_config = storage_config
+            session._provider = provider
+            session._base_version = base_version
+            session._profile_filter = profile_filter
+            session._uploader = uploader
+            if record is not None:
+                session._integrity_storage = storage
+                session._verified_record = dict(record, version=base_version)
+            # Copies keep the mtimes, so the snapshot's manifest describes every branch
+            if delta:
+                session._manifest = dict(manifest)
+            elif record is not None:
+                session._checked_manifest = dict(manifest)
+            sessions.append(session)
+    except BaseException:
+        for session in sessions:
+            shutil.rmtree(session.path, ignore_errors=True)
+            _unmark_mount(session.path)
+            _release_pooled(session)
+        raise
+    finally:
+        shutil.rmtree(seed_path, ignore_errors=True)
+        _unmark_mount(seed_path)
+
+    with _registry_lock:
+        _mounted_sessions.extend(sessions)
+    return sessions
+
 @contextmanager
 def with_browserstate(
     user_id: str,
     session_id: str,
-    provider: Literal["local", "s3", "gcs", "redis"] = "local",
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
     storage_path: Optional[str] = None,
     temp_dir: Optional[str] = None,
-    redis_options: Optional[dict] = None
+    redis_options: Optional[dict] = None,
+    **options: Any
 ):
     """
     Context manager for using BrowserState with Nova Act.
-    
+
+    Only the session mounted by this context manager is unmounted on exit, so
+    it is safe to use from several threads at once with different sessions.
+
     Args:
         user_id: Unique identifier for the user
         session_id: Identifier for this specific browser session
-        provider: Storage provider ("local", "s3", "gcs", "redis")
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
         storage_path: Path for local storage (used with "local" provider)
         temp_dir: Path for temporary directory to mount session
         redis_options: Configuration for Redis connection (used with "redis" provider)
-        
+        **options: Further settings of the session, e.g. cache, delta or lease, as documented in
+            create_session_config
+
     Yields:
         str: Path to the mounted browser session directory to use with Nova
     """
-    state_path = mount_browserstate(
+    session = mount_browserstate_session(
         user_id=user_id,
         session_id=session_id,
         provider=provider,
         storage_path=storage_path,
         temp_dir=temp_dir,
-        redis_options=redis_options
+        redis_options=redis_options,
+        **options
     )
     try:
-        yield state_path
+        yield session.path
     finally:
-        unmount_browserstate()
+        session.unmount()
 
 
 def mount_browserstate(
     user_id: str,
     session_id: str,
-    provider: Literal["local", "s3", "gcs", "redis"] = "local",
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
     storage_path: Optional[str] = None,
     temp_dir: Optional[str] = None,
-    redis_options: Optional[dict] = None
+    redis_options: Optional[dict] = None,
+    **options: Any
 ) -> str:
     """
     Mount browser session for use with Nova Act.
-    
+
     Args:
         user_id: Unique identifier for the user
         session_id: Identifier for this specific browser session
-        provider: Storage provider ("local", "s3", "gcs", "redis")
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
         storage_path: Path for local storage (used with "local" provider)
         temp_dir: Path for temporary directory to mount session
         redis_options: Configuration for Redis connection (used with "redis" provider)
-        
+        **options: Further settings of the session, e.g. cache, delta or lease, as documented in
+            create_session_config
+
     Returns:
         str: Path to the mounted browser session directory to use with Nova
     """
-    global _user_browserstate_instance
-    options = BrowserStateOptions(
+    return mount_browserstate_session(
         user_id=user_id,
+        session_id=session_id,
         provider=provider,
         storage_path=storage_path,
         temp_dir=temp_dir,
-        redis_options=redis_options
-    )
-    _user_browserstate_instance = BrowserState(options)
-    return _user_browserstate_instance.mount_session(session_id=session_id)["path"]
+        redis_options=redis_options,
+        **options
+    ).path
+
+
+def mount_browserstate_session(
+    user_id: str,
+    session_id: str,
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
+    storage_path: Optional[str] = None,
+    temp_dir: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    cache: Optional[MountCache] = None,
+    delta: bool = False,
+    profile_filter: Optional[ProfileFilter] = None,
+    uploader: Optional[BackgroundUploader] = None,
+    storage_format: Literal["browserstate", "archive", "dedup"] = "browserstate",
+    format_options: Optional[dict] = None,
+    client_pool: Optional[ClientPool] = None,
+    lazy: Union[bool, ProfileFilter] = False,
+    verify: bool = True,
+    lease: bool = False,
+    lease_options: Optional[dict] = None,
+    s3_options: Optional[dict] = None,
+    gcs_options: Optional[dict] = None,
+    tier_options: Optional[dict] = None,
+    compact: Union[bool, ProfileCompactor] = False,
+    streaming: bool = False
+) -> MountedSession:
+    """
+    Mount browser session and return a handle to it.
+
+    Unlike mount_browserstate, the returned handle identifies exactly this
+    session, which makes it possible to mount many sessions concurrently
+    (for example one per worker thread) and unmount each of them on its own.
+
+    Args:
+        user_id: Unique identifier for the user
+        session_id: Identifier for this specific browser session
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
+        storage_path: Path for local storage (used with "local" provider)
+        temp_dir: Path for temporary directory to mount session
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        cache, delta, profile_filter, uploader, storage_format, format_options, client_pool, lazy, verify,
+            lease, lease_options, s3_options, gcs_options, tier_options, compact, streaming: Further
+            settings of the session, as documented in create_session_config
+
+    Returns:
+        MountedSession: Handle to the mounted session
+    """
+    if _find_mounted_session(user_id, session_id):
+        logging.warning(
+            f"Session {session_id} for user {user_id} is already mounted; "
+            "the mount that is unmounted last will overwrite the other"
+        )
+
+    metrics = start_operation("mount", user_id, session_id, provider, storage_format)
+    held_lease = None
+    # Shared storage and clients this mount uses, kept from eviction while it is mounted
+    pooled: List[Any] = []
+    try:
+        if lease:
+            # Taken before anything is downloaded, so the previous holder's upload is complete
+            with metrics.phase("lease"):
+                # Tiered sessions are leased where their hot tier is
+                lease_provider = (tier_options or {}).get("hot", "local") if provider == "tiered" else provider
+                lease_client = None
+                if lease_provider == "redis" and client_pool is not None:
+                    lease_client = client_pool.redis_client(redis_options)
+                    client_pool.retain(lease_client)
+                    pooled.append(lease_client)
+                held_lease = _acquire_lease(
+                    user_id, session_id, lease_provider, storage_path, redis_options, lease_client, lease_options
+                )
+        if uploader is not None:
+            with metrics.phase("wait_upload"):
+                uploader.wait_for(user_id, session_id)
+        # Buckets configured here are accessed directly, with parallel transfers
+        object_options = s3_options if provider == "s3" else gcs_options if provider == "gcs" else None
+        if (
+            cache is not None or delta or lazy or storage_format != "browserstate" or object_options is not None
+            or provider == "tiered" or streaming
+        ):
+            storage_config = _storage_config(
+                provider, storage_path, redis_options, storage_format, format_options, s3_options, gcs_options,
+                tier_options
+            )
+            with metrics.phase("setup"):
+                storage = _direct_storage(storage_config, client_pool)
+            if client_pool is not None:
+                client_pool.retain(storage)
+                pooled.append(storage)
+            session = _mount_direct(
+                user_id, session_id, storage_config, storage, temp_dir, cache, delta, profile_filter, metrics,
+                lazy, verify
+            )
+        else:
+            browserstate_options = {
+                "user_id": user_id,
+                "provider": provider,
+                "storage_path": storage_path,
+                "temp_dir": temp_dir,
+                "redis_options": redis_options,
+            }
+            with metrics.phase("setup"):
+                browserstate = None
+                if client_pool is not None:
+                    browserstate = client_pool.checkout_browserstate(browserstate_options)
+                if browserstate is None:
+                    options = BrowserStateOptions(
+                        user_id=user_id,
+                        provider=provider,
+                        storage_path=storage_path,
+                        temp_dir=temp_dir,
+                        redis_options=redis_options
+                    )
+                    browserstate = BrowserState(options)
+            with metrics.phase("download"):
+                path = browserstate.mount_session(session_id=session_id)["path"]
+                _mark_mount(path, user_id, session_id)
+            if profile_filter is not None:
+                with metrics.phase("prune"):
+                    profile_filter.prune(path)
+            if metrics.enabled:
+                metrics.add_directory(path)
+            session = MountedSession(user_id, session_id, path, browserstate=browserstate)
+            session._profile_filter = profile_filter
+            session._provider = provider
+            if verify and provider in ("local", "redis"):
+                with metrics.phase("verify"):
+                    _verify_browserstate_mount(session, storage_path, redis_options, client_pool)
+            if client_pool is not None:
+                session._browserstate_options = browserstate_options
+    except BaseException as e:
+        if held_lease is not None:
+            held_lease.release()
+        for client in pooled:
+            client_pool.release(client)
+        metrics.finish(e)
+        raise
+    metrics.finish()
+
+    session._client_pool = client_pool
+    session._pooled = pooled
+    session._lease = held_lease
+    session._uploader = uploader
+    session._compactor = ProfileCompactor() if compact is True else compact or None
+    with _registry_lock:
+        _mounted_sessions.append(session)
+    return session
 
 
-def unmount_browserstate():
+def unmount_browserstate(user_id: Optional[str] = None, session_id: Optional[str] = None):
     """
-    Unmount the currently mounted browser session.
-    
+    Unmount a mounted browser session.
+
     This function should be called when finished with the browser session to ensure proper cleanup.
+    Without arguments the most recently mounted session is unmounted; pass
+    user_id and session_id to unmount a specific one.
+
+    Args:
+        user_id: User of the session to unmount
+        session_id: Identifier of the session to unmount
     """
-    global _user_browserstate_instance
-    if _user_browserstate_instance:
-        _user_browserstate_instance.unmount_session()
-        _user_browserstate_instance = None 
\ No newline at end of file
+    if (user_id is None) != (session_id is None):
+        raise ValueError("user_id and session_id must be given together")
+
+    if user_id is None:
+        with _registry_lock:
+            session = _mounted_sessions[-1] if _mounted_sessions else None
+    else:
+        session = _find_mounted_session(user_id, session_id)
+    if session:
+        session.unmount()
+
+
+def wait_hydrated(user_data_dir: str, timeout: Optional[float] = None) -> bool:
+    """
+    Wait until the session mounted at user_data_dir is completely downloaded.
+
+    For sessions mounted with lazy=True through with_browserstate, which
+    only yields the path; see MountedSession.wait_hydrated.
+
+    Args:
+        user_data_dir: Path of the mounted session
+        timeout: Maximum number of seconds to wait
+
+    Returns:
+        bool: True once every file is in place, False on timeout
+
+    Raises:
+        ValueError: If no session is mounted at user_data_dir
+    """
+    with _registry_lock:
+        sessions = [session for session in _mounted_sessions if session.path == user_data_dir]
+    if not sessions:
+        raise ValueError(f"No session is mounted at {user_data_dir}")
+    return sessions[-1].wait_hydrated(timeout)
+
+
+def get_mounted_sessions() -> List[MountedSession]:
+    """
+    List the sessions currently mounted in this process.
+
+    Returns:
+        List[MountedSession]: Mounted sessions, oldest first
+    """
+    with _registry_lock:
+        return list(_mounted_sessions)
+
+
+@asynccontextmanager
+async def async_with_browserstate(
+    user_id: str,
+    session_id: str,
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
+    storage_path: Optional[str] = None,
+    temp_dir: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    executor: Optional[Executor] = None,
+    **options: Any
+):
+    """
+    Async context manager for using BrowserState with Nova Act from asyncio code.
+
+    Provider downloads and uploads run in an executor so the event loop keeps
+    serving other tasks, and many sessions can be mounted concurrently on one
+    loop. Accepts the same configuration as with_browserstate, so a dict from
+    create_session_config can be passed with ** unpacking.
+
+    Args:
+        user_id: Unique identifier for the user
+        session_id: Identifier for this specific browser session
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
+        storage_path: Path for local storage (used with "local" provider)
+        temp_dir: Path for temporary directory to mount session
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        executor: Executor to run provider I/O in (defaults to the loop's default executor)
+        **options: Further settings of the session, e.g. cache, delta or lease, as documented in
+            create_session_config
+
+    Yields:
+        str: Path to the mounted browser session directory to use with Nova
+    """
+    session = await async_mount_browserstate_session(
+        user_id=user_id,
+        session_id=session_id,
+        provider=provider,
+        storage_path=storage_path,
+        temp_dir=temp_dir,
+        redis_options=redis_options,
+        executor=executor,
+        **options
+    )
+    try:
+        yield session.path
+    finally:
+        await session.async_unmount(executor)
+
+
+async def async_mount_browserstate(
+    user_id: str,
+    session_id: str,
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
+    storage_path: Optional[str] = None,
+    temp_dir: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    executor: Optional[Executor] = None,
+    **options: Any
+) -> str:
+    """
+    Mount browser session for use with Nova Act without blocking the event loop.
+
+    Args:
+        user_id: Unique identifier for the user
+        session_id: Identifier for this specific browser session
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
+        storage_path: Path for local storage (used with "local" provider)
+        temp_dir: Path for temporary directory to mount session
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        executor: Executor to run provider I/O in (defaults to the loop's default executor)
+        **options: Further settings of the session, e.g. cache, delta or lease, as documented in
+            create_session_config
+
+    Returns:
+        str: Path to the mounted browser session directory to use with Nova
+    """
+    session = await async_mount_browserstate_session(
+        user_id=user_id,
+        session_id=session_id,
+        provider=provider,
+        storage_path=storage_path,
+        temp_dir=temp_dir,
+        redis_options=redis_options,
+        executor=executor,
+        **options
+    )
+    return session.path
+
+
+async def async_mount_browserstate_session(
+    user_id: str,
+    session_id: str,
+    provider: Literal["local", "s3", "gcs", "redis", "tiered"] = "local",
+    storage_path: Optional[str] = None,
+    temp_dir: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    executor: Optional[Executor] = None,
+    **options: Any
+) -> MountedSession:
+    """
+    Mount browser session without blocking the event loop and return a handle to it.
+
+    If the awaiting task is cancelled while the download is in flight, the
+    session is unmounted again as soon as the download finishes.
+
+    Args:
+        user_id: Unique identifier for the user
+        session_id: Identifier for this specific browser session
+        provider: Storage provider ("local", "s3", "gcs", "redis", "tiered")
+        storage_path: Path for local storage (used with "local" provider)
+        temp_dir: Path for temporary directory to mount session
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        executor: Executor to run provider I/O in (defaults to the loop's default executor)
+        **options: Further settings of the session, e.g. cache, delta or lease, as documented in
+            create_session_config
+
+    Returns:
+        MountedSession: Handle to the mounted session
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, functools.partial(
+        mount_browserstate_session,
+        user_id=user_id,
+        session_id=session_id,
+        provider=provider,
+        storage_path=storage_path,
+        temp_dir=temp_dir,
+        redis_options=redis_options,
+        **options
+    ))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(
+            lambda done: _unmount_abandoned_mount(loop, executor, done)
+        )
+        raise
+
+
+async def async_unmount_browserstate(
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    executor: Optional[Executor] = None
+):
+    """
+    Unmount a mounted browser session without blocking the event loop.
+
+    Args:
+        user_id: User of the session to unmount
+        session_id: Identifier of the session to unmount
+        executor: Executor to run the upload in (defaults to the loop's default executor)
+    """
+    await _run_in_executor(executor, unmount_browserstate, user_id, session_id)
+
+
+async def _run_in_executor(executor: Optional[Executor], func, *args):
+    # Shielded so that cancelling the caller never leaves an upload half-tracked;
+    # the executor job runs to completion either way.
+    loop = asyncio.get_running_loop()
+    return await asyncio.shield(loop.run_in_executor(executor, func, *args))
+
+
+def _unmount_abandoned_mount(loop, executor: Optional[Executor], future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    loop.run_in_executor(executor, future.result().unmount)
+
+
+def _find_mounted_session(user_id: str, session_id: str) -> Optional[MountedSession]:
+    with _registry_lock:
+        for session in reversed(_mounted_sessions):
+            if session.key == (user_id, session_id):
+                return session
+    return None
+
+
+def _acquire_lease(
+    user_id: str,
+    session_id: str,
+    provider: str,
+    storage_path: Optional[str],
+    redis_options: Optional[dict],
+    redis_client: Any,
+    lease_options: Optional[dict]
+) -> Lease:
+    lease_options = lease_options or {}
+    store = create_lease_store(provider, storage_path, redis_options, redis_client)
+    return acquire_lease(
+        store,
+        f"{user_id}/{session_id}",
+        ttl=lease_options.get("ttl", DEFAULT_LEASE_TTL),
+        timeout=lease_options.get("timeout"),
+    )
+
+
+def _storage_config(
+    provider: str,
+    storage_path: Optional[str],
+    redis_options: Optional[dict],
+    storage_format: str,
+    format_options: Optional[dict],
+    s3_options: Optional[dict] = None,
+    gcs_options: Optional[dict] = None,
+    tier_options: Optional[dict] = None
+) -> Dict[str, Any]:
+    return {
+        "provider": provider,
+        "storage_path": storage_path,
+        "redis_options": redis_options,
+        "storage_format": storage_format,
+        "format_options": format_options,
+        "s3_options": s3_options,
+        "gcs_options": gcs_options,
+        "tier_options": tier_options,
+    }
+
+
+def storage_from_config(config: Dict[str, Any]) -> SessionStorage:
+    """
+    Create direct storage for the storage settings of a session configuration.
+
+    Args:
+        config: Keyword arguments of create_session_config; only the storage settings
+            (provider, storage_path, redis_options, storage_format, format_options,
+            s3_options, gcs_options, tier_options) are used, with the same defaults
+
+    Returns:
+        SessionStorage: Storage the configuration mounts sessions from
+    """
+    settings = create_session_config(**dict({"user_id": "", "session_id": ""}, **config))
+    return create_session_storage(**_storage_config(
+        settings["provider"], settings["storage_path"], settings["redis_options"], settings["storage_format"],
+        settings["format_options"], settings["s3_options"], settings["gcs_options"], settings["tier_options"],
+    ))
+
+
+def _direct_storage(storage_config: Dict[str, Any], client_pool: Optional[ClientPool]) -> SessionStorage:
+    if client_pool is not None:
+        return client_pool.session_storage(storage_config)
+    return create_session_storage(**storage_config)
+
+
+def _copy_session(
+    source: SessionStorage,
+    user_id: str,
+    session_id: str,
+    target: SessionStorage,
+    target_session_id: str
+) -> Optional[str]:
+    """Copy a stored session together with its checksum record."""
+    version = source.get_version(user_id, session_id)
+    record = source.integrity.read(user_id, session_id) if source.integrity is not None else None
+    copied = source.copy_session(user_id, session_id, target, target_session_id)
+    if copied is None or target.integrity is None:
+        return copied
+    if (
+        record is not None and record["version"] is not None and record["version"] == version
+        and source.get_version(user_id, session_id) == version
+    ):
+        target.integrity.write(user_id, target_session_id, dict(record, version=copied))
+    else:
+        # A record left by an earlier session of that name does not describe the copy
+        target.integrity.delete(user_id, target_session_id, previous=False)
+    return copied
+
+
+def _mount_direct(
+    user_id: str,
+    session_id: str,
+    storage_config: Dict[str, Any],
+    storage: SessionStorage,
+    temp_dir: Optional[str],
+    cache: Optional[MountCache],
+    delta: bool,
+    profile_filter: Optional[ProfileFilter],
+    metrics: OperationMetrics,
+    lazy: Union[bool, ProfileFilter],
+    verify: bool
+) -> MountedSession:
+    path = _new_mount_path(temp_dir, user_id, session_id)
+    try:
+        return _mount_direct_at(
+            path, user_id, session_id, storage_config, storage, cache, delta, profile_filter, metrics, lazy, verify
+        )
+    except BaseException:
+        if not os.path.lexists(path):
+            _unmark_mount(path)
+        raise
+
+
+def _mount_direct_at(
+    path: str,
+    user_id: str,
+    session_id: str,
+    storage_config: Dict[str, Any],
+    storage: SessionStorage,
+    cache: Optional[MountCache],
+    delta: bool,
+    profile_filter: Optional[ProfileFilter],
+    metrics: OperationMetrics,
+    lazy: Union[bool, ProfileFilter],
+    verify: bool
+) -> MountedSession:
+    with metrics.phase("version"):
+        version = storage.get_version(user_id, session_id)
+    key = _cache_key(storage, user_id, session_id)
+    hit = False
+    if cache is not None and version is not None:
+        with metrics.phase("cache"):
+            hit = cache.checkout(key, version, path)
+    if cache is not None:
+        metrics.set_cache_hit(hit)
+    checked = verify and storage.integrity is not None
+    download_rest = None
+    critical = None
+    corrupt: Optional[IntegrityError] = None
+    try:
+        if hit:
+            logging.info(f"Mounted session {session_id} for user {user_id} from cache")
+            if profile_filter is not None:
+                with metrics.phase("prune"):
+                    profile_filter.prune(path)
+        elif lazy:
+            critical = lazy if isinstance(lazy, ProfileFilter) else ProfileFilter.auth_state_only()
+            with metrics.phase("download"):
+                version, download_rest = storage.download_lazily(
+                    user_id, session_id, path, critical, profile_filter
+                )
+            if metrics.enabled:
+                metrics.add_directory(path)
+        else:
+            with metrics.phase("download"):
+                version = storage.download(user_id, session_id, path, profile_filter)
+            if metrics.enabled:
+                metrics.add_directory(path)
+    except IntegrityError as e:
+        # Damaged data found by the download itself is handled like a failed verification
+        if not checked:
+            raise
+        corrupt = e
+
+    session = MountedSession(user_id, session_id, path, storage=storage, cache=cache)
+    session._storage_config = storage_config
+    session._provider = storage_config["provider"]
+    session._base_version = version
+    session._profile_filter = profile_filter
+    if checked:
+        session._integrity_storage = storage
+        # Cache entries were checked in from this very mount path, so they are trusted
+        if corrupt is not None or (version is not None and not hit):
+            file_filter = profile_filter if critical is None else _HydrationPhase(critical, profile_filter, True)
+            with metrics.phase("verify"):
+                try:
+                    if corrupt is not None:
+                        _fall_back(session, storage, str(corrupt))
+                        download_rest = None
+                    elif _verify_mount(session, storage, file_filter):
+                        download_rest = None
+                except BaseException:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise
+    if delta:
+        with metrics.phase("manifest"):
+            if session._checked_manifest is not None:
+                session._manifest, session._checked_manifest = session._checked_manifest, None
+            else:
+                session._manifest = build_manifest(path)
+    if download_rest is not None and version is not None:
+        _start_hydration(session, download_rest, _HydrationPhase(critical, profile_filter, False))
+    return session
+
+
+def _verify_browserstate_mount(
+    session: MountedSession,
+    storage_path: Optional[str],
+    redis_options: Optional[dict],
+    client_pool: Optional[ClientPool]
+):
+    # Reads the checksum records through direct storage of the same location BrowserState uses
+    try:
+        redis_client = None
+        if session._provider == "redis" and client_pool is not None:
+            redis_client = client_pool.redis_client(redis_options)
+        storage = create_session_storage(
+            session._provider, storage_path, redis_options, redis_client=redis_client
+        )
+        session._base_version = storage.get_version(session.user_id, session.session_id)
+        if session._base_version is not None:
+            _verify_mount(session, storage, session._profile_filter)
+    except IntegrityError:
+        shutil.rmtree(session.path, ignore_errors=True)
+        _unmark_mount(session.path)
+        raise
+    except Exception as e:
+        # BrowserState mounted the session fine; only the adapter's own bookkeeping failed
+        logging.warning(f"Cannot verify session {session.session_id} for user {session.user_id}: {e}")
+        return
+    session._integrity_storage = storage
+
+
+def _verify_mount(session: MountedSession, storage: SessionStorage, file_filter) -> bool:
+    """Check a freshly downloaded session, replacing it with the previous generation if it is corrupt."""
+    user_id, session_id = session.key
+    record = storage.integrity.read(user_id, session_id)
+    if record is None or record["version"] not in (None, session._base_version):
+        # Never uploaded through the adapter, or written by someone else since
+        return False
+    manifest, problems = verify_profile(session.path, record, file_filter)
+    if not problems:
+        session._verified_record = record
+        session._checked_manifest = manifest
+        return False
+    _fall_back(session, storage, f"{len(problems)} files differ from their checksums, e.g. {problems[0]}")
+    return True
+
+
+def _fall_back(session: MountedSession, storage: SessionStorage, reason: str):
+    """Replace a corrupt mounted session with the previous generation, if that one is intact."""
+    user_id, session_id = session.key
+    logging.warning(f"Session {session_id} for user {user_id} is corrupt ({reason}); trying the previous generation")
+    previous = storage.integrity.read(user_id, session_id, previous=True)
+    staging_path = f"{session.path}.{uuid.uuid4().hex[:8]}.previous"
+    try:
+        if previous is not None and storage.download_previous(
+            user_id, session_id, staging_path, session._profile_filter
+        ):
+            manifest, problems = verify_profile(staging_path, previous, session._profile_filter)
+            if not problems:
+                shutil.rmtree(session.path, ignore_errors=True)
+                os.rename(staging_path, session.path)
+                # Not based on the stored generation any more, so the next upload replaces it fully
+                session._base_version = None
+                session._checked_manifest = manifest
+                logging.warning(f"Mounted the previous generation of session {session_id} for user {user_id}")
+                return
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    raise IntegrityError(
+        f"Session {session_id} for user {user_id} is corrupt and no intact previous generation is available"
+    )
+
+
+def _start_hydration(session: MountedSession, download_rest, rest_filter: _HydrationPhase):
+    hydration: Future = Future()
+
+    def add_to_manifest(staging_path: str):
+        manifest = None
+        if session._verified_record is not None:
+            manifest, problems = verify_profile(staging_path, session._verified_record, rest_filter)
+            if problems:
+                raise IntegrityError(
+                    f"{len(problems)} files of session {session.session_id} differ from their checksums "
+                    f"(e.g. {problems[0]})"
+                )
+        # Taken before the files are moved in, so browser writes count as changes
+        known = session._manifest if session._manifest is not None else session._checked_manifest
+        if known is not None:
+            known.update(manifest if manifest is not None else build_manifest(staging_path))
+
+    def run():
+        try:
+            download_rest(add_to_manifest)
+        except BaseException as e:
+            logging.error(f"Downloading the rest of session {session.session_id} failed: {e}")
+            hydration.set_exception(e)
+        else:
+            hydration.set_result(None)
+
+    session._hydration = hydration
+    threading.Thread(target=run, name=f"browserstate-hydrate-{session.session_id}", daemon=True).start()
+
+
+def _new_mount_path(temp_dir: Optional[str], user_id: str, session_id: str) -> str:
+    # Unique per mount so duplicate mounts of a session never share a directory
+    base = temp_dir or os.path.join(tempfile.gettempdir(), "browserstate-nova")
+    path = os.path.join(base, user_id, f"{session_id}-{uuid.uuid4().hex[:8]}")
+    # Lets a SessionSweeper reclaim the directory if this process dies before unmounting
+    _mark_mount(path, user_id, session_id)
+    return path
+
+
+def _cache_key(storage: SessionStorage, user_id: str, session_id: str) -> str:
+    return f"{storage.scope}|{user_id}|{session_id}"
+
+
+def _upload_direct(session: MountedSession, metrics: OperationMetrics) -> str:
+    storage = session._storage
+    checked = session._integrity_storage is not None
+    manifest = None
+    if session._manifest is not None or checked:
+        with metrics.phase("manifest"):
+            known = session._manifest if session._manifest is not None else session._checked_manifest
+            manifest = build_manifest(session.path, known)
+    if session._manifest is not None:
+        diff = diff_manifests(session._manifest, manifest)
+        if not diff and session._base_version is not None:
+            logging.info(f"Session {session.session_id} unchanged, skipping upload")
+            return session._base_version
+    if checked:
+        with metrics.phase("verify"):
+            _begin_upload(session, storage, manifest)
+
+    version = None
+    if session._manifest is not None:
+        with metrics.phase("upload"):
+            version = storage.upload_changes(
+                session.user_id, session.session_id, session.path, diff, session._base_version
+            )
+        if version is not None:
+            logging.info(
+                f"Uploaded {len(diff.changed)} changed and {len(diff.deleted)} deleted "
+                f"files of session {session.session_id}"
+            )
+            metrics.add_transfer(len(diff.changed), sum(manifest[path].size for path in diff.changed))
+    if version is None:
+        with metrics.phase("upload"):
+            version = storage.upload(session.user_id, session.session_id, session.path)
+        if metrics.enabled:
+            metrics.add_directory(session.path)
+    if checked:
+        # Written last: only a record with the new version vouches for the upload
+        with metrics.phase("verify"):
+            storage.integrity.write(session.user_id, session.session_id, create_record(manifest, version))
+    return version
+
+
+def _begin_upload(session: MountedSession, storage: SessionStorage, manifest: Dict[str, FileEntry]):
+    user_id, session_id = session.key
+    record = session._verified_record
+    # Only a generation that passed verification when it was mounted is worth falling back to
+    if (
+        record is not None and session._base_version is not None
+        and storage.get_version(user_id, session_id) == session._base_version
+    ):
+        try:
+            kept = storage.keep_previous(user_id, session_id)
+        except Exception as e:
+            # E.g. a Redis server older than 6.2 without COPY; the upload itself can still go ahead
+            logging.warning(f"Could not keep the previous generation of session {session_id}: {e}")
+            kept = False
+        if kept:
+            storage.integrity.write(user_id, session_id, record, previous=True)
+    storage.integrity.write(user_id, session_id, create_record(manifest))
+
+
+def _release_pooled(session: MountedSession):
+    pooled, session._pooled = session._pooled, []
+    for client in pooled:
+        session._client_pool.release(client)
+
+
+def _detach_session(session: MountedSession) -> bool:
+    with _registry_lock:
+        if not session._mounted:
+            return False
+        session._mounted = False
+        _mounted_sessions.remove(session)
+    return True
+
+
+def _persist_session(session: MountedSession, discard_on_error: bool = False, final: bool = True):
+    # A failed upload that will be retried (final=False) keeps the lease, so the retry may still upload
+    config = session._storage_config or {}
+    metrics = start_operation(
+        "unmount",
+        session.user_id,
+        session.session_id,
+        config.get("provider", session._provider),
+        config.get("storage_format", "browserstate"),
+    )
+    persisted = False
+    try:
+        if session._lease is not None:
+            with metrics.phase("lease"):
+                try:
+                    session._lease.check()
+                except LeaseLostError:
+                    # The session belongs to the new holder of the lease now; this copy must not overwrite it
+                    logging.error(f"Discarding the changes to session {session.session_id}: its lease was lost")
+                    shutil.rmtree(session.path, ignore_errors=True)
+                    raise
+        if session._profile_filter is not None:
+            with metrics.phase("prune"):
+                removed = session._profile_filter.prune(session.path)
+            if removed:
+                logging.info(f"Pruned {removed} bytes from session {session.session_id} before upload")
+        if session._compactor is not None:
+            with metrics.phase("compact"):
+                session.compacted_bytes = session._compactor.compact(session.path)
+            if session.compacted_bytes:
+                logging.info(
+                    f"Compaction saved {session.compacted_bytes} bytes of session {session.session_id} before upload"
+                )
+
+        if session._browserstate is not None:
+            storage = session._integrity_storage
+            if storage is not None:
+                with metrics.phase("manifest"):
+                    manifest = build_manifest(session.path, session._checked_manifest)
+                with metrics.phase("verify"):
+                    _begin_upload(session, storage, manifest)
+            if metrics.enabled:
+                metrics.add_directory(session.path)
+            with metrics.phase("upload"):
+                session._browserstate.unmount_session()
+            if storage is not None:
+                with metrics.phase("verify"):
+                    version = storage.get_version(session.user_id, session.session_id)
+                    if version is not None:
+                        storage.integrity.write(
+                            session.user_id, session.session_id, create_record(manifest, version)
+                        )
+            if session._client_pool is not None:
+                session._client_pool.checkin_browserstate(session._browserstate_options, session._browserstate)
+        else:
+            try:
+                version = _upload_direct(session, metrics)
+            except BaseException:
+                if discard_on_error:
+                    shutil.rmtree(session.path, ignore_errors=True)
+                else:
+                    logging.error(
+                        f"Upload of session {session.session_id} for user {session.user_id} failed; "
+                        f"its profile is kept at {session.path}"
+                    )
+                raise
+            if session._cache is not None:
+                key = _cache_key(session._storage, session.user_id, session.session_id)
+                with metrics.phase("cache"):
+                    session._cache.checkin(key, version, session.path)
+            else:
+                with metrics.phase("cleanup"):
+                    shutil.rmtree(session.path, ignore_errors=True)
+        persisted = True
+    except BaseException as e:
+        metrics.finish(e)
+        raise
+    finally:
+        if session._lease is not None and (persisted or final or session._lease.lost):
+            session._lease.release()
+        if persisted or final:
+            _release_pooled(session)
+        if not os.path.lexists(session.path):
+            _unmark_mount(session.path)
+    metrics.finish()
+
+
+# Imported last because these modules build on the functions defined above
+from .pool import SessionPool  # noqa: E402
+from .batch import MountResult, UnmountResult, mount_many, unmount_many  # noqa: E402
+from .cli import MigrationResult, migrate_sessions, prefetch_sessions  # noqa: E402
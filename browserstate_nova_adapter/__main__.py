@@ -0,0 +1,6 @@
+"""
+Runs the browserstate-nova command: python -m browserstate_nova_adapter.
+"""
+from .cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,494 @@
+"""
+Streaming packed transport format for browser profiles.
+
+A profile is packed into a tar stream, compressed, and cut into fixed-size
+chunks. Packing and unpacking are generator pipelines: only a few shards
+and one chunk are held in memory at a time, however large the profile is.
+
+The tar stream is compressed in shards of SHARD_SIZE bytes that do not
+depend on each other, so large profiles can be compressed on several
+processes. With gzip the shards are deflate blocks of one gzip member (as
+pigz writes them), with zstd they are consecutive frames. Shard boundaries
+only depend on the profile, so the archive is the same however many
+processes packed it.
+"""
+import atexit
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import struct
+import tarfile
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .filters import ProfileFilter
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Read size when streaming file contents into the archive
+BLOCK_SIZE = 1024 * 1024
+
+# Bytes of the tar stream compressed independently of each other
+SHARD_SIZE = 1024 * 1024
+
+# Processes packing one profile by default; 1 packs in this process only. More
+# processes are opt-in: they start by importing the main module, so the script
+# using them needs an if __name__ == "__main__": guard
+PACK_WORKERS = 1
+
+# Profile bytes packed in this process before the remaining shards go to the
+# process pool, so small profiles never pay for starting processes
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+
+# Header of the gzip member written by pack_profile: no name, no mtime, Unix
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03"
+
+# Process pools shared by all uploads, by number of workers. Their processes
+# are not forked from this one: forking a process that runs other threads
+# (uploads, heartbeats, Redis clients) can copy a held lock and deadlock.
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_process_pools: Dict[int, ProcessPoolExecutor] = {}
+_process_pools_lock = threading.Lock()
+
+# A piece of a shard: literal tar stream bytes, or (path, offset, length, rel_path) of file contents
+_Piece = Union[bytes, Tuple[str, int, int, str]]
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+# Raised by tarfile and the decompressors on damaged data
+_CORRUPT_DATA_ERRORS = (tarfile.TarError, zlib.error, EOFError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+def default_compression() -> str:
+    """Best compression available: "zstd" if the zstandard package is installed, else "gzip"."""
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def pack_profile(
+    root: str,
+    compression: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    profile_filter: Optional[ProfileFilter] = None,
+    executor: Optional[Executor] = None,
+    parallel_threshold: int = PARALLEL_THRESHOLD,
+    workers: int = 1
+) -> Iterator[bytes]:
+    """
+    Pack a profile directory into compressed archive chunks.
+
+    Args:
+        root: Profile directory
+        compression: "zstd", "gzip" or "none" (defaults to default_compression())
+        chunk_size: Size of every chunk except the last one
+        profile_filter: Only pack files kept by this filter
+        executor: Executor, usually a ProcessPoolExecutor (see process_pool), compressing shards in parallel
+        parallel_threshold: Bytes packed in this process before shards are handed to executor
+        workers: Number of workers of executor, which sets how many shards are queued on it
+
+    Yields:
+        bytes: Consecutive chunks of the compressed tar stream
+    """
+    compression = compression or default_compression()
+    # Fails early on an unknown compression or a missing zstandard package
+    _compressor(compression)
+    pending = bytearray()
+
+    def feed(data: bytes) -> Iterator[bytes]:
+        pending.extend(data)
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+
+    if compression == "gzip":
+        yield from feed(_GZIP_HEADER)
+    crc = 0
+    length = 0
+    shards = _pack_shards(_shards(root, profile_filter), compression, executor, parallel_threshold, workers)
+    for packed, shard_crc, shard_length in shards:
+        yield from feed(packed)
+        crc = _crc32_combine(crc, shard_crc, shard_length)
+        length += shard_length
+    if compression == "gzip":
+        yield from feed(struct.pack("<II", crc, length & 0xFFFFFFFF))
+    while pending:
+        yield bytes(pending[:chunk_size])
+        del pending[:chunk_size]
+
+
+def process_pool(workers: int = PACK_WORKERS) -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool shared by every archive packed with the same number of workers.
+
+    The processes start by importing the main module, so a script using the
+    pool must keep its own work under if __name__ == "__main__":. A pool that
+    breaks anyway is dropped, and packing continues in this process.
+
+    Args:
+        workers: Number of processes
+
+    Returns:
+        Optional[ProcessPoolExecutor]: The pool, or None for a single worker
+    """
+    if workers <= 1:
+        return None
+    with _process_pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            pool = _process_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(_START_METHOD)
+            )
+        return pool
+
+
+def _discard_process_pool(pool: Executor):
+    with _process_pools_lock:
+        for workers in [workers for workers, shared in _process_pools.items() if shared is pool]:
+            del _process_pools[workers]
+    pool.shutdown(wait=False)
+
+
+@atexit.register
+def _shutdown_process_pools():
+    with _process_pools_lock:
+        pools = list(_process_pools.values())
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+def unpack_profile(
+    chunks: Iterable[bytes],
+    target_path: str,
+    compression: str,
+    profile_filter: Optional[ProfileFilter] = None,
+    buffer_size: int = BLOCK_SIZE
+):
+    """
+    Unpack archive chunks produced by pack_profile into a directory.
+
+    Decompression never produces more than buffer_size bytes at a time and
+    file contents are written from one reused buffer, so memory use does not
+    depend on the size of the profile or how well it compressed.
+
+    Args:
+        chunks: Chunks of the compressed tar stream, in order
+        target_path: Directory to unpack into (created if missing)
+        compression: Compression the chunks were packed with
+        profile_filter: Only unpack files kept by this filter
+        buffer_size: Size of the decompression and write buffers
+    """
+    os.makedirs(target_path, exist_ok=True)
+    target_path = os.path.realpath(target_path)
+    stream = _decompressed(_ChunkReader(chunks), compression, buffer_size)
+    view = memoryview(bytearray(buffer_size))
+    with tarfile.open(fileobj=stream, mode="r|") as archive:
+        for member in archive:
+            destination = os.path.realpath(os.path.join(target_path, member.name))
+            if os.path.commonpath([destination, target_path]) != target_path:
+                raise ValueError(f"Archive entry {member.name!r} escapes the session directory")
+            if member.isdir():
+                os.makedirs(destination, exist_ok=True)
+                continue
+            if not member.isfile():
+                continue
+            if profile_filter is not None and not profile_filter.matches(member.name):
+                continue
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with archive.extractfile(member) as source, open(destination, "wb") as f:
+                while True:
+                    size = source.readinto(view)
+                    if not size:
+                        break
+                    f.write(view[:size])
+            os.utime(destination, (member.mtime, member.mtime))
+            os.chmod(destination, member.mode or 0o644)
+
+
+def _shards(root: str, profile_filter: Optional[ProfileFilter]) -> Iterator[Tuple[List[_Piece], bool]]:
+    """Cut the tar stream of a profile into shards of SHARD_SIZE bytes; yields (pieces, is_last)."""
+    pieces: List[_Piece] = []
+    size = 0
+
+    def add(piece: _Piece, length: int) -> Iterator[Tuple[List[_Piece], bool]]:
+        nonlocal pieces, size
+        offset = 0
+        while offset < length:
+            take = min(length - offset, SHARD_SIZE - size)
+            if isinstance(piece, bytes):
+                pieces.append(piece[offset:offset + take])
+            else:
+                path, start, _, rel_path = piece
+                pieces.append((path, start + offset, take, rel_path))
+            offset += take
+            size += take
+            if size == SHARD_SIZE:
+                yield pieces, False
+                pieces, size = [], 0
+
+    for rel_path, path, is_dir in _walk(root, profile_filter):
+        info = tarfile.TarInfo(rel_path)
+        stat = os.lstat(path)
+        info.mtime = stat.st_mtime
+        info.mode = stat.st_mode & 0o7777
+        if is_dir:
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = stat.st_size
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+        yield from add(header, len(header))
+        if is_dir:
+            continue
+        yield from add((path, 0, info.size, rel_path), info.size)
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield from add(tarfile.NUL * padding, padding)
+
+    # End-of-archive marker: two zero blocks
+    yield from add(tarfile.NUL * (2 * tarfile.BLOCKSIZE), 2 * tarfile.BLOCKSIZE)
+    yield pieces, True
+
+
+def _pack_shards(
+    shards: Iterable[Tuple[List[_Piece], bool]],
+    compression: str,
+    executor: Optional[Executor],
+    parallel_threshold: int,
+    workers: int
+) -> Iterator[Tuple[bytes, int, int]]:
+    """Compress shards in order, in this process until parallel_threshold and on executor after that."""
+    # (future, pieces, last) per shard; the future is None for shards packed in this process
+    queue: Deque[Tuple[Optional[Future], List[_Piece], bool]] = deque()
+    # Enough queued shards to keep every worker busy without holding the whole profile in memory
+    max_queued = 2 * max(1, workers)
+    packed = 0
+
+    def broken():
+        nonlocal executor
+        if executor is not None:
+            logging.warning(
+                "The archive process pool broke, packing in this process instead; processes can only be "
+                'started from scripts that keep their work under if __name__ == "__main__":'
+            )
+            _discard_process_pool(executor)
+            executor = None
+
+    def submit(pieces: List[_Piece], last: bool) -> Optional[Future]:
+        try:
+            return executor.submit(_pack_shard, pieces, compression, last)
+        except BrokenProcessPool:
+            broken()
+            return None
+
+    def result(future: Optional[Future], pieces: List[_Piece], last: bool) -> Tuple[bytes, int, int]:
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                broken()
+        return _pack_shard(pieces, compression, last)
+
+    try:
+        for pieces, last in shards:
+            use_executor = executor is not None and packed >= parallel_threshold
+            queue.append((submit(pieces, last) if use_executor else None, pieces, last))
+            while queue and (queue[0][0] is None or len(queue) >= max_queued):
+                yield result(*queue.popleft())
+            packed += SHARD_SIZE
+        while queue:
+            yield result(*queue.popleft())
+    finally:
+        for future, _, _ in queue:
+            if future is not None:
+                future.cancel()
+
+
+def _pack_shard(pieces: List[_Piece], compression: str, last: bool) -> Tuple[bytes, int, int]:
+    """Read and compress one shard; returns the compressed bytes and the CRC-32 and length of the input."""
+    data = bytearray(sum(len(piece) if isinstance(piece, bytes) else piece[2] for piece in pieces))
+    view = memoryview(data)
+    position = 0
+    for piece in pieces:
+        if isinstance(piece, bytes):
+            view[position:position + len(piece)] = piece
+            position += len(piece)
+            continue
+        path, offset, length, rel_path = piece
+        end = position + length
+        with open(path, "rb", buffering=0) as f:
+            f.seek(offset)
+            while position < end:
+                read = f.readinto(view[position:end])
+                if not read:
+                    raise IOError(f"{rel_path} shrank while it was being packed")
+                position += read
+    crc = zlib.crc32(data)
+    if compression == "gzip":
+        # Raw deflate; every shard but the last ends on a byte boundary so the next one can follow
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        packed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    elif compression == "zstd":
+        packed = _require_zstandard().ZstdCompressor(level=3).compress(data)
+    else:
+        packed = bytes(data)
+    return packed, crc, len(data)
+
+
+def _crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """CRC-32 of two concatenated inputs from their CRCs, as zlib's crc32_combine."""
+    if length2 == 0:
+        return crc1
+    return _gf2_times(_crc32_shift(length2), crc1) ^ crc2
+
+
+@functools.lru_cache(maxsize=16)
+def _crc32_shift(length: int) -> Tuple[int, ...]:
+    """Matrix over GF(2) advancing a CRC-32 by length zero bytes."""
+    # Operator for one zero bit, then squared three times for one zero byte
+    operator = [0xEDB88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = _gf2_square(operator)
+    result = [1 << n for n in range(32)]
+    while length:
+        if length & 1:
+            result = [_gf2_times(operator, row) for row in result]
+        operator = _gf2_square(operator)
+        length >>= 1
+    return tuple(result)
+
+
+def _gf2_times(matrix, vector: int) -> int:
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix) -> List[int]:
+    return [_gf2_times(matrix, row) for row in matrix]
+
+
+def _walk(root: str, profile_filter: Optional[ProfileFilter]):
+    # Sorted so that the same profile always packs to the same bytes
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        if profile_filter is not None:
+            dirnames[:] = [
+                d for d in dirnames
+                if not profile_filter.excludes_directory(d if rel_dir == "." else f"{rel_dir}/{d}")
+            ]
+        if rel_dir != ".":
+            yield rel_dir, dirpath, True
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            rel_path = name if rel_dir == "." else f"{rel_dir}/{name}"
+            if profile_filter is None or profile_filter.matches(rel_path):
+                yield rel_path, path, False
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    decompress = compress
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _compressor(compression: str):
+    if compression == "zstd":
+        return _require_zstandard().ZstdCompressor(level=3).compressobj()
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "none":
+        return _Identity()
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+def _decompressed(source: io.RawIOBase, compression: str, buffer_size: int) -> io.RawIOBase:
+    """Stream of the tar archive in source, decompressed at most buffer_size bytes at a time."""
+    if compression == "zstd":
+        # Reads the consecutive frames of the shards as one stream
+        return _require_zstandard().ZstdDecompressor().stream_reader(
+            source, read_size=buffer_size, read_across_frames=True
+        )
+    if compression == "gzip":
+        return _Inflater(source, buffer_size)
+    if compression == "none":
+        return source
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError(
+            "The zstandard package is required for zstd compressed archives. "
+            "Install it with: pip install zstandard"
+        )
+    return zstandard
+
+
+class _ChunkReader(io.RawIOBase):
+    """Non-seekable file object over archive chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._view = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._view:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._view = memoryview(chunk)
+        size = min(len(buffer), len(self._view))
+        buffer[:size] = self._view[:size]
+        self._view = self._view[size:]
+        return size
+
+
+class _Inflater(io.RawIOBase):
+    """Decompresses a gzip stream into the caller's buffer, never producing more than fits."""
+
+    def __init__(self, source: io.RawIOBase, read_size: int):
+        self._source = source
+        self._read_size = read_size
+        self._decompressor = zlib.decompressobj(31)
+        self._input = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._decompressor.eof:
+            if not self._input:
+                self._input = self._source.read(self._read_size)
+                if not self._input:
+                    raise EOFError("Compressed archive ended before the end of its stream")
+            data = self._decompressor.decompress(self._input, len(buffer))
+            self._input = self._decompressor.unconsumed_tail
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+        return 0
@@ -0,0 +1,138 @@
+"""
+Mounting and unmounting many sessions at once.
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from . import MountedSession, mount_browserstate_session
+
+
+class MountResult(NamedTuple):
+    """Outcome of mounting one configuration of a batch."""
+    config: Dict[str, Any]
+    session: Optional[MountedSession]
+    error: Optional[BaseException]
+
+
+class UnmountResult(NamedTuple):
+    """Outcome of unmounting one session of a batch."""
+    session: MountedSession
+    error: Optional[BaseException]
+
+
+def mount_many(
+    configs: Iterable[Dict[str, Any]],
+    max_workers: int = 8,
+    executor: Optional[Executor] = None
+) -> Iterator[MountResult]:
+    """
+    Mount many sessions in parallel, yielding each one as soon as it is mounted.
+
+    At most max_workers mounts are in flight, and a new one is only started
+    when a result is taken, so the batch never runs further ahead of the
+    caller than that: sessions are mounted as fast as the caller can use
+    them. A failed mount is yielded with its error and does not stop the
+    batch. Sessions that were mounted but not yielded because the caller
+    stopped iterating are unmounted again.
+
+    Args:
+        configs: Session configurations, e.g. from create_session_config; may be a lazy iterable
+        max_workers: Number of sessions mounting at the same time
+        executor: Thread pool to mount on (defaults to a pool of max_workers threads)
+
+    Yields:
+        MountResult: Configuration with its mounted session or the error, in completion order
+
+    Example:
+        ```python
+        sessions = []
+        for result in mount_many(configs, max_workers=16):
+            if result.error is None:
+                run_nova(result.session.path)
+                sessions.append(result.session)
+        failed = [r for r in unmount_many(sessions) if r.error is not None]
+        ```
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-batch")
+    configs = iter(configs)
+    pending: Dict[Future, Dict[str, Any]] = {}
+
+    def submit(count: int):
+        for config in islice(configs, count):
+            pending[executor.submit(mount_browserstate_session, **config)] = config
+
+    try:
+        submit(max_workers)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                config = pending.pop(future)
+                # Keep storage I/O going while the caller works with this session
+                submit(1)
+                error = future.exception()
+                if error is not None:
+                    logging.error(
+                        f"Mounting session {config.get('session_id')} for user {config.get('user_id')} failed: {error}"
+                    )
+                    yield MountResult(config, None, error)
+                else:
+                    yield MountResult(config, future.result(), None)
+    finally:
+        for future in pending:
+            if future.cancel():
+                continue
+            try:
+                session = future.result()
+            except BaseException:
+                continue
+            try:
+                session.unmount()
+            except Exception as e:
+                logging.error(f"Unmounting unused session {session.session_id} failed: {e}")
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def unmount_many(
+    sessions: Iterable[MountedSession],
+    max_workers: int = 8,
+    executor: Optional[Executor] = None
+) -> List[UnmountResult]:
+    """
+    Unmount many sessions in parallel.
+
+    Every session is unmounted even if others fail.
+
+    Args:
+        sessions: Sessions to unmount
+        max_workers: Number of sessions unmounting at the same time
+        executor: Thread pool to unmount on (defaults to a pool of max_workers threads)
+
+    Returns:
+        List[UnmountResult]: One result per session, in the order they were given
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-batch")
+    try:
+        submitted = [(session, executor.submit(session.unmount)) for session in sessions]
+        results = []
+        for session, future in submitted:
+            error = future.exception()
+            if error is not None:
+                logging.error(
+                    f"Unmounting session {session.session_id} for user {session.user_id} failed: {error}"
+                )
+            results.append(UnmountResult(session, error))
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
@@ -0,0 +1,287 @@
+"""
+Key/value blob stores used by the packed session storage formats.
+"""
+import itertools
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Serializes counter updates of stores without a native atomic operation
+_counter_lock = threading.Lock()
+
+LOCK_FILE = ".counters.lock"
+
+# Blobs sent to or requested from Redis in one pipeline by get_many and put_many
+MAX_IN_FLIGHT = 8
+
+
+class BlobStore(ABC):
+    """
+    Minimal key/value store for session blobs (archive chunks, indexes).
+
+    Keys are "/" separated relative paths such as "user/session/index.json".
+    """
+
+    @property
+    @abstractmethod
+    def scope(self) -> str:
+        """Identifies the storage location, e.g. for keying local caches."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a blob, or None if it does not exist."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        """Create or replace a blob atomically."""
+
+    @abstractmethod
+    def delete(self, keys: Iterable[str]):
+        """Delete blobs; missing keys are ignored."""
+
+    @abstractmethod
+    def list(self, prefix: str) -> List[str]:
+        """List the keys starting with prefix."""
+
+    def exists(self, key: str) -> bool:
+        """Whether a blob exists; stores that can check without reading the blob override this."""
+        return self.get(key) is not None
+
+    def get_many(self, keys: Iterable[str], max_in_flight: int = MAX_IN_FLIGHT) -> Iterable[Optional[bytes]]:
+        """
+        Get several blobs in order.
+
+        Stores with batched or parallel reads override this; the default
+        fetches one blob at a time as the result is consumed.
+
+        Args:
+            keys: Keys of the blobs
+            max_in_flight: Most blobs requested at once, which bounds the memory held
+        """
+        for key in keys:
+            yield self.get(key)
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]], max_in_flight: int = MAX_IN_FLIGHT):
+        """
+        Store several blobs, consuming items as they are written.
+
+        Stores with batched writes override this; the default writes one blob at a time.
+
+        Args:
+            items: Pairs of key and data, e.g. from a generator
+            max_in_flight: Most blobs sent at once, which bounds the memory held
+        """
+        for key, data in items:
+            self.put(key, data)
+
+    def update_count(self, key: str, update: Callable[[int], int], linked: Iterable[str] = ()) -> int:
+        """
+        Atomically replace an integer counter blob with update(current value).
+
+        A missing counter reads as 0. When the new value is 0 or less, the
+        counter and its linked blobs are deleted in the same atomic step.
+
+        The default implementation is atomic within one process; stores
+        shared between processes override it.
+
+        Args:
+            key: Key of the counter
+            update: Function computing the new value from the current one
+            linked: Blobs that are deleted together with the counter
+
+        Returns:
+            int: The new value
+        """
+        with self._counter_guard():
+            raw = self.get(key)
+            count = update(int(raw) if raw is not None else 0)
+            if count > 0:
+                self.put(key, str(count).encode("ascii"))
+            else:
+                self.delete([key, *linked])
+        return count
+
+    @contextmanager
+    def _counter_guard(self):
+        with _counter_lock:
+            yield
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs stored as files below a root directory."""
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the blobs
+        """
+        self.root = os.path.abspath(root)
+
+    @property
+    def scope(self) -> str:
+        return f"local:{self.root}"
+
+    def _path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid blob key {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, keys: Iterable[str]):
+        for key in keys:
+            path = self._path(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            # Drop directories the deletion left empty
+            parent = os.path.dirname(path)
+            while parent != self.root:
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+    def list(self, prefix: str) -> List[str]:
+        # Only walk the deepest directory fully covered by the prefix
+        base = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        start = os.path.join(self.root, *base.split("/")) if base else self.root
+        keys = []
+        for dirpath, _, filenames in os.walk(start):
+            for name in filenames:
+                if name.endswith(".tmp") or name == LOCK_FILE:
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    @contextmanager
+    def _counter_guard(self):
+        # The lock file also serializes other processes sharing the directory
+        with _counter_lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, LOCK_FILE), "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+
+
+class RedisBlobStore(BlobStore):
+    """Blobs stored as Redis strings under a key prefix."""
+
+    def __init__(self, client, key_prefix: str, ttl: Optional[int] = None, scope: str = "redis"):
+        """
+        Args:
+            client: redis.Redis client
+            key_prefix: Prefix prepended to every blob key
+            ttl: Expiry in seconds applied to every blob written
+            scope: Identifier of the Redis location
+        """
+        self.client = client
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self._scope = scope
+
+    @property
+    def scope(self) -> str:
+        return f"{self._scope}/{self.key_prefix}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.key_prefix + key)
+
+    def exists(self, key: str) -> bool:
+        return bool(self.client.exists(self.key_prefix + key))
+
+    def put(self, key: str, data: bytes):
+        self.client.set(self.key_prefix + key, data, ex=self.ttl)
+
+    def get_many(self, keys: Iterable[str], max_in_flight: int = MAX_IN_FLIGHT) -> Iterable[Optional[bytes]]:
+        # One round trip per batch instead of per blob; later batches are only requested once consumed
+        for batch in _batches(keys, max_in_flight):
+            pipe = self.client.pipeline(transaction=False)
+            for key in batch:
+                pipe.get(self.key_prefix + key)
+            yield from pipe.execute()
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]], max_in_flight: int = MAX_IN_FLIGHT):
+        for batch in _batches(items, max_in_flight):
+            pipe = self.client.pipeline(transaction=False)
+            for key, data in batch:
+                pipe.set(self.key_prefix + key, data, ex=self.ttl)
+            pipe.execute()
+
+    def delete(self, keys: Iterable[str]):
+        keys = [self.key_prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def list(self, prefix: str) -> List[str]:
+        start = len(self.key_prefix)
+        pattern = _escape_glob(self.key_prefix + prefix) + "*"
+        return sorted(
+            (key.decode("utf-8") if isinstance(key, bytes) else key)[start:]
+            for key in self.client.scan_iter(match=pattern, count=1000)
+        )
+
+    def update_count(self, key: str, update: Callable[[int], int], linked: Iterable[str] = ()) -> int:
+        key = self.key_prefix + key
+        linked = [self.key_prefix + name for name in linked]
+
+        def transaction(pipe) -> int:
+            raw = pipe.get(key)
+            count = update(int(raw) if raw is not None else 0)
+            pipe.multi()
+            if count > 0:
+                pipe.set(key, count, ex=self.ttl)
+                if self.ttl:
+                    # Blobs in use by a counter expire no earlier than the counter
+                    for name in linked:
+                        pipe.expire(name, self.ttl)
+            else:
+                pipe.delete(key, *linked)
+            return count
+
+        return self.client.transaction(transaction, key, value_from_callable=True)
+
+
+def _batches(items: Iterable, size: int) -> Iterable[list]:
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, max(1, size)))
+        if not batch:
+            return
+        yield batch
+
+
+def _escape_glob(text: str) -> str:
+    for char in "\\*?[]":
+        text = text.replace(char, "\\" + char)
+    return text
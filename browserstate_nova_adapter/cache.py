@@ -0,0 +1,183 @@
+"""
+Warm on-disk cache of unpacked browser profiles.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+
+class MountCache:
+    """
+    Size-bounded LRU cache of unpacked browser profiles, keyed by session and version.
+
+    When a session is unmounted its profile directory is moved into the cache
+    instead of being deleted. The next mount of the same session only checks
+    the stored version with the provider and, if it is unchanged, moves the
+    cached directory back into place instead of downloading the profile again.
+
+    A cache directory must only be used by one process at a time; it is safe
+    to share a MountCache instance between threads.
+
+    Example:
+        ```python
+        cache = MountCache("/var/cache/browserstate-nova", max_bytes=20 * 1024 ** 3)
+        config = create_session_config(user_id="user1", session_id="session1", cache=cache)
+        ```
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 5 * 1024 ** 3, max_entries: Optional[int] = None):
+        """
+        Args:
+            cache_dir: Directory to keep cached profiles in
+            max_bytes: Maximum total size of cached profiles
+            max_entries: Maximum number of cached profiles (unbounded if None)
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries_dir = os.path.join(self.cache_dir, "entries")
+        self._index_path = os.path.join(self.cache_dir, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(self._entries_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    @property
+    def size(self) -> int:
+        """Total size in bytes of the cached profiles."""
+        with self._lock:
+            return sum(entry["size"] for entry in self._index.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def version(self, key: str) -> Optional[str]:
+        """Version of the cached profile of a session, or None if it is not cached."""
+        with self._lock:
+            entry = self._index.get(key)
+            return entry["version"] if entry is not None else None
+
+    def checkout(self, key: str, version: str, target_path: str) -> bool:
+        """
+        Move a cached profile to target_path if it matches version.
+
+        The entry leaves the cache; it is expected to come back with checkin
+        when the session is unmounted. A cached profile with a different
+        version is stale and is dropped.
+
+        Args:
+            key: Cache key of the session
+            version: Current version of the session in storage
+            target_path: Where to place the profile (must not exist yet)
+
+        Returns:
+            bool: True on a cache hit
+        """
+        with self._lock:
+            entry = self._index.pop(key, None)
+            if entry is None:
+                return False
+            entry_path = self._entry_path(key)
+            if entry["version"] != version:
+                logging.info(f"Dropping stale cached profile for {key}")
+                shutil.rmtree(entry_path, ignore_errors=True)
+                self._save_index()
+                return False
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            shutil.move(entry_path, target_path)
+            self._save_index()
+            return True
+
+    def checkin(self, key: str, version: str, source_path: str):
+        """
+        Move a profile directory into the cache, evicting least recently used entries.
+
+        Profiles larger than the whole cache are deleted instead.
+
+        Args:
+            key: Cache key of the session
+            version: Version of the session in storage matching the profile
+            source_path: Profile directory to take over
+        """
+        size = _directory_size(source_path)
+        with self._lock:
+            entry_path = self._entry_path(key)
+            if key in self._index or os.path.exists(entry_path):
+                self._index.pop(key, None)
+                shutil.rmtree(entry_path, ignore_errors=True)
+            if size > self.max_bytes:
+                shutil.rmtree(source_path, ignore_errors=True)
+                self._save_index()
+                return
+            shutil.move(source_path, entry_path)
+            self._index[key] = {"version": version, "size": size, "last_used": time.time()}
+            self._evict()
+            self._save_index()
+
+    def discard(self, key: str):
+        """Remove a session from the cache."""
+        with self._lock:
+            if self._index.pop(key, None) is not None:
+                shutil.rmtree(self._entry_path(key), ignore_errors=True)
+                self._save_index()
+
+    def clear(self):
+        """Remove every cached profile."""
+        with self._lock:
+            for key in list(self._index):
+                shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            self._index.clear()
+            self._save_index()
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._index.values())
+        by_age = sorted(self._index, key=lambda k: self._index[k]["last_used"])
+        for key in by_age:
+            over_entries = self.max_entries is not None and len(self._index) > self.max_entries
+            if total <= self.max_bytes and not over_entries:
+                break
+            total -= self._index.pop(key)["size"]
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._entries_dir, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        # Drop entries whose directory went missing and directories nobody references
+        index = {k: v for k, v in index.items() if os.path.isdir(self._entry_path(k))}
+        referenced = {os.path.basename(self._entry_path(k)) for k in index}
+        for name in os.listdir(self._entries_dir):
+            if name not in referenced:
+                shutil.rmtree(os.path.join(self._entries_dir, name), ignore_errors=True)
+        return index
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,277 @@
+"""
+The browserstate-nova command: listing, prefetching and migrating stored sessions.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import _cache_key, _copy_session, storage_from_config
+from .cache import MountCache
+from .integrity import IntegrityError, verify_profile
+from .storage import SessionStorage
+from .sweeper import SessionSweeper, _list_users, _local_base_path
+from .tiered import TieredSessionStorage
+
+
+class MigrationResult(NamedTuple):
+    """Outcome of migrate_sessions."""
+    copied: List[Tuple[str, str]]
+    skipped: List[Tuple[str, str]]
+    failed: List[Tuple[str, str]]
+
+
+def prefetch_sessions(
+    storage: SessionStorage,
+    cache: MountCache,
+    sessions: Iterable[Tuple[str, str]],
+    max_workers: int = 4
+) -> List[Tuple[str, str]]:
+    """
+    Download sessions into a mount cache, so the next mounts on this host need no download.
+
+    Sessions whose current version is already cached are left alone. Sessions
+    with a checksum record are verified before they are cached. A session that
+    fails is logged and does not stop the others. The cache directory must not
+    be in use by a running worker at the same time.
+
+    Args:
+        storage: Storage of the sessions, e.g. from storage_from_config
+        cache: Mount cache the workers of this host mount with
+        sessions: User and session identifiers
+        max_workers: Sessions downloading at the same time
+
+    Returns:
+        List[Tuple[str, str]]: User and session identifiers of the sessions that were downloaded
+    """
+    def prefetch(user_id: str, session_id: str) -> bool:
+        key = _cache_key(storage, user_id, session_id)
+        version = storage.get_version(user_id, session_id)
+        if version is None or cache.version(key) == version:
+            return False
+        # Next to the cache entries, so checking in is a rename
+        staging_path = os.path.join(cache.cache_dir, f"prefetch-{uuid.uuid4().hex[:8]}")
+        try:
+            version = storage.download(user_id, session_id, staging_path)
+            if version is None:
+                return False
+            record = storage.integrity.read(user_id, session_id) if storage.integrity is not None else None
+            if record is not None and record["version"] in (None, version):
+                _, problems = verify_profile(staging_path, record)
+                if problems:
+                    raise IntegrityError(f"{len(problems)} files differ from their checksums, e.g. {problems[0]}")
+            cache.checkin(key, version, staging_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        logging.info(f"Prefetched session {session_id} for user {user_id}")
+        return True
+
+    sessions = list(sessions)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-prefetch") as executor:
+        futures = [executor.submit(prefetch, user_id, session_id) for user_id, session_id in sessions]
+    prefetched = []
+    for session, future in zip(sessions, futures):
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Cannot prefetch session {session[1]} for user {session[0]}: {error}")
+        elif future.result():
+            prefetched.append(session)
+    return prefetched
+
+
+def migrate_sessions(
+    source: SessionStorage,
+    target: SessionStorage,
+    sessions: Iterable[Tuple[str, str]],
+    state_path: Optional[str] = None,
+    max_workers: int = 4
+) -> MigrationResult:
+    """
+    Copy sessions to other storage, e.g. from "local" to "redis" or from "redis" to "s3".
+
+    Sessions are copied max_workers at a time, each streamed through a
+    temporary directory (or copied on the server where both sides are the
+    same storage) together with its checksum record. With a state_path, every
+    copied session is recorded with its version on both sides, so running the
+    migration again skips sessions that have not changed since and resumes an
+    interrupted migration where it stopped.
+
+    Args:
+        source: Storage to copy from
+        target: Storage to copy to
+        sessions: User and session identifiers
+        state_path: File recording the migrated sessions between runs
+        max_workers: Sessions copying at the same time
+
+    Returns:
+        MigrationResult: Copied sessions, sessions skipped as already migrated or gone, and failed sessions
+    """
+    state: Dict[str, Any] = {"sessions": {}}
+    if state_path is not None:
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+    migrated = state.setdefault("sessions", {})
+    lock = threading.Lock()
+
+    def save():
+        if state_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        tmp_path = f"{state_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
+
+    def migrate(user_id: str, session_id: str) -> bool:
+        key = f"{user_id}/{session_id}"
+        version = source.get_version(user_id, session_id)
+        if version is None:
+            return False
+        with lock:
+            done = migrated.get(key)
+        if done is not None and done["source"] == version and (
+            target.get_version(user_id, session_id) == done["target"]
+        ):
+            return False
+        copied = _copy_session(source, user_id, session_id, target, session_id)
+        if copied is None:
+            return False
+        with lock:
+            # Recorded with the version read before copying, so a session changed meanwhile is copied again
+            migrated[key] = {"source": version, "target": copied}
+            save()
+        logging.info(f"Migrated session {session_id} for user {user_id}")
+        return True
+
+    copied: List[Tuple[str, str]] = []
+    skipped: List[Tuple[str, str]] = []
+    failed: List[Tuple[str, str]] = []
+    sessions = list(sessions)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-migrate") as executor:
+        futures = [executor.submit(migrate, user_id, session_id) for user_id, session_id in sessions]
+    if isinstance(target, TieredSessionStorage):
+        # Copies to tiered storage land in the hot tier and reach the cold tier in the background
+        target.flush()
+    for session, future in zip(sessions, futures):
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Cannot migrate session {session[1]} for user {session[0]}: {error}")
+            failed.append(session)
+        elif future.result():
+            copied.append(session)
+        else:
+            skipped.append(session)
+    return MigrationResult(copied, skipped, failed)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Command line entry point of the browserstate-nova command (also python -m browserstate_nova_adapter).
+
+    Args:
+        argv: Arguments, defaults to sys.argv[1:]
+
+    Returns:
+        int: Exit status
+    """
+    storage_flags = argparse.ArgumentParser(add_help=False)
+    storage_flags.add_argument(
+        "--config", type=json.loads, default={}, help="Storage as create_session_config keyword arguments (JSON)"
+    )
+    storage_flags.add_argument("--provider", choices=["local", "redis", "s3", "gcs", "tiered"])
+    storage_flags.add_argument("--storage-path", help="Path of local storage or of the local hot tier")
+    storage_flags.add_argument("--storage-format", choices=["browserstate", "archive", "dedup"])
+    storage_flags.add_argument("--format-options", type=json.loads, help="Options of the storage format as JSON")
+    storage_flags.add_argument("--redis-options", type=json.loads, help="Redis options as JSON")
+    storage_flags.add_argument("--s3-options", type=json.loads, help="S3 options as JSON")
+    storage_flags.add_argument("--gcs-options", type=json.loads, help="GCS options as JSON")
+    storage_flags.add_argument("--tier-options", type=json.loads, help="Tiers of the tiered provider as JSON")
+    storage_flags.add_argument(
+        "--user", action="append", help="Only this user (repeatable, required for Redis, S3 and GCS)"
+    )
+    storage_flags.add_argument("--session", action="append", help="Only this session (repeatable)")
+
+    parser = argparse.ArgumentParser(
+        prog="browserstate-nova", description="Inspect, prefetch and migrate stored browser sessions."
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    commands.add_parser("list", parents=[storage_flags], help="List sessions with their sizes")
+    prefetch_parser = commands.add_parser(
+        "prefetch", parents=[storage_flags], help="Download sessions into the mount cache of this host"
+    )
+    prefetch_parser.add_argument("--cache-dir", required=True, help="Directory of the mount cache")
+    prefetch_parser.add_argument("--cache-max-bytes", type=int, help="Size of the mount cache")
+    prefetch_parser.add_argument("--jobs", type=int, default=4, help="Sessions downloading at the same time")
+    migrate_parser = commands.add_parser("migrate", parents=[storage_flags], help="Copy sessions to other storage")
+    migrate_parser.add_argument(
+        "--to", type=json.loads, required=True, help="Target storage as create_session_config keyword arguments (JSON)"
+    )
+    migrate_parser.add_argument("--state", help="File recording migrated sessions, so a rerun resumes")
+    migrate_parser.add_argument("--jobs", type=int, default=4, help="Sessions copying at the same time")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    config = dict(args.config)
+    for name in ("provider", "storage_path", "storage_format", "format_options", "redis_options",
+                 "s3_options", "gcs_options", "tier_options"):
+        if getattr(args, name) is not None:
+            config[name] = getattr(args, name)
+    try:
+        storage = storage_from_config(config)
+        target = storage_from_config(args.to) if args.command == "migrate" else None
+    except (TypeError, ValueError) as e:
+        parser.error(str(e))
+    users = args.user if args.user is not None else _list_users(storage)
+    if users is None:
+        parser.error("--user is required for this storage")
+
+    if args.command == "list":
+        return _list(storage, users, args.session)
+    sessions = [
+        (user_id, session_id)
+        for user_id in users
+        for session_id in (args.session if args.session is not None else storage.list_sessions(user_id))
+    ]
+    if args.command == "prefetch":
+        cache_options = {"max_bytes": args.cache_max_bytes} if args.cache_max_bytes is not None else {}
+        prefetched = prefetch_sessions(storage, MountCache(args.cache_dir, **cache_options), sessions, args.jobs)
+        print(f"Prefetched {len(prefetched)} of {len(sessions)} sessions")
+        return 0
+    result = migrate_sessions(storage, target, sessions, args.state, args.jobs)
+    print(f"Migrated {len(result.copied)} sessions, skipped {len(result.skipped)}, {len(result.failed)} failed")
+    return 1 if result.failed else 0
+
+
+def _list(storage: SessionStorage, users: List[str], session_ids: Optional[List[str]]) -> int:
+    # Sizes and last use are only known for storage on the local file system
+    known = _local_base_path(storage) is not None or isinstance(storage, TieredSessionStorage)
+    # A scratch index, so a sweeper's own index keeps covering every user
+    with tempfile.TemporaryDirectory(prefix="browserstate-nova-") as scratch:
+        sweeper = SessionSweeper(storage, os.path.join(scratch, "index.json"), user_ids=users)
+        sweeper.scan(limit=sys.maxsize)
+    usage = sorted(
+        (entry for entry in sweeper.usage() if session_ids is None or entry.session_id in session_ids),
+        key=lambda entry: (entry.user_id, entry.session_id),
+    )
+    for entry in usage:
+        size = str(entry.size) if known else "-"
+        accessed = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.accessed)) if known else "-"
+        print(f"{entry.user_id}\t{entry.session_id}\t{size}\t{accessed}")
+    if known:
+        print(f"{len(usage)} sessions, {sum(entry.size for entry in usage)} bytes")
+    else:
+        print(f"{len(usage)} sessions")
+    return 0
+
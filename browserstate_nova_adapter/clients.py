@@ -0,0 +1,261 @@
+"""
+Reuse of BrowserState instances and provider clients across mounts.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import SessionStorage, _redis_client, _redis_connection_options, create_session_storage
+
+
+class ClientPool:
+    """
+    Keeps BrowserState instances, session storage and Redis clients alive between mounts.
+
+    Creating them (and the connections they open) can take longer than
+    mounting a small session, so short tasks benefit from reusing them.
+
+    BrowserState instances track the session they mounted, so they are
+    handed out exclusively: a mount checks one out and its unmount returns
+    it, and concurrent mounts with the same configuration get separate
+    instances. Direct session storage and Redis clients are thread-safe and
+    shared by every mount with the same configuration.
+
+    Entries unused for idle_timeout seconds are evicted on the next access
+    of the pool, except storage and clients retained by a mounted session
+    until it is unmounted; close() releases everything.
+
+    Example:
+        ```python
+        clients = ClientPool(idle_timeout=300)
+        config = create_session_config(user_id="user1", session_id="session1", client_pool=clients)
+        ...
+        clients.close()
+        ```
+    """
+
+    def __init__(self, idle_timeout: float = 300.0, max_idle: int = 4):
+        """
+        Args:
+            idle_timeout: Seconds after which an unused entry is evicted
+            max_idle: Idle BrowserState instances kept per configuration
+        """
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._browserstates: Dict[str, List[Tuple[float, Any]]] = {}
+        self._storages: Dict[str, List[Any]] = {}
+        self._redis_clients: Dict[str, List[Any]] = {}
+        # Number of retain() calls without release() by id of the storage or client
+        self._retained: Dict[int, int] = {}
+        self._closed = False
+
+    def checkout_browserstate(self, options: Dict[str, Any]) -> Optional[Any]:
+        """
+        Take an idle BrowserState instance out of the pool.
+
+        Args:
+            options: BrowserStateOptions arguments the instance was created with
+
+        Returns:
+            The instance, or None if there is no idle instance for options
+        """
+        key = _config_key(options)
+        with self._lock:
+            self._evict_idle()
+            idle = self._browserstates.get(key)
+            if not idle:
+                return None
+            _, browserstate = idle.pop()
+            if not idle:
+                del self._browserstates[key]
+            return browserstate
+
+    def checkin_browserstate(self, options: Dict[str, Any], browserstate: Any):
+        """
+        Return a BrowserState instance whose session has been unmounted.
+
+        Args:
+            options: BrowserStateOptions arguments the instance was created with
+            browserstate: The instance
+        """
+        key = _config_key(options)
+        with self._lock:
+            if self._closed:
+                _close(browserstate)
+                return
+            idle = self._browserstates.setdefault(key, [])
+            if len(idle) >= self.max_idle:
+                _close(browserstate)
+                return
+            idle.append((time.monotonic(), browserstate))
+
+    def session_storage(self, storage_config: Dict[str, Any]) -> SessionStorage:
+        """
+        Shared direct session storage for a configuration.
+
+        Args:
+            storage_config: Arguments of create_session_storage
+
+        Returns:
+            SessionStorage: Storage created on first use and reused afterwards
+        """
+        key = _config_key(storage_config)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ClientPool is closed")
+            self._evict_idle()
+            now = time.monotonic()
+            entry = self._storages.get(key)
+            if entry is None:
+                redis_client = None
+                redis_key = None
+                provider = storage_config.get("provider")
+                if provider == "tiered":
+                    # The hot tier is the part of tiered storage that talks to Redis
+                    provider = (storage_config.get("tier_options") or {}).get("hot", "local")
+                if provider == "redis":
+                    redis_options = storage_config.get("redis_options") or {}
+                    redis_key = _redis_key(redis_options)
+                    redis_client = self._redis_client(redis_options, redis_key, now)
+                storage = create_session_storage(**storage_config, redis_client=redis_client)
+                entry = self._storages[key] = [storage, now, redis_key]
+            entry[1] = now
+            if entry[2] is not None and entry[2] in self._redis_clients:
+                self._redis_clients[entry[2]][1] = now
+            return entry[0]
+
+    def redis_client(self, redis_options: Optional[dict] = None):
+        """
+        Shared redis.Redis client for a connection configuration.
+
+        Args:
+            redis_options: Same options as the "redis" provider; only the connection options matter
+
+        Returns:
+            redis.Redis: Client created on first use and reused afterwards
+        """
+        redis_options = redis_options or {}
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ClientPool is closed")
+            self._evict_idle()
+            return self._redis_client(redis_options, _redis_key(redis_options), time.monotonic())
+
+    def retain(self, client: Any):
+        """
+        Keep shared storage or a Redis client from being evicted until it is released again.
+
+        Args:
+            client: Storage from session_storage or client from redis_client
+        """
+        with self._lock:
+            self._retained[id(client)] = self._retained.get(id(client), 0) + 1
+
+    def release(self, client: Any):
+        """
+        Undo one retain(); the idle timeout of the storage or client starts again once nothing retains it.
+
+        Args:
+            client: Storage or client passed to retain
+        """
+        with self._lock:
+            count = self._retained.get(id(client), 0) - 1
+            if count > 0:
+                self._retained[id(client)] = count
+                return
+            self._retained.pop(id(client), None)
+            now = time.monotonic()
+            for entry in list(self._storages.values()) + list(self._redis_clients.values()):
+                if entry[0] is client:
+                    entry[1] = now
+
+    def evict_idle(self) -> int:
+        """
+        Evict entries that were not used for idle_timeout seconds.
+
+        Returns:
+            int: Number of evicted entries
+        """
+        with self._lock:
+            return self._evict_idle()
+
+    def close(self):
+        """Release every idle BrowserState instance, shared storage and Redis client."""
+        with self._lock:
+            self._closed = True
+            for idle in self._browserstates.values():
+                for _, browserstate in idle:
+                    _close(browserstate)
+            for client, _ in self._redis_clients.values():
+                _close(client)
+            self._browserstates.clear()
+            self._storages.clear()
+            self._redis_clients.clear()
+            self._retained.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return (
+                sum(len(idle) for idle in self._browserstates.values())
+                + len(self._storages)
+                + len(self._redis_clients)
+            )
+
+    def __enter__(self) -> "ClientPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _redis_client(self, redis_options: dict, key: str, now: float):
+        entry = self._redis_clients.get(key)
+        if entry is None:
+            entry = self._redis_clients[key] = [_redis_client(redis_options), now]
+        entry[1] = now
+        return entry[0]
+
+    def _evict_idle(self) -> int:
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for key in list(self._browserstates):
+            idle = self._browserstates[key]
+            for _, browserstate in [item for item in idle if item[0] < deadline]:
+                _close(browserstate)
+                evicted += 1
+            idle[:] = [item for item in idle if item[0] >= deadline]
+            if not idle:
+                del self._browserstates[key]
+        for key in [
+            key for key, entry in self._storages.items() if entry[1] < deadline and id(entry[0]) not in self._retained
+        ]:
+            del self._storages[key]
+            evicted += 1
+        in_use = {entry[2] for entry in self._storages.values()}
+        for key in [
+            key for key, entry in self._redis_clients.items()
+            if entry[1] < deadline and key not in in_use and id(entry[0]) not in self._retained
+        ]:
+            _close(self._redis_clients.pop(key)[0])
+            evicted += 1
+        return evicted
+
+
+def _config_key(config: Dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True, default=repr)
+
+
+def _redis_key(redis_options: dict) -> str:
+    # Every option, e.g. ssl or username, with the defaults filled in so that spelled out defaults match
+    return _config_key(dict(_redis_connection_options(redis_options), **redis_options))
+
+
+def _close(client: Any):
+    close = getattr(client, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            logging.warning(f"Closing {client!r} failed: {e}")
@@ -0,0 +1,330 @@
+"""
+Compaction of the SQLite and LevelDB stores of a browser profile before it is uploaded.
+"""
+import logging
+import os
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import sqlite3
+except ImportError:  # pragma: no cover - Python built without SQLite
+    sqlite3 = None
+
+from .filters import ProfileFilter
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Sidecar files SQLite keeps next to a database while it is open or after a crash
+_SQLITE_SIDECARS = ("-journal", "-wal", "-shm")
+
+# LevelDB stores hold a CURRENT file naming the live MANIFEST
+_MANIFEST_NAME = re.compile(r"^MANIFEST-(\d+)$")
+_LOG_NAME = re.compile(r"^(\d+)\.log$")
+
+# Block size and record types of the LevelDB log format, which MANIFEST files are written in
+_BLOCK_SIZE = 32768
+_FULL, _FIRST, _MIDDLE, _LAST = 1, 2, 3, 4
+
+# VersionEdit tags of the log numbers, the only part of a MANIFEST compaction needs
+_TAG_LOG_NUMBER = 2
+_TAG_PREV_LOG_NUMBER = 9
+
+
+class ProfileCompactor:
+    """
+    Shrinks the databases of a browser profile before it is persisted.
+
+    Chromium keeps cookies, history and form data in SQLite databases, and
+    Local Storage, Session Storage and IndexedDB in LevelDB stores. Both
+    accumulate dead space over repeated runs: free pages in SQLite, and
+    superseded write-ahead logs and MANIFEST files in LevelDB. Compaction
+
+    - vacuums SQLite databases with at least min_free_bytes of free pages,
+    - checkpoints write-ahead logs into their databases and removes empty
+      rollback journals, so no committed data lives only in a sidecar file,
+    - removes LevelDB log and MANIFEST files that the live MANIFEST no longer
+      refers to.
+
+    Databases that cannot be opened (for example because a browser still
+    has them locked) and LevelDB stores whose MANIFEST cannot be read are
+    left untouched. Profiles smaller than min_bytes are not compacted at all.
+
+    Example:
+        ```python
+        config = create_session_config(
+            user_id="user1",
+            session_id="session1",
+            compact=ProfileCompactor(min_bytes=64 * 1024 ** 2)
+        )
+        ```
+    """
+
+    def __init__(self, min_bytes: int = 16 * 1024 ** 2, min_free_bytes: int = 1024 ** 2):
+        """
+        Args:
+            min_bytes: Profile size from which on compaction runs
+            min_free_bytes: Free space in a SQLite database from which on it is vacuumed
+        """
+        self.min_bytes = min_bytes
+        self.min_free_bytes = min_free_bytes
+        # Caches hold neither databases worth compacting nor anything worth reading headers of
+        self._skip = ProfileFilter.without_caches()
+
+    def compact(self, root: str) -> int:
+        """
+        Compact the databases below root.
+
+        Args:
+            root: Profile directory
+
+        Returns:
+            int: Number of bytes saved, 0 if the profile is below min_bytes
+        """
+        databases: List[str] = []
+        stores: List[str] = []
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+            dirnames[:] = [
+                name for name in dirnames
+                if not self._skip.excludes_directory(name if rel_dir == "." else f"{rel_dir}/{name}")
+            ]
+            is_store = "CURRENT" in filenames
+            if is_store:
+                stores.append(dirpath)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    size += os.lstat(path).st_size
+                except OSError:
+                    continue
+                if not is_store and not name.endswith(_SQLITE_SIDECARS) and _is_sqlite(path):
+                    databases.append(path)
+        if size < self.min_bytes:
+            return 0
+
+        saved = 0
+        for path in databases:
+            saved += self._compact_database(path)
+        for path in stores:
+            saved += _remove_obsolete_leveldb_files(path)
+        return saved
+
+    def _compact_database(self, path: str) -> int:
+        if sqlite3 is None:
+            return 0
+        free = _sqlite_free_bytes(path)
+        sidecars = [path + suffix for suffix in _SQLITE_SIDECARS if os.path.exists(path + suffix)]
+        if free < self.min_free_bytes and not sidecars:
+            return 0
+        before = _total_size([path] + sidecars)
+        try:
+            # Opening the database replays a write-ahead log and rolls back a hot journal first
+            connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+            try:
+                connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                if free >= self.min_free_bytes:
+                    connection.execute("VACUUM")
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Not compacting {path}: {e}")
+            return 0
+        # Closing the last connection removes the WAL; an empty journal carries nothing either
+        journal = path + "-journal"
+        try:
+            if os.path.getsize(journal) == 0:
+                os.remove(journal)
+        except OSError:
+            pass
+        existing = [path] + [path + suffix for suffix in _SQLITE_SIDECARS if os.path.exists(path + suffix)]
+        return max(0, before - _total_size(existing))
+
+
+def _is_sqlite(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+def _sqlite_free_bytes(path: str) -> int:
+    """Size of the free pages of a database, read from its header."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(100)
+    except OSError:
+        return 0
+    if len(header) < 100:
+        return 0
+    page_size = struct.unpack(">H", header[16:18])[0]
+    if page_size == 1:
+        page_size = 65536
+    free_pages = struct.unpack(">I", header[36:40])[0]
+    return page_size * free_pages
+
+
+def _total_size(paths: List[str]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.lstat(path).st_size
+        except OSError:
+            pass
+    return total
+
+
+def _remove_obsolete_leveldb_files(store_path: str) -> int:
+    """Remove the log and MANIFEST files LevelDB itself would delete when opening the store."""
+    try:
+        with open(os.path.join(store_path, "CURRENT")) as f:
+            current = f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return 0
+    match = _MANIFEST_NAME.match(current)
+    if match is None:
+        return 0
+    manifest_number = int(match.group(1))
+    numbers = _manifest_log_numbers(os.path.join(store_path, current))
+    if numbers is None:
+        logging.warning(f"Not compacting {store_path}: its MANIFEST cannot be read")
+        return 0
+    log_number, prev_log_number = numbers
+
+    saved = 0
+    for name in os.listdir(store_path):
+        manifest = _MANIFEST_NAME.match(name)
+        log = _LOG_NAME.match(name)
+        if manifest is not None:
+            obsolete = int(manifest.group(1)) < manifest_number
+        elif log is not None:
+            obsolete = log_number is not None and int(log.group(1)) < log_number and (
+                int(log.group(1)) != prev_log_number
+            )
+        else:
+            # Info logs of earlier runs
+            obsolete = name == "LOG.old"
+        if not obsolete:
+            continue
+        path = os.path.join(store_path, name)
+        try:
+            size = os.lstat(path).st_size
+            os.remove(path)
+        except OSError:
+            continue
+        saved += size
+    return saved
+
+
+def _manifest_log_numbers(path: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """
+    Read the log number and previous log number recorded last in a MANIFEST.
+
+    Returns:
+        Optional[Tuple]: The two numbers (None where never recorded), or None if the file is malformed
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    numbers: Dict[int, Optional[int]] = {_TAG_LOG_NUMBER: None, _TAG_PREV_LOG_NUMBER: None}
+    for record in _log_records(data):
+        if record is None:
+            return None
+        edit = _edit_log_numbers(record)
+        if edit is None:
+            return None
+        numbers.update(edit)
+    return numbers[_TAG_LOG_NUMBER], numbers[_TAG_PREV_LOG_NUMBER]
+
+
+def _log_records(data: bytes):
+    """Yield the records of a LevelDB log file, or None once it turns out to be malformed."""
+    offset = 0
+    pending = b""
+    while offset + 7 <= len(data):
+        block_left = _BLOCK_SIZE - offset % _BLOCK_SIZE
+        if block_left < 7:
+            # Trailer too short for a header
+            offset += block_left
+            continue
+        length, kind = struct.unpack("<HB", data[offset + 4:offset + 7])
+        if kind == 0 and length == 0:
+            # Zero padding preallocated at the end of the file
+            offset += block_left
+            continue
+        start = offset + 7
+        if length > block_left - 7 or start + length > len(data):
+            yield None
+            return
+        fragment = data[start:start + length]
+        offset = start + length
+        if kind == _FULL:
+            yield fragment
+        elif kind == _FIRST:
+            pending = fragment
+        elif kind == _MIDDLE:
+            pending += fragment
+        elif kind == _LAST:
+            yield pending + fragment
+            pending = b""
+        else:
+            yield None
+            return
+
+
+def _edit_log_numbers(edit: bytes) -> Optional[Dict[int, int]]:
+    """Parse a VersionEdit record for its log numbers; None if it is malformed."""
+    found: Dict[int, int] = {}
+    position = 0
+    try:
+        while position < len(edit):
+            tag, position = _varint(edit, position)
+            if tag in (_TAG_LOG_NUMBER, _TAG_PREV_LOG_NUMBER, 3, 4):
+                value, position = _varint(edit, position)
+                if tag in (_TAG_LOG_NUMBER, _TAG_PREV_LOG_NUMBER):
+                    found[tag] = value
+            elif tag == 1:
+                position = _skip_bytes(edit, position)
+            elif tag == 5:
+                _, position = _varint(edit, position)
+                position = _skip_bytes(edit, position)
+            elif tag == 6:
+                _, position = _varint(edit, position)
+                _, position = _varint(edit, position)
+            elif tag == 7:
+                for _ in range(3):
+                    _, position = _varint(edit, position)
+                position = _skip_bytes(edit, position)
+                position = _skip_bytes(edit, position)
+            else:
+                return None
+    except IndexError:
+        return None
+    return found
+
+
+def _varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+        if shift > 63:
+            raise IndexError("varint too long")
+
+
+def _skip_bytes(data: bytes, position: int) -> int:
+    length, position = _varint(data, position)
+    if position + length > len(data):
+        raise IndexError("length prefixed slice out of range")
+    return position + length
@@ -0,0 +1,139 @@
+"""
+Content-addressed chunk store shared by every session of a blob store.
+"""
+import hashlib
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from .archive import _CORRUPT_DATA_ERRORS, _require_zstandard, default_compression
+from .blobs import BlobStore
+from .integrity import IntegrityError
+
+# Size of the chunks files are split into
+DEDUP_CHUNK_SIZE = 1024 * 1024
+
+# One-byte header of a stored chunk naming its encoding
+_ENCODINGS = {"zstd": b"Z", "gzip": b"D", "none": b"N"}
+
+
+class ChunkStore:
+    """
+    Chunks stored once under the digest of their contents, with reference counts.
+
+    Chunks live under "chunks/<digest>" and their reference counts under
+    "refs/<digest>". Every session that uses a chunk holds one reference to
+    it; releasing the last reference deletes the chunk. Because a chunk is
+    identified by its contents, identical files of different users and
+    sessions are stored and transferred only once.
+    """
+
+    def __init__(self, blobs: BlobStore, compression: Optional[str] = None):
+        """
+        Args:
+            blobs: Blob store holding the chunks
+            compression: "zstd", "gzip" or "none" for newly stored chunks (defaults to zstd when available)
+        """
+        self.blobs = blobs
+        self.compression = compression or default_compression()
+        if self.compression not in _ENCODINGS:
+            raise ValueError(f"Unknown compression {self.compression!r}")
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """Digest identifying a chunk."""
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def add(self, data: bytes) -> str:
+        """
+        Add a reference to a chunk, storing it if it is not stored yet.
+
+        Args:
+            data: Chunk contents
+
+        Returns:
+            str: Digest of the chunk
+        """
+        digest = self.digest(data)
+        key = self._key(digest)
+        # Counting first means a concurrent release can never delete the chunk after it was written
+        count = self.blobs.update_count(self._ref_key(digest), lambda count: count + 1, [key])
+        # A concurrent first adder may still be writing the chunk, or have failed to; writing
+        # the same contents again is harmless, so no reference is handed out before the chunk exists
+        if count == 1 or not self.blobs.exists(key):
+            try:
+                self.blobs.put(key, self._encode(data))
+            except BaseException:
+                # The caller never got the digest, so it cannot release the reference itself
+                self.release([digest])
+                raise
+        return digest
+
+    def retain(self, digest: str) -> bool:
+        """
+        Add a reference to a chunk that is already stored.
+
+        Args:
+            digest: Digest of the chunk
+
+        Returns:
+            bool: False, without adding a reference, if the chunk is not stored
+        """
+        count = self.blobs.update_count(
+            self._ref_key(digest), lambda count: count + 1 if count > 0 else 0, [self._key(digest)]
+        )
+        return count > 0
+
+    def release(self, digests: Iterable[str]):
+        """Drop one reference to each chunk, deleting chunks that are no longer referenced."""
+        for digest in digests:
+            self.blobs.update_count(self._ref_key(digest), lambda count: count - 1, [self._key(digest)])
+
+    def get_many(self, digests: Iterable[str]) -> Iterator[bytes]:
+        """
+        Read chunks in order, verifying their contents.
+
+        Raises:
+            IntegrityError: If a chunk is missing or corrupt
+        """
+        digests = list(digests)
+        for digest, raw in zip(digests, self.blobs.get_many(self._key(d) for d in digests)):
+            if raw is None:
+                raise IntegrityError(f"Chunk {digest} is missing")
+            try:
+                data = self._decode(raw)
+            except _CORRUPT_DATA_ERRORS as e:
+                raise IntegrityError(f"Chunk {digest} is corrupt: {e}") from e
+            if self.digest(data) != digest:
+                raise IntegrityError(f"Chunk {digest} is corrupt")
+            yield data
+
+    def _encode(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            packed = _require_zstandard().ZstdCompressor(level=3).compress(data)
+        elif self.compression == "gzip":
+            packed = zlib.compress(data, 6)
+        else:
+            packed = data
+        if len(packed) >= len(data):
+            # Incompressible data such as images or already compressed files
+            return _ENCODINGS["none"] + data
+        return _ENCODINGS[self.compression] + packed
+
+    @staticmethod
+    def _decode(raw: bytes) -> bytes:
+        encoding, payload = raw[:1], raw[1:]
+        if encoding == _ENCODINGS["zstd"]:
+            return _require_zstandard().ZstdDecompressor().decompress(payload)
+        if encoding == _ENCODINGS["gzip"]:
+            return zlib.decompress(payload)
+        if encoding == _ENCODINGS["none"]:
+            return payload
+        raise IntegrityError(f"Unknown chunk encoding {encoding!r}")
+
+    @staticmethod
+    def _key(digest: str) -> str:
+        return f"chunks/{digest[:2]}/{digest}"
+
+    @staticmethod
+    def _ref_key(digest: str) -> str:
+        return f"refs/{digest[:2]}/{digest}"
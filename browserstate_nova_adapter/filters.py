@@ -0,0 +1,162 @@
+"""
+Include/exclude rules deciding which profile files are persisted.
+"""
+import fnmatch
+import os
+from typing import Iterable, Sequence, Tuple
+
+# Directories Chromium rebuilds on demand. They dominate profile size but
+# carry nothing needed to stay logged in.
+CACHE_PATTERNS: Tuple[str, ...] = (
+    "Cache",
+    "Code Cache",
+    "GPUCache",
+    "DawnCache",
+    "DawnGraphiteCache",
+    "DawnWebGPUCache",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+    "Service Worker/CacheStorage",
+    "Service Worker/ScriptCache",
+    "component_crx_cache",
+    "extensions_crx_cache",
+    "Crashpad",
+    "BrowserMetrics",
+    "*.pma",
+    "optimization_guide_model_store",
+    "Safe Browsing",
+)
+
+# Files that hold logins and site state: cookies (and the key that encrypts
+# them in "Local State"), web storage, IndexedDB and preferences.
+AUTH_STATE_PATTERNS: Tuple[str, ...] = (
+    "/Local State",
+    "Cookies",
+    "Cookies-journal",
+    "Local Storage",
+    "Session Storage",
+    "IndexedDB",
+    "Preferences",
+    "Secure Preferences",
+)
+
+
+class ProfileFilter:
+    """
+    Decides which files of a browser profile are stored and transferred.
+
+    Patterns are shell-style globs matched against a file's path relative to
+    the profile root (using "/" as separator) and against each of its parent
+    directories, so "Cache" excludes every directory named Cache and all of
+    its contents. Patterns match at any depth unless they start with "/",
+    which anchors them to the profile root.
+
+    A file is kept when it matches at least one include pattern and no
+    exclude pattern.
+
+    Example:
+        ```python
+        config = create_session_config(
+            user_id="user1",
+            session_id="session1",
+            profile_filter=ProfileFilter.auth_state_only()
+        )
+        ```
+    """
+
+    def __init__(self, include: Sequence[str] = ("*",), exclude: Sequence[str] = ()):
+        """
+        Args:
+            include: Patterns of files to keep
+            exclude: Patterns of files to drop even when included
+        """
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+
+    @classmethod
+    def without_caches(cls) -> "ProfileFilter":
+        """Keep everything except Chromium cache directories."""
+        return cls(exclude=CACHE_PATTERNS)
+
+    @classmethod
+    def auth_state_only(cls) -> "ProfileFilter":
+        """Keep only cookies, Local/Session Storage, IndexedDB and preferences."""
+        return cls(include=AUTH_STATE_PATTERNS, exclude=CACHE_PATTERNS)
+
+    def matches(self, rel_path: str) -> bool:
+        """
+        Check whether a profile file should be persisted.
+
+        Args:
+            rel_path: Path relative to the profile root, using "/" as separator
+
+        Returns:
+            bool: True if the file is kept
+        """
+        candidates = list(_candidates(rel_path))
+        return _any_match(self.include, candidates) and not _any_match(self.exclude, candidates)
+
+    def excludes_directory(self, rel_path: str) -> bool:
+        """
+        Check whether a whole directory is excluded, so it need not be walked.
+
+        Args:
+            rel_path: Directory path relative to the profile root, using "/" as separator
+
+        Returns:
+            bool: True if no file below the directory can be kept
+        """
+        return _any_match(self.exclude, list(_candidates(rel_path)))
+
+    def prune(self, root: str) -> int:
+        """
+        Delete every file below root that the filter does not keep.
+
+        Args:
+            root: Profile directory
+
+        Returns:
+            int: Number of bytes removed
+        """
+        removed = 0
+        for dirpath, _, filenames in os.walk(root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+                if self.matches(rel_path):
+                    continue
+                try:
+                    removed += os.lstat(path).st_size
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            if dirpath == root or os.listdir(dirpath):
+                continue
+            # Directories emptied by the filter go too; other empty ones are part of the profile
+            if not self.matches(os.path.relpath(dirpath, root).replace(os.sep, "/")):
+                os.rmdir(dirpath)
+        return removed
+
+    def __repr__(self) -> str:
+        return f"ProfileFilter(include={self.include!r}, exclude={self.exclude!r})"
+
+
+def _candidates(rel_path: str) -> Iterable[Tuple[bool, str]]:
+    # Every contiguous run of path components, flagged with whether it starts
+    # at the profile root. "Default/Cache/data" yields "Default", "Default/Cache",
+    # "Cache", "Cache/data", ... so unanchored patterns match at any depth.
+    parts = rel_path.split("/")
+    for start in range(len(parts)):
+        for end in range(start + 1, len(parts) + 1):
+            yield start == 0, "/".join(parts[start:end])
+
+
+def _any_match(patterns: Sequence[str], candidates) -> bool:
+    for pattern in patterns:
+        anchored = pattern.startswith("/")
+        body = pattern.lstrip("/")
+        for at_root, candidate in candidates:
+            if (at_root or not anchored) and fnmatch.fnmatchcase(candidate, body):
+                return True
+    return False
@@ -0,0 +1,145 @@
+"""
+Checksums of uploaded sessions, verified when the sessions are mounted again.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .blobs import BlobStore
+from .manifest import FileEntry, build_manifest
+
+
+class IntegrityError(IOError):
+    """A session does not match the checksums recorded when it was uploaded."""
+
+
+class IntegrityStore:
+    """
+    Keeps the checksum records of the current and the previous generation of every session.
+
+    A record lists the size, digest and mtime of every file of a session:
+
+        {"version": "...", "files": {"Default/Cookies": [size, digest, mtime_ns], ...}, "timestamp": ...}
+
+    An upload first writes the record of the files it is about to store with
+    "version" set to null, and then, as its very last step, the same record
+    with the version the upload produced. Blob writes are atomic, so a
+    record is never half written, and a record without a version marks an
+    upload that never finished.
+
+    Records live at "<user_id>/<session_id>/current.json" and
+    "<user_id>/<session_id>/previous.json" of a blob store.
+    """
+
+    def __init__(self, blobs: BlobStore):
+        """
+        Args:
+            blobs: Blob store holding the records
+        """
+        self.blobs = blobs
+
+    def read(self, user_id: str, session_id: str, previous: bool = False) -> Optional[dict]:
+        """
+        Read the record of a session.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            previous: Read the record of the previous generation instead of the current one
+
+        Returns:
+            Optional[dict]: The record, or None if there is none
+        """
+        raw = self.blobs.get(self._key(user_id, session_id, previous))
+        return json.loads(raw) if raw is not None else None
+
+    def write(self, user_id: str, session_id: str, record: dict, previous: bool = False):
+        """
+        Replace the record of a session.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            record: Record from create_record
+            previous: Write the record of the previous generation instead of the current one
+        """
+        self.blobs.put(self._key(user_id, session_id, previous), json.dumps(record).encode("utf-8"))
+
+    def delete(self, user_id: str, session_id: str, previous: Optional[bool] = None):
+        """
+        Delete the records of a session.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            previous: Only delete the record of the previous (True) or the current (False) generation
+        """
+        kinds = (False, True) if previous is None else (previous,)
+        self.blobs.delete([self._key(user_id, session_id, kind) for kind in kinds])
+
+    def _key(self, user_id: str, session_id: str, previous: bool) -> str:
+        if not user_id or not session_id or "/" in user_id or "/" in session_id:
+            raise ValueError("user_id and session_id must be non-empty and must not contain '/'")
+        return f"{user_id}/{session_id}/{'previous' if previous else 'current'}.json"
+
+
+def create_record(manifest: Dict[str, FileEntry], version: Optional[str] = None) -> dict:
+    """
+    Create the checksum record of a profile.
+
+    Args:
+        manifest: Manifest of the profile, see build_manifest
+        version: Version the profile was stored as, or None while it is being uploaded
+
+    Returns:
+        dict: Record for IntegrityStore.write
+    """
+    return {
+        "version": version,
+        "files": {path: [entry.size, entry.digest, entry.mtime_ns] for path, entry in manifest.items()},
+        "timestamp": int(1000 * time.time()),
+    }
+
+
+def verify_profile(root: str, record: dict, file_filter=None) -> Tuple[Dict[str, FileEntry], List[str]]:
+    """
+    Check a downloaded profile against a checksum record.
+
+    Sizes are compared first, so a truncated or missing file is found
+    without hashing anything. Files whose size and mtime still match the
+    record are trusted, as every storage format that keeps mtimes restores
+    them only after writing a file completely; the remaining files are
+    hashed in parallel. Files the record does not list are ignored, as are
+    recorded files that file_filter excludes because they were not downloaded.
+
+    Args:
+        root: Profile directory
+        record: Record from IntegrityStore.read
+        file_filter: Object with a matches(rel_path) method, e.g. the ProfileFilter the profile was downloaded with
+
+    Returns:
+        Tuple[Dict[str, FileEntry], List[str]]: Manifest of root (empty if a size
+        was already wrong) and the recorded paths that are missing or differ
+    """
+    expected = {
+        path: FileEntry(entry[0], entry[2] if len(entry) > 2 else -1, entry[1])
+        for path, entry in record["files"].items()
+        if file_filter is None or file_filter.matches(path)
+    }
+    wrong_size = []
+    for path, entry in expected.items():
+        try:
+            if os.path.getsize(os.path.join(root, *path.split("/"))) != entry.size:
+                wrong_size.append(path)
+        except OSError:
+            wrong_size.append(path)
+    if wrong_size:
+        return {}, sorted(wrong_size)
+
+    manifest = build_manifest(root, previous=expected)
+    problems = sorted(
+        path for path, entry in expected.items()
+        if path not in manifest or manifest[path].digest != entry.digest
+    )
+    return manifest, problems
@@ -0,0 +1,419 @@
+"""
+Leases that keep a session from being mounted by two workers at the same time.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Seconds a lease lasts unless it is renewed
+DEFAULT_LEASE_TTL = 30.0
+
+# Longest a local waiter sleeps before looking again, for releases by other processes
+LOCAL_POLL_INTERVAL = 0.5
+
+LOCK_FILE = ".leases.lock"
+
+_local_stores: Dict[str, "LocalLeaseStore"] = {}
+_local_stores_lock = threading.Lock()
+
+
+class LeaseTimeoutError(TimeoutError):
+    """The lease of a session was not granted within the timeout."""
+
+
+class LeaseLostError(RuntimeError):
+    """A lease expired or was taken over before its session was unmounted."""
+
+
+class LeaseStore(ABC):
+    """
+    Where leases are kept: a lease is a key with an owner token and an expiry.
+
+    Every successful acquisition also gets a fencing number that is larger
+    than the one of any earlier holder of the same key, so writers can tell
+    a stale holder from the current one.
+    """
+
+    @abstractmethod
+    def try_acquire(self, key: str, token: str, ttl: float) -> Optional[int]:
+        """
+        Take a lease if it is free or has expired.
+
+        Args:
+            key: Lease key, e.g. "<user_id>/<session_id>"
+            token: Unique token of the new owner
+            ttl: Seconds until the lease expires unless renewed
+
+        Returns:
+            Optional[int]: Fencing number of the new lease, or None if someone else holds it
+        """
+
+    @abstractmethod
+    def renew(self, key: str, token: str, ttl: float) -> bool:
+        """Extend a lease by ttl seconds; False if token no longer holds it."""
+
+    @abstractmethod
+    def release(self, key: str, token: str) -> bool:
+        """Give up a lease and wake the next waiter; False if token no longer held it."""
+
+    @abstractmethod
+    def wait(self, key: str, timeout: float):
+        """Block until the lease may have been released, or for at most timeout seconds."""
+
+
+class LocalLeaseStore(LeaseStore):
+    """
+    Leases stored as small JSON files below a root directory.
+
+    Updates are serialized by a lock file, so the leases hold across
+    processes sharing the directory. Waiters in this process are woken in
+    the order they started waiting as soon as a lease is released; releases
+    by other processes are noticed within LOCAL_POLL_INTERVAL.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the lease files
+        """
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._released: Dict[str, threading.Condition] = {}
+
+    def try_acquire(self, key: str, token: str, ttl: float) -> Optional[int]:
+        with self._update(key) as (lease, write):
+            if lease.get("token") is not None and lease["expires"] > time.time():
+                return None
+            fence = lease.get("fence", 0) + 1
+            write({"token": token, "fence": fence, "expires": time.time() + ttl})
+            return fence
+
+    def renew(self, key: str, token: str, ttl: float) -> bool:
+        with self._update(key) as (lease, write):
+            if lease.get("token") != token or lease["expires"] <= time.time():
+                return False
+            write(dict(lease, expires=time.time() + ttl))
+            return True
+
+    def release(self, key: str, token: str) -> bool:
+        with self._update(key) as (lease, write):
+            held = lease.get("token") == token and lease["expires"] > time.time()
+            if held:
+                # The file stays behind so the next fencing number is still larger
+                write(dict(lease, token=None, expires=0))
+        if held:
+            condition = self._condition(key)
+            with condition:
+                condition.notify()
+        return held
+
+    def wait(self, key: str, timeout: float):
+        condition = self._condition(key)
+        with condition:
+            condition.wait(min(timeout, LOCAL_POLL_INTERVAL))
+
+    def _condition(self, key: str) -> threading.Condition:
+        with self._lock:
+            return self._released.setdefault(key, threading.Condition())
+
+    def _path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid lease key {key!r}")
+        return os.path.join(self.root, *parts) + ".lease"
+
+    def _update(self, key: str) -> "_LeaseFile":
+        return _LeaseFile(self, self._path(key))
+
+
+class _LeaseFile:
+    """Reads a lease file and allows replacing it, all while holding the store's lock file."""
+
+    def __init__(self, store: LocalLeaseStore, path: str):
+        self.store = store
+        self.path = path
+        self._lock_file = None
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._lock_file = open(os.path.join(self.store.root, LOCK_FILE), "ab")
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    lease = json.load(f)
+            except (OSError, ValueError):
+                lease = {}
+        except BaseException:
+            self._close()
+            raise
+        return lease, self._write
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._close()
+
+    def _write(self, lease: dict):
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(lease, f)
+        os.replace(tmp_path, self.path)
+
+    def _close(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.store._lock.release()
+
+
+class RedisLeaseStore(LeaseStore):
+    """
+    Leases stored as Redis keys set with NX and an expiry.
+
+    Releasing pushes to a per-lease wake-up list that waiters block on with
+    BLPOP, which Redis serves in the order the waiters arrived.
+    """
+
+    def __init__(self, client, key_prefix: str):
+        """
+        Args:
+            client: redis.Redis client
+            key_prefix: Prefix prepended to every lease key
+        """
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def try_acquire(self, key: str, token: str, ttl: float) -> Optional[int]:
+        if not self.client.set(self.key_prefix + key, token, nx=True, px=_milliseconds(ttl)):
+            return None
+        return self.client.incr(f"{self.key_prefix}{key}:fence")
+
+    def renew(self, key: str, token: str, ttl: float) -> bool:
+        return self._if_held(key, token, lambda pipe, name: pipe.pexpire(name, _milliseconds(ttl)))
+
+    def release(self, key: str, token: str) -> bool:
+        wake_key = f"{self.key_prefix}{key}:released"
+
+        def release(pipe, name: str):
+            pipe.delete(name)
+            pipe.lpush(wake_key, token)
+            # Nobody may be waiting; the wake-up must not linger
+            pipe.pexpire(wake_key, _milliseconds(DEFAULT_LEASE_TTL))
+
+        return self._if_held(key, token, release)
+
+    def wait(self, key: str, timeout: float):
+        self.client.blpop([f"{self.key_prefix}{key}:released"], timeout=max(timeout, 0.01))
+
+    def _if_held(self, key: str, token: str, update) -> bool:
+        name = self.key_prefix + key
+
+        def transaction(pipe) -> bool:
+            holder = pipe.get(name)
+            if holder is None or (holder.decode("utf-8") if isinstance(holder, bytes) else holder) != token:
+                pipe.unwatch()
+                return False
+            pipe.multi()
+            update(pipe, name)
+            return True
+
+        return self.client.transaction(transaction, name, value_from_callable=True)
+
+
+class Lease:
+    """
+    A lease held on one session, renewed in the background until it is released.
+
+    The lease is advisory: storage does not compare the fencing number on
+    writes, so a worker that stalls between check() and the end of its
+    upload can still overwrite the state of a worker that took the lease
+    over. Keep ttl well above the longest expected pause of a worker.
+
+    Attributes:
+        key: Lease key
+        fence: Fencing number, larger than that of every earlier holder
+        ttl: Seconds the lease lasts after each renewal
+    """
+
+    def __init__(self, store: LeaseStore, key: str, token: str, fence: int, ttl: float):
+        self.store = store
+        self.key = key
+        self.fence = fence
+        self.ttl = ttl
+        self._token = token
+        self._lost = False
+        self._released = False
+
+    @property
+    def lost(self) -> bool:
+        """Whether a renewal found the lease expired or held by someone else."""
+        return self._lost
+
+    def check(self):
+        """
+        Make sure the lease is still held, extending it by ttl.
+
+        Called right before the session is uploaded, so a worker that knows
+        its lease ran out does not overwrite the state of the worker that took
+        it over. The upload itself is not fenced.
+
+        Raises:
+            LeaseLostError: If the lease is no longer held
+        """
+        if self._lost or not self.store.renew(self.key, self._token, self.ttl):
+            self._lost = True
+            raise LeaseLostError(f"The lease on {self.key} expired or was taken over by another worker")
+
+    def release(self):
+        """Give up the lease. Calling release more than once is a no-op."""
+        if self._released:
+            return
+        self._released = True
+        _heartbeat.remove(self)
+        if not self._lost:
+            self.store.release(self.key, self._token)
+
+    def _renew(self):
+        if self._released:
+            return
+        if not self.store.renew(self.key, self._token, self.ttl):
+            self._lost = True
+            logging.error(f"Lost the lease on {self.key}; the session will not be uploaded")
+
+
+def acquire_lease(
+    store: LeaseStore,
+    key: str,
+    ttl: float = DEFAULT_LEASE_TTL,
+    timeout: Optional[float] = None
+) -> Lease:
+    """
+    Take a lease, waiting in line while someone else holds it.
+
+    Args:
+        store: Where the lease is kept
+        key: Lease key, e.g. "<user_id>/<session_id>"
+        ttl: Seconds the lease lasts without renewal; it is renewed every ttl / 3 while held
+        timeout: Maximum number of seconds to wait (wait as long as it takes if None)
+
+    Returns:
+        Lease: The held lease
+
+    Raises:
+        LeaseTimeoutError: If the lease was not granted within timeout
+    """
+    token = uuid.uuid4().hex
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        fence = store.try_acquire(key, token, ttl)
+        if fence is not None:
+            lease = Lease(store, key, token, fence, ttl)
+            _heartbeat.add(lease)
+            return lease
+        remaining = ttl if deadline is None else deadline - time.monotonic()
+        if remaining <= 0:
+            raise LeaseTimeoutError(f"The lease on {key} was not granted within {timeout} seconds")
+        # A holder that died never releases; look again once its lease could have expired
+        store.wait(key, min(remaining, ttl))
+
+
+def create_lease_store(
+    provider: str = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    redis_client=None
+) -> LeaseStore:
+    """
+    Create the lease store of a provider configuration.
+
+    Leases live under <storage_path>/.nova-leases for "local" and under
+    <key_prefix>:nova-lease: for "redis".
+
+    Args:
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        redis_client: Existing redis.Redis client to use instead of connecting from redis_options
+
+    Returns:
+        LeaseStore: Lease store for the provider
+
+    Raises:
+        ValueError: If the provider has no lease support
+    """
+    if provider == "local":
+        base = storage_path or os.path.join(os.path.expanduser("~"), ".browserstate")
+        root = os.path.abspath(os.path.join(base, ".nova-leases"))
+        # One store per directory, so releases wake the waiters of every mount in this process
+        with _local_stores_lock:
+            store = _local_stores.get(root)
+            if store is None:
+                store = _local_stores[root] = LocalLeaseStore(root)
+        return store
+    if provider == "redis":
+        from .storage import _redis_client
+
+        redis_options = redis_options or {}
+        key_prefix = redis_options.get("key_prefix", "browserstate").rstrip(":")
+        client = redis_client if redis_client is not None else _redis_client(redis_options)
+        return RedisLeaseStore(client, f"{key_prefix}:nova-lease:")
+    raise ValueError(f"Leases are not available for provider {provider!r}")
+
+
+class _Heartbeat:
+    """One background thread renewing every held lease at a third of its ttl."""
+
+    def __init__(self):
+        self._leases: Dict[Lease, float] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, lease: Lease):
+        with self._condition:
+            self._leases[lease] = time.monotonic() + lease.ttl / 3
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="browserstate-lease-heartbeat", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def remove(self, lease: Lease):
+        with self._condition:
+            self._leases.pop(lease, None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [lease for lease, at in self._leases.items() if at <= now]
+                for lease in due:
+                    self._leases[lease] = now + lease.ttl / 3
+                if not due:
+                    next_at = min(self._leases.values(), default=now + 60)
+                    self._condition.wait(next_at - now)
+                    continue
+            for lease in due:
+                try:
+                    lease._renew()
+                except Exception as e:
+                    # E.g. a Redis hiccup; the next beat tries again before the lease runs out
+                    logging.warning(f"Renewing the lease on {lease.key} failed: {e}")
+                if lease.lost:
+                    self.remove(lease)
+
+
+_heartbeat = _Heartbeat()
+
+
+def _milliseconds(seconds: float) -> int:
+    return max(1, int(seconds * 1000))
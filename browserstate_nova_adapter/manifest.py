@@ -0,0 +1,114 @@
+"""
+Per-file manifests of browser profiles, used to find what changed during a mount.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+# Read size used when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Threads hashing files at the same time; hashlib releases the GIL while hashing
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+class FileEntry(NamedTuple):
+    """Manifest entry of one profile file."""
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+class ManifestDiff(NamedTuple):
+    """Relative paths that were added or modified, and paths that were deleted."""
+    changed: List[str]
+    deleted: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.deleted)
+
+
+def hash_file(path: str) -> str:
+    """
+    Hash the contents of a file.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(
+    root: str,
+    previous: Optional[Dict[str, FileEntry]] = None,
+    max_workers: int = HASH_WORKERS
+) -> Dict[str, FileEntry]:
+    """
+    Build a manifest of every regular file below root.
+
+    Files whose size and mtime match their entry in previous are not hashed
+    again, which keeps rebuilding the manifest of a mostly unchanged profile cheap.
+    The remaining files are hashed on up to max_workers threads.
+
+    Args:
+        root: Profile directory
+        previous: Earlier manifest of the same directory
+        max_workers: Number of files hashed at the same time
+
+    Returns:
+        Dict[str, FileEntry]: Entries keyed by path relative to root, using "/" as separator
+    """
+    previous = previous or {}
+    manifest = {}
+    to_hash = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if not os.path.isfile(path) or os.path.islink(path):
+                continue
+            rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+            known = previous.get(rel_path)
+            if known is not None and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+                manifest[rel_path] = known
+            else:
+                to_hash.append((rel_path, path, stat))
+
+    if max_workers > 1 and len(to_hash) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(to_hash))) as executor:
+            digests = list(executor.map(hash_file, [path for _, path, _ in to_hash]))
+    else:
+        digests = [hash_file(path) for _, path, _ in to_hash]
+    for (rel_path, _, stat), digest in zip(to_hash, digests):
+        manifest[rel_path] = FileEntry(stat.st_size, stat.st_mtime_ns, digest)
+    return manifest
+
+
+def diff_manifests(old: Dict[str, FileEntry], new: Dict[str, FileEntry]) -> ManifestDiff:
+    """
+    Compare two manifests by content.
+
+    Args:
+        old: Manifest taken at mount time
+        new: Manifest of the profile now
+
+    Returns:
+        ManifestDiff: Files to upload and files to delete
+    """
+    changed = sorted(
+        path for path, entry in new.items()
+        if path not in old or old[path].digest != entry.digest
+    )
+    deleted = sorted(path for path in old if path not in new)
+    return ManifestDiff(changed, deleted)
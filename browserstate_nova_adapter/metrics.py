@@ -0,0 +1,339 @@
+"""
+Per-phase timings and transfer counters of mounts and unmounts, delivered to pluggable hooks.
+
+Nothing is measured while no hook is registered: every operation then gets
+a shared no-op recorder, so instrumentation costs one function call per phase.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_hooks: Tuple[Callable[["OperationMetrics"], None], ...] = ()
+_hooks_lock = threading.Lock()
+
+
+class OperationMetrics:
+    """
+    Measurements of one mount or unmount, passed to every hook when the operation ends.
+
+    Attributes:
+        operation: "mount" or "unmount"
+        user_id: User of the session
+        session_id: Identifier of the session
+        provider: Storage provider of the session
+        storage_format: Storage format of the session
+        phases: Seconds spent per phase, e.g. {"setup": 0.01, "download": 0.4}
+        duration: Seconds the whole operation took
+        files: Profile files transferred
+        bytes: Profile bytes transferred (before compression)
+        cache_hit: Whether the mount was served from the mount cache; None without a cache
+        error: Exception the operation failed with, if any
+    """
+
+    enabled = True
+
+    def __init__(self, operation: str, user_id: str, session_id: str, provider: str, storage_format: str):
+        self.operation = operation
+        self.user_id = user_id
+        self.session_id = session_id
+        self.provider = provider
+        self.storage_format = storage_format
+        self.phases: Dict[str, float] = {}
+        self.duration = 0.0
+        self.files = 0
+        self.bytes = 0
+        self.cache_hit: Optional[bool] = None
+        self.error: Optional[BaseException] = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the operation; phases entered more than once add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_transfer(self, files: int, size: int):
+        """Count transferred profile files and bytes."""
+        self.files += files
+        self.bytes += size
+
+    def add_directory(self, path: str):
+        """Count every file below path as transferred."""
+        self.add_transfer(*directory_stats(path))
+
+    def set_cache_hit(self, hit: bool):
+        """Record whether the mount cache had the session."""
+        self.cache_hit = hit
+
+    def finish(self, error: Optional[BaseException] = None):
+        """End the operation and pass the measurements to the hooks."""
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+        for hook in _hooks:
+            try:
+                hook(self)
+            except Exception as e:
+                logging.warning(f"Metrics hook {hook!r} failed: {e}")
+
+    def as_dict(self) -> dict:
+        """Measurements as a JSON-serializable dict."""
+        return {
+            "operation": self.operation,
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "provider": self.provider,
+            "storage_format": self.storage_format,
+            "phases": dict(self.phases),
+            "duration": self.duration,
+            "files": self.files,
+            "bytes": self.bytes,
+            "cache_hit": self.cache_hit,
+            "error": repr(self.error) if self.error is not None else None,
+        }
+
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _NullMetrics:
+    """Recorder used while no hook is registered."""
+
+    enabled = False
+    _context = _NullContext()
+
+    def phase(self, name: str) -> _NullContext:
+        return self._context
+
+    def add_transfer(self, files: int, size: int):
+        pass
+
+    def add_directory(self, path: str):
+        pass
+
+    def set_cache_hit(self, hit: bool):
+        pass
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+
+_NULL_METRICS = _NullMetrics()
+
+
+def start_operation(operation: str, user_id: str, session_id: str, provider: str, storage_format: str):
+    """
+    Start measuring an operation.
+
+    Returns:
+        OperationMetrics, or a no-op recorder with the same methods while no hook is registered
+    """
+    if not _hooks:
+        return _NULL_METRICS
+    return OperationMetrics(operation, user_id, session_id, provider, storage_format)
+
+
+def add_metrics_hook(hook: Callable[[OperationMetrics], None]):
+    """
+    Call hook with the OperationMetrics of every mount and unmount from now on.
+
+    Hooks run on the thread that performed the operation and should return
+    quickly; exceptions they raise are logged and otherwise ignored.
+
+    Args:
+        hook: Callable, e.g. a function, a LoggingHook or a MetricsRegistry
+    """
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_metrics_hook(hook: Callable[[OperationMetrics], None]):
+    """Stop calling a hook registered with add_metrics_hook."""
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(registered for registered in _hooks if registered is not hook)
+
+
+def directory_stats(path: str) -> Tuple[int, int]:
+    """
+    Count the regular files below a directory.
+
+    Returns:
+        Tuple[int, int]: Number of files and their total size in bytes
+    """
+    files = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            files += 1
+            size += stat.st_size
+    return files, size
+
+
+class LoggingHook:
+    """
+    Logs one record per operation.
+
+    The measurements are attached to the record as its "browserstate_metrics"
+    attribute, for structured log handlers.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO):
+        """
+        Args:
+            logger: Logger to log to (defaults to the "browserstate_nova_adapter.metrics" logger)
+            level: Level of successful operations; failed ones are logged as errors
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def __call__(self, metrics: OperationMetrics):
+        phases = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in metrics.phases.items())
+        status = f"failed ({metrics.error})" if metrics.error is not None else "done"
+        self.logger.log(
+            logging.ERROR if metrics.error is not None else self.level,
+            f"{metrics.operation} of session {metrics.session_id} for user {metrics.user_id} {status} "
+            f"in {metrics.duration:.3f}s [{phases}] files={metrics.files} bytes={metrics.bytes}",
+            extra={"browserstate_metrics": metrics.as_dict()},
+        )
+
+
+class MetricsRegistry:
+    """
+    Prometheus-style counters and histograms of mounts and unmounts, kept in memory.
+
+    Register it as a hook and expose render() through whatever endpoint or
+    exporter the application already has; the registry itself never opens
+    a connection.
+
+    Example:
+        ```python
+        registry = MetricsRegistry()
+        add_metrics_hook(registry)
+        ...
+        print(registry.render())
+        ```
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, namespace: str = "browserstate_nova"):
+        """
+        Args:
+            buckets: Upper bounds of the histogram buckets in seconds
+            namespace: Prefix of the metric names
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+
+    def __call__(self, metrics: OperationMetrics):
+        labels = {
+            "operation": metrics.operation,
+            "provider": metrics.provider,
+            "storage_format": metrics.storage_format,
+        }
+        status = "error" if metrics.error is not None else "ok"
+        with self._lock:
+            self._inc("operations_total", dict(labels, status=status))
+            self._observe("operation_seconds", labels, metrics.duration)
+            for name, seconds in metrics.phases.items():
+                self._observe("phase_seconds", dict(labels, phase=name), seconds)
+            self._inc("transferred_files_total", labels, metrics.files)
+            self._inc("transferred_bytes_total", labels, metrics.bytes)
+            if metrics.cache_hit is not None:
+                self._inc("cache_requests_total", dict(labels, result="hit" if metrics.cache_hit else "miss"))
+
+    def get(self, name: str, **labels) -> float:
+        """
+        Value of a counter, or the observation count of a histogram.
+
+        Args:
+            name: Metric name without the namespace, e.g. "operations_total"
+            labels: Labels to match; unspecified labels are summed over
+
+        Returns:
+            float: The summed value
+        """
+        wanted = set((key, str(value)) for key, value in labels.items())
+        total = 0.0
+        with self._lock:
+            for (metric, metric_labels), value in self._counters.items():
+                if metric == name and wanted <= set(metric_labels):
+                    total += value
+            for (metric, metric_labels), values in self._histograms.items():
+                if metric == name and wanted <= set(metric_labels):
+                    total += values[-1]
+        return total
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({metric for metric, _ in self._counters}):
+                lines.append(f"# TYPE {self.namespace}_{name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{self.namespace}_{name}{_format_labels(labels)} {value:g}")
+            for name in sorted({metric for metric, _ in self._histograms}):
+                lines.append(f"# TYPE {self.namespace}_{name} histogram")
+                for (metric, labels), values in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets + (float("inf"),), values):
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(
+                            f"{self.namespace}_{name}_bucket{_format_labels(labels + (('le', le),))} {count:g}"
+                        )
+                    lines.append(f"{self.namespace}_{name}_sum{_format_labels(labels)} {values[-2]:g}")
+                    lines.append(f"{self.namespace}_{name}_count{_format_labels(labels)} {values[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drop all recorded values."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _inc(self, name: str, labels: Dict[str, str], amount: float = 1):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _observe(self, name: str, labels: Dict[str, str], value: float):
+        key = (name, tuple(sorted(labels.items())))
+        # Cumulative bucket counts (including +Inf), then sum and count
+        values = self._histograms.setdefault(key, [0.0] * (len(self.buckets) + 3))
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                values[number] += 1
+        values[len(self.buckets)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(pairs) + "}"
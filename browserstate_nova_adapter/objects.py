@@ -0,0 +1,573 @@
+"""
+Object storage (S3, GCS) with parallel, multipart transfers of profile files.
+"""
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .blobs import BlobStore
+from .integrity import IntegrityError
+
+# Files larger than this are split into parts that are transferred in parallel
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+# Objects or parts transferred at the same time
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Where parts of unfinished multipart writes are kept by stores without native multipart uploads
+PARTS_PREFIX = ".nova-parts/"
+
+
+class ObjectStore(ABC):
+    """
+    Bucket of objects addressed by "/" separated keys, read by range and written in parts.
+
+    Attributes:
+        min_part_size: Smallest part a multipart write accepts, except for the last part
+        max_parts: Most parts a multipart write may have
+    """
+
+    min_part_size = 1
+    max_parts = 10000
+
+    @property
+    @abstractmethod
+    def scope(self) -> str:
+        """Identifies the storage location, e.g. for keying local caches."""
+
+    @abstractmethod
+    def list(self, prefix: str) -> Dict[str, int]:
+        """List the objects whose key starts with prefix, with their sizes."""
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        """Read bytes start to end (exclusive, None for the end of the object), or None if it does not exist."""
+
+    @abstractmethod
+    def write(self, key: str, data: bytes):
+        """Create or replace an object."""
+
+    @abstractmethod
+    def delete(self, keys: Iterable[str]):
+        """Delete objects; missing keys are ignored."""
+
+    @abstractmethod
+    def start_multipart(self, key: str) -> str:
+        """Start writing an object in parts, returning the id of the upload."""
+
+    @abstractmethod
+    def write_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        """Write part number (counting from 1) of a multipart write, returning its tag."""
+
+    @abstractmethod
+    def complete_multipart(self, key: str, upload_id: str, parts: List[str]):
+        """Assemble the object from the tags of its parts, in order."""
+
+    @abstractmethod
+    def abort_multipart(self, key: str, upload_id: str):
+        """Discard the parts of an unfinished multipart write."""
+
+
+class S3ObjectStore(ObjectStore):
+    """Objects in an S3 bucket (or an S3-compatible service), accessed through a boto3 client."""
+
+    # S3 rejects smaller parts
+    min_part_size = 5 * 1024 * 1024
+
+    def __init__(self, client, bucket_name: str):
+        """
+        Args:
+            client: boto3 S3 client
+            bucket_name: Bucket holding the sessions
+        """
+        self.client = client
+        self.bucket_name = bucket_name
+
+    @property
+    def scope(self) -> str:
+        return f"s3:{self.client.meta.endpoint_url}/{self.bucket_name}"
+
+    def list(self, prefix: str) -> Dict[str, int]:
+        objects = {}
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for entry in page.get("Contents", ()):
+                objects[entry["Key"]] = entry["Size"]
+        return objects
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        if end is not None and end <= start:
+            return b""
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key, **kwargs)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+
+    def delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        # DeleteObjects takes at most 1000 keys
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True},
+            )
+
+    def start_multipart(self, key: str) -> str:
+        return self.client.create_multipart_upload(Bucket=self.bucket_name, Key=key)["UploadId"]
+
+    def write_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        response = self.client.upload_part(
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+        )
+        return response["ETag"]
+
+    def complete_multipart(self, key: str, upload_id: str, parts: List[str]):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"ETag": tag, "PartNumber": n} for n, tag in enumerate(parts, 1)]},
+        )
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+
+
+class GCSObjectStore(ObjectStore):
+    """
+    Objects in a Google Cloud Storage bucket.
+
+    Parts of a multipart write are uploaded as temporary objects under
+    PARTS_PREFIX and composed into the final object, the same way parallel
+    composite uploads work in gsutil.
+    """
+
+    # Most objects a single compose request accepts
+    max_parts = 32
+
+    def __init__(self, bucket):
+        """
+        Args:
+            bucket: google.cloud.storage.Bucket holding the sessions
+        """
+        self.bucket = bucket
+
+    @property
+    def scope(self) -> str:
+        return f"gcs:{self.bucket.name}"
+
+    def list(self, prefix: str) -> Dict[str, int]:
+        return {blob.name: blob.size for blob in self.bucket.list_blobs(prefix=prefix)}
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        from google.api_core.exceptions import NotFound
+
+        if end is not None and end <= start:
+            return b""
+        try:
+            # The end of a GCS range is inclusive
+            return self.bucket.blob(key).download_as_bytes(start=start, end=None if end is None else end - 1)
+        except NotFound:
+            return None
+
+    def write(self, key: str, data: bytes):
+        self.bucket.blob(key).upload_from_string(data)
+
+    def delete(self, keys: Iterable[str]):
+        blobs = [self.bucket.blob(key) for key in keys]
+        if blobs:
+            self.bucket.delete_blobs(blobs, on_error=lambda blob: None)
+
+    def start_multipart(self, key: str) -> str:
+        return uuid.uuid4().hex
+
+    def write_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        name = f"{PARTS_PREFIX}{upload_id}/{number:05d}"
+        self.bucket.blob(name).upload_from_string(data)
+        return name
+
+    def complete_multipart(self, key: str, upload_id: str, parts: List[str]):
+        self.bucket.blob(key).compose([self.bucket.blob(name) for name in parts])
+        self.delete(parts)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self.delete(self.list(f"{PARTS_PREFIX}{upload_id}/"))
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Objects stored as files below a root directory.
+
+    A stand-in for S3 and GCS in tests and benchmarks that goes through the
+    same parallel, multipart transfer code.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Directory holding the objects
+        """
+        self.root = os.path.abspath(root)
+
+    @property
+    def scope(self) -> str:
+        return f"local-objects:{self.root}"
+
+    def _path(self, key: str) -> str:
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            raise ValueError(f"Invalid object key {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def list(self, prefix: str) -> Dict[str, int]:
+        # Only walk the deepest directory fully covered by the prefix
+        base = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        start = os.path.join(self.root, *base.split("/")) if base else self.root
+        objects = {}
+        for dirpath, _, filenames in os.walk(start):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix) and not key.startswith(PARTS_PREFIX):
+                    try:
+                        objects[key] = os.path.getsize(path)
+                    except FileNotFoundError:
+                        continue
+        return objects
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(start)
+                return f.read() if end is None else f.read(max(0, end - start))
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, keys: Iterable[str]):
+        for key in keys:
+            path = self._path(key)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            # Drop directories the deletion left empty
+            parent = os.path.dirname(path)
+            while parent != self.root:
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+    def start_multipart(self, key: str) -> str:
+        self._path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(f"{PARTS_PREFIX}{upload_id}"))
+        return upload_id
+
+    def write_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        name = f"{PARTS_PREFIX}{upload_id}/{number:05d}"
+        with open(self._path(name), "wb") as f:
+            f.write(data)
+        return name
+
+    def complete_multipart(self, key: str, upload_id: str, parts: List[str]):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            for name in parts:
+                with open(self._path(name), "rb") as part:
+                    shutil.copyfileobj(part, f)
+        os.replace(tmp_path, path)
+        self.abort_multipart(key, upload_id)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        shutil.rmtree(self._path(f"{PARTS_PREFIX}{upload_id}"), ignore_errors=True)
+
+
+class ObjectBlobStore(BlobStore):
+    """
+    Blobs stored as objects under a key prefix of an object store.
+
+    Counter updates are only atomic within one process, so the store is
+    meant for records written by a single writer, such as checksum records.
+    """
+
+    def __init__(self, store: ObjectStore, key_prefix: str):
+        """
+        Args:
+            store: Object store holding the blobs
+            key_prefix: Prefix prepended to every blob key
+        """
+        self.store = store
+        self.key_prefix = key_prefix
+
+    @property
+    def scope(self) -> str:
+        return f"{self.store.scope}/{self.key_prefix}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.store.read(self.key_prefix + key)
+
+    def put(self, key: str, data: bytes):
+        self.store.write(self.key_prefix + key, data)
+
+    def delete(self, keys: Iterable[str]):
+        self.store.delete([self.key_prefix + key for key in keys])
+
+    def list(self, prefix: str) -> List[str]:
+        start = len(self.key_prefix)
+        return sorted(key[start:] for key in self.store.list(self.key_prefix + prefix))
+
+
+def upload_files(
+    store: ObjectStore,
+    source_path: str,
+    prefix: str,
+    rel_paths: Iterable[str],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    part_size: int = DEFAULT_PART_SIZE
+) -> List[str]:
+    """
+    Upload profile files as objects named <prefix><rel_path>, several at a time.
+
+    Files larger than part_size are uploaded as multipart writes whose parts
+    are sent in parallel with the other files. At most max_concurrency
+    transfers run at once, each holding at most one part in memory.
+
+    Args:
+        store: Object store to upload to
+        source_path: Profile directory
+        prefix: Key prefix of the session
+        rel_paths: Files to upload, relative to source_path with "/" as separator
+        max_concurrency: Transfers running at the same time
+        part_size: Size of the parts large files are split into
+
+    Returns:
+        List[str]: Keys of the uploaded objects
+    """
+    keys = []
+    multipart: List[Tuple[str, str, List[Future]]] = []
+    futures: List[Future] = []
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        try:
+            for rel_path in rel_paths:
+                path = os.path.join(source_path, *rel_path.split("/"))
+                key = prefix + rel_path
+                size = os.path.getsize(path)
+                file_part_size = _part_size(store, size, part_size)
+                keys.append(key)
+                if size <= file_part_size:
+                    futures.append(executor.submit(_upload_object, store, key, path))
+                    continue
+                upload_id = store.start_multipart(key)
+                parts = [
+                    executor.submit(_upload_part, store, key, upload_id, number, path, offset, file_part_size)
+                    for number, offset in enumerate(range(0, size, file_part_size), 1)
+                ]
+                multipart.append((key, upload_id, parts))
+                futures.extend(parts)
+            _wait_all(futures)
+            for key, upload_id, parts in multipart:
+                futures.append(executor.submit(store.complete_multipart, key, upload_id, [p.result() for p in parts]))
+            _wait_all(futures)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            for key, upload_id, _ in multipart:
+                try:
+                    store.abort_multipart(key, upload_id)
+                except Exception:
+                    # The store expires abandoned parts on its own; the upload error matters more
+                    pass
+            raise
+    return keys
+
+
+def download_objects(
+    store: ObjectStore,
+    objects: Dict[str, int],
+    prefix: str,
+    target_path: str,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    part_size: int = DEFAULT_PART_SIZE
+):
+    """
+    Download objects named <prefix><rel_path> into target_path, several at a time.
+
+    Objects larger than part_size are fetched as ranged reads that run in
+    parallel with the other objects and are written into place.
+
+    Args:
+        store: Object store to download from
+        objects: Keys to download with their sizes, as returned by ObjectStore.list
+        prefix: Key prefix of the session
+        target_path: Directory to write the profile to
+        max_concurrency: Transfers running at the same time
+        part_size: Size of the ranges large objects are read in
+
+    Raises:
+        IntegrityError: If an object disappeared or changed size during the download
+    """
+    target_path = os.path.realpath(target_path)
+    futures: List[Future] = []
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        try:
+            for key, size in sorted(objects.items()):
+                destination = os.path.realpath(os.path.join(target_path, key[len(prefix):]))
+                if os.path.commonpath([destination, target_path]) != target_path:
+                    raise ValueError(f"Object {key!r} escapes the session directory")
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                # Sized up front so that ranges can be written in any order
+                with open(destination, "wb") as f:
+                    f.truncate(size)
+                for start in range(0, size, max(1, part_size)):
+                    end = min(start + part_size, size)
+                    futures.append(executor.submit(_download_range, store, key, destination, start, end))
+            _wait_all(futures)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _part_size(store: ObjectStore, size: int, part_size: int) -> int:
+    # Large files get larger parts rather than more parts than the store accepts
+    return max(part_size, store.min_part_size, -(-size // store.max_parts))
+
+
+def _upload_object(store: ObjectStore, key: str, path: str):
+    with open(path, "rb") as f:
+        store.write(key, f.read())
+
+
+def _upload_part(
+    store: ObjectStore, key: str, upload_id: str, number: int, path: str, offset: int, length: int
+) -> str:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return store.write_part(key, upload_id, number, data)
+
+
+def _download_range(store: ObjectStore, key: str, destination: str, start: int, end: int):
+    data = store.read(key, start, end)
+    if data is None:
+        raise IntegrityError(f"Object {key} disappeared during the download")
+    if len(data) != end - start:
+        raise IntegrityError(f"Object {key} changed during the download")
+    with open(destination, "r+b") as f:
+        f.seek(start)
+        f.write(data)
+
+
+def _wait_all(futures: List[Future]):
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in done:
+        if future.exception() is not None:
+            raise future.exception()
+
+
+def create_object_store(provider: str, options: Optional[dict] = None) -> ObjectStore:
+    """
+    Create the object store of an "s3" or "gcs" provider configuration.
+
+    Args:
+        provider: "s3" or "gcs"
+        options: For "s3": bucket_name, access_key_id, secret_access_key, region and
+            endpoint as for BrowserState's S3 storage, or an existing boto3 client as
+            "client". For "gcs": bucket_name, service_account_path and project_id as
+            for BrowserState's GCS storage, or an existing Bucket as "bucket".
+            "max_concurrency" sizes the connection pool.
+
+    Returns:
+        ObjectStore: Object store of the bucket
+
+    Raises:
+        ValueError: If the provider is not an object store or no bucket is configured
+    """
+    options = options or {}
+    max_concurrency = options.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+    if provider == "s3":
+        if not options.get("bucket_name"):
+            raise ValueError("s3_options must name a bucket_name")
+        client = options.get("client")
+        if client is None:
+            client = _s3_client(options, max_concurrency)
+        return S3ObjectStore(client, options["bucket_name"])
+    if provider == "gcs":
+        bucket = options.get("bucket")
+        if bucket is None:
+            if not options.get("bucket_name"):
+                raise ValueError("gcs_options must name a bucket_name")
+            bucket = _gcs_client(options, max_concurrency).bucket(options["bucket_name"])
+        return GCSObjectStore(bucket)
+    raise ValueError(f"Provider {provider!r} is not an object store")
+
+
+def _s3_client(options: dict, max_concurrency: int):
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise ImportError(
+            "The boto3 package is required for direct S3 access. "
+            "Install it with: pip install boto3"
+        )
+    kwargs = {}
+    if options.get("region"):
+        kwargs["region_name"] = options["region"]
+    if options.get("endpoint"):
+        kwargs["endpoint_url"] = options["endpoint"]
+    if options.get("access_key_id") and options.get("secret_access_key"):
+        kwargs["aws_access_key_id"] = options["access_key_id"]
+        kwargs["aws_secret_access_key"] = options["secret_access_key"]
+    # One connection per concurrent transfer instead of botocore's default of 10
+    return boto3.client("s3", config=Config(max_pool_connections=max(10, max_concurrency)), **kwargs)
+
+
+def _gcs_client(options: dict, max_concurrency: int):
+    try:
+        from google.cloud import storage
+    except ImportError:
+        raise ImportError(
+            "The google-cloud-storage package is required for direct GCS access. "
+            "Install it with: pip install google-cloud-storage"
+        )
+    kwargs = {}
+    if options.get("project_id"):
+        kwargs["project"] = options["project_id"]
+    if options.get("service_account_path"):
+        client = storage.Client.from_service_account_json(options["service_account_path"], **kwargs)
+    else:
+        client = storage.Client(**kwargs)
+    try:
+        import requests
+
+        # One connection per concurrent transfer instead of the default of 10
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        client._http.mount("https://", adapter)
+    except (ImportError, AttributeError):
+        pass
+    return client
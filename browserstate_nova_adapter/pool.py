@@ -0,0 +1,275 @@
+"""
+Pool of browser sessions mounted ahead of time.
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from . import mount_browserstate_session, MountedSession
+
+
+class SessionPool:
+    """
+    Keeps upcoming sessions mounted in the background so they can be handed out instantly.
+
+    Sessions that are known to be needed soon are queued with prefetch. The
+    pool mounts up to `size` of them ahead of time on a bounded set of
+    worker threads. acquire returns an already mounted session (or waits for
+    one that is still mounting), and release hands the session back to the
+    workers to be unmounted and uploaded while the caller moves on.
+
+    Backpressure: at most `size` sessions are mounted ahead of time, and
+    release blocks while `max_pending_unmounts` uploads are already in flight.
+
+    Example:
+        ```python
+        with SessionPool(size=4, provider="redis", redis_options={"host": "localhost"}) as pool:
+            for user_id in upcoming_users:
+                pool.prefetch(user_id=user_id, session_id="default")
+
+            with pool.session(user_id="user1", session_id="default") as user_data_dir:
+                with NovaAct(starting_page="https://example.com", user_data_dir=user_data_dir) as nova:
+                    nova.act("search for something")
+        ```
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        max_workers: int = 4,
+        max_pending_unmounts: Optional[int] = None,
+        **defaults: Any
+    ):
+        """
+        Args:
+            size: Maximum number of sessions mounted ahead of time
+            max_workers: Number of background threads mounting and unmounting sessions
+            max_pending_unmounts: Maximum number of released sessions waiting to be
+                uploaded before release blocks (defaults to max_workers)
+            **defaults: Session configuration shared by all sessions of the pool
+                (same keys as create_session_config, e.g. provider or storage_path)
+        """
+        if size < 1 or max_workers < 1:
+            raise ValueError("size and max_workers must be at least 1")
+        self.size = size
+        self.defaults = defaults
+        self.errors: List[BaseException] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-pool")
+        self._unmount_slots = threading.BoundedSemaphore(max_pending_unmounts or max_workers)
+        self._lock = threading.Lock()
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._ready: Dict[Tuple[str, str], Future] = {}
+        self._busy: Set[Tuple[str, str]] = set()
+        self._pending_unmounts: Set[Future] = set()
+        self._closed = False
+
+    def prefetch(self, user_id: str, session_id: str, **config: Any):
+        """
+        Queue a session that will be acquired soon so it gets mounted in the background.
+
+        Args:
+            user_id: Unique identifier for the user
+            session_id: Identifier for this specific browser session
+            **config: Session configuration overriding the pool defaults
+        """
+        with self._lock:
+            self._check_open()
+            self._queue.append(self._config(user_id, session_id, config))
+            self._fill()
+
+    def acquire(self, user_id: str, session_id: str, timeout: Optional[float] = None, **config: Any) -> MountedSession:
+        """
+        Get a mounted session, prefetched if possible.
+
+        Sessions that were not prefetched are mounted on the calling thread.
+
+        Args:
+            user_id: Unique identifier for the user
+            session_id: Identifier for this specific browser session
+            timeout: Seconds to wait for a session that is still being prefetched
+            **config: Session configuration overriding the pool defaults
+
+        Returns:
+            MountedSession: Handle to the mounted session; give it back with release
+
+        Raises:
+            TimeoutError: If a prefetched session is still mounting after timeout seconds; it
+                stays in the pool for a later acquire
+        """
+        key = (user_id, session_id)
+        with self._lock:
+            self._check_open()
+            future = self._ready.pop(key, None)
+            queued = [c for c in self._queue if (c["user_id"], c["session_id"]) == key]
+            for queued_config in queued:
+                self._queue.remove(queued_config)
+            if future is None:
+                config = queued[0] if queued and not config else self._config(user_id, session_id, config)
+            self._busy.add(key)
+            self._fill()
+
+        try:
+            if future is not None:
+                return future.result(timeout)
+            return mount_browserstate_session(**config)
+        except FutureTimeoutError:
+            with self._lock:
+                self._busy.discard(key)
+                if not self._closed:
+                    # Still mounting: it stays ready for the next acquire, or for close() to unmount
+                    self._ready[key] = future
+                    future = None
+                    self._fill()
+            if future is not None:
+                future.add_done_callback(self._unmount_abandoned)
+            raise
+        except BaseException:
+            with self._lock:
+                self._busy.discard(key)
+                self._fill()
+            raise
+
+    def release(self, session: MountedSession):
+        """
+        Give a session back; it is unmounted and uploaded in the background.
+
+        Blocks while max_pending_unmounts uploads are already in flight.
+
+        Args:
+            session: Session returned by acquire
+
+        Raises:
+            RuntimeError: If the pool is closed; unmount the session directly then
+        """
+        self._release(session, check_open=True)
+
+    @contextmanager
+    def session(self, user_id: str, session_id: str, timeout: Optional[float] = None, **config: Any):
+        """
+        Context manager acquiring a session and releasing it on exit.
+
+        Args:
+            user_id: Unique identifier for the user
+            session_id: Identifier for this specific browser session
+            timeout: Seconds to wait for a session that is still being prefetched
+            **config: Session configuration overriding the pool defaults
+
+        Yields:
+            str: Path to the mounted browser session directory to use with Nova
+        """
+        mounted = self.acquire(user_id, session_id, timeout=timeout, **config)
+        try:
+            yield mounted.path
+        finally:
+            self.release(mounted)
+
+    def wait(self):
+        """Block until every released session has been unmounted."""
+        while True:
+            with self._lock:
+                pending = list(self._pending_unmounts)
+            if not pending:
+                return
+            for future in pending:
+                try:
+                    future.result()
+                except BaseException:
+                    pass  # Already recorded in self.errors
+
+    def close(self):
+        """
+        Stop prefetching, unmount every session still held by the pool and wait for all uploads.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.clear()
+            prefetched = list(self._ready.values())
+            self._ready.clear()
+
+        for future in prefetched:
+            try:
+                session = future.result()
+            except BaseException:
+                continue
+            self._release(session)
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "SessionPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _config(self, user_id: str, session_id: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        merged = dict(self.defaults)
+        merged.update(config)
+        merged["user_id"] = user_id
+        merged["session_id"] = session_id
+        return merged
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("SessionPool is closed")
+
+    def _release(self, session: MountedSession, check_open: bool = False):
+        self._unmount_slots.acquire()
+        try:
+            with self._lock:
+                if check_open and self._closed:
+                    raise RuntimeError(
+                        f"SessionPool is closed; unmount session {session.session_id} with session.unmount()"
+                    )
+                future = self._executor.submit(self._unmount, session)
+                # Pending before close() can start waiting, so it never shuts the executor down under it
+                self._pending_unmounts.add(future)
+        except BaseException:
+            self._unmount_slots.release()
+            raise
+        future.add_done_callback(self._unmount_done)
+
+    def _fill(self):
+        # Called with self._lock held. Sessions that are in use stay queued
+        # until they are released.
+        for config in list(self._queue):
+            if len(self._ready) >= self.size:
+                return
+            key = (config["user_id"], config["session_id"])
+            if key in self._ready or key in self._busy:
+                continue
+            self._queue.remove(config)
+            self._ready[key] = self._executor.submit(mount_browserstate_session, **config)
+
+    def _unmount(self, session: MountedSession):
+        try:
+            session.unmount()
+        finally:
+            with self._lock:
+                self._busy.discard(session.key)
+                if not self._closed:
+                    self._fill()
+
+    def _unmount_abandoned(self, future: Future):
+        # A prefetch that timed out in acquire after the pool was closed
+        if future.exception() is not None:
+            return
+        try:
+            future.result().unmount()
+        except BaseException as e:
+            logging.error(f"Error unmounting pooled session: {e}")
+            self.errors.append(e)
+
+    def _unmount_done(self, future: Future):
+        self._unmount_slots.release()
+        # Recorded before the future stops being pending, so wait() never returns without it
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Error unmounting pooled session: {error}")
+            self.errors.append(error)
+        with self._lock:
+            self._pending_unmounts.discard(future)
@@ -0,0 +1,1750 @@
+"""
+Direct access to BrowserState session storage.
+
+BrowserState normally moves profiles between the provider and disk on its
+own. Adapter features that need more control over that transfer (such as the
+mount cache) use the classes in this module instead. The "browserstate"
+format reads and writes the same storage layout as BrowserState, so a
+session can be mounted through either path; packed formats such as
+"archive" are only readable through the adapter.
+"""
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from .archive import (
+    BLOCK_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    PACK_WORKERS,
+    PARALLEL_THRESHOLD,
+    _CORRUPT_DATA_ERRORS,
+    _walk,
+    default_compression,
+    pack_profile,
+    process_pool,
+    unpack_profile,
+)
+from .blobs import MAX_IN_FLIGHT, BlobStore, LocalBlobStore, RedisBlobStore, _escape_glob
+from .dedup import DEDUP_CHUNK_SIZE, ChunkStore
+from .filters import ProfileFilter
+from .integrity import IntegrityError, IntegrityStore
+from .manifest import ManifestDiff
+from .objects import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_PART_SIZE,
+    ObjectBlobStore,
+    ObjectStore,
+    create_object_store,
+    download_objects,
+    upload_files,
+)
+
+# Archive chunk size for Redis, small enough that no single command holds up the server for other clients
+REDIS_CHUNK_SIZE = 1024 * 1024
+
+# Options of the "redis" provider that configure the stored keys rather than the connection
+_REDIS_KEY_OPTIONS = ("key_prefix", "ttl")
+
+# Seconds a half uploaded Redis archive lives on after its uploader died
+_STAGING_TTL = 3600
+
+# Reads of a Redis archive before giving up on one that keeps being replaced
+_MAX_READ_ATTEMPTS = 5
+
+# ioctl cloning a whole file on Linux file systems with copy-on-write support (Btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+# Source and target devices where cloning failed, so copies between them go straight to a regular copy
+_no_reflink_devices: Set[Tuple[int, int]] = set()
+
+
+class SessionStorage(ABC):
+    """
+    Reads and writes complete browser sessions in a storage provider.
+
+    Every stored session has an opaque version string that changes whenever
+    the session is written, by this adapter or by BrowserState itself.
+
+    Attributes:
+        integrity: Where the checksum records of the stored sessions are kept,
+            or None if the storage has no place for them
+        snapshots: Storage of the same kind holding the snapshots of these
+            sessions, each stored as a session named after the snapshot
+    """
+
+    integrity: Optional[IntegrityStore] = None
+    snapshots: Optional["SessionStorage"] = None
+
+    @property
+    @abstractmethod
+    def scope(self) -> str:
+        """Identifies the storage location, e.g. for keying local caches."""
+
+    @abstractmethod
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        """
+        Get the current version of a stored session.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+
+        Returns:
+            Optional[str]: Version of the session, or None if it does not exist
+        """
+
+    @abstractmethod
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        """
+        Download a session into target_path, creating an empty profile if it does not exist.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            target_path: Directory to write the profile to (must not exist yet)
+            profile_filter: Only download files kept by this filter
+
+        Returns:
+            Optional[str]: Version of the downloaded session, or None if it did not exist
+        """
+
+    @abstractmethod
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        """
+        Replace the stored session with the profile in source_path.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            source_path: Directory containing the profile
+
+        Returns:
+            str: New version of the session
+        """
+
+    @abstractmethod
+    def list_sessions(self, user_id: str) -> List[str]:
+        """
+        List the stored sessions of a user.
+
+        Args:
+            user_id: User identifier
+
+        Returns:
+            List[str]: Session identifiers, sorted
+        """
+
+    @abstractmethod
+    def delete(self, user_id: str, session_id: str) -> bool:
+        """
+        Delete a stored session together with its previous generation.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+
+        Returns:
+            bool: False if the session did not exist
+        """
+
+    def copy_session(
+        self,
+        user_id: str,
+        session_id: str,
+        target: "SessionStorage",
+        target_session_id: str
+    ) -> Optional[str]:
+        """
+        Copy a stored session to target, replacing target_session_id there.
+
+        Used to take snapshots and to branch sessions from them. The default
+        implementation downloads the session into a temporary directory and
+        uploads it again; storage that can copy without moving the profile
+        through this process overrides it.
+
+        Args:
+            user_id: User identifier
+            session_id: Session to copy
+            target: Storage to copy to, usually this storage or its snapshots
+            target_session_id: Identifier of the copy
+
+        Returns:
+            Optional[str]: Version of the copy, or None if the session does not exist
+        """
+        staging_dir = tempfile.mkdtemp(prefix="browserstate-copy-")
+        try:
+            profile_path = os.path.join(staging_dir, "profile")
+            if self.download(user_id, session_id, profile_path) is None:
+                return None
+            return target.upload(user_id, target_session_id, profile_path)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def upload_changes(
+        self,
+        user_id: str,
+        session_id: str,
+        source_path: str,
+        diff: ManifestDiff,
+        base_version: Optional[str]
+    ) -> Optional[str]:
+        """
+        Apply only the changed and deleted files of a profile to the stored session.
+
+        Storage that cannot update a session in place, or whose stored
+        session is no longer at base_version, returns None and the caller
+        falls back to a full upload.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            source_path: Directory containing the profile
+            diff: Files changed and deleted since the profile was mounted
+            base_version: Version of the session the profile was mounted from
+
+        Returns:
+            Optional[str]: New version of the session, or None if nothing was uploaded
+        """
+        return None
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        """
+        Keep the stored generation of a session as a fallback before it is replaced.
+
+        Only one previous generation is kept; keeping another one replaces it.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+
+        Returns:
+            bool: False if there was nothing to keep or the storage cannot keep generations
+        """
+        return False
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        """
+        Download the generation kept by keep_previous into target_path.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            target_path: Directory to write the profile to (must not exist yet)
+            profile_filter: Only download files kept by this filter
+
+        Returns:
+            bool: False, without creating target_path, if no previous generation is kept
+        """
+        return False
+
+    def download_lazily(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        critical: ProfileFilter,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Tuple[Optional[str], Callable[..., None]]:
+        """
+        Download the critical files of a session now and return a function fetching the rest.
+
+        The returned function downloads the remaining files into a staging
+        directory next to target_path and then moves them in. Files that
+        already exist in target_path by then (because the browser created
+        them) are kept. It fails if the session changed in between.
+
+        The default implementation runs two filtered downloads; storage that
+        has to fetch a whole session at once overrides it to fetch only once.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            target_path: Directory to write the profile to (must not exist yet)
+            critical: Files to download before returning
+            profile_filter: Only download files kept by this filter
+
+        Returns:
+            Tuple[Optional[str], Callable]: Version of the session (None if it
+            did not exist) and the function downloading the rest. The function
+            takes an optional callback that is called with the staging
+            directory before its files are moved in.
+        """
+        version = self.download(user_id, session_id, target_path, _HydrationPhase(critical, profile_filter, True))
+        if version is None:
+            return None, _nothing_to_hydrate
+
+        def download_rest(before_merge: Optional[Callable[[str], None]] = None):
+            staging_path = f"{target_path}.{uuid.uuid4().hex[:8]}.hydrate"
+            try:
+                rest_version = self.download(
+                    user_id, session_id, staging_path, _HydrationPhase(critical, profile_filter, False)
+                )
+                if rest_version != version:
+                    raise IOError(f"Session {session_id} changed while it was being downloaded")
+                if before_merge is not None:
+                    before_merge(staging_path)
+                _merge_into(staging_path, target_path)
+            finally:
+                shutil.rmtree(staging_path, ignore_errors=True)
+
+        return version, download_rest
+
+
+class LocalSessionStorage(SessionStorage):
+    """
+    Session storage on the local file system, laid out as <storage_path>/<user_id>/<session_id>.
+    """
+
+    def __init__(self, storage_path: Optional[str] = None):
+        """
+        Args:
+            storage_path: Root directory of the stored sessions. Defaults to ~/.browserstate
+        """
+        self.base_path = os.path.abspath(
+            storage_path or os.path.join(os.path.expanduser("~"), ".browserstate")
+        )
+
+    @property
+    def scope(self) -> str:
+        return f"local:{self.base_path}"
+
+    def session_path(self, user_id: str, session_id: str) -> str:
+        """Path of the stored session directory."""
+        if not user_id or not session_id:
+            raise ValueError("user_id and session_id cannot be empty")
+        return os.path.join(self.base_path, user_id, session_id)
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        try:
+            stat = os.stat(self.session_path(user_id, session_id))
+        except FileNotFoundError:
+            return None
+        # BrowserState replaces the whole directory on upload, so the inode
+        # changes; uploads from this module additionally bump the mtime.
+        return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}"
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        version = self.get_version(user_id, session_id)
+        if version is None:
+            os.makedirs(target_path)
+            return None
+
+        _copy_profile(self.session_path(user_id, session_id), target_path, profile_filter)
+        self._record_access(user_id, session_id)
+        return version
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        return self._replace(user_id, session_id, lambda staging_path: shutil.copytree(source_path, staging_path))
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        if not user_id:
+            raise ValueError("user_id cannot be empty")
+        user_path = os.path.join(self.base_path, user_id)
+        try:
+            names = os.listdir(user_path)
+        except FileNotFoundError:
+            return []
+        # Staging directories of uploads in progress start with a dot
+        return sorted(
+            name for name in names
+            if not name.startswith(".") and os.path.isdir(os.path.join(user_path, name))
+        )
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        session_path = self.session_path(user_id, session_id)
+        shutil.rmtree(self.previous_path(user_id, session_id), ignore_errors=True)
+        try:
+            os.remove(self.access_path(user_id, session_id))
+        except FileNotFoundError:
+            pass
+        if not os.path.isdir(session_path):
+            return False
+        # Moved aside first so readers never see a half deleted session
+        old_path = os.path.join(os.path.dirname(session_path), f".{session_id}.{uuid.uuid4().hex}.old")
+        os.rename(session_path, old_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return True
+
+    def copy_session(
+        self,
+        user_id: str,
+        session_id: str,
+        target: SessionStorage,
+        target_session_id: str
+    ) -> Optional[str]:
+        if not isinstance(target, LocalSessionStorage):
+            return super().copy_session(user_id, session_id, target, target_session_id)
+        source_path = self.session_path(user_id, session_id)
+        if not os.path.isdir(source_path):
+            return None
+        # Hard links for the same reason as in keep_previous: stored files are
+        # replaced, never rewritten, so a copy costs no space or file I/O
+        return target._replace(
+            user_id,
+            target_session_id,
+            lambda staging_path: shutil.copytree(source_path, staging_path, copy_function=_link_or_copy),
+        )
+
+    def upload_changes(
+        self,
+        user_id: str,
+        session_id: str,
+        source_path: str,
+        diff: ManifestDiff,
+        base_version: Optional[str]
+    ) -> Optional[str]:
+        if base_version is None or self.get_version(user_id, session_id) != base_version:
+            return None
+
+        session_path = self.session_path(user_id, session_id)
+        for rel_path in diff.changed:
+            source = os.path.join(source_path, *rel_path.split("/"))
+            destination = os.path.join(session_path, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            # Per-file copy and rename so no file is ever left half written
+            staging = f"{destination}.{uuid.uuid4().hex}.upload"
+            shutil.copy2(source, staging)
+            os.replace(staging, destination)
+        for rel_path in diff.deleted:
+            try:
+                os.remove(os.path.join(session_path, *rel_path.split("/")))
+            except FileNotFoundError:
+                pass
+        return self._touch(session_path, user_id, session_id)
+
+    def access_path(self, user_id: str, session_id: str) -> str:
+        """Path of the file whose mtime records the last download of the session."""
+        self.session_path(user_id, session_id)
+        return os.path.join(self.base_path, ".nova-access", user_id, session_id)
+
+    def last_access(self, user_id: str, session_id: str) -> Optional[float]:
+        """
+        Time of the last download or upload of a session.
+
+        Returns:
+            Optional[float]: Seconds since the epoch, or None if the session does not exist
+        """
+        try:
+            written = os.stat(self.session_path(user_id, session_id)).st_mtime
+        except FileNotFoundError:
+            return None
+        try:
+            return max(written, os.stat(self.access_path(user_id, session_id)).st_mtime)
+        except FileNotFoundError:
+            return written
+
+    def previous_path(self, user_id: str, session_id: str) -> str:
+        """Path of the previous generation kept by keep_previous."""
+        self.session_path(user_id, session_id)
+        return os.path.join(self.base_path, ".nova-previous", user_id, session_id)
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        session_path = self.session_path(user_id, session_id)
+        if not os.path.isdir(session_path):
+            return False
+        previous_path = self.previous_path(user_id, session_id)
+        parent = os.path.dirname(previous_path)
+        os.makedirs(parent, exist_ok=True)
+        # Hard links cost no space, and uploads replace files rather than
+        # rewriting them, so the links keep the contents of this generation.
+        staging_path = os.path.join(parent, f".{session_id}.{uuid.uuid4().hex}.keep")
+        old_path = None
+        try:
+            shutil.copytree(session_path, staging_path, copy_function=_link_or_copy)
+            if os.path.exists(previous_path):
+                old_path = os.path.join(parent, f".{session_id}.{uuid.uuid4().hex}.old")
+                os.rename(previous_path, old_path)
+            os.rename(staging_path, previous_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+        return True
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        previous_path = self.previous_path(user_id, session_id)
+        if not os.path.isdir(previous_path):
+            return False
+        _copy_profile(previous_path, target_path, profile_filter)
+        return True
+
+    def _replace(self, user_id: str, session_id: str, fill: Callable[[str], None]) -> str:
+        session_path = self.session_path(user_id, session_id)
+        parent = os.path.dirname(session_path)
+        os.makedirs(parent, exist_ok=True)
+
+        # Written next to the destination first so the swap is two renames and
+        # readers never see a partially written session.
+        staging_path = os.path.join(parent, f".{session_id}.{uuid.uuid4().hex}.upload")
+        try:
+            fill(staging_path)
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        old_path = None
+        if os.path.exists(session_path):
+            old_path = os.path.join(parent, f".{session_id}.{uuid.uuid4().hex}.old")
+            os.rename(session_path, old_path)
+        os.rename(staging_path, session_path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+        return self._touch(session_path, user_id, session_id)
+
+    def _record_access(self, user_id: str, session_id: str):
+        # A separate file, because the mtime of the session directory is part of its version
+        access_path = self.access_path(user_id, session_id)
+        try:
+            os.utime(access_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(access_path), exist_ok=True)
+            open(access_path, "ab").close()
+
+    def _touch(self, session_path: str, user_id: str, session_id: str) -> str:
+        now = time.time_ns()
+        os.utime(session_path, ns=(now, now))
+        return self.get_version(user_id, session_id)
+
+
+class RedisSessionStorage(SessionStorage):
+    """
+    Session storage in Redis, stored as BrowserState does: a base64 encoded ZIP
+    archive under <key_prefix><user_id>:<session_id> plus a JSON metadata key.
+
+    Archives are built and extracted in a temporary file next to the profile
+    and move to and from Redis buffer_size bytes at a time (GETRANGE and
+    APPEND), so no session is ever held in memory whole.
+    """
+
+    def __init__(self, redis_options: Optional[dict] = None, client=None, buffer_size: int = BLOCK_SIZE):
+        """
+        Args:
+            redis_options: Same options as the "redis" provider (host, port, db,
+                password, key_prefix, ttl)
+            client: Existing redis.Redis client to use instead of connecting from redis_options
+            buffer_size: Bytes of archive transferred per Redis command
+        """
+        redis_options = redis_options or {}
+        key_prefix = redis_options.get("key_prefix", "browserstate")
+        self.key_prefix = key_prefix if key_prefix.endswith(":") else f"{key_prefix}:"
+        self.ttl = redis_options.get("ttl")
+        self._location = _redis_location(redis_options)
+        if client is None:
+            client = _redis_client(redis_options)
+        self.client = client
+        self.buffer_size = buffer_size
+
+    @property
+    def scope(self) -> str:
+        return f"redis:{self._location}/{self.key_prefix}"
+
+    def session_key(self, user_id: str, session_id: str) -> str:
+        """Redis key holding the session archive."""
+        if ":" in user_id or ":" in session_id:
+            raise ValueError("user_id and session_id must not contain colons (:)")
+        return f"{self.key_prefix}{user_id}:{session_id}"
+
+    def metadata_key(self, user_id: str, session_id: str) -> str:
+        """Redis key holding the session metadata."""
+        return f"{self.session_key(user_id, session_id)}:metadata"
+
+    def previous_key(self, user_id: str, session_id: str) -> str:
+        """Redis key holding the archive of the previous generation kept by keep_previous."""
+        self.session_key(user_id, session_id)
+        return f"{self.key_prefix}nova-previous:{user_id}:{session_id}"
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        # Copied on the server (Redis 6.2+); the copies keep the TTL of the originals
+        pipe = self.client.pipeline(transaction=True)
+        pipe.copy(self.session_key(user_id, session_id), self.previous_key(user_id, session_id), replace=True)
+        pipe.copy(
+            self.metadata_key(user_id, session_id),
+            f"{self.previous_key(user_id, session_id)}:metadata",
+            replace=True,
+        )
+        copied, _ = pipe.execute()
+        return bool(copied)
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        previous_key = self.previous_key(user_id, session_id)
+        with _spool_file(target_path) as spool:
+            if not self._read_archive(previous_key, f"{previous_key}:metadata", spool)[0]:
+                return False
+            os.makedirs(target_path)
+            with zipfile.ZipFile(spool) as archive:
+                _safe_extract(archive, target_path, profile_filter)
+        return True
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        prefix = self.session_key(user_id, "")
+        sessions = set()
+        for key in self.client.scan_iter(match=_escape_glob(prefix) + "*", count=1000):
+            session_id = (key.decode("utf-8") if isinstance(key, bytes) else key)[len(prefix):]
+            # Metadata keys have a suffix after another colon
+            if session_id and ":" not in session_id:
+                sessions.add(session_id)
+        return sorted(sessions)
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        previous_key = self.previous_key(user_id, session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self.session_key(user_id, session_id), self.metadata_key(user_id, session_id))
+        pipe.delete(previous_key, f"{previous_key}:metadata")
+        deleted, _ = pipe.execute()
+        return deleted > 0
+
+    def copy_session(
+        self,
+        user_id: str,
+        session_id: str,
+        target: SessionStorage,
+        target_session_id: str
+    ) -> Optional[str]:
+        if not isinstance(target, RedisSessionStorage) or target.client is not self.client:
+            return super().copy_session(user_id, session_id, target, target_session_id)
+        source_key = self.session_key(user_id, session_id)
+        if not self.client.exists(source_key):
+            return None
+        target_key = target.session_key(user_id, target_session_id)
+        version = uuid.uuid4().hex
+        # Copied on the server (Redis 6.2+), with metadata naming a new generation
+        pipe = self.client.pipeline(transaction=True)
+        pipe.copy(source_key, target_key, replace=True)
+        if target.ttl:
+            pipe.expire(target_key, target.ttl)
+        else:
+            pipe.persist(target_key)
+        pipe.set(target.metadata_key(user_id, target_session_id), json.dumps(_metadata(version)), ex=target.ttl)
+        copied = pipe.execute()[0]
+        if not copied:
+            # Deleted in the meantime
+            target.delete(user_id, target_session_id)
+            return None
+        return version
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        raw = self.client.get(self.metadata_key(user_id, session_id))
+        if raw is None:
+            return None
+        return _metadata_version(raw)
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        os.makedirs(target_path)
+        with _spool_file(target_path) as spool:
+            found, metadata = self._read_archive(
+                self.session_key(user_id, session_id), self.metadata_key(user_id, session_id), spool
+            )
+            if not found:
+                return None
+            with zipfile.ZipFile(spool) as archive:
+                _safe_extract(archive, target_path, profile_filter)
+        return _metadata_version(metadata) if metadata is not None else None
+
+    def download_lazily(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        critical: ProfileFilter,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Tuple[Optional[str], Callable[..., None]]:
+        # The session is a single archive: fetch it once and extract it in two steps
+        os.makedirs(target_path)
+        spool = _spool_file(target_path)
+        try:
+            found, metadata = self._read_archive(
+                self.session_key(user_id, session_id), self.metadata_key(user_id, session_id), spool
+            )
+            if not found:
+                spool.close()
+                return None, _nothing_to_hydrate
+            archive = zipfile.ZipFile(spool)
+            try:
+                _safe_extract(archive, target_path, _HydrationPhase(critical, profile_filter, True))
+            except BaseException:
+                archive.close()
+                raise
+        except BaseException:
+            spool.close()
+            raise
+
+        def extract_rest(before_merge: Optional[Callable[[str], None]] = None):
+            staging_path = f"{target_path}.{uuid.uuid4().hex[:8]}.hydrate"
+            try:
+                os.makedirs(staging_path)
+                _safe_extract(archive, staging_path, _HydrationPhase(critical, profile_filter, False))
+                if before_merge is not None:
+                    before_merge(staging_path)
+                _merge_into(staging_path, target_path)
+            finally:
+                archive.close()
+                spool.close()
+                shutil.rmtree(staging_path, ignore_errors=True)
+
+        return _metadata_version(metadata) if metadata is not None else None, extract_rest
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        key = self.session_key(user_id, session_id)
+        # Built up under a key of its own, so readers never see half an archive
+        staging_key = f"{self.key_prefix}nova-upload:{user_id}:{session_id}:{uuid.uuid4().hex}"
+        step = max(1, self.buffer_size // 3) * 3
+        with _spool_file(source_path) as spool:
+            with zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as archive:
+                for root, _, files in os.walk(source_path):
+                    for name in files:
+                        file_path = os.path.join(root, name)
+                        archive.write(file_path, os.path.relpath(file_path, source_path))
+            spool.seek(0)
+
+            version = uuid.uuid4().hex
+            try:
+                # Expires by itself should this process die halfway
+                self.client.set(staging_key, b"", ex=_STAGING_TTL)
+                for piece in iter(lambda: spool.read(step), b""):
+                    self.client.append(staging_key, base64.b64encode(piece))
+                pipe = self.client.pipeline(transaction=True)
+                pipe.rename(staging_key, key)
+                if self.ttl:
+                    pipe.expire(key, self.ttl)
+                else:
+                    pipe.persist(key)
+                pipe.set(self.metadata_key(user_id, session_id), json.dumps(_metadata(version)), ex=self.ttl)
+                pipe.execute()
+            except BaseException:
+                self.client.delete(staging_key)
+                raise
+        return version
+
+    def _read_archive(self, key: str, metadata_key: str, spool) -> Tuple[bool, Optional[bytes]]:
+        """
+        Decode the archive under key into spool, buffer_size bytes at a time.
+
+        Returns:
+            Tuple[bool, Optional[bytes]]: Whether the archive exists, and the
+            metadata of the generation that was read
+        """
+        # Multiples of 4 base64 characters decode on their own
+        step = max(1, self.buffer_size // 3) * 4
+        for _ in range(_MAX_READ_ATTEMPTS):
+            pipe = self.client.pipeline(transaction=True)
+            pipe.strlen(key)
+            pipe.get(metadata_key)
+            length, metadata = pipe.execute()
+            if not length:
+                return False, metadata
+            spool.seek(0)
+            spool.truncate()
+            for start in range(0, length, step):
+                spool.write(base64.b64decode(self.client.getrange(key, start, start + step - 1)))
+            spool.seek(0)
+            # The pieces only make up one archive if no upload replaced it in the meantime
+            pipe = self.client.pipeline(transaction=True)
+            pipe.strlen(key)
+            pipe.get(metadata_key)
+            if pipe.execute() == [length, metadata]:
+                return True, metadata
+        raise IOError(f"{key} kept changing while it was read")
+
+
+class ObjectSessionStorage(SessionStorage):
+    """
+    Session storage in S3 or GCS, stored as BrowserState does: one object
+    per profile file under <user_id>/<session_id>/.
+
+    Files are transferred max_concurrency at a time. Files larger than
+    part_size are uploaded in parts (multipart uploads in S3, composed
+    objects in GCS) and downloaded with ranged reads, so a few large files
+    such as caches or IndexedDB blobs are spread over several connections.
+    The generation of every upload is recorded next to the sessions, in
+    .nova-meta/<user_id>/<session_id>.json.
+    """
+
+    def __init__(
+        self,
+        store: ObjectStore,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        part_size: int = DEFAULT_PART_SIZE,
+        root: str = ""
+    ):
+        """
+        Args:
+            store: Object store holding the sessions
+            max_concurrency: Transfers running at the same time
+            part_size: Size of the parts large files are transferred in
+            root: Key prefix of all sessions, e.g. ".nova-snapshots/"
+        """
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+        self.root = root
+
+    @property
+    def scope(self) -> str:
+        return f"objects:{self.store.scope}/{self.root}"
+
+    def session_prefix(self, user_id: str, session_id: str) -> str:
+        """Key prefix of the objects of a session."""
+        if not user_id or not session_id or "/" in user_id or "/" in session_id:
+            raise ValueError("user_id and session_id must be non-empty and must not contain '/'")
+        return f"{self.root}{user_id}/{session_id}/"
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        raw = self.store.read(self._metadata_key(user_id, session_id))
+        if raw is not None:
+            return _metadata_version(raw)
+        # Written by BrowserState, which records no generation
+        objects = self.store.list(self.session_prefix(user_id, session_id))
+        return _listing_version(objects) if objects else None
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        version = self.get_version(user_id, session_id)
+        os.makedirs(target_path)
+        prefix = self.session_prefix(user_id, session_id)
+        objects = {
+            key: size for key, size in self.store.list(prefix).items()
+            if not key.endswith("/") and (profile_filter is None or profile_filter.matches(key[len(prefix):]))
+        }
+        download_objects(self.store, objects, prefix, target_path, self.max_concurrency, self.part_size)
+        return version
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        prefix = self.session_prefix(user_id, session_id)
+        stored = self.store.list(prefix)
+        rel_paths = [rel_path for rel_path, _, is_dir in _walk(source_path, None) if not is_dir]
+        written = upload_files(self.store, source_path, prefix, rel_paths, self.max_concurrency, self.part_size)
+        # Objects are replaced one by one, so files that no longer exist are removed afterwards
+        self.store.delete(sorted(set(stored) - set(written)))
+        return self._write_version(user_id, session_id)
+
+    def upload_changes(
+        self,
+        user_id: str,
+        session_id: str,
+        source_path: str,
+        diff: ManifestDiff,
+        base_version: Optional[str]
+    ) -> Optional[str]:
+        if base_version is None or self.get_version(user_id, session_id) != base_version:
+            return None
+        prefix = self.session_prefix(user_id, session_id)
+        upload_files(self.store, source_path, prefix, diff.changed, self.max_concurrency, self.part_size)
+        self.store.delete(prefix + rel_path for rel_path in diff.deleted)
+        return self._write_version(user_id, session_id)
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        if not user_id or "/" in user_id:
+            raise ValueError("user_id must be non-empty and must not contain '/'")
+        prefix = f"{self.root}{user_id}/"
+        sessions = {key[len(prefix):].split("/", 1)[0] for key in self.store.list(prefix)}
+        return sorted(session_id for session_id in sessions if session_id and not session_id.startswith("."))
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        keys = list(self.store.list(self.session_prefix(user_id, session_id)))
+        metadata_key = self._metadata_key(user_id, session_id)
+        existed = bool(keys) or self.store.read(metadata_key, 0, 1) is not None
+        # The metadata goes first so a reader never takes a half deleted session for a complete one
+        self.store.delete([metadata_key])
+        self.store.delete(keys)
+        return existed
+
+    def _write_version(self, user_id: str, session_id: str) -> str:
+        version = uuid.uuid4().hex
+        self.store.write(self._metadata_key(user_id, session_id), json.dumps(_metadata(version)).encode("utf-8"))
+        return version
+
+    def _metadata_key(self, user_id: str, session_id: str) -> str:
+        self.session_prefix(user_id, session_id)
+        return f"{self.root}.nova-meta/{user_id}/{session_id}.json"
+
+
+class ArchiveSessionStorage(SessionStorage):
+    """
+    Sessions stored as a handful of compressed archive chunks in a blob store.
+
+    Layout per session: "<user_id>/<session_id>/index.json" names the
+    current generation and its chunks, which live under
+    "<user_id>/<session_id>/<generation>/". An upload writes a new
+    generation, then switches the index to it and deletes the previous one,
+    so readers always see a complete archive.
+
+    Chunks are streamed: at most max_in_flight chunks are in memory or on
+    the wire at a time (one pipeline for Redis), however large the profile is.
+    With more than one worker, profiles larger than parallel_threshold are
+    compressed on a pool of processes; the chunks are the same whatever the
+    number of processes.
+    """
+
+    def __init__(
+        self,
+        blobs: BlobStore,
+        compression: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        workers: int = PACK_WORKERS,
+        parallel_threshold: int = PARALLEL_THRESHOLD,
+        buffer_size: int = BLOCK_SIZE
+    ):
+        """
+        Args:
+            blobs: Blob store holding the chunks
+            compression: "zstd", "gzip" or "none" (defaults to zstd when available)
+            chunk_size: Size of the archive chunks in bytes
+            max_in_flight: Most chunks transferred at once
+            workers: Processes compressing a profile; 1 (the default) packs in this process. The processes
+                import the main module, which must guard its work with if __name__ == "__main__":
+            parallel_threshold: Profile bytes packed in this process before the workers are used
+            buffer_size: Bytes decompressed and written at a time when unpacking
+        """
+        self.blobs = blobs
+        self.compression = compression or default_compression()
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.buffer_size = buffer_size
+
+    @property
+    def scope(self) -> str:
+        return f"archive:{self.blobs.scope}"
+
+    def read_index(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Read the index of a stored session, or None if it does not exist."""
+        raw = self.blobs.get(self._index_key(user_id, session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        index = self.read_index(user_id, session_id)
+        return index["generation"] if index else None
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        index = self.read_index(user_id, session_id)
+        if index is None:
+            return False
+        older = self._read_previous_index(user_id, session_id)
+        self.blobs.put(self._previous_index_key(user_id, session_id), json.dumps(index).encode("utf-8"))
+        if older and older["generation"] != index["generation"]:
+            self.blobs.delete(older["chunks"])
+        return True
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        index = self._read_previous_index(user_id, session_id)
+        if index is None:
+            return False
+        self._unpack(index, session_id, target_path, profile_filter)
+        return True
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        index = self.read_index(user_id, session_id)
+        if index is None:
+            os.makedirs(target_path)
+            return None
+        self._unpack(index, session_id, target_path, profile_filter)
+        return index["generation"]
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        previous = self.read_index(user_id, session_id)
+        generation = uuid.uuid4().hex
+        prefix = f"{self._session_prefix(user_id, session_id)}{generation}/"
+
+        keys = []
+        sizes = []
+
+        def chunks():
+            packed = pack_profile(
+                source_path, self.compression, self.chunk_size,
+                executor=process_pool(self.workers), parallel_threshold=self.parallel_threshold,
+                workers=self.workers,
+            )
+            for number, chunk in enumerate(packed):
+                keys.append(f"{prefix}{number:05d}")
+                sizes.append(len(chunk))
+                yield keys[-1], chunk
+
+        self.blobs.put_many(chunks(), self.max_in_flight)
+        size = sum(sizes)
+
+        index = {
+            "format": "archive",
+            "generation": generation,
+            "compression": self.compression,
+            "chunks": keys,
+            "size": size,
+            "timestamp": int(1000 * time.time()),
+        }
+        self._switch_index(user_id, session_id, index, previous)
+        return generation
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        if not user_id or "/" in user_id:
+            raise ValueError("user_id must be non-empty and must not contain '/'")
+        prefix = f"{user_id}/"
+        return sorted(
+            key[len(prefix):-len("/index.json")] for key in self.blobs.list(prefix)
+            if key.endswith("/index.json") and key.count("/") == 2
+        )
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        index = self.read_index(user_id, session_id)
+        kept = self._read_previous_index(user_id, session_id)
+        # The index goes first so readers never find it pointing at deleted chunks
+        self.blobs.delete([self._index_key(user_id, session_id), self._previous_index_key(user_id, session_id)])
+        for stored in (index, kept):
+            if stored is not None:
+                self.blobs.delete(stored["chunks"])
+        return index is not None
+
+    def copy_session(
+        self,
+        user_id: str,
+        session_id: str,
+        target: SessionStorage,
+        target_session_id: str
+    ) -> Optional[str]:
+        if not isinstance(target, ArchiveSessionStorage):
+            return super().copy_session(user_id, session_id, target, target_session_id)
+        index = self.read_index(user_id, session_id)
+        if index is None:
+            return None
+        previous = target.read_index(user_id, target_session_id)
+        generation = uuid.uuid4().hex
+        prefix = f"{target._session_prefix(user_id, target_session_id)}{generation}/"
+        # The packed chunks are copied as they are, without unpacking and packing them again
+        keys = [f"{prefix}{number:05d}" for number in range(len(index["chunks"]))]
+
+        def chunks():
+            stored = self.blobs.get_many(index["chunks"], self.max_in_flight)
+            for key, target_key, data in zip(index["chunks"], keys, stored):
+                if data is None:
+                    raise IntegrityError(f"Archive chunk {key} of session {session_id} is missing")
+                yield target_key, data
+
+        target.blobs.put_many(chunks(), target.max_in_flight)
+        copy = dict(index, generation=generation, chunks=keys, timestamp=int(1000 * time.time()))
+        target._switch_index(user_id, target_session_id, copy, previous)
+        return generation
+
+    def _unpack(self, index: dict, session_id: str, target_path: str, profile_filter: Optional[ProfileFilter]):
+        def chunks():
+            for key, data in zip(index["chunks"], self.blobs.get_many(index["chunks"], self.max_in_flight)):
+                if data is None:
+                    raise IntegrityError(f"Archive chunk {key} of session {session_id} is missing")
+                yield data
+
+        try:
+            unpack_profile(chunks(), target_path, index["compression"], profile_filter, self.buffer_size)
+        except _CORRUPT_DATA_ERRORS as e:
+            raise IntegrityError(f"Archive of session {session_id} is corrupt: {e}") from e
+
+    def _switch_index(self, user_id: str, session_id: str, index: dict, previous: Optional[dict]):
+        self.blobs.put(self._index_key(user_id, session_id), json.dumps(index).encode("utf-8"))
+        if previous and not self._is_kept(user_id, session_id, previous):
+            self.blobs.delete(previous["chunks"])
+
+    def _read_previous_index(self, user_id: str, session_id: str) -> Optional[dict]:
+        raw = self.blobs.get(self._previous_index_key(user_id, session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def _is_kept(self, user_id: str, session_id: str, index: dict) -> bool:
+        kept = self._read_previous_index(user_id, session_id)
+        return kept is not None and kept["generation"] == index["generation"]
+
+    def _previous_index_key(self, user_id: str, session_id: str) -> str:
+        return f"{self._session_prefix(user_id, session_id)}previous.json"
+
+    def _session_prefix(self, user_id: str, session_id: str) -> str:
+        if not user_id or not session_id or "/" in user_id or "/" in session_id:
+            raise ValueError("user_id and session_id must be non-empty and must not contain '/'")
+        return f"{user_id}/{session_id}/"
+
+    def _index_key(self, user_id: str, session_id: str) -> str:
+        return f"{self._session_prefix(user_id, session_id)}index.json"
+
+
+class DedupSessionStorage(SessionStorage):
+    """
+    Sessions stored as per-file chunk lists over a content-addressed chunk store.
+
+    Each session is a manifest at "<root>/<user_id>/<session_id>/manifest.json"
+    (root is "sessions", or "snapshots" for snapshots) listing every file
+    with the digests of its chunks; the chunks themselves are shared by all
+    sessions of the blob store (see ChunkStore), so files that are identical
+    across users and sessions are stored once. Small files are kept inline
+    in the manifest.
+
+    Uploading reuses the chunk list of every file whose size and mtime did
+    not change since the previous upload, and only transfers chunks the
+    store does not have yet.
+    """
+
+    def __init__(
+        self,
+        blobs: BlobStore,
+        compression: Optional[str] = None,
+        chunk_size: int = DEDUP_CHUNK_SIZE,
+        inline_threshold: int = 4096,
+        root: str = "sessions"
+    ):
+        """
+        Args:
+            blobs: Blob store holding manifests and chunks
+            compression: "zstd", "gzip" or "none" (defaults to zstd when available)
+            chunk_size: Size files are split into; sessions only share chunks of the same size
+            inline_threshold: Files up to this size are stored in the manifest itself
+            root: Key prefix of the manifests, so several storages can share one chunk store
+        """
+        self.blobs = blobs
+        self.chunks = ChunkStore(blobs, compression)
+        self.chunk_size = chunk_size
+        self.inline_threshold = inline_threshold
+        self.root = root
+
+    @property
+    def scope(self) -> str:
+        if self.root != "sessions":
+            return f"dedup:{self.blobs.scope}/{self.root}"
+        return f"dedup:{self.blobs.scope}"
+
+    def read_manifest(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Read the manifest of a stored session, or None if it does not exist."""
+        raw = self.blobs.get(self._manifest_key(user_id, session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        manifest = self.read_manifest(user_id, session_id)
+        return manifest["generation"] if manifest else None
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        manifest = self.read_manifest(user_id, session_id)
+        if manifest is None:
+            return False
+        older = self._read_previous_manifest(user_id, session_id)
+        # The previous generation takes over the chunk references of the current one,
+        # which the next upload then leaves in place
+        self.blobs.put(self._previous_manifest_key(user_id, session_id), json.dumps(manifest).encode("utf-8"))
+        if older and older["generation"] != manifest["generation"]:
+            self.chunks.release(_manifest_chunks(older))
+        return True
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        manifest = self._read_previous_manifest(user_id, session_id)
+        if manifest is None:
+            return False
+        os.makedirs(target_path)
+        self._write_files(manifest, target_path, profile_filter)
+        return True
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        manifest = self.read_manifest(user_id, session_id)
+        os.makedirs(target_path)
+        if manifest is None:
+            return None
+        self._write_files(manifest, target_path, profile_filter)
+        return manifest["generation"]
+
+    def _write_files(self, manifest: dict, target_path: str, profile_filter: Optional[ProfileFilter]):
+        target_path = os.path.realpath(target_path)
+        for rel_path in manifest["dirs"]:
+            os.makedirs(_session_path(target_path, rel_path), exist_ok=True)
+        for entry in manifest["files"]:
+            if profile_filter is not None and not profile_filter.matches(entry["path"]):
+                continue
+            destination = _session_path(target_path, entry["path"])
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, "wb") as f:
+                if "data" in entry:
+                    f.write(base64.b64decode(entry["data"]))
+                else:
+                    for data in self.chunks.get_many(entry["chunks"]):
+                        f.write(data)
+            os.chmod(destination, entry["mode"])
+            os.utime(destination, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        previous = self.read_manifest(user_id, session_id)
+        previous_files = {entry["path"]: entry for entry in previous["files"]} if previous else {}
+        # Chunks this upload holds a reference to, each referenced once per session
+        retained: Set[str] = set()
+        files = []
+        dirs = []
+        try:
+            for rel_path, path, is_dir in _walk(source_path, None):
+                if is_dir:
+                    dirs.append(rel_path)
+                    continue
+                stat = os.stat(path)
+                entry = {"path": rel_path, "mtime_ns": stat.st_mtime_ns, "mode": stat.st_mode & 0o777}
+                if stat.st_size <= self.inline_threshold:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    entry["size"] = len(data)
+                    entry["data"] = base64.b64encode(data).decode("ascii")
+                else:
+                    old = previous_files.get(rel_path)
+                    unchanged = (
+                        old is not None and "chunks" in old
+                        and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns
+                    )
+                    entry["size"] = stat.st_size
+                    entry["chunks"] = self._store_file(path, old["chunks"] if unchanged else None, retained)
+                files.append(entry)
+
+            manifest = {
+                "format": "dedup",
+                "generation": uuid.uuid4().hex,
+                "chunk_size": self.chunk_size,
+                "dirs": dirs,
+                "files": files,
+                "timestamp": int(1000 * time.time()),
+            }
+            # A file that changed while it was read may have left references the manifest does not use
+            unused = retained - _manifest_chunks(manifest)
+            self.chunks.release(unused)
+            retained -= unused
+            self.blobs.put(self._manifest_key(user_id, session_id), json.dumps(manifest).encode("utf-8"))
+        except BaseException:
+            self.chunks.release(retained)
+            raise
+        if previous and not self._is_kept(user_id, session_id, previous):
+            self.chunks.release(_manifest_chunks(previous))
+        return manifest["generation"]
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        if not user_id or "/" in user_id:
+            raise ValueError("user_id must be non-empty and must not contain '/'")
+        prefix = f"{self.root}/{user_id}/"
+        return sorted(
+            key[len(prefix):-len("/manifest.json")] for key in self.blobs.list(prefix)
+            if key.endswith("/manifest.json") and key.count("/") == 3
+        )
+
+    def copy_session(
+        self,
+        user_id: str,
+        session_id: str,
+        target: SessionStorage,
+        target_session_id: str
+    ) -> Optional[str]:
+        if not isinstance(target, DedupSessionStorage) or target.blobs.scope != self.blobs.scope:
+            return super().copy_session(user_id, session_id, target, target_session_id)
+        manifest = self.read_manifest(user_id, session_id)
+        if manifest is None:
+            return None
+        previous = target.read_manifest(user_id, target_session_id)
+        # The copy only takes references to the chunks both share
+        retained: Set[str] = set()
+        try:
+            for digest in _manifest_chunks(manifest):
+                if not self.chunks.retain(digest):
+                    raise IntegrityError(f"Chunk {digest} of session {session_id} is missing")
+                retained.add(digest)
+            copy = dict(manifest, generation=uuid.uuid4().hex, timestamp=int(1000 * time.time()))
+            target.blobs.put(target._manifest_key(user_id, target_session_id), json.dumps(copy).encode("utf-8"))
+        except BaseException:
+            self.chunks.release(retained)
+            raise
+        if previous and not target._is_kept(user_id, target_session_id, previous):
+            target.chunks.release(_manifest_chunks(previous))
+        return copy["generation"]
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        manifest = self.read_manifest(user_id, session_id)
+        if manifest is None:
+            return False
+        kept = self._read_previous_manifest(user_id, session_id)
+        self.blobs.delete([self._manifest_key(user_id, session_id), self._previous_manifest_key(user_id, session_id)])
+        self.chunks.release(_manifest_chunks(manifest))
+        if kept and kept["generation"] != manifest["generation"]:
+            self.chunks.release(_manifest_chunks(kept))
+        return True
+
+    def _store_file(self, path: str, known: Optional[List[str]], retained: Set[str]) -> List[str]:
+        def reuse(digest: str) -> bool:
+            if digest in retained:
+                return True
+            if self.chunks.retain(digest):
+                retained.add(digest)
+                return True
+            return False
+
+        if known is not None and all(reuse(digest) for digest in known):
+            return list(known)
+
+        digests = []
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(self.chunk_size), b""):
+                digest = ChunkStore.digest(data)
+                if digest not in retained:
+                    self.chunks.add(data)
+                    retained.add(digest)
+                digests.append(digest)
+        return digests
+
+    def _manifest_key(self, user_id: str, session_id: str) -> str:
+        if not user_id or not session_id or "/" in user_id or "/" in session_id:
+            raise ValueError("user_id and session_id must be non-empty and must not contain '/'")
+        return f"{self.root}/{user_id}/{session_id}/manifest.json"
+
+    def _read_previous_manifest(self, user_id: str, session_id: str) -> Optional[dict]:
+        raw = self.blobs.get(self._previous_manifest_key(user_id, session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def _is_kept(self, user_id: str, session_id: str, manifest: dict) -> bool:
+        kept = self._read_previous_manifest(user_id, session_id)
+        return kept is not None and kept["generation"] == manifest["generation"]
+
+    def _previous_manifest_key(self, user_id: str, session_id: str) -> str:
+        self._manifest_key(user_id, session_id)
+        return f"{self.root}/{user_id}/{session_id}/previous.json"
+
+
+def create_blob_store(
+    provider: str = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    namespace: str = "archive",
+    redis_client=None
+) -> BlobStore:
+    """
+    Create a blob store for a provider configuration.
+
+    Blobs are kept apart from sessions stored in the BrowserState layout:
+    under <storage_path>/.nova-<namespace> for "local", and under
+    <key_prefix><namespace>: for "redis".
+
+    Args:
+        provider: Storage provider ("local", "redis")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        namespace: Name separating this store from other adapter data
+        redis_client: Existing redis.Redis client to use instead of connecting from redis_options
+
+    Returns:
+        BlobStore: Blob store for the provider
+
+    Raises:
+        ValueError: If the provider has no blob store support
+    """
+    if provider == "local":
+        base = storage_path or os.path.join(os.path.expanduser("~"), ".browserstate")
+        return LocalBlobStore(os.path.join(base, f".nova-{namespace}"))
+    if provider == "redis":
+        redis_options = redis_options or {}
+        key_prefix = redis_options.get("key_prefix", "browserstate").rstrip(":")
+        return RedisBlobStore(
+            redis_client if redis_client is not None else _redis_client(redis_options),
+            f"{key_prefix}:{namespace}:",
+            ttl=redis_options.get("ttl"),
+            scope=f"redis:{_redis_location(redis_options)}",
+        )
+    raise ValueError(f"Direct session storage is not available for provider {provider!r}")
+
+
+def create_session_storage(
+    provider: str = "local",
+    storage_path: Optional[str] = None,
+    redis_options: Optional[dict] = None,
+    storage_format: str = "browserstate",
+    format_options: Optional[dict] = None,
+    redis_client=None,
+    s3_options: Optional[dict] = None,
+    gcs_options: Optional[dict] = None,
+    tier_options: Optional[dict] = None
+) -> SessionStorage:
+    """
+    Create direct session storage for a provider configuration.
+
+    Args:
+        provider: Storage provider ("local", "redis", "s3", "gcs", "tiered")
+        storage_path: Path for local storage (used with "local" provider)
+        redis_options: Configuration for Redis connection (used with "redis" provider)
+        storage_format: "browserstate" for the layout BrowserState reads and writes,
+            "archive" for compressed, chunked archives, or "dedup" for chunks
+            deduplicated across all sessions
+        format_options: Options of the storage format, e.g. {"compression": "gzip",
+            "chunk_size": 4194304, "max_in_flight": 8} for "archive" (chunks default
+            to 1 MiB with Redis and 8 MiB otherwise)
+        redis_client: Existing redis.Redis client to use instead of connecting from redis_options
+        s3_options: Bucket and transfer settings (used with "s3" provider), see create_object_store;
+            "max_concurrency" (8) and "part_size" (8 MiB) tune the parallel transfers
+        gcs_options: Bucket and transfer settings (used with "gcs" provider), as for s3_options
+        tier_options: Tiers of the "tiered" provider: {"hot": "local" or "redis" (default "local"),
+            "cold": "s3" or "gcs" (defaults to the one with options), "max_bytes": size of the hot
+            tier before sessions are evicted, "max_age": seconds unused before sessions are evicted,
+            "replication_workers": 2}. The hot tier uses storage_path or redis_options and the
+            storage format; the cold tier s3_options or gcs_options
+
+    Returns:
+        SessionStorage: Storage for the provider, with checksum records kept
+        in the "integrity" blob store of the provider and snapshots in a
+        separate storage of the same format (see SessionStorage.snapshots)
+
+    Raises:
+        ValueError: If the provider or format has no direct storage support
+    """
+    format_options = format_options or {}
+    if provider not in ("local", "redis", "s3", "gcs", "tiered"):
+        raise ValueError(f"Direct session storage is not available for provider {provider!r}")
+    if storage_format not in ("browserstate", "archive", "dedup"):
+        raise ValueError(f"Unknown storage format {storage_format!r}")
+    if provider in ("s3", "gcs"):
+        return _object_storage(provider, s3_options if provider == "s3" else gcs_options, storage_format)
+    if provider == "tiered":
+        return _tiered_storage(
+            storage_path, redis_options, storage_format, format_options, redis_client,
+            s3_options, gcs_options, tier_options or {}
+        )
+    if provider == "redis" and redis_client is None:
+        redis_client = _redis_client(redis_options or {})
+
+    storage = _format_storage(provider, storage_path, redis_options, storage_format, format_options, redis_client)
+    storage.integrity = IntegrityStore(
+        create_blob_store(provider, storage_path, redis_options, "integrity", redis_client)
+    )
+    storage.snapshots = _format_storage(
+        provider, storage_path, redis_options, storage_format, format_options, redis_client, snapshots=True
+    )
+    storage.snapshots.integrity = IntegrityStore(
+        create_blob_store(provider, storage_path, redis_options, "snapshot-integrity", redis_client)
+    )
+    return storage
+
+
+def _object_storage(provider: str, options: Optional[dict], storage_format: str) -> SessionStorage:
+    if storage_format != "browserstate":
+        raise ValueError(f"Storage format {storage_format!r} is not available for provider {provider!r}")
+    options = options or {}
+    store = create_object_store(provider, options)
+    transfer = {
+        "max_concurrency": options.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+        "part_size": options.get("part_size", DEFAULT_PART_SIZE),
+    }
+    storage = ObjectSessionStorage(store, **transfer)
+    storage.integrity = IntegrityStore(ObjectBlobStore(store, ".nova-integrity/"))
+    storage.snapshots = ObjectSessionStorage(store, root=".nova-snapshots/", **transfer)
+    storage.snapshots.integrity = IntegrityStore(ObjectBlobStore(store, ".nova-snapshot-integrity/"))
+    return storage
+
+
+def _tiered_storage(
+    storage_path: Optional[str],
+    redis_options: Optional[dict],
+    storage_format: str,
+    format_options: dict,
+    redis_client,
+    s3_options: Optional[dict],
+    gcs_options: Optional[dict],
+    tier_options: dict
+) -> SessionStorage:
+    from .tiered import TieredSessionStorage
+
+    hot_provider = tier_options.get("hot", "local")
+    cold_provider = tier_options.get("cold", "s3" if s3_options is not None else "gcs")
+    if hot_provider not in ("local", "redis"):
+        raise ValueError(f"The hot tier must be 'local' or 'redis', not {hot_provider!r}")
+    if cold_provider not in ("s3", "gcs"):
+        raise ValueError(f"The cold tier must be 's3' or 'gcs', not {cold_provider!r}")
+    if hot_provider == "redis" and redis_client is None:
+        redis_client = _redis_client(redis_options or {})
+    hot = create_session_storage(
+        hot_provider, storage_path, redis_options, storage_format, format_options, redis_client
+    )
+    cold = _object_storage(cold_provider, s3_options if cold_provider == "s3" else gcs_options, "browserstate")
+    settings = {
+        name: tier_options[name]
+        for name in ("max_bytes", "max_age", "replication_workers")
+        if tier_options.get(name) is not None
+    }
+    storage = TieredSessionStorage(
+        hot, cold, create_blob_store(hot_provider, storage_path, redis_options, "tiers", redis_client), **settings
+    )
+    storage.snapshots = TieredSessionStorage(
+        hot.snapshots,
+        cold.snapshots,
+        create_blob_store(hot_provider, storage_path, redis_options, "tier-snapshots", redis_client),
+        **settings
+    )
+    return storage
+
+
+def _format_storage(
+    provider: str,
+    storage_path: Optional[str],
+    redis_options: Optional[dict],
+    storage_format: str,
+    format_options: dict,
+    redis_client,
+    snapshots: bool = False
+) -> SessionStorage:
+    if storage_format == "dedup":
+        # Snapshots share the chunk store, so they hold references instead of copies
+        return DedupSessionStorage(
+            create_blob_store(provider, storage_path, redis_options, "dedup", redis_client),
+            compression=format_options.get("compression"),
+            chunk_size=format_options.get("chunk_size", DEDUP_CHUNK_SIZE),
+            inline_threshold=format_options.get("inline_threshold", 4096),
+            root="snapshots" if snapshots else "sessions",
+        )
+    if storage_format == "archive":
+        return ArchiveSessionStorage(
+            create_blob_store(
+                provider, storage_path, redis_options, "archive-snapshots" if snapshots else "archive", redis_client
+            ),
+            compression=format_options.get("compression"),
+            chunk_size=format_options.get(
+                "chunk_size", REDIS_CHUNK_SIZE if provider == "redis" else DEFAULT_CHUNK_SIZE
+            ),
+            max_in_flight=format_options.get("max_in_flight", MAX_IN_FLIGHT),
+            workers=format_options.get("workers", PACK_WORKERS),
+            parallel_threshold=format_options.get("parallel_threshold", PARALLEL_THRESHOLD),
+            buffer_size=format_options.get("buffer_size", BLOCK_SIZE),
+        )
+    if provider == "local":
+        storage = LocalSessionStorage(storage_path)
+        if snapshots:
+            storage = LocalSessionStorage(os.path.join(storage.base_path, ".nova-snapshots"))
+        return storage
+    if snapshots:
+        key_prefix = (redis_options or {}).get("key_prefix", "browserstate").rstrip(":")
+        redis_options = dict(redis_options or {}, key_prefix=f"{key_prefix}:nova-snapshot")
+    return RedisSessionStorage(redis_options, redis_client, format_options.get("buffer_size", BLOCK_SIZE))
+
+
+def _redis_client(redis_options: dict):
+    try:
+        import redis
+    except ImportError:
+        raise ImportError(
+            "The redis package is required for direct Redis access. "
+            "Install it with: pip install redis"
+        )
+    return redis.Redis(**_redis_connection_options(redis_options))
+
+
+def _redis_connection_options(redis_options: dict) -> dict:
+    # Everything but the options of the stored keys is passed on to redis.Redis, e.g. ssl or username
+    options = {"host": "localhost", "port": 6379, "db": 0, "password": None}
+    options.update((name, value) for name, value in redis_options.items() if name not in _REDIS_KEY_OPTIONS)
+    return options
+
+
+def _redis_location(redis_options: dict) -> str:
+    return "{}:{}/{}".format(
+        redis_options.get("host", "localhost"),
+        redis_options.get("port", 6379),
+        redis_options.get("db", 0),
+    )
+
+
+def _metadata(version: str) -> dict:
+    return {
+        "timestamp": int(1000 * time.time()),
+        "version": "2.0",
+        "encrypted": False,
+        "generation": version,
+    }
+
+
+def _listing_version(objects: Dict[str, int]) -> str:
+    # Changes whenever BrowserState adds, removes or resizes a file
+    digest = hashlib.blake2b(digest_size=10)
+    for key, size in sorted(objects.items()):
+        digest.update(f"{key}\0{size}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _metadata_version(raw) -> str:
+    metadata = json.loads(raw)
+    # Sessions uploaded by BrowserState only carry a timestamp
+    return str(metadata.get("generation") or metadata.get("timestamp"))
+
+
+class _HydrationPhase:
+    """Files of one step of a lazy download: the critical files, or all others."""
+
+    def __init__(self, critical: ProfileFilter, profile_filter: Optional[ProfileFilter], critical_step: bool):
+        self.critical = critical
+        self.profile_filter = profile_filter
+        self.critical_step = critical_step
+
+    def matches(self, rel_path: str) -> bool:
+        if self.profile_filter is not None and not self.profile_filter.matches(rel_path):
+            return False
+        return self.critical.matches(rel_path) == self.critical_step
+
+    def excludes_directory(self, rel_path: str) -> bool:
+        if self.profile_filter is not None and self.profile_filter.excludes_directory(rel_path):
+            return True
+        return self.critical_step and self.critical.excludes_directory(rel_path)
+
+
+def _nothing_to_hydrate(before_merge: Optional[Callable[[str], None]] = None):
+    pass
+
+
+def _copy_profile(source_path: str, target_path: str, profile_filter: Optional[ProfileFilter]):
+    ignore = None
+    if profile_filter is not None:
+        def ignore(directory, names):
+            rel_dir = os.path.relpath(directory, source_path).replace(os.sep, "/")
+            ignored = []
+            for name in names:
+                rel_path = name if rel_dir == "." else f"{rel_dir}/{name}"
+                if os.path.isdir(os.path.join(directory, name)):
+                    if profile_filter.excludes_directory(rel_path):
+                        ignored.append(name)
+                elif not profile_filter.matches(rel_path):
+                    ignored.append(name)
+            return ignored
+    shutil.copytree(source_path, target_path, ignore=ignore, copy_function=_clone_or_copy)
+
+
+def _clone_or_copy(source: str, destination: str):
+    # A reflink shares the data blocks until either file is written, so on
+    # Btrfs, XFS and similar file systems a copy costs neither I/O nor space
+    if fcntl is not None and sys.platform.startswith("linux"):
+        devices = (os.stat(source).st_dev, os.stat(os.path.dirname(destination)).st_dev)
+        if devices not in _no_reflink_devices:
+            try:
+                with open(source, "rb") as src, open(destination, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            except OSError:
+                _no_reflink_devices.add(devices)
+            else:
+                shutil.copystat(source, destination)
+                return
+    shutil.copy2(source, destination)
+
+
+def _link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def _merge_into(source_path: str, target_path: str):
+    # Files the browser created in the meantime win over downloaded ones
+    for dirpath, _, filenames in os.walk(source_path):
+        rel_dir = os.path.relpath(dirpath, source_path)
+        target_dir = os.path.normpath(os.path.join(target_path, rel_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in filenames:
+            source = os.path.join(dirpath, name)
+            destination = os.path.join(target_dir, name)
+            try:
+                # Unlike a rename, a hard link never replaces an existing file
+                os.link(source, destination)
+            except FileExistsError:
+                continue
+            except OSError:
+                if not os.path.lexists(destination):
+                    os.replace(source, destination)
+
+
+def _manifest_chunks(manifest: dict) -> Set[str]:
+    return {digest for entry in manifest["files"] for digest in entry.get("chunks", ())}
+
+
+def _session_path(target_path: str, rel_path: str) -> str:
+    destination = os.path.realpath(os.path.join(target_path, rel_path))
+    if os.path.commonpath([destination, target_path]) != target_path:
+        raise ValueError(f"Session entry {rel_path!r} escapes the session directory")
+    return destination
+
+
+def _spool_file(path: str):
+    """Temporary file on the file system of path, for archives too large to hold in memory."""
+    directory = os.path.dirname(os.path.abspath(path))
+    return tempfile.TemporaryFile(dir=directory if os.path.isdir(directory) else None)
+
+
+def _safe_extract(archive: zipfile.ZipFile, target_path: str, profile_filter: Optional[ProfileFilter] = None):
+    target_path = os.path.realpath(target_path)
+    members = []
+    for member in archive.infolist():
+        destination = os.path.realpath(os.path.join(target_path, member.filename))
+        if os.path.commonpath([destination, target_path]) != target_path:
+            raise ValueError(f"Archive entry {member.filename!r} escapes the session directory")
+        if profile_filter is None or member.is_dir() or profile_filter.matches(member.filename):
+            members.append(member)
+    archive.extractall(target_path, members)
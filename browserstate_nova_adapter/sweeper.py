@@ -0,0 +1,511 @@
+"""
+Expiry of abandoned sessions and reclamation of orphaned mount directories.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .cache import _directory_size
+from .storage import LocalSessionStorage, SessionStorage, create_session_storage
+from .tiered import TieredSessionStorage
+
+# Suffix of the files recording which process owns a mount directory
+MARKER_SUFFIX = ".owner"
+
+# Directory levels below a temp dir searched for mounts: <temp_dir>/browserstate/<user_id>/<session_id>
+_MAX_MOUNT_DEPTH = 3
+
+
+class SessionUsage(NamedTuple):
+    """Size and last use of a stored session, as indexed by SessionSweeper."""
+    user_id: str
+    session_id: str
+    size: int
+    accessed: float
+
+
+class SweepResult(NamedTuple):
+    """Outcome of one SessionSweeper.sweep run."""
+    scanned: int
+    expired: List[Tuple[str, str]]
+    freed_bytes: int
+    reclaimed_mounts: List[str]
+
+
+class SessionSweeper:
+    """
+    Deletes sessions nobody uses any more and reclaims mounts of crashed workers.
+
+    The sweeper keeps an index of the stored sessions with their size and
+    last use in a small JSON file. Every scan refreshes the next batch_size
+    sessions after where the previous scan stopped, so a run costs the same
+    however many sessions the storage holds, and the index covers all of
+    them after a few runs. Sizes are only measured again when a session
+    changed.
+
+    Sessions unused for more than ttl seconds are deleted, then the least
+    recently used ones until the indexed sessions take at most max_bytes.
+    Every session is checked again right before it is deleted, and sessions
+    mounted by a live process are never deleted.
+
+    Every mount directory gets an owner file next to it naming the host and
+    process that mounted it. Mounts whose process is gone (because the worker
+    crashed before unmounting) are removed by reclaim_mounts.
+
+    Last use is the last download or upload for "local" storage and the
+    index of the "tiered" provider; other storage counts the time the sweeper
+    first saw the current version, and its sizes are not known. Only one
+    sweeper should run per storage at a time.
+
+    Example:
+        ```python
+        sweeper = SessionSweeper(
+            LocalSessionStorage("/var/lib/browserstate"),
+            ttl=30 * 86400,
+            max_bytes=500 * 1024 ** 3,
+            temp_dirs=["/mnt/nova-mounts"],
+        )
+        result = sweeper.sweep()
+        ```
+    """
+
+    def __init__(
+        self,
+        storage: SessionStorage,
+        state_path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        temp_dirs: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        user_ids: Optional[Sequence[str]] = None,
+        marker_grace: float = 3600
+    ):
+        """
+        Args:
+            storage: Storage of the sessions, e.g. from create_session_storage
+            state_path: File keeping the index between runs. Defaults to .nova-sweeper.json in the
+                storage path of "local" storage or of the hot tier of "tiered" storage
+            ttl: Seconds after the last use at which sessions are deleted (never if None)
+            max_bytes: Total size of the sessions above which the least recently used are deleted (unbounded if None)
+            temp_dirs: Directories mounts are created in (defaults to the system temp dir locations)
+            batch_size: Sessions scanned per run
+            user_ids: Users whose sessions are swept. Defaults to every user of "local" and "tiered" storage
+            marker_grace: Seconds after which owner files of mounts that no longer exist are removed
+
+        Raises:
+            ValueError: If state_path or user_ids are needed but not given
+        """
+        base_path = _local_base_path(storage)
+        if state_path is None and base_path is None:
+            raise ValueError("state_path is required for storage outside the local file system")
+        if user_ids is None and base_path is None and not isinstance(storage, TieredSessionStorage):
+            raise ValueError("user_ids are required to sweep this storage")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.storage = storage
+        self.state_path = os.path.abspath(state_path or os.path.join(base_path, ".nova-sweeper.json"))
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.temp_dirs = [os.path.abspath(path) for path in temp_dirs or _default_temp_dirs()]
+        self.batch_size = batch_size
+        self.user_ids = sorted(user_ids) if user_ids is not None else None
+        self.marker_grace = marker_grace
+        self._state = self._load_state()
+
+    def sweep(self) -> SweepResult:
+        """
+        Reclaim orphaned mounts, scan the next batch of sessions and expire sessions.
+
+        Returns:
+            SweepResult: Number of sessions scanned, expired sessions, bytes freed and reclaimed mounts
+        """
+        reclaimed = self.reclaim_mounts()
+        scanned = self.scan()
+        expired, freed = self.expire()
+        return SweepResult(scanned, expired, freed, reclaimed)
+
+    def scan(self, limit: Optional[int] = None) -> int:
+        """
+        Refresh the index for the next sessions, continuing where the previous scan stopped.
+
+        Args:
+            limit: Sessions to scan, defaults to batch_size
+
+        Returns:
+            int: Number of sessions scanned
+        """
+        limit = self.batch_size if limit is None else limit
+        sessions = self._state["sessions"]
+        users = self._users()
+        known_users = set(users)
+        for key in [key for key in sessions if key.split("/", 1)[0] not in known_users]:
+            del sessions[key]
+
+        scanned = 0
+        for user_id, session_id in self._after_cursor(users):
+            if scanned >= limit:
+                break
+            self._refresh(user_id, session_id)
+            self._state["cursor"] = [user_id, session_id]
+            scanned += 1
+        self._save_state()
+        return scanned
+
+    def expire(self) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        Delete indexed sessions past the ttl, then the least recently used ones above max_bytes.
+
+        Returns:
+            Tuple[List[Tuple[str, str]], int]: User and session identifiers of the deleted sessions, and bytes freed
+        """
+        if self.ttl is None and self.max_bytes is None:
+            return [], 0
+        live = self._live_mounts()
+        usage = self.usage()
+        total = sum(entry.size for entry in usage)
+        now = time.time()
+        expired = []
+        freed = 0
+        for entry in usage:
+            too_old = self.ttl is not None and now - entry.accessed > self.ttl
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_old and not too_big:
+                if self.ttl is None:
+                    break
+                continue
+            if (entry.user_id, entry.session_id) in live:
+                continue
+            key = f"{entry.user_id}/{entry.session_id}"
+            before = self._state["sessions"][key]
+            # Used or replaced since it was scanned
+            current = self._refresh(entry.user_id, entry.session_id)
+            if current is None:
+                total -= entry.size
+                continue
+            if current["version"] != before["version"] or current["accessed"] > before["accessed"]:
+                total += current["size"] - entry.size
+                continue
+            self._delete(entry.user_id, entry.session_id)
+            del self._state["sessions"][key]
+            total -= entry.size
+            freed += entry.size
+            expired.append((entry.user_id, entry.session_id))
+        self._save_state()
+        if expired:
+            logging.info(f"Expired {len(expired)} sessions, freeing {freed} bytes")
+        return expired, freed
+
+    def usage(self) -> List[SessionUsage]:
+        """
+        Indexed sessions, least recently used first.
+
+        Returns:
+            List[SessionUsage]: Size and last use of every session scanned so far
+        """
+        entries = [
+            SessionUsage(*key.split("/", 1), entry["size"], entry["accessed"])
+            for key, entry in self._state["sessions"].items()
+        ]
+        return sorted(entries, key=lambda entry: (entry.accessed, entry.user_id, entry.session_id))
+
+    def reclaim_mounts(self) -> List[str]:
+        """
+        Remove mount directories whose process is gone, and stale owner files.
+
+        Returns:
+            List[str]: Paths of the removed mount directories
+        """
+        reclaimed = []
+        now = time.time()
+        for marker, path, owner in self._mounts():
+            if owner is not None and _owner_alive(owner):
+                if os.path.lexists(path) or now - owner.get("created", now) <= self.marker_grace:
+                    continue
+            elif owner is None:
+                # Unreadable owner files are trusted to be a live mount for a while
+                try:
+                    if now - os.stat(marker).st_mtime <= self.marker_grace:
+                        continue
+                except OSError:
+                    continue
+            if os.path.lexists(path):
+                shutil.rmtree(path, ignore_errors=True)
+                reclaimed.append(path)
+            try:
+                os.remove(marker)
+            except OSError:
+                pass
+        if reclaimed:
+            logging.info(f"Reclaimed {len(reclaimed)} orphaned mounts")
+        return reclaimed
+
+    def _after_cursor(self, users: List[str]) -> Iterator[Tuple[str, str]]:
+        """Yield every session once, starting after the cursor and wrapping around to it."""
+        cursor = self._state["cursor"]
+        if cursor is None:
+            for user_id in users:
+                for session_id in self._list_sessions(user_id):
+                    yield user_id, session_id
+            return
+        cursor = tuple(cursor)
+        for user_id in users:
+            if user_id >= cursor[0]:
+                for session_id in self._list_sessions(user_id):
+                    if (user_id, session_id) > cursor:
+                        yield user_id, session_id
+        for user_id in users:
+            if user_id <= cursor[0]:
+                for session_id in self._list_sessions(user_id):
+                    if (user_id, session_id) <= cursor:
+                        yield user_id, session_id
+
+    def _list_sessions(self, user_id: str) -> List[str]:
+        """List the sessions of a user, dropping the index entries of sessions that are gone."""
+        listed = self.storage.list_sessions(user_id)
+        existing = set(listed)
+        sessions = self._state["sessions"]
+        for key in [key for key in sessions if key.split("/", 1)[0] == user_id]:
+            if key.split("/", 1)[1] not in existing:
+                del sessions[key]
+        return listed
+
+    def _refresh(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Update the index entry of a session; returns it, or None if the session is gone."""
+        sessions = self._state["sessions"]
+        key = f"{user_id}/{session_id}"
+        known = sessions.get(key)
+        storage = self.storage
+        now = time.time()
+        version = storage.get_version(user_id, session_id)
+        if version is None:
+            sessions.pop(key, None)
+            return None
+        size = None
+        accessed = None
+        if isinstance(storage, TieredSessionStorage):
+            hot = storage.hot_usage(user_id, session_id)
+            if hot is not None:
+                size, accessed = hot
+            storage = storage.hot if hot is not None else storage.cold
+        if isinstance(storage, LocalSessionStorage):
+            if accessed is None:
+                accessed = storage.last_access(user_id, session_id)
+            if size is None:
+                if known is not None and known["version"] == version:
+                    size = known["size"]
+                else:
+                    size = _directory_size(storage.session_path(user_id, session_id))
+        if accessed is None:
+            # Nothing records reads here, so a session counts as used when it was last written
+            accessed = known["accessed"] if known is not None and known["version"] == version else now
+        if size is None:
+            size = known["size"] if known is not None and known["version"] == version else 0
+        entry = {"version": version, "size": size, "accessed": accessed}
+        sessions[key] = entry
+        return entry
+
+    def _delete(self, user_id: str, session_id: str):
+        if self.storage.integrity is not None:
+            self.storage.integrity.delete(user_id, session_id)
+        self.storage.delete(user_id, session_id)
+        logging.info(f"Deleted expired session {session_id} for user {user_id}")
+
+    def _users(self) -> List[str]:
+        if self.user_ids is not None:
+            return self.user_ids
+        return _list_users(self.storage) or []
+
+    def _live_mounts(self) -> Set[Tuple[str, str]]:
+        return {
+            (owner["user_id"], owner["session_id"])
+            for _, path, owner in self._mounts()
+            if owner is not None and _owner_alive(owner) and os.path.lexists(path)
+        }
+
+    def _mounts(self) -> Iterator[Tuple[str, str, Optional[dict]]]:
+        """Yield (owner file, mount path, owner) for every owner file below the temp dirs."""
+        for temp_dir in self.temp_dirs:
+            for marker in _find_markers(temp_dir, _MAX_MOUNT_DEPTH):
+                name = os.path.basename(marker)
+                path = os.path.join(os.path.dirname(marker), name[1:-len(MARKER_SUFFIX)])
+                yield marker, path, _read_owner(marker)
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("sessions", {})
+        state.setdefault("cursor", None)
+        return state
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = f"{self.state_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Command line entry point: python -m browserstate_nova_adapter.sweeper.
+
+    Args:
+        argv: Arguments, defaults to sys.argv[1:]
+
+    Returns:
+        int: Exit status
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m browserstate_nova_adapter.sweeper",
+        description="Expire unused browser sessions and reclaim mounts of crashed workers.",
+    )
+    parser.add_argument("--provider", default="local", choices=["local", "redis", "s3", "gcs", "tiered"])
+    parser.add_argument("--storage-path", help="Path of local storage or of the local hot tier")
+    parser.add_argument("--storage-format", default="browserstate", choices=["browserstate", "archive", "dedup"])
+    parser.add_argument("--redis-options", type=json.loads, help="Redis options as JSON")
+    parser.add_argument("--s3-options", type=json.loads, help="S3 options as JSON")
+    parser.add_argument("--gcs-options", type=json.loads, help="GCS options as JSON")
+    parser.add_argument("--tier-options", type=json.loads, help="Tiers of the tiered provider as JSON")
+    parser.add_argument("--state", help="File keeping the index between runs")
+    parser.add_argument("--ttl", type=float, help="Delete sessions unused for this many seconds")
+    parser.add_argument("--max-bytes", type=int, help="Delete least recently used sessions above this total size")
+    parser.add_argument("--temp-dir", action="append", help="Directory mounts are created in (repeatable)")
+    parser.add_argument("--user", action="append", help="Only sweep this user (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Sessions scanned per run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    storage = create_session_storage(
+        args.provider, args.storage_path, args.redis_options, args.storage_format,
+        s3_options=args.s3_options, gcs_options=args.gcs_options, tier_options=args.tier_options,
+    )
+    sweeper = SessionSweeper(
+        storage, args.state, args.ttl, args.max_bytes, args.temp_dir, args.batch_size, args.user
+    )
+    result = sweeper.sweep()
+    print(
+        f"Scanned {result.scanned} sessions, expired {len(result.expired)} ({result.freed_bytes} bytes), "
+        f"reclaimed {len(result.reclaimed_mounts)} mounts"
+    )
+    return 0
+
+
+def _mark_mount(path: str, user_id: str, session_id: str):
+    """Record this process as the owner of the mount directory at path."""
+    marker = _marker_path(path)
+    owner = {
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "user_id": user_id,
+        "session_id": session_id,
+        "created": time.time(),
+    }
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    tmp_path = f"{marker}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(owner, f)
+    os.replace(tmp_path, marker)
+
+
+def _unmark_mount(path: str):
+    try:
+        os.remove(_marker_path(path))
+    except OSError:
+        pass
+
+
+def _marker_path(path: str) -> str:
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}{MARKER_SUFFIX}")
+
+
+def _read_owner(marker: str) -> Optional[dict]:
+    try:
+        with open(marker) as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return owner if isinstance(owner, dict) and "pid" in owner else None
+
+
+def _owner_alive(owner: dict) -> bool:
+    if owner.get("host") != socket.gethostname():
+        # Mounts of other hosts sharing the directory cannot be checked from here
+        return True
+    if os.name == "nt":
+        # os.kill terminates the process on Windows instead of probing it
+        return True
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        return True
+    return True
+
+
+def _find_markers(root: str, depth: int) -> Iterator[str]:
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    markers = [
+        entry for entry in entries
+        if entry.name.startswith(".") and entry.name.endswith(MARKER_SUFFIX) and entry.is_file(follow_symlinks=False)
+    ]
+    for entry in markers:
+        yield entry.path
+    if depth <= 0:
+        return
+    # Mount directories hold whole profiles; only their parents are searched
+    mounts = {entry.name[1:-len(MARKER_SUFFIX)] for entry in markers}
+    for entry in entries:
+        if not entry.name.startswith(".") and entry.name not in mounts and entry.is_dir(follow_symlinks=False):
+            yield from _find_markers(entry.path, depth - 1)
+
+
+def _default_temp_dirs() -> List[str]:
+    # Where direct mounts and BrowserState put their directories without a temp_dir
+    base = tempfile.gettempdir()
+    return [os.path.join(base, "browserstate-nova"), os.path.join(base, "browserstate")]
+
+
+def _list_users(storage: SessionStorage) -> Optional[List[str]]:
+    """Users with stored sessions, or None for storage that cannot list its users."""
+    if _local_base_path(storage) is None and not isinstance(storage, TieredSessionStorage):
+        return None
+    users: Set[str] = set()
+    if isinstance(storage, TieredSessionStorage):
+        users.update(key.split("/")[0] for key in storage.index.list("") if key.count("/") == 1)
+        storage = storage.hot
+    if isinstance(storage, LocalSessionStorage):
+        try:
+            names = os.listdir(storage.base_path)
+        except FileNotFoundError:
+            names = []
+        users.update(
+            name for name in names
+            if not name.startswith(".") and os.path.isdir(os.path.join(storage.base_path, name))
+        )
+    return sorted(users)
+
+
+def _local_base_path(storage: SessionStorage) -> Optional[str]:
+    if isinstance(storage, TieredSessionStorage):
+        storage = storage.hot
+    return storage.base_path if isinstance(storage, LocalSessionStorage) else None
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,434 @@
+"""
+Tiered session storage: a fast local tier in front of a durable remote one.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set, Tuple
+
+from .blobs import BlobStore
+from .cache import _directory_size
+from .filters import ProfileFilter
+from .manifest import ManifestDiff
+from .storage import SessionStorage
+
+# Replicators shared by every storage instance with the same tiers, so their queues and locks are shared too
+_replicators: Dict[str, "_Replicator"] = {}
+_replicators_lock = threading.Lock()
+
+
+class TieredSessionStorage(SessionStorage):
+    """
+    Session storage with a hot tier (local disk or a nearby Redis) in front of a cold, durable tier (S3 or GCS).
+
+    Uploads go to the hot tier and return as soon as it holds the session;
+    the session is then copied to the cold tier in the background (write-back).
+    Downloads are served from the hot tier while it is fresh, that is while
+    it holds a session that has not been replicated yet, or the very
+    generation the cold tier still stores. Otherwise the session is fetched
+    from the cold tier and kept in the hot tier for the next mount.
+
+    Replicated sessions leave the hot tier when they have not been used for
+    max_age seconds or, least recently used first, when the hot tier holds
+    more than max_bytes. Sessions waiting for replication are never evicted.
+
+    The state of every session in the hot tier is recorded in the index blob
+    store as "<user_id>/<session_id>.json". Replication and eviction are
+    coordinated within one process; replicate_pending() picks up sessions a
+    previous process left unreplicated.
+
+    Attributes:
+        hot: Storage of the hot tier
+        cold: Storage of the cold tier
+        errors: Replication failures that ran out of retries
+    """
+
+    def __init__(
+        self,
+        hot: SessionStorage,
+        cold: SessionStorage,
+        index: BlobStore,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        replication_workers: int = 2,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+        """
+        Args:
+            hot: Storage of the hot tier
+            cold: Storage of the cold tier
+            index: Blob store, usually in the hot tier, keeping the state of the hot sessions
+            max_bytes: Size of the hot tier above which replicated sessions are evicted (unbounded if None)
+            max_age: Seconds after the last use at which replicated sessions are evicted (never if None)
+            replication_workers: Sessions copied to the cold tier at the same time
+            max_retries: Retries of a failed replication before the session waits for replicate_pending()
+            retry_delay: Delay before the first retry in seconds; doubles on every retry
+        """
+        self.hot = hot
+        self.cold = cold
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.integrity = hot.integrity
+        with _replicators_lock:
+            replicator = _replicators.get(self.scope)
+            if replicator is None:
+                replicator = _replicators[self.scope] = _Replicator(replication_workers)
+        self._replicator = replicator
+        self.errors = replicator.errors
+
+    @property
+    def scope(self) -> str:
+        return f"tiered:{self.hot.scope}|{self.cold.scope}"
+
+    def get_version(self, user_id: str, session_id: str) -> Optional[str]:
+        version = self._fresh_version(user_id, session_id, self._read(user_id, session_id))
+        if version is not None:
+            return version
+        return self.cold.get_version(user_id, session_id)
+
+    def download(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> Optional[str]:
+        with self._replicator.lock(user_id, session_id):
+            record = self._read(user_id, session_id)
+            if self._fresh_version(user_id, session_id, record) is None:
+                record = self._pull(user_id, session_id)
+            if record is None:
+                os.makedirs(target_path)
+                return None
+            record["accessed"] = time.time()
+            self._write(user_id, session_id, record)
+            return self.hot.download(user_id, session_id, target_path, profile_filter)
+
+    def upload(self, user_id: str, session_id: str, source_path: str) -> str:
+        size = _directory_size(source_path)
+        with self._replicator.lock(user_id, session_id):
+            version = self.hot.upload(user_id, session_id, source_path)
+            self._stored(user_id, session_id, version, size)
+        self._replicator.submit(self, user_id, session_id)
+        return version
+
+    def upload_changes(
+        self,
+        user_id: str,
+        session_id: str,
+        source_path: str,
+        diff: ManifestDiff,
+        base_version: Optional[str]
+    ) -> Optional[str]:
+        with self._replicator.lock(user_id, session_id):
+            record = self._read(user_id, session_id)
+            if record is None or record["hot"] != base_version:
+                return None
+            version = self.hot.upload_changes(user_id, session_id, source_path, diff, base_version)
+            if version is None:
+                return None
+            self._stored(user_id, session_id, version, _directory_size(source_path))
+        # The cold tier receives the whole session, which also covers several changes replicated at once
+        self._replicator.submit(self, user_id, session_id)
+        return version
+
+    def list_sessions(self, user_id: str) -> List[str]:
+        return sorted(set(self.hot.list_sessions(user_id)) | set(self.cold.list_sessions(user_id)))
+
+    def delete(self, user_id: str, session_id: str) -> bool:
+        # Waits for a running replication, which would otherwise bring the session back to the cold tier
+        with self._replicator.copy_lock(user_id, session_id), self._replicator.lock(user_id, session_id):
+            self.index.delete([_index_key(user_id, session_id)])
+            deleted_hot = self.hot.delete(user_id, session_id)
+            deleted_cold = self.cold.delete(user_id, session_id)
+        for tier in (self.hot, self.cold):
+            if tier.integrity is not None:
+                tier.integrity.delete(user_id, session_id)
+        return deleted_hot or deleted_cold
+
+    def keep_previous(self, user_id: str, session_id: str) -> bool:
+        return self.hot.keep_previous(user_id, session_id)
+
+    def download_previous(
+        self,
+        user_id: str,
+        session_id: str,
+        target_path: str,
+        profile_filter: Optional[ProfileFilter] = None
+    ) -> bool:
+        return self.hot.download_previous(user_id, session_id, target_path, profile_filter)
+
+    def replicate(self, user_id: str, session_id: str) -> bool:
+        """
+        Copy the hot generation of a session to the cold tier now, if it has not been copied yet.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+
+        Returns:
+            bool: True if the session was copied
+        """
+        # One copy of a session at a time, while uploads to the hot tier go on
+        with self._replicator.copy_lock(user_id, session_id):
+            staging_dir = tempfile.mkdtemp(prefix="browserstate-tier-")
+            try:
+                profile_path = os.path.join(staging_dir, "profile")
+                with self._replicator.lock(user_id, session_id):
+                    record = self._read(user_id, session_id)
+                    if record is None or record["replicated"] == record["hot"]:
+                        return False
+                    version = self.hot.download(user_id, session_id, profile_path)
+                    if version is None:
+                        return False
+                cold_version = self.cold.upload(user_id, session_id, profile_path)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            _copy_record(self.hot, self.cold, user_id, session_id, version, cold_version)
+            with self._replicator.lock(user_id, session_id):
+                # A newer upload keeps the session pending; its own replication is queued already
+                record = self._read(user_id, session_id)
+                if record is not None:
+                    record.update(replicated=version, cold=cold_version)
+                    self._write(user_id, session_id, record)
+        logging.info(f"Replicated session {session_id} for user {user_id} to the cold tier")
+        return True
+
+    def replicate_pending(self) -> int:
+        """
+        Queue the replication of every hot session that has not reached the cold tier yet.
+
+        Returns:
+            int: Number of sessions queued
+        """
+        queued = 0
+        for user_id, session_id, record in self._records():
+            if record["replicated"] != record["hot"]:
+                self._replicator.submit(self, user_id, session_id)
+                queued += 1
+        return queued
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued replication has finished, successfully or not.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            bool: True if nothing is pending anymore
+        """
+        return self._replicator.flush(timeout)
+
+    def hot_usage(self, user_id: str, session_id: str) -> Optional[Tuple[int, float]]:
+        """
+        Size and last use of a session in the hot tier.
+
+        Returns:
+            Optional[Tuple[int, float]]: Size in bytes and time of the last download or upload,
+            or None if the session is not in the hot tier
+        """
+        record = self._read(user_id, session_id)
+        if record is None:
+            return None
+        return record["size"], record["accessed"]
+
+    def evict(self, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        Remove replicated sessions from the hot tier by age and size.
+
+        Sessions unused for more than max_age seconds are removed first, then
+        the least recently used ones until the hot tier holds at most
+        max_bytes. The cold tier keeps every evicted session.
+
+        Args:
+            max_bytes: Size limit of the hot tier, defaults to the one set on the storage
+            max_age: Age limit in seconds, defaults to the one set on the storage
+
+        Returns:
+            List[Tuple[str, str]]: User and session identifiers of the evicted sessions
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        records = sorted(self._records(), key=lambda entry: entry[2]["accessed"])
+        total = sum(record["size"] for _, _, record in records)
+        now = time.time()
+        evicted = []
+        for user_id, session_id, record in records:
+            expired = max_age is not None and now - record["accessed"] > max_age
+            if not expired and (max_bytes is None or total <= max_bytes):
+                continue
+            if self._evict(user_id, session_id):
+                total -= record["size"]
+                evicted.append((user_id, session_id))
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} sessions from the hot tier")
+        return evicted
+
+    def _evict(self, user_id: str, session_id: str) -> bool:
+        with self._replicator.lock(user_id, session_id):
+            # Checked again under the lock: a session uploaded in the meantime has to stay
+            record = self._read(user_id, session_id)
+            if record is None or record["replicated"] != record["hot"]:
+                return False
+            self.index.delete([_index_key(user_id, session_id)])
+            self.hot.delete(user_id, session_id)
+        if self.hot.integrity is not None:
+            self.hot.integrity.delete(user_id, session_id)
+        return True
+
+    def _fresh_version(self, user_id: str, session_id: str, record: Optional[dict]) -> Optional[str]:
+        if record is None or self.hot.get_version(user_id, session_id) != record["hot"]:
+            return None
+        if record["replicated"] != record["hot"]:
+            # Not replicated yet, so newer than anything in the cold tier
+            return record["hot"]
+        if self.cold.get_version(user_id, session_id) != record["cold"]:
+            return None
+        return record["hot"]
+
+    def _pull(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Fetch a session from the cold tier into the hot tier."""
+        staging_dir = tempfile.mkdtemp(prefix="browserstate-tier-")
+        try:
+            profile_path = os.path.join(staging_dir, "profile")
+            cold_version = self.cold.download(user_id, session_id, profile_path)
+            if cold_version is None:
+                # Deleted from the cold tier, e.g. by another worker
+                self.index.delete([_index_key(user_id, session_id)])
+                self.hot.delete(user_id, session_id)
+                return None
+            size = _directory_size(profile_path)
+            version = self.hot.upload(user_id, session_id, profile_path)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        _copy_record(self.cold, self.hot, user_id, session_id, cold_version, version)
+        record = {"hot": version, "cold": cold_version, "replicated": version, "size": size}
+        logging.info(f"Fetched session {session_id} for user {user_id} from the cold tier")
+        return record
+
+    def _stored(self, user_id: str, session_id: str, version: str, size: int):
+        record = self._read(user_id, session_id) or {"cold": None, "replicated": None}
+        record.update(hot=version, size=size, accessed=time.time())
+        self._write(user_id, session_id, record)
+
+    def _records(self) -> List[Tuple[str, str, dict]]:
+        records = []
+        for key in self.index.list(""):
+            if not key.endswith(".json") or key.count("/") != 1:
+                continue
+            user_id, name = key.split("/")
+            session_id = name[:-len(".json")]
+            record = self._read(user_id, session_id)
+            if record is not None:
+                records.append((user_id, session_id, record))
+        return records
+
+    def _read(self, user_id: str, session_id: str) -> Optional[dict]:
+        raw = self.index.get(_index_key(user_id, session_id))
+        return json.loads(raw) if raw is not None else None
+
+    def _write(self, user_id: str, session_id: str, record: dict):
+        self.index.put(_index_key(user_id, session_id), json.dumps(record).encode("utf-8"))
+
+
+class _Replicator:
+    """Background copies to the cold tier, at most one queued per session."""
+
+    def __init__(self, max_workers: int):
+        self.errors: List[BaseException] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-tier")
+        self._lock = threading.Lock()
+        self._session_locks: Dict[Tuple[str, str, str], threading.RLock] = {}
+        self._queued: Set[Tuple[str, str]] = set()
+        self._pending: Set[Future] = set()
+
+    def lock(self, user_id: str, session_id: str) -> threading.RLock:
+        """Guards the hot copy and the index record of a session."""
+        with self._lock:
+            return self._session_locks.setdefault(("state", user_id, session_id), threading.RLock())
+
+    def copy_lock(self, user_id: str, session_id: str) -> threading.RLock:
+        """Held while a session is copied to the cold tier; taken before lock() when both are needed."""
+        with self._lock:
+            return self._session_locks.setdefault(("copy", user_id, session_id), threading.RLock())
+
+    def submit(self, storage: TieredSessionStorage, user_id: str, session_id: str):
+        key = (user_id, session_id)
+        with self._lock:
+            if key in self._queued:
+                # The queued copy reads the session when it runs, so it also covers this upload
+                return
+            self._queued.add(key)
+            future = self._executor.submit(self._run, storage, key)
+            self._pending.add(future)
+        future.add_done_callback(lambda done: self._done(key, done))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return True
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            _, not_done = wait(pending, timeout=remaining)
+            if not_done:
+                return False
+
+    def _run(self, storage: TieredSessionStorage, key: Tuple[str, str]):
+        with self._lock:
+            self._queued.discard(key)
+        for attempt in range(storage.max_retries + 1):
+            try:
+                storage.replicate(*key)
+                break
+            except Exception as e:
+                if attempt == storage.max_retries:
+                    raise
+                delay = storage.retry_delay * (2 ** attempt)
+                logging.warning(f"Replication of session {key[1]} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        if storage.max_bytes is not None or storage.max_age is not None:
+            storage.evict()
+
+    def _done(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            self._pending.discard(future)
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Replication of session {key[1]} for user {key[0]} to the cold tier failed: {error}")
+            self.errors.append(error)
+
+
+def _index_key(user_id: str, session_id: str) -> str:
+    if not user_id or not session_id or "/" in user_id or "/" in session_id:
+        raise ValueError("user_id and session_id must be non-empty and must not contain '/'")
+    return f"{user_id}/{session_id}.json"
+
+
+def _copy_record(
+    source: SessionStorage,
+    target: SessionStorage,
+    user_id: str,
+    session_id: str,
+    version: str,
+    target_version: str
+):
+    """Carry the checksum record of a copied generation over to the other tier."""
+    if target.integrity is None:
+        return
+    record = source.integrity.read(user_id, session_id) if source.integrity is not None else None
+    if record is not None and record["version"] == version:
+        target.integrity.write(user_id, session_id, dict(record, version=target_version))
+    else:
+        target.integrity.delete(user_id, session_id, previous=False)
@@ -0,0 +1,277 @@
+"""
+Background uploads of unmounted sessions.
+"""
+import atexit
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+JOB_FILE = "job.json"
+PROFILE_DIR = "profile"
+
+
+class BackgroundUploader:
+    """
+    Uploads unmounted sessions on background threads so unmounting returns immediately.
+
+    Sessions mounted with an uploader are handed to it when they are
+    unmounted (including on with_browserstate exit). Profiles mounted
+    through direct session storage (cache or delta mounts) are first moved
+    into a staging directory together with a small job file; failed uploads
+    are retried with exponential backoff, and a job that still fails stays
+    staged so that recover() can upload it later, even from a new process.
+    Sessions mounted through BrowserState are unmounted in the background
+    once, without staging. A lease held on a session stays held, and renewed,
+    until its upload succeeds or the last retry fails.
+
+    Mounting a session with the same uploader waits for a pending upload of
+    that session first, so a remount never sees stale state. Pending uploads
+    are drained when the uploader is closed, which also happens
+    automatically at interpreter exit.
+
+    Example:
+        ```python
+        uploader = BackgroundUploader("/var/lib/browserstate-nova/staging")
+        config = create_session_config(user_id="user1", session_id="session1", uploader=uploader)
+        uploader.recover(config)  # re-queue uploads left over by a previous process
+        ```
+    """
+
+    def __init__(
+        self,
+        staging_dir: Optional[str] = None,
+        max_workers: int = 2,
+        max_pending: int = 16,
+        max_retries: int = 5,
+        retry_delay: float = 1.0
+    ):
+        """
+        Args:
+            staging_dir: Directory for staged profiles. Defaults to a directory in the system temp dir
+            max_workers: Number of uploads running at the same time
+            max_pending: Number of queued uploads after which unmounting blocks
+            max_retries: Retries of a failed upload before it is left for recover()
+            retry_delay: Delay before the first retry in seconds; doubles on every retry
+        """
+        self.staging_dir = os.path.abspath(
+            staging_dir or os.path.join(tempfile.gettempdir(), "browserstate-nova-staging")
+        )
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.errors: List[BaseException] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="browserstate-upload")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Set[Future]] = {}
+        self._active_jobs: Set[str] = set()
+        self._closed = False
+        os.makedirs(self.staging_dir, exist_ok=True)
+        atexit.register(self.close)
+
+    def submit(self, session) -> Future:
+        """
+        Queue the upload of an unmounted session.
+
+        Blocks while max_pending uploads are already queued.
+
+        Args:
+            session: MountedSession that has been detached from the registry
+
+        Returns:
+            Future: Completes when the session has been uploaded
+        """
+        if self._closed:
+            raise RuntimeError("BackgroundUploader is closed")
+        job_dir = self._stage(session) if session._storage is not None else None
+        return self._submit_job(session, job_dir)
+
+    def wait_for(self, user_id: str, session_id: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until pending uploads of a session are finished.
+
+        Args:
+            user_id: User identifier
+            session_id: Session identifier
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            bool: True if no upload of the session is pending anymore
+        """
+        with self._lock:
+            pending = list(self._pending.get((user_id, session_id), ()))
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued upload has finished, successfully or not.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            bool: True if nothing is pending anymore
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                pending = [f for futures in self._pending.values() for f in futures]
+            if not pending:
+                return True
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            _, not_done = wait(pending, timeout=remaining)
+            if not_done:
+                return False
+
+    wait_all = flush
+
+    def recover(self, config: Dict[str, Any]) -> int:
+        """
+        Queue every staged upload left behind by failed retries or a previous process.
+
+        Job files only name the session, its provider and its storage format,
+        never credentials, so the storage is built from config. Jobs staged
+        for another provider or storage format stay staged. A recovered upload
+        is a full upload without a lease: the profile filter and compaction
+        already ran before the first attempt, and with verify (the default) a
+        new checksum record is written, but nothing keeps another worker from
+        mounting the session while it uploads.
+
+        Args:
+            config: Storage settings the sessions were mounted with, as create_session_config keyword
+                arguments (user_id and session_id are not needed)
+
+        Returns:
+            int: Number of uploads queued
+        """
+        from . import MountedSession, create_session_config, storage_from_config
+
+        settings = create_session_config(**dict({"user_id": "", "session_id": ""}, **config))
+        storage = storage_from_config(config)
+        queued = 0
+        for name in sorted(os.listdir(self.staging_dir)):
+            job_dir = os.path.join(self.staging_dir, name)
+            with self._lock:
+                if job_dir in self._active_jobs:
+                    continue
+            try:
+                with open(os.path.join(job_dir, JOB_FILE)) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (job.get("provider"), job.get("storage_format")) != (
+                settings["provider"], settings["storage_format"]
+            ):
+                logging.warning(
+                    f"Leaving staged upload {name} for {job.get('provider')} storage in "
+                    f"{job.get('storage_format')} format for another recover()"
+                )
+                continue
+            session = MountedSession(
+                job["user_id"], job["session_id"], os.path.join(job_dir, PROFILE_DIR), storage=storage
+            )
+            session._mounted = False
+            session._storage_config = job
+            session._provider = job["provider"]
+            if settings["verify"] and storage.integrity is not None:
+                session._integrity_storage = storage
+            self._submit_job(session, job_dir)
+            queued += 1
+        return queued
+
+    def close(self):
+        """Drain the queue and stop the worker threads."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._executor.shutdown(wait=True)
+        atexit.unregister(self.close)
+
+    def __enter__(self) -> "BackgroundUploader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _stage(self, session) -> str:
+        job_dir = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        os.makedirs(job_dir)
+        with self._lock:
+            # Keep recover() away from the job until it is queued
+            self._active_jobs.add(job_dir)
+        profile_path = os.path.join(job_dir, PROFILE_DIR)
+        shutil.move(session.path, profile_path)
+        session.path = profile_path
+
+        # Only identifiers: the storage settings may hold passwords and keys
+        job = {
+            "user_id": session.user_id,
+            "session_id": session.session_id,
+            "provider": session._storage_config["provider"],
+            "storage_format": session._storage_config["storage_format"],
+        }
+        tmp_path = os.path.join(job_dir, f"{JOB_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, os.path.join(job_dir, JOB_FILE))
+        return job_dir
+
+    def _submit_job(self, session, job_dir: Optional[str]) -> Future:
+        self._slots.acquire()
+        try:
+            if job_dir:
+                with self._lock:
+                    self._active_jobs.add(job_dir)
+            future = self._executor.submit(self._run, session, job_dir)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.setdefault(session.key, set()).add(future)
+        future.add_done_callback(lambda done: self._done(session.key, done))
+        return future
+
+    def _run(self, session, job_dir: Optional[str]):
+        # Without a staged copy a failed BrowserState unmount cannot be retried
+        attempts = self.max_retries + 1 if job_dir else 1
+        try:
+            for attempt in range(attempts):
+                try:
+                    session._persist(final=attempt + 1 == attempts)
+                    break
+                except Exception as e:
+                    if attempt + 1 == attempts:
+                        raise
+                    delay = self.retry_delay * (2 ** attempt)
+                    logging.warning(
+                        f"Upload of session {session.session_id} failed ({e}), retrying in {delay:.1f}s"
+                    )
+                    time.sleep(delay)
+            if job_dir:
+                shutil.rmtree(job_dir, ignore_errors=True)
+        finally:
+            if job_dir:
+                with self._lock:
+                    self._active_jobs.discard(job_dir)
+
+    def _done(self, key: Tuple[str, str], future: Future):
+        # Recorded before the future leaves _pending, so flush() never returns without the error
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Background upload of session {key[1]} for user {key[0]} failed: {error}")
+            self.errors.append(error)
+        with self._lock:
+            futures = self._pending.get(key)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._pending[key]
+        self._slots.release()
@@ -1,27 +1,35 @@
-from browserstate_nova_adapter import with_browserstate
+from browserstate_nova_adapter import with_browserstate, mount_browserstate, unmount_browserstate
 from nova_act import NovaAct
 
+
 # Example 1: Using with context manager
-with with_browserstate(
-    user_id="demo-user",
-    session_id="nova-session",
-    provider="redis",  # or 'local', 's3', 'gcs'
-    redis_options={"host": "localhost", "port": 6379}
-) as user_data_dir:
-    with NovaAct(starting_page="https://example.com", user_data_dir=user_data_dir) as nova:
-        nova.act("search for something")
-        
+def run_with_context_manager():
+    with with_browserstate(
+        user_id="demo-user",
+        session_id="nova-session",
+        provider="redis",  # or 'local', 's3', 'gcs'
+        redis_options={"host": "localhost", "port": 6379}
+    ) as user_data_dir:
+        with NovaAct(starting_page="https://example.com", user_data_dir=user_data_dir) as nova:
+            nova.act("search for something")
+
+
 # Example 2: Manual mounting and unmounting
-from browserstate_nova_adapter import mount_browserstate, unmount_browserstate
+def run_with_manual_mounting():
+    user_data_dir = mount_browserstate(
+        user_id="demo",
+        session_id="session1",
+        provider="local"
+    )
+
+    try:
+        with NovaAct(starting_page="https://example.com", user_data_dir=user_data_dir) as nova:
+            nova.act("search for something")
+    finally:
+        unmount_browserstate()
 
-user_data_dir = mount_browserstate(
-    user_id="demo",
-    session_id="session1",
-    provider="local"
-)
 
-try:
-    with NovaAct(starting_page="https://example.com", user_data_dir=user_data_dir) as nova:
-        nova.act("search for something")
-finally:
-    unmount_browserstate() 
\ No newline at end of file
+# Keeps the examples from re-running in the worker processes that archive storage can start
+if __name__ == "__main__":
+    run_with_context_manager()
+    run_with_manual_mounting()
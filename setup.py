@@ -3,11 +3,23 @@ from setuptools import setup, find_packages
 setup(
     name="browserstate-nova-adapter",
     version="0.1.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "benchmarks"]),
     install_requires=[
         "browserstate",
     ],
     extras_require={
+        "redis": [
+            "redis>=4.0.0",
+        ],
+        "archive": [
+            "zstandard>=0.15.0",
+        ],
+        "s3": [
+            "boto3>=1.20.0",
+        ],
+        "gcs": [
+            "google-cloud-storage>=2.0.0",
+        ],
         "dev": [
             "pytest>=6.0.0",
             "pytest-cov>=2.10.0",
@@ -18,6 +30,8 @@ setup(
         "test": [
             "pytest>=6.0.0",
             "pytest-cov>=2.10.0",
+            "fakeredis>=2.0.0",
+            "moto[server]>=5.0.0",
         ],
     },
     author="browserstate-org",
@@ -32,4 +46,9 @@ setup(
         "Operating System :: OS Independent",
     ],
     python_requires=">=3.7",
+    entry_points={
+        "console_scripts": [
+            "browserstate-nova=browserstate_nova_adapter.cli:main",
+        ],
+    },
 ) 
\ No newline at end of file
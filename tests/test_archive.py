@@ -0,0 +1,312 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _tree(root):
+    found = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                found[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return found
+
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.profile = os.path.join(self.root, "profile")
+        _write(os.path.join(self.profile, "Local State"), b'{"os_crypt": {}}')
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"cookies" * 100)
+        _write(os.path.join(self.profile, "Default", "Cache", "data_0"), os.urandom(300 * 1024))
+        long_name = "x" * 120
+        _write(os.path.join(self.profile, "Default", "IndexedDB", long_name, "000001.log"), b"idb")
+        os.makedirs(os.path.join(self.profile, "Default", "blob_storage"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _round_trip(self, compression):
+        from browserstate_nova_adapter.archive import pack_profile, unpack_profile
+
+        chunks = list(pack_profile(self.profile, compression, chunk_size=64 * 1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) == 64 * 1024 for chunk in chunks[:-1]))
+
+        target = os.path.join(self.root, f"target-{compression}")
+        unpack_profile(iter(chunks), target, compression)
+        self.assertEqual(_tree(target), _tree(self.profile))
+        self.assertTrue(os.path.isdir(os.path.join(target, "Default", "blob_storage")))
+
+    def test_round_trip_gzip(self):
+        self._round_trip("gzip")
+
+    def test_round_trip_uncompressed(self):
+        self._round_trip("none")
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_round_trip_zstd(self):
+        self._round_trip("zstd")
+
+    def test_packing_is_deterministic(self):
+        from browserstate_nova_adapter.archive import pack_profile
+
+        first = b"".join(pack_profile(self.profile, "gzip"))
+        second = b"".join(pack_profile(self.profile, "gzip"))
+        self.assertEqual(first, second)
+
+    def test_parallel_packing_matches_serial_packing(self):
+        import gzip
+        from concurrent.futures import ProcessPoolExecutor
+        from browserstate_nova_adapter.archive import pack_profile, unpack_profile
+
+        # Spans several shards, with a file crossing shard boundaries
+        _write(os.path.join(self.profile, "Default", "History"), os.urandom(1024) * 2600)
+        compressions = ["gzip", "none"] + (["zstd"] if zstandard else [])
+        with ProcessPoolExecutor(2) as executor:
+            for compression in compressions:
+                serial = b"".join(pack_profile(self.profile, compression))
+                parallel = b"".join(pack_profile(self.profile, compression, executor=executor, parallel_threshold=0))
+                self.assertEqual(parallel, serial, compression)
+                target = os.path.join(self.root, f"target-{compression}")
+                unpack_profile(iter([parallel]), target, compression)
+                self.assertEqual(_tree(target), _tree(self.profile))
+        # Still one ordinary gzip stream
+        self.assertEqual(
+            gzip.decompress(b"".join(pack_profile(self.profile, "gzip"))),
+            b"".join(pack_profile(self.profile, "none")),
+        )
+
+    def test_shared_process_pool_does_not_fork(self):
+        from browserstate_nova_adapter.archive import _shutdown_process_pools, pack_profile, process_pool
+
+        self.assertIsNone(process_pool(1))
+        pool = process_pool(2)
+        try:
+            self.assertIs(process_pool(2), pool)
+            self.assertNotEqual(pool._mp_context.get_start_method(), "fork")
+            _write(os.path.join(self.profile, "Default", "History"), os.urandom(1024) * 2600)
+            self.assertEqual(
+                b"".join(pack_profile(self.profile, "gzip", executor=pool, parallel_threshold=0)),
+                b"".join(pack_profile(self.profile, "gzip")),
+            )
+        finally:
+            _shutdown_process_pools()
+        self.assertIsNot(process_pool(2), pool)
+        _shutdown_process_pools()
+
+    def test_broken_process_pool_falls_back_to_this_process(self):
+        from concurrent.futures import Executor, Future
+        from concurrent.futures.process import BrokenProcessPool
+        from browserstate_nova_adapter.archive import pack_profile
+
+        class BrokenPool(Executor):
+            # Like a pool whose processes died re-running an unguarded main module
+            submitted = 0
+
+            def submit(self, fn, *args, **kwargs):
+                self.submitted += 1
+                if self.submitted > 2:
+                    raise BrokenProcessPool("A child process terminated abruptly")
+                future = Future()
+                future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+                return future
+
+        _write(os.path.join(self.profile, "Default", "History"), os.urandom(1024) * 2600)
+        pool = BrokenPool()
+        with self.assertLogs(level="WARNING") as logs:
+            parallel = b"".join(pack_profile(self.profile, "gzip", executor=pool, parallel_threshold=0, workers=2))
+        self.assertEqual(parallel, b"".join(pack_profile(self.profile, "gzip")))
+        self.assertIn("__main__", logs.output[0])
+        # Given up on once it broke
+        self.assertLessEqual(pool.submitted, 4)
+
+    def test_archive_storage_packs_in_process_by_default(self):
+        from browserstate_nova_adapter.archive import process_pool
+        from browserstate_nova_adapter.storage import ArchiveSessionStorage, create_blob_store
+
+        storage = ArchiveSessionStorage(create_blob_store("local", os.path.join(self.root, "storage")))
+        self.assertEqual(storage.workers, 1)
+        self.assertIsNone(process_pool(storage.workers))
+
+    def test_crc32_combine(self):
+        import zlib
+        from browserstate_nova_adapter.archive import _crc32_combine
+
+        for first, second in ((b"", b"tail"), (b"head", b""), (os.urandom(100), os.urandom(3 * 1024 * 1024 + 5))):
+            self.assertEqual(
+                _crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second)), zlib.crc32(first + second)
+            )
+
+    def test_filtered_pack(self):
+        from browserstate_nova_adapter import ProfileFilter
+        from browserstate_nova_adapter.archive import pack_profile, unpack_profile
+
+        target = os.path.join(self.root, "target")
+        chunks = pack_profile(self.profile, "gzip", profile_filter=ProfileFilter.without_caches())
+        unpack_profile(chunks, target, "gzip")
+        self.assertNotIn("Default/Cache/data_0", _tree(target))
+        self.assertIn("Default/Cookies", _tree(target))
+
+    def test_archive_storage_format(self):
+        from browserstate_nova_adapter import create_session_config, with_browserstate
+        from browserstate_nova_adapter.storage import create_blob_store
+
+        storage_path = os.path.join(self.root, "storage")
+        config = create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            storage_format="archive",
+            format_options={"compression": "gzip", "chunk_size": 128 * 1024},
+        )
+
+        with with_browserstate(**config) as user_data_dir:
+            shutil.rmtree(user_data_dir)
+            shutil.copytree(self.profile, user_data_dir)
+
+        blobs = create_blob_store("local", storage_path)
+        keys = blobs.list("user/session/")
+        # An index plus a handful of chunks instead of one object per file
+        self.assertIn("user/session/index.json", keys)
+        self.assertLessEqual(len(keys), 5)
+
+        with with_browserstate(**config) as user_data_dir:
+            self.assertEqual(_tree(user_data_dir), _tree(self.profile))
+
+        # Re-uploading keeps the replaced generation as the fallback, and only that one
+        kept = blobs.list("user/session/")
+        self.assertIn("user/session/previous.json", kept)
+        self.assertEqual(len(kept), 2 * len(keys))
+        with with_browserstate(**config):
+            pass
+        self.assertEqual(len(blobs.list("user/session/")), len(kept))
+
+    def test_unpacking_memory_is_bounded(self):
+        import tracemalloc
+
+        from browserstate_nova_adapter.archive import pack_profile, unpack_profile
+
+        # Compresses to next to nothing, so a whole chunk would inflate to the full file at once
+        with open(os.path.join(self.profile, "Default", "History"), "wb") as f:
+            for _ in range(64):
+                f.write(bytes(1024 * 1024))
+        chunks = list(pack_profile(self.profile, "gzip", chunk_size=4 * 1024 * 1024))
+        self.assertEqual(len(chunks), 1)
+
+        target = os.path.join(self.root, "target")
+        tracemalloc.start()
+        try:
+            unpack_profile(iter(chunks), target, "gzip", buffer_size=256 * 1024)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 8 * 1024 * 1024)
+        self.assertEqual(os.path.getsize(os.path.join(target, "Default", "History")), 64 * 1024 * 1024)
+
+    def test_truncated_archive(self):
+        from browserstate_nova_adapter.archive import _CORRUPT_DATA_ERRORS, pack_profile, unpack_profile
+
+        data = b"".join(pack_profile(self.profile, "gzip"))
+        with self.assertRaises(_CORRUPT_DATA_ERRORS):
+            unpack_profile(iter([data[:len(data) // 2]]), os.path.join(self.root, "target"), "gzip")
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisArchive(unittest.TestCase):
+
+    def test_round_trip(self):
+        from browserstate_nova_adapter import ArchiveSessionStorage, RedisBlobStore
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cookies"), os.urandom(50 * 1024))
+
+        client = fakeredis.FakeRedis()
+        storage = ArchiveSessionStorage(
+            RedisBlobStore(client, "browserstate:archive:", ttl=60), compression="gzip", chunk_size=16 * 1024
+        )
+        version = storage.upload("user", "session", source)
+        self.assertEqual(storage.get_version("user", "session"), version)
+        self.assertGreater(client.ttl("browserstate:archive:user/session/index.json"), 0)
+
+        target = os.path.join(root, "target")
+        storage.download("user", "session", target)
+        self.assertEqual(_tree(target), _tree(source))
+
+    def test_chunks_are_pipelined_in_bounded_batches(self):
+        from browserstate_nova_adapter import create_session_storage
+        from browserstate_nova_adapter.storage import REDIS_CHUNK_SIZE
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cache"), os.urandom(200 * 1024))
+
+        client = fakeredis.FakeRedis()
+        self.assertEqual(
+            create_session_storage("redis", storage_format="archive", redis_client=client).chunk_size,
+            REDIS_CHUNK_SIZE,
+        )
+        storage = create_session_storage(
+            "redis",
+            redis_options={"key_prefix": "test", "ttl": 60},
+            storage_format="archive",
+            format_options={"compression": "none", "chunk_size": 16 * 1024, "max_in_flight": 4},
+            redis_client=client,
+        )
+        batches = []
+        real_pipeline = client.pipeline
+
+        def pipeline(*args, **kwargs):
+            pipe = real_pipeline(*args, **kwargs)
+            real_execute = pipe.execute
+
+            def execute(*args, **kwargs):
+                batches.append(len(pipe.command_stack))
+                return real_execute(*args, **kwargs)
+
+            pipe.execute = execute
+            return pipe
+
+        with patch.object(client, "pipeline", side_effect=pipeline):
+            storage.upload("user", "session", source)
+            chunks = storage.read_index("user", "session")["chunks"]
+            self.assertEqual(len(chunks), 13)
+            self.assertEqual(batches, [4, 4, 4, 1])
+
+            batches.clear()
+            target = os.path.join(root, "target")
+            storage.download("user", "session", target)
+            self.assertEqual(batches, [4, 4, 4, 1])
+        self.assertEqual(_tree(target), _tree(source))
+        for key in chunks:
+            self.assertGreater(client.ttl(f"test:archive:{key}"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class TestAsyncBrowserState(unittest.TestCase):
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_async_with_browserstate(self, mock_browserstate):
+        from browserstate_nova_adapter import async_with_browserstate, create_session_config
+
+        mock_instance = MagicMock()
+        mock_instance.mount_session.return_value = {"path": "/tmp/browser_data"}
+        mock_browserstate.return_value = mock_instance
+
+        config = create_session_config(user_id="test-user", session_id="test-session")
+
+        async def run():
+            async with async_with_browserstate(**config) as user_data_dir:
+                self.assertEqual(user_data_dir, "/tmp/browser_data")
+                mock_instance.unmount_session.assert_not_called()
+
+        asyncio.run(run())
+        mock_instance.mount_session.assert_called_once_with(session_id="test-session")
+        mock_instance.unmount_session.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_async_mount_and_unmount(self, mock_browserstate):
+        from browserstate_nova_adapter import async_mount_browserstate, async_unmount_browserstate
+
+        mock_instance = MagicMock()
+        mock_instance.mount_session.return_value = {"path": "/tmp/browser_data"}
+        mock_browserstate.return_value = mock_instance
+
+        async def run():
+            path = await async_mount_browserstate(user_id="test-user", session_id="test-session")
+            self.assertEqual(path, "/tmp/browser_data")
+            await async_unmount_browserstate(user_id="test-user", session_id="test-session")
+
+        asyncio.run(run())
+        mock_instance.unmount_session.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_mounts_overlap_on_one_loop(self, mock_browserstate):
+        from browserstate_nova_adapter import async_with_browserstate
+
+        # Each download blocks until every session has started downloading,
+        # which can only happen if the mounts run concurrently.
+        started = threading.Barrier(4)
+
+        def create(options):
+            instance = MagicMock()
+
+            def mount_session(session_id):
+                started.wait(timeout=5)
+                return {"path": f"/tmp/{session_id}"}
+
+            instance.mount_session.side_effect = mount_session
+            return instance
+
+        mock_browserstate.side_effect = create
+
+        async def use(index):
+            async with async_with_browserstate(user_id="user", session_id=f"s{index}") as path:
+                return path
+
+        async def run():
+            return await asyncio.gather(*(use(i) for i in range(4)))
+
+        self.assertEqual(asyncio.run(run()), [f"/tmp/s{i}" for i in range(4)])
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_cancelled_mount_is_unmounted(self, mock_browserstate):
+        from browserstate_nova_adapter import async_mount_browserstate_session
+
+        mock_instance = MagicMock()
+
+        def slow_mount(session_id):
+            time.sleep(0.2)
+            return {"path": "/tmp/browser_data"}
+
+        mock_instance.mount_session.side_effect = slow_mount
+        mock_browserstate.return_value = mock_instance
+
+        async def run():
+            task = asyncio.ensure_future(
+                async_mount_browserstate_session(user_id="test-user", session_id="test-session")
+            )
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # Give the abandoned download time to finish and be unmounted
+            for _ in range(50):
+                if mock_instance.unmount_session.called:
+                    break
+                await asyncio.sleep(0.02)
+
+        asyncio.run(run())
+        mock_instance.unmount_session.assert_called_once()
+
+    def test_async_mount_forwards_every_setting(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from browserstate_nova_adapter import async_mount_browserstate
+
+        with patch('browserstate_nova_adapter.mount_browserstate_session') as mount, \
+                ThreadPoolExecutor(1, thread_name_prefix="io") as executor:
+            mount.side_effect = lambda **kwargs: MagicMock(path=threading.current_thread().name)
+            path = asyncio.run(async_mount_browserstate(
+                "test-user", "test-session", "redis", executor=executor, delta=True, lease=True
+            ))
+        self.assertTrue(path.startswith("io"))
+        mount.assert_called_once_with(
+            user_id="test-user", session_id="test-session", provider="redis", storage_path=None, temp_dir=None,
+            redis_options=None, delta=True, lease=True,
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
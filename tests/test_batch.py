@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _configs(self, count, **overrides):
+        from browserstate_nova_adapter import create_session_config
+
+        return [
+            create_session_config(
+                user_id=f"user{number}",
+                session_id="session",
+                storage_path=self.storage_path,
+                temp_dir=os.path.join(self.root, "mounts"),
+                delta=True,
+                **overrides
+            )
+            for number in range(count)
+        ]
+
+    def test_mount_and_unmount_many(self):
+        from browserstate_nova_adapter import get_mounted_sessions, mount_many, unmount_many
+
+        sessions = []
+        for result in mount_many(self._configs(6), max_workers=3):
+            self.assertIsNone(result.error)
+            _write(os.path.join(result.session.path, "Cookies"), result.config["user_id"])
+            sessions.append(result.session)
+        self.assertEqual(len(sessions), 6)
+        self.assertEqual(len(get_mounted_sessions()), 6)
+
+        results = unmount_many(sessions, max_workers=3)
+        self.assertEqual([r.session for r in results], sessions)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual(get_mounted_sessions(), [])
+        with open(os.path.join(self.storage_path, "user4", "session", "Cookies")) as f:
+            self.assertEqual(f.read(), "user4")
+
+    def test_errors_do_not_abort_the_batch(self):
+        from browserstate_nova_adapter import mount_many
+
+        configs = self._configs(3)
+        configs[1]["storage_format"] = "unknown"
+        results = list(mount_many(configs, max_workers=2))
+        failed = [r for r in results if r.error is not None]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(failed), 1)
+        self.assertIsInstance(failed[0].error, ValueError)
+        self.assertIs(failed[0].config, configs[1])
+        for result in results:
+            if result.session is not None:
+                result.session.unmount()
+
+    def test_in_flight_mounts_are_bounded(self):
+        from browserstate_nova_adapter import mount_browserstate_session, mount_many, unmount_many
+
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def slow_mount(**config):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+            return mount_browserstate_session(**config)
+
+        with patch("browserstate_nova_adapter.batch.mount_browserstate_session", slow_mount):
+            sessions = [result.session for result in mount_many(self._configs(8), max_workers=2)]
+        self.assertLessEqual(max(peak), 2)
+        unmount_many(sessions)
+
+    def test_stopping_early_unmounts_unused_sessions(self):
+        from browserstate_nova_adapter import get_mounted_sessions, mount_many
+
+        results = mount_many(self._configs(5), max_workers=3)
+        first = next(results)
+        results.close()
+        self.assertEqual(get_mounted_sessions(), [first.session])
+        first.session.unmount()
+
+    def test_unmount_errors_are_collected(self):
+        from browserstate_nova_adapter import mount_many, unmount_many
+
+        sessions = [result.session for result in mount_many(self._configs(3))]
+        for session in sessions:
+            _write(os.path.join(session.path, "Cookies"), "x")
+        real_upload = LocalSessionStorage.upload
+
+        def upload(storage, user_id, session_id, source_path):
+            if user_id == "user1":
+                raise IOError("disk full")
+            return real_upload(storage, user_id, session_id, source_path)
+
+        with patch.object(LocalSessionStorage, "upload", upload):
+            results = unmount_many(sessions)
+        errors = {r.session.user_id: r.error for r in results}
+        self.assertIsInstance(errors.pop("user1"), IOError)
+        self.assertEqual(set(errors.values()), {None})
+
+
+if __name__ == '__main__':
+    unittest.main()
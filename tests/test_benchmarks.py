@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_generated_profiles_are_deterministic(self):
+        from benchmarks.profiles import SHARED_FILE, ProfileSpec, generate_profile
+
+        spec = ProfileSpec(files=50, median_size=2048, shared_size=64 * 1024)
+        first = os.path.join(self.root, "first")
+        second = os.path.join(self.root, "second")
+        other = os.path.join(self.root, "other")
+        files, size = generate_profile(first, spec, seed=1)
+        self.assertEqual(generate_profile(second, spec, seed=1), (files, size))
+        generate_profile(other, spec, seed=2)
+
+        self.assertEqual(files, 50)
+        self.assertEqual(sum(len(names) for _, _, names in os.walk(first)), 50)
+        with open(os.path.join(first, "Default", "Cookies"), "rb") as f:
+            cookies = f.read()
+        with open(os.path.join(second, "Default", "Cookies"), "rb") as f:
+            self.assertEqual(f.read(), cookies)
+        with open(os.path.join(other, "Default", "Cookies"), "rb") as f:
+            self.assertNotEqual(f.read(), cookies)
+        # The shared component is identical whatever the seed
+        with open(os.path.join(first, SHARED_FILE), "rb") as f, open(os.path.join(other, SHARED_FILE), "rb") as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_percentile(self):
+        from benchmarks.run import percentile
+
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(percentile([5], 99), 5)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_run_scenario(self):
+        from benchmarks.profiles import ProfileSpec
+        from benchmarks.run import run_scenario
+
+        spec = ProfileSpec(files=30, median_size=1024)
+        result = run_scenario("local-delta", {"provider": "local", "delta": True}, spec, self.root, iterations=3)
+        self.assertEqual(result["iterations"], 3)
+        self.assertEqual(result["profile"]["files"], 30)
+        for phase in ("mount", "unmount", "cycle"):
+            self.assertLessEqual(result[phase]["p50"], result[phase]["p99"])
+        self.assertGreater(result["storage_bytes"], 0)
+
+    def test_compare_reports_regressions(self):
+        from benchmarks.run import compare
+
+        def result(mount_p95, rss):
+            return {
+                "scenario": "local", "profile_name": "small", "peak_rss_mb": rss,
+                "mount": {"p95": mount_p95}, "unmount": {"p95": 10.0}, "cycle": {"p95": 20.0},
+            }
+
+        baseline = [result(10.0, 100.0)]
+        self.assertEqual(compare([result(11.0, 100.0)], baseline, 0.2), [])
+        regressions = compare([result(15.0, 130.0)], baseline, 0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("mount p95", regressions[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
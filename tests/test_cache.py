@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestMountCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+        self.temp_dir = os.path.join(self.root, "mounts")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self, cache, session_id="session"):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id=session_id,
+            provider="local",
+            storage_path=self.storage_path,
+            temp_dir=self.temp_dir,
+            cache=cache,
+        )
+
+    def test_remount_uses_cache(self):
+        from browserstate_nova_adapter import MountCache, with_browserstate
+
+        cache = MountCache(os.path.join(self.root, "cache"))
+        config = self._config(cache)
+
+        with with_browserstate(**config) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "logged-in")
+
+        # The session was uploaded and its profile kept in the cache
+        stored = os.path.join(self.storage_path, "user", "session", "Default", "Cookies")
+        self.assertEqual(_read(stored), "logged-in")
+        self.assertEqual(len(cache), 1)
+
+        with patch.object(LocalSessionStorage, "download", autospec=True) as download:
+            with with_browserstate(**config) as user_data_dir:
+                self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+                self.assertEqual(len(cache), 0)
+            download.assert_not_called()
+
+        self.assertEqual(len(cache), 1)
+
+    def test_changed_session_is_downloaded_again(self):
+        from browserstate_nova_adapter import MountCache, with_browserstate
+
+        cache = MountCache(os.path.join(self.root, "cache"))
+        config = self._config(cache)
+
+        with with_browserstate(**config) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Cookies"), "first")
+
+        # Another writer replaces the stored session
+        other = os.path.join(self.root, "other")
+        _write(os.path.join(other, "Cookies"), "second")
+        LocalSessionStorage(self.storage_path).upload("user", "session", other)
+
+        with with_browserstate(**config) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Cookies")), "second")
+
+    def test_lru_eviction(self):
+        from browserstate_nova_adapter import MountCache
+
+        cache = MountCache(os.path.join(self.root, "cache"), max_bytes=250)
+        for name in ("a", "b", "c"):
+            profile = os.path.join(self.root, name)
+            _write(os.path.join(profile, "data"), "x" * 100)
+            cache.checkin(name, "v1", profile)
+
+        # Only two 100 byte profiles fit; the oldest one was evicted
+        self.assertNotIn("a", cache)
+        self.assertIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.size, 200)
+
+        target = os.path.join(self.root, "restored")
+        self.assertFalse(cache.checkout("b", "v2", target))
+        self.assertNotIn("b", cache)
+        self.assertTrue(cache.checkout("c", "v1", target))
+        self.assertEqual(_read(os.path.join(target, "data")), "x" * 100)
+
+    def test_index_survives_restart(self):
+        from browserstate_nova_adapter import MountCache
+
+        cache_dir = os.path.join(self.root, "cache")
+        profile = os.path.join(self.root, "profile")
+        _write(os.path.join(profile, "data"), "x")
+        MountCache(cache_dir).checkin("key", "v1", profile)
+
+        cache = MountCache(cache_dir)
+        self.assertIn("key", cache)
+        self.assertTrue(cache.checkout("key", "v1", profile))
+
+    def test_cache_requires_direct_storage(self):
+        from browserstate_nova_adapter import MountCache, mount_browserstate
+
+        cache = MountCache(os.path.join(self.root, "cache"))
+        with self.assertRaises(ValueError):
+            mount_browserstate(user_id="user", session_id="session", provider="s3", cache=cache)
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisSessionStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_round_trip(self):
+        from browserstate_nova_adapter import RedisSessionStorage
+
+        storage = RedisSessionStorage({"key_prefix": "test", "ttl": 60}, client=fakeredis.FakeRedis())
+        self.assertIsNone(storage.get_version("user", "session"))
+
+        source = os.path.join(self.root, "source")
+        _write(os.path.join(source, "Default", "Cookies"), "logged-in")
+        version = storage.upload("user", "session", source)
+        self.assertEqual(storage.get_version("user", "session"), version)
+        self.assertGreater(storage.client.ttl("test:user:session"), 0)
+
+        target = os.path.join(self.root, "target")
+        self.assertEqual(storage.download("user", "session", target), version)
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), "logged-in")
+
+
+if __name__ == '__main__':
+    unittest.main()
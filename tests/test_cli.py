@@ -0,0 +1,123 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+from browserstate_nova_adapter import storage_from_config
+from browserstate_nova_adapter.cache import MountCache
+from browserstate_nova_adapter.cli import main, migrate_sessions, prefetch_sessions
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source_config = {"storage_path": os.path.join(self.root, "source")}
+        self.target_config = {
+            "storage_path": os.path.join(self.root, "target"),
+            "storage_format": "archive",
+            "format_options": {"compression": "gzip"},
+        }
+        self.source = storage_from_config(self.source_config)
+        self.profile = os.path.join(self.root, "profile")
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"logged-in")
+        for user_id, session_id in [("alice", "a"), ("alice", "b"), ("bob", "a")]:
+            self.source.upload(user_id, session_id, self.profile)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_migration_resumes(self):
+        target = storage_from_config(self.target_config)
+        state = os.path.join(self.root, "migration.json")
+        sessions = [("alice", "a"), ("alice", "b"), ("bob", "a"), ("bob", "missing")]
+
+        real_upload = target.upload
+
+        def upload(user_id, session_id, source_path):
+            if (user_id, session_id) == ("alice", "b"):
+                raise IOError("connection reset")
+            return real_upload(user_id, session_id, source_path)
+
+        with patch.object(target, "upload", side_effect=upload):
+            result = migrate_sessions(self.source, target, sessions, state, max_workers=2)
+        self.assertEqual(result.copied, [("alice", "a"), ("bob", "a")])
+        self.assertEqual(result.failed, [("alice", "b")])
+        self.assertEqual(result.skipped, [("bob", "missing")])
+
+        # The rerun only copies what is missing
+        with patch.object(target, "upload", wraps=real_upload) as upload:
+            result = migrate_sessions(self.source, target, sessions, state, max_workers=2)
+        self.assertEqual(result.copied, [("alice", "b")])
+        self.assertEqual(result.failed, [])
+        upload.assert_called_once()
+        for user_id, session_id in sessions[:3]:
+            restored = os.path.join(self.root, "restored", user_id, session_id)
+            self.assertIsNotNone(target.download(user_id, session_id, restored))
+            self.assertEqual(_read(os.path.join(restored, "Default", "Cookies")), b"logged-in")
+
+        # Sessions changed at the source since are copied again
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"changed")
+        self.source.upload("bob", "a", self.profile)
+        result = migrate_sessions(self.source, target, sessions, state)
+        self.assertEqual(result.copied, [("bob", "a")])
+        restored = os.path.join(self.root, "restored-again")
+        target.download("bob", "a", restored)
+        self.assertEqual(_read(os.path.join(restored, "Default", "Cookies")), b"changed")
+
+    def test_prefetch_warms_the_mount_cache(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        cache = MountCache(os.path.join(self.root, "cache"))
+        prefetched = prefetch_sessions(self.source, cache, [("alice", "a"), ("bob", "a"), ("bob", "missing")])
+        self.assertEqual(prefetched, [("alice", "a"), ("bob", "a")])
+        self.assertEqual(prefetch_sessions(self.source, cache, [("alice", "a")]), [])
+
+        with patch.object(type(self.source), "download", side_effect=AssertionError("downloaded")):
+            session = mount_browserstate_session(
+                user_id="alice", session_id="a", temp_dir=os.path.join(self.root, "mounts"), cache=cache,
+                **self.source_config
+            )
+        self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), b"logged-in")
+        session.unmount()
+
+    def test_list_and_migrate(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main(["list", "--storage-path", self.source_config["storage_path"], "--user", "alice"])
+        self.assertEqual(status, 0)
+        lines = output.getvalue().splitlines()
+        self.assertEqual([line.split("\t")[:3] for line in lines[:2]], [["alice", "a", "9"], ["alice", "b", "9"]])
+        self.assertEqual(lines[2], "2 sessions, 18 bytes")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main([
+                "migrate", "--config", json.dumps(self.source_config), "--to", json.dumps(self.target_config),
+                "--state", os.path.join(self.root, "migration.json"), "--jobs", "2",
+            ])
+        self.assertEqual(status, 0)
+        self.assertIn("Migrated 3 sessions, skipped 0, 0 failed", output.getvalue())
+        self.assertEqual(storage_from_config(self.target_config).list_sessions("alice"), ["a", "b"])
+
+        with self.assertRaises(SystemExit):
+            main(["list", "--provider", "redis"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _mock_browserstate(self, mock_browserstate):
+        def create(options):
+            instance = MagicMock()
+            instance.mount_session.return_value = {"path": os.path.join(self.root, "mounted")}
+            return instance
+
+        mock_browserstate.side_effect = create
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_browserstate_is_reused(self, mock_browserstate):
+        from browserstate_nova_adapter import ClientPool, with_browserstate
+
+        self._mock_browserstate(mock_browserstate)
+        with ClientPool() as clients:
+            for _ in range(3):
+                with with_browserstate(user_id="user", session_id="session", client_pool=clients):
+                    pass
+            with with_browserstate(user_id="other", session_id="session", client_pool=clients):
+                pass
+
+        # One instance per user, reused by every mount of that user
+        self.assertEqual(mock_browserstate.call_count, 2)
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_concurrent_mounts_get_their_own_instance(self, mock_browserstate):
+        from browserstate_nova_adapter import ClientPool, mount_browserstate_session
+
+        self._mock_browserstate(mock_browserstate)
+        clients = ClientPool()
+        first = mount_browserstate_session(user_id="user", session_id="a", client_pool=clients)
+        second = mount_browserstate_session(user_id="user", session_id="b", client_pool=clients)
+        self.assertIsNot(first._browserstate, second._browserstate)
+        first.unmount()
+        second.unmount()
+        self.assertEqual(len(clients), 2)
+
+        third = mount_browserstate_session(user_id="user", session_id="c", client_pool=clients)
+        self.assertIn(third._browserstate, (first._browserstate, second._browserstate))
+        third.unmount()
+        clients.close()
+        first._browserstate.close.assert_called_once()
+        second._browserstate.close.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_idle_instances_are_evicted(self, mock_browserstate):
+        from browserstate_nova_adapter import ClientPool, mount_browserstate_session
+
+        self._mock_browserstate(mock_browserstate)
+        clients = ClientPool(idle_timeout=0)
+        session = mount_browserstate_session(user_id="user", session_id="session", client_pool=clients)
+        session.unmount()
+        self.assertEqual(clients.evict_idle(), 1)
+        session._browserstate.close.assert_called_once()
+        self.assertEqual(len(clients), 0)
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_failed_unmount_does_not_return_instance(self, mock_browserstate):
+        from browserstate_nova_adapter import ClientPool, mount_browserstate_session
+
+        self._mock_browserstate(mock_browserstate)
+        clients = ClientPool()
+        session = mount_browserstate_session(user_id="user", session_id="session", client_pool=clients)
+        session._browserstate.unmount_session.side_effect = IOError("connection reset")
+        with self.assertRaises(IOError):
+            session.unmount()
+        self.assertEqual(len(clients), 0)
+
+    def test_direct_storage_is_shared(self):
+        from browserstate_nova_adapter import ClientPool, mount_browserstate_session
+
+        clients = ClientPool()
+        config = dict(
+            session_id="session",
+            storage_path=os.path.join(self.root, "storage"),
+            temp_dir=os.path.join(self.root, "mounts"),
+            delta=True,
+            client_pool=clients,
+        )
+        first = mount_browserstate_session(user_id="alice", **config)
+        second = mount_browserstate_session(user_id="bob", **config)
+        self.assertIs(first._storage, second._storage)
+        first.unmount()
+        second.unmount()
+        clients.close()
+        with self.assertRaises(RuntimeError):
+            mount_browserstate_session(user_id="alice", **config)
+
+    def test_redis_clients_are_shared_per_configuration(self):
+        from browserstate_nova_adapter import ClientPool
+
+        with patch('browserstate_nova_adapter.clients._redis_client', side_effect=lambda options: MagicMock()) as connect:
+            clients = ClientPool()
+            first = clients.session_storage(
+                {"provider": "redis", "redis_options": {"host": "cache", "key_prefix": "a"}}
+            )
+            archive = clients.session_storage({
+                "provider": "redis", "redis_options": {"host": "cache", "key_prefix": "a"}, "storage_format": "archive",
+            })
+            prefixed = clients.session_storage(
+                {"provider": "redis", "redis_options": {"host": "cache", "key_prefix": "b"}}
+            )
+            spelled_out = clients.redis_client({"host": "cache", "port": 6379, "key_prefix": "a"})
+            tls = clients.redis_client({"host": "cache", "key_prefix": "a", "ssl": True})
+
+        self.assertEqual(connect.call_count, 3)
+        self.assertIs(archive.blobs.client, first.client)
+        self.assertIs(spelled_out, first.client)
+        self.assertIsNot(prefixed.client, first.client)
+        self.assertIsNot(tls, first.client)
+
+        clients.close()
+        first.client.close.assert_called_once()
+        tls.close.assert_called_once()
+
+    def test_redis_connection_options_are_passed_on(self):
+        from browserstate_nova_adapter.storage import _redis_connection_options
+
+        self.assertEqual(
+            _redis_connection_options({"host": "cache", "ssl": True, "username": "nova", "key_prefix": "a", "ttl": 60}),
+            {"host": "cache", "port": 6379, "db": 0, "password": None, "ssl": True, "username": "nova"},
+        )
+
+    @unittest.skipUnless(fakeredis, "fakeredis is not installed")
+    def test_clients_of_mounted_sessions_are_not_evicted(self):
+        from browserstate_nova_adapter import ClientPool, mount_browserstate_session
+
+        server = fakeredis.FakeServer()
+        created = []
+
+        def connect(options):
+            client = fakeredis.FakeRedis(server=server)
+            client.close = MagicMock(wraps=client.close)
+            created.append(client)
+            return client
+
+        clients = ClientPool(idle_timeout=0)
+        with patch('browserstate_nova_adapter.clients._redis_client', side_effect=connect):
+            session = mount_browserstate_session(
+                user_id="user", session_id="session", provider="redis", redis_options={"key_prefix": "test"},
+                temp_dir=os.path.join(self.root, "mounts"), streaming=True, lease=True,
+                lease_options={"timeout": 0}, client_pool=clients,
+            )
+            # The storage and the client of the lease are in use until the session is unmounted
+            self.assertEqual(clients.evict_idle(), 0)
+            self.assertEqual(len(created), 1)
+            created[0].close.assert_not_called()
+
+            session.unmount()
+            self.assertEqual(clients.evict_idle(), 2)
+            created[0].close.assert_called_once()
+        clients.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+from browserstate_nova_adapter.compaction import ProfileCompactor
+
+
+def _varint(value):
+    out = b""
+    while value >= 0x80:
+        out += bytes([value & 0x7F | 0x80])
+        value >>= 7
+    return out + bytes([value])
+
+
+def _manifest(log_number, garbage=False):
+    comparator = b"leveldb.BytewiseComparator"
+    edit = _varint(1) + _varint(len(comparator)) + comparator
+    edit += _varint(2) + _varint(log_number) + _varint(3) + _varint(9) + _varint(4) + _varint(100)
+    # A table file: level, number, size, smallest and largest key
+    edit += _varint(7) + _varint(0) + _varint(4) + _varint(2048) + _varint(1) + b"a" + _varint(1) + b"z"
+    if garbage:
+        edit += _varint(42)
+    return b"\0\0\0\0" + struct.pack("<HB", len(edit), 1) + edit
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class TestProfileCompactor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.profile = os.path.join(self.root, "profile")
+        os.makedirs(os.path.join(self.profile, "Default"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _database(self, name="History", wal=False):
+        path = os.path.join(self.profile, "Default", name)
+        connection = sqlite3.connect(path, isolation_level=None)
+        if wal:
+            connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE visits (url TEXT)")
+        connection.executemany("INSERT INTO visits VALUES (?)", [("x" * 1000,)] * 2000)
+        connection.execute("DELETE FROM visits WHERE rowid > 1")
+        return path, connection
+
+    def test_vacuums_databases_with_free_pages(self):
+        path, connection = self._database()
+        connection.close()
+        before = os.path.getsize(path)
+
+        saved = ProfileCompactor(min_bytes=0).compact(self.profile)
+        self.assertGreater(saved, 1024 * 1024)
+        self.assertEqual(os.path.getsize(path), before - saved)
+        connection = sqlite3.connect(path)
+        self.assertEqual(connection.execute("SELECT count(*) FROM visits").fetchone(), (1,))
+        connection.close()
+
+        # Nothing left to reclaim
+        self.assertEqual(ProfileCompactor(min_bytes=0).compact(self.profile), 0)
+
+    def test_checkpoints_write_ahead_logs(self):
+        path, connection = self._database("Cookies", wal=True)
+        connection.execute("PRAGMA wal_autocheckpoint=0")
+        connection.execute("INSERT INTO visits VALUES ('only in the log')")
+        # A profile copied while the browser was running, or after it crashed
+        copy = os.path.join(self.root, "copy", "Default")
+        os.makedirs(copy)
+        for suffix in ("", "-wal"):
+            shutil.copy2(path + suffix, os.path.join(copy, "Cookies" + suffix))
+        connection.close()
+        shutil.copy2(path, os.path.join(copy, "Web Data"))
+        _write(os.path.join(copy, "Web Data-journal"), b"")
+
+        saved = ProfileCompactor(min_bytes=0).compact(os.path.dirname(copy))
+        self.assertGreater(saved, 0)
+        self.assertEqual(sorted(os.listdir(copy)), ["Cookies", "Web Data"])
+        connection = sqlite3.connect(os.path.join(copy, "Cookies"))
+        self.assertEqual(connection.execute("SELECT url FROM visits WHERE url LIKE 'only%'").fetchone(),
+                         ("only in the log",))
+        connection.close()
+
+    def test_removes_obsolete_leveldb_files(self):
+        store = os.path.join(self.profile, "Default", "Local Storage", "leveldb")
+        _write(os.path.join(store, "CURRENT"), b"MANIFEST-000005\n")
+        _write(os.path.join(store, "MANIFEST-000005"), _manifest(log_number=7))
+        for name in ("MANIFEST-000002", "000003.log", "000007.log", "000004.ldb", "LOG", "LOG.old", "LOCK"):
+            _write(os.path.join(store, name), b"x" * 100)
+
+        saved = ProfileCompactor(min_bytes=0).compact(self.profile)
+        self.assertEqual(saved, 300)
+        self.assertEqual(
+            sorted(os.listdir(store)),
+            ["000004.ldb", "000007.log", "CURRENT", "LOCK", "LOG", "MANIFEST-000005"],
+        )
+
+    def test_unreadable_manifest_leaves_the_store_alone(self):
+        store = os.path.join(self.profile, "Default", "IndexedDB", "https_example.com_0.indexeddb.leveldb")
+        _write(os.path.join(store, "CURRENT"), b"MANIFEST-000005\n")
+        _write(os.path.join(store, "MANIFEST-000005"), _manifest(log_number=7, garbage=True))
+        _write(os.path.join(store, "000003.log"), b"x" * 100)
+        self.assertEqual(ProfileCompactor(min_bytes=0).compact(self.profile), 0)
+        self.assertIn("000003.log", os.listdir(store))
+
+    def test_small_profiles_are_left_alone(self):
+        path, connection = self._database()
+        connection.close()
+        before = os.path.getsize(path)
+        self.assertEqual(ProfileCompactor(min_bytes=1024 ** 3).compact(self.profile), 0)
+        self.assertEqual(os.path.getsize(path), before)
+
+    def test_unmount_compacts_before_upload(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        storage_path = os.path.join(self.root, "storage")
+        session = mount_browserstate_session(
+            user_id="user", session_id="session", storage_path=storage_path,
+            temp_dir=os.path.join(self.root, "mounts"), compact=ProfileCompactor(min_bytes=0),
+        )
+        shutil.rmtree(session.path)
+        shutil.copytree(self.profile, session.path)
+        path, connection = self._database()
+        connection.close()
+        shutil.copy2(path, os.path.join(session.path, "Default", "History"))
+        session.unmount()
+
+        self.assertGreater(session.compacted_bytes, 1024 * 1024)
+        stored = os.path.join(storage_path, "user", "session", "Default", "History")
+        self.assertEqual(os.path.getsize(stored), os.path.getsize(path) - session.compacted_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
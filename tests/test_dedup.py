@@ -0,0 +1,225 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestDedupStorage(unittest.TestCase):
+
+    def setUp(self):
+        from browserstate_nova_adapter import DedupSessionStorage, LocalBlobStore
+
+        self.root = tempfile.mkdtemp()
+        self.blobs = LocalBlobStore(os.path.join(self.root, "blobs"))
+        self.storage = DedupSessionStorage(self.blobs, compression="gzip", chunk_size=64 * 1024)
+        self.component = os.urandom(200 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _profile(self, name, cookies):
+        path = os.path.join(self.root, name)
+        _write(os.path.join(path, "Default", "Cookies"), cookies)
+        _write(os.path.join(path, "WidevineCdm", "libwidevinecdm.so"), self.component)
+        os.makedirs(os.path.join(path, "Default", "blob_storage"))
+        return path
+
+    def test_identical_files_are_stored_once(self):
+        self.storage.upload("alice", "default", self._profile("alice", b"alice"))
+        chunks = self.blobs.list("chunks/")
+        # 200 KiB in 64 KiB chunks
+        self.assertEqual(len(chunks), 4)
+
+        self.storage.upload("bob", "default", self._profile("bob", b"bob"))
+        self.assertEqual(self.blobs.list("chunks/"), chunks)
+
+    def test_round_trip(self):
+        source = self._profile("source", b"cookies")
+        _write(os.path.join(source, "Default", "History"), b"h" * 10000)
+        os.utime(os.path.join(source, "Default", "History"), ns=(1_600_000_000_000_000_123,) * 2)
+        version = self.storage.upload("alice", "default", source)
+        self.assertEqual(self.storage.get_version("alice", "default"), version)
+
+        target = os.path.join(self.root, "target")
+        self.assertEqual(self.storage.download("alice", "default", target), version)
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), b"cookies")
+        self.assertEqual(_read(os.path.join(target, "Default", "History")), b"h" * 10000)
+        self.assertEqual(_read(os.path.join(target, "WidevineCdm", "libwidevinecdm.so")), self.component)
+        self.assertEqual(os.stat(os.path.join(target, "Default", "History")).st_mtime_ns, 1_600_000_000_000_000_123)
+        self.assertTrue(os.path.isdir(os.path.join(target, "Default", "blob_storage")))
+
+    def test_unchanged_files_are_not_read_again(self):
+        from browserstate_nova_adapter import ChunkStore
+
+        source = self._profile("source", b"cookies")
+        self.storage.upload("alice", "default", source)
+        with patch.object(ChunkStore, "add") as add:
+            self.storage.upload("alice", "default", source)
+        add.assert_not_called()
+
+    def test_unreferenced_chunks_are_collected(self):
+        source = self._profile("alice", b"alice")
+        self.storage.upload("alice", "default", source)
+        self.storage.upload("bob", "default", self._profile("bob", b"bob"))
+
+        _write(os.path.join(source, "WidevineCdm", "libwidevinecdm.so"), os.urandom(100 * 1024))
+        self.storage.upload("alice", "default", source)
+        # bob still references the old component, alice added two new chunks
+        self.assertEqual(len(self.blobs.list("chunks/")), 6)
+
+        self.assertTrue(self.storage.delete("bob", "default"))
+        self.assertEqual(len(self.blobs.list("chunks/")), 2)
+        self.assertTrue(self.storage.delete("alice", "default"))
+        self.assertEqual(self.blobs.list("chunks/"), [])
+        self.assertEqual(self.blobs.list("refs/"), [])
+        self.assertFalse(self.storage.delete("alice", "default"))
+
+    def test_failed_upload_releases_its_references(self):
+        self.storage.upload("alice", "default", self._profile("alice", b"alice"))
+        chunks = self.blobs.list("chunks/")
+        refs = {key: self.blobs.get(key) for key in self.blobs.list("refs/")}
+
+        bob = self._profile("bob", b"bob")
+        _write(os.path.join(bob, "extra.bin"), os.urandom(100 * 1024))
+        with patch.object(type(self.storage), "_manifest_key", side_effect=[
+            "sessions/bob/default/manifest.json", IOError("offline")
+        ]):
+            with self.assertRaises(IOError):
+                self.storage.upload("bob", "default", bob)
+        self.assertEqual(self.blobs.list("chunks/"), chunks)
+        self.assertEqual({key: self.blobs.get(key) for key in self.blobs.list("refs/")}, refs)
+
+    def test_failed_chunk_write_releases_its_reference(self):
+        from browserstate_nova_adapter import ChunkStore
+
+        chunks = ChunkStore(self.blobs, compression="gzip")
+        real_put = self.blobs.put
+
+        def put(key, data):
+            if key.startswith("chunks/"):
+                raise IOError("disk full")
+            return real_put(key, data)
+
+        with patch.object(self.blobs, "put", side_effect=put):
+            with self.assertRaises(IOError):
+                chunks.add(self.component)
+        self.assertEqual(self.blobs.list("refs/"), [])
+        # A later add stores the chunk with a single reference
+        digest = chunks.add(self.component)
+        self.assertEqual(self.blobs.get(f"refs/{digest[:2]}/{digest}"), b"1")
+        self.assertEqual(list(chunks.get_many([digest])), [self.component])
+
+    def test_concurrent_add_does_not_depend_on_the_first_write(self):
+        import threading
+        from browserstate_nova_adapter import ChunkStore
+
+        chunks = ChunkStore(self.blobs, compression="gzip")
+        real_put = self.blobs.put
+        writing = threading.Event()
+        second_added = threading.Event()
+
+        def put(key, data):
+            if key.startswith("chunks/") and not writing.is_set():
+                # The first adder stalls mid-write and then fails
+                writing.set()
+                second_added.wait(timeout=5)
+                raise IOError("connection reset")
+            return real_put(key, data)
+
+        errors = []
+
+        def first():
+            try:
+                chunks.add(self.component)
+            except IOError as e:
+                errors.append(e)
+
+        with patch.object(self.blobs, "put", side_effect=put):
+            thread = threading.Thread(target=first)
+            thread.start()
+            self.assertTrue(writing.wait(timeout=5))
+            digest = chunks.add(self.component)
+            # Returned only once the chunk it references exists
+            self.assertTrue(self.blobs.exists(f"chunks/{digest[:2]}/{digest}"))
+            second_added.set()
+            thread.join(timeout=5)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.blobs.get(f"refs/{digest[:2]}/{digest}"), b"1")
+        self.assertEqual(list(chunks.get_many([digest])), [self.component])
+
+    def test_corrupt_chunk_is_detected(self):
+        self.storage.upload("alice", "default", self._profile("alice", b"alice"))
+        self.blobs.put(self.blobs.list("chunks/")[0], b"Ngarbage")
+        with self.assertRaises(IOError):
+            self.storage.download("alice", "default", os.path.join(self.root, "target"))
+
+    def test_dedup_storage_format(self):
+        from browserstate_nova_adapter import create_session_config, with_browserstate
+
+        storage_path = os.path.join(self.root, "storage")
+        for user_id in ("alice", "bob"):
+            config = create_session_config(
+                user_id=user_id,
+                session_id="default",
+                storage_path=storage_path,
+                temp_dir=os.path.join(self.root, "mounts"),
+                storage_format="dedup",
+            )
+            with with_browserstate(**config) as user_data_dir:
+                _write(os.path.join(user_data_dir, "WidevineCdm", "libwidevinecdm.so"), self.component)
+            with with_browserstate(**config) as user_data_dir:
+                self.assertEqual(_read(os.path.join(user_data_dir, "WidevineCdm", "libwidevinecdm.so")), self.component)
+
+        chunk_dir = os.path.join(storage_path, ".nova-dedup", "chunks")
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(chunk_dir)), 1)
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisDedup(unittest.TestCase):
+
+    def test_shared_chunks_and_collection(self):
+        from browserstate_nova_adapter import DedupSessionStorage, RedisBlobStore
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "component.bin"), os.urandom(50 * 1024))
+
+        client = fakeredis.FakeRedis()
+        blobs = RedisBlobStore(client, "browserstate:dedup:", ttl=60)
+        storage = DedupSessionStorage(blobs, compression="gzip", chunk_size=16 * 1024)
+        storage.upload("alice", "default", source)
+        storage.upload("bob", "default", source)
+        self.assertEqual(len(blobs.list("chunks/")), 4)
+        self.assertEqual({blobs.get(key) for key in blobs.list("refs/")}, {b"2"})
+        self.assertGreater(client.ttl("browserstate:dedup:" + blobs.list("chunks/")[0]), 0)
+
+        target = os.path.join(root, "target")
+        storage.download("bob", "default", target)
+        self.assertEqual(_read(os.path.join(target, "component.bin")), _read(os.path.join(source, "component.bin")))
+
+        storage.delete("alice", "default")
+        storage.delete("bob", "default")
+        self.assertEqual(blobs.list(""), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
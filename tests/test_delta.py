@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_diff_manifests(self):
+        from browserstate_nova_adapter.manifest import build_manifest, diff_manifests
+
+        _write(os.path.join(self.root, "Default", "Cookies"), "a")
+        _write(os.path.join(self.root, "Default", "History"), "b")
+        _write(os.path.join(self.root, "Local State"), "c")
+        before = build_manifest(self.root)
+        self.assertEqual(sorted(before), ["Default/Cookies", "Default/History", "Local State"])
+
+        _write(os.path.join(self.root, "Default", "Cookies"), "changed")
+        os.remove(os.path.join(self.root, "Default", "History"))
+        _write(os.path.join(self.root, "Default", "Preferences"), "new")
+        # Rewritten with identical content: not a change
+        _write(os.path.join(self.root, "Local State"), "c")
+
+        diff = diff_manifests(before, build_manifest(self.root, before))
+        self.assertEqual(diff.changed, ["Default/Cookies", "Default/Preferences"])
+        self.assertEqual(diff.deleted, ["Default/History"])
+        self.assertFalse(diff_manifests(before, before))
+
+    def test_unchanged_files_are_not_rehashed(self):
+        from browserstate_nova_adapter import manifest
+
+        _write(os.path.join(self.root, "Cookies"), "a")
+        before = manifest.build_manifest(self.root)
+        with patch.object(manifest, "hash_file") as hash_file:
+            self.assertEqual(manifest.build_manifest(self.root, before), before)
+            hash_file.assert_not_called()
+
+
+class TestDeltaUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+        self.stored = os.path.join(self.storage_path, "user", "session")
+        _write(os.path.join(self.stored, "Default", "Cookies"), "old-cookies")
+        _write(os.path.join(self.stored, "Default", "History"), "history")
+        _write(os.path.join(self.stored, "Default", "Cache", "blob"), "x" * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            delta=True,
+        )
+
+    def test_only_changes_are_uploaded(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        with patch.object(LocalSessionStorage, "upload", autospec=True) as full_upload:
+            with with_browserstate(**self._config()) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Default", "Cookies"), "new-cookies")
+                _write(os.path.join(user_data_dir, "Default", "Preferences"), "prefs")
+                os.remove(os.path.join(user_data_dir, "Default", "History"))
+            full_upload.assert_not_called()
+
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Cookies")), "new-cookies")
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Preferences")), "prefs")
+        self.assertFalse(os.path.exists(os.path.join(self.stored, "Default", "History")))
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Cache", "blob")), "x" * 1000)
+
+    def test_unchanged_session_skips_upload(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        with patch.object(LocalSessionStorage, "upload", autospec=True) as full_upload, \
+                patch.object(LocalSessionStorage, "upload_changes", autospec=True) as upload_changes:
+            with with_browserstate(**self._config()):
+                pass
+            full_upload.assert_not_called()
+            upload_changes.assert_not_called()
+
+    def test_falls_back_to_full_upload_when_base_changed(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        session = mount_browserstate_session(**self._config())
+        _write(os.path.join(session.path, "Default", "Cookies"), "mine")
+
+        # Someone else uploads the session while it is mounted here
+        other = os.path.join(self.root, "other")
+        _write(os.path.join(other, "Default", "Other"), "theirs")
+        LocalSessionStorage(self.storage_path).upload("user", "session", other)
+
+        session.unmount()
+        # The full upload replaced the session with this mount's profile
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Cookies")), "mine")
+        self.assertFalse(os.path.exists(os.path.join(self.stored, "Default", "Other")))
+        self.assertFalse(os.path.exists(session.path))
+
+    def test_failed_upload_keeps_the_profile(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        session = mount_browserstate_session(**self._config())
+        _write(os.path.join(session.path, "Default", "Cookies"), "unsaved")
+        with patch.object(LocalSessionStorage, "upload_changes", side_effect=IOError("network down")):
+            with self.assertRaises(IOError):
+                session.unmount()
+        self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), "unsaved")
+
+        session = mount_browserstate_session(**dict(self._config(), session_id="other"))
+        _write(os.path.join(session.path, "Default", "Cookies"), "unsaved")
+        with patch.object(LocalSessionStorage, "upload", side_effect=IOError("network down")):
+            with self.assertRaises(IOError):
+                session.unmount(discard_on_error=True)
+        self.assertFalse(os.path.exists(session.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+def _write(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _files(root):
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            found.append(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/"))
+    return sorted(found)
+
+
+PROFILE_FILES = [
+    "Local State",
+    "Default/Cookies",
+    "Default/Network/Cookies",
+    "Default/Preferences",
+    "Default/History",
+    "Default/Local Storage/leveldb/000003.log",
+    "Default/IndexedDB/https_example.com_0.indexeddb.leveldb/CURRENT",
+    "Default/Cache/Cache_Data/data_0",
+    "Default/Code Cache/js/index",
+    "Default/Service Worker/CacheStorage/abc/index",
+    "Default/Service Worker/Database/CURRENT",
+    "GPUCache/data_0",
+]
+
+
+class TestProfileFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for rel_path in PROFILE_FILES:
+            _write(os.path.join(self.root, *rel_path.split("/")), "x" * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_without_caches(self):
+        from browserstate_nova_adapter import ProfileFilter
+
+        removed = ProfileFilter.without_caches().prune(self.root)
+
+        self.assertEqual(removed, 40)
+        self.assertEqual(_files(self.root), [
+            "Default/Cookies",
+            "Default/History",
+            "Default/IndexedDB/https_example.com_0.indexeddb.leveldb/CURRENT",
+            "Default/Local Storage/leveldb/000003.log",
+            "Default/Network/Cookies",
+            "Default/Preferences",
+            "Default/Service Worker/Database/CURRENT",
+            "Local State",
+        ])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "Default", "Cache")))
+
+    def test_auth_state_only(self):
+        from browserstate_nova_adapter import ProfileFilter
+
+        ProfileFilter.auth_state_only().prune(self.root)
+
+        self.assertEqual(_files(self.root), [
+            "Default/Cookies",
+            "Default/IndexedDB/https_example.com_0.indexeddb.leveldb/CURRENT",
+            "Default/Local Storage/leveldb/000003.log",
+            "Default/Network/Cookies",
+            "Default/Preferences",
+            "Local State",
+        ])
+
+    def test_anchored_patterns(self):
+        from browserstate_nova_adapter import ProfileFilter
+
+        profile_filter = ProfileFilter(exclude=["/Default/History", "*.log"])
+        self.assertFalse(profile_filter.matches("Default/History"))
+        self.assertTrue(profile_filter.matches("Other/Default/History"))
+        self.assertFalse(profile_filter.matches("Default/Local Storage/leveldb/000003.log"))
+        self.assertTrue(profile_filter.excludes_directory("Default/History"))
+
+    def test_filtered_direct_download(self):
+        from browserstate_nova_adapter import ProfileFilter
+        from browserstate_nova_adapter.storage import LocalSessionStorage
+
+        storage_path = os.path.join(self.root, "storage")
+        shutil.copytree(self.root, os.path.join(storage_path, "user", "session"),
+                        ignore=shutil.ignore_patterns("storage"))
+        target = os.path.join(self.root, "target")
+
+        LocalSessionStorage(storage_path).download(
+            "user", "session", target, ProfileFilter.without_caches()
+        )
+        self.assertNotIn("Default/Cache/Cache_Data/data_0", _files(target))
+        self.assertIn("Default/Cookies", _files(target))
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_pruned_before_browserstate_upload(self, mock_browserstate):
+        from browserstate_nova_adapter import ProfileFilter, create_session_config, with_browserstate
+
+        mock_instance = MagicMock()
+        mock_instance.mount_session.return_value = {"path": self.root}
+        seen_at_upload = []
+        mock_instance.unmount_session.side_effect = lambda: seen_at_upload.extend(_files(self.root))
+        mock_browserstate.return_value = mock_instance
+
+        config = create_session_config(
+            user_id="user",
+            session_id="session",
+            profile_filter=ProfileFilter.auth_state_only()
+        )
+        with with_browserstate(**config) as user_data_dir:
+            # Nova fills the cache again while the session is mounted
+            _write(os.path.join(user_data_dir, "Default", "Cache", "Cache_Data", "data_1"))
+
+        self.assertNotIn("Default/Cache/Cache_Data/data_1", seen_at_upload)
+        self.assertNotIn("Default/History", seen_at_upload)
+        self.assertIn("Default/Cookies", seen_at_upload)
+
+
+if __name__ == '__main__':
+    unittest.main()
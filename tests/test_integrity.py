@@ -0,0 +1,288 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.storage import ArchiveSessionStorage, DedupSessionStorage, LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestVerifyProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_detects_missing_truncated_and_changed_files(self):
+        from browserstate_nova_adapter.filters import ProfileFilter
+        from browserstate_nova_adapter.integrity import create_record, verify_profile
+        from browserstate_nova_adapter.manifest import build_manifest
+
+        _write(os.path.join(self.root, "Default", "Cookies"), "logged-in")
+        _write(os.path.join(self.root, "Default", "History"), "visited")
+        _write(os.path.join(self.root, "Default", "Cache", "data_0"), "cached")
+        record = create_record(build_manifest(self.root), "v1")
+
+        manifest, problems = verify_profile(self.root, record)
+        self.assertEqual(problems, [])
+        self.assertEqual(set(manifest), {"Default/Cookies", "Default/History", "Default/Cache/data_0"})
+
+        # Files that were not downloaded are not expected
+        shutil.rmtree(os.path.join(self.root, "Default", "Cache"))
+        _, problems = verify_profile(self.root, record, ProfileFilter.without_caches())
+        self.assertEqual(problems, [])
+        _, problems = verify_profile(self.root, record)
+        self.assertEqual(problems, ["Default/Cache/data_0"])
+
+        _write(os.path.join(self.root, "Default", "Cookies"), "logged-")
+        _write(os.path.join(self.root, "Default", "History"), "VISITED")
+        _, problems = verify_profile(self.root, record, ProfileFilter.without_caches())
+        self.assertEqual(problems, ["Default/Cookies"])
+        _write(os.path.join(self.root, "Default", "Cookies"), "logged-in")
+        _, problems = verify_profile(self.root, record, ProfileFilter.without_caches())
+        self.assertEqual(problems, ["Default/History"])
+
+    def test_unchanged_files_are_not_hashed(self):
+        from browserstate_nova_adapter.integrity import create_record, verify_profile
+        from browserstate_nova_adapter.manifest import build_manifest
+
+        _write(os.path.join(self.root, "Default", "Cookies"), "logged-in")
+        _write(os.path.join(self.root, "Default", "History"), "visited")
+        record = create_record(build_manifest(self.root), "v1")
+        stat = os.stat(os.path.join(self.root, "Default", "History"))
+        _write(os.path.join(self.root, "Default", "History"), "VISITED")
+        os.utime(os.path.join(self.root, "Default", "History"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        with patch("browserstate_nova_adapter.manifest.hash_file", wraps=lambda path: "x") as hash_file:
+            manifest, problems = verify_profile(self.root, record)
+        self.assertEqual(hash_file.call_count, 1)
+        self.assertEqual(problems, ["Default/History"])
+        self.assertEqual(manifest["Default/Cookies"].digest, record["files"]["Default/Cookies"][1])
+
+
+class TestMountVerification(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+        self.stored = os.path.join(self.storage_path, "user", "session")
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self, **kwargs):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            **kwargs
+        )
+
+    def _save(self, cookies, **kwargs):
+        from browserstate_nova_adapter import with_browserstate
+
+        with with_browserstate(**self._config(**kwargs)) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), cookies)
+            _write(os.path.join(user_data_dir, "Default", "History"), "visited")
+
+    def test_record_is_written_last(self):
+        from browserstate_nova_adapter import create_session_storage, mount_browserstate_session
+
+        self._save("first", delta=True)
+        storage = LocalSessionStorage(self.storage_path)
+        integrity = create_session_storage(storage_path=self.storage_path).integrity
+        record = integrity.read("user", "session")
+        self.assertEqual(record["version"], storage.get_version("user", "session"))
+        self.assertEqual(sorted(record["files"]), ["Default/Cookies", "Default/History"])
+
+        session = mount_browserstate_session(**self._config(delta=True))
+        self.assertIsNotNone(session._verified_record)
+        # The verification pass doubles as the delta manifest
+        self.assertEqual(set(session._manifest), {"Default/Cookies", "Default/History"})
+        _write(os.path.join(session.path, "Default", "Cookies"), "second")
+        session.unmount()
+        self.assertEqual(integrity.read("user", "session", previous=True)["version"], record["version"])
+        self.assertEqual(
+            integrity.read("user", "session")["version"], storage.get_version("user", "session")
+        )
+
+    def test_corrupt_session_falls_back_to_previous_generation(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        self._save("first")
+        self._save("second")
+        with open(os.path.join(self.stored, "Default", "Cookies"), "w") as f:
+            f.write("garbage!")
+
+        with self.assertLogs(level="WARNING") as logs:
+            with with_browserstate(**self._config()) as user_data_dir:
+                self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "first")
+        self.assertIn("Default/Cookies", logs.output[0])
+        # The intact generation was uploaded again
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Cookies")), "first")
+
+    def test_interrupted_upload_is_detected(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        self._save("first", delta=True)
+        self._save("second", delta=True)
+        session = mount_browserstate_session(**self._config(delta=True))
+        _write(os.path.join(session.path, "Default", "Cookies"), "third")
+        _write(os.path.join(session.path, "Default", "History"), "more")
+        real_replace = os.replace
+        calls = []
+
+        def crash_after_first_file(source, destination):
+            if source.endswith(".upload"):
+                calls.append(destination)
+                if len(calls) > 1:
+                    raise KeyboardInterrupt
+            real_replace(source, destination)
+
+        with patch("browserstate_nova_adapter.storage.os.replace", crash_after_first_file):
+            with self.assertRaises(KeyboardInterrupt):
+                session.unmount()
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "Cookies")), "third")
+        self.assertEqual(_read(os.path.join(self.stored, "Default", "History")), "visited")
+
+        session = mount_browserstate_session(**self._config(delta=True))
+        # Half of the interrupted upload is discarded together with it
+        self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), "second")
+        self.assertEqual(_read(os.path.join(session.path, "Default", "History")), "visited")
+        session.unmount()
+
+    def test_finished_upload_without_final_record_is_accepted(self):
+        from browserstate_nova_adapter import IntegrityStore, with_browserstate
+
+        self._save("first")
+        real_write = IntegrityStore.write
+
+        def lose_final_record(store, user_id, session_id, record, previous=False):
+            if record["version"] is not None and not previous:
+                raise KeyboardInterrupt
+            real_write(store, user_id, session_id, record, previous)
+
+        with patch.object(IntegrityStore, "write", lose_final_record):
+            with self.assertRaises(KeyboardInterrupt):
+                self._save("second")
+        with with_browserstate(**self._config()) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "second")
+
+    def test_no_intact_generation(self):
+        from browserstate_nova_adapter import IntegrityError, mount_browserstate_session
+
+        self._save("first")
+        os.remove(os.path.join(self.stored, "Default", "History"))
+        with self.assertRaises(IntegrityError):
+            mount_browserstate_session(**self._config())
+        self.assertEqual([name for _, _, names in os.walk(os.path.join(self.root, "mounts")) for name in names], [])
+
+        # Opting out mounts whatever is stored
+        session = mount_browserstate_session(**self._config(verify=False))
+        self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), "first")
+        session.unmount()
+
+    def test_sessions_written_elsewhere_are_not_checked(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        self._save("first")
+        # Replaced outside the adapter, e.g. by BrowserState
+        shutil.rmtree(self.stored)
+        _write(os.path.join(self.stored, "Default", "Cookies"), "external")
+        with with_browserstate(**self._config()) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "external")
+
+    def test_browserstate_mounts_are_verified(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        self._save("first")
+        self._save("second")
+        # Records written by a mount through BrowserState describe the same storage
+        with with_browserstate(user_id="user", session_id="session", storage_path=self.storage_path) as path:
+            self.assertEqual(_read(os.path.join(path, "Default", "Cookies")), "second")
+            _write(os.path.join(path, "Default", "Cookies"), "third")
+        with open(os.path.join(self.stored, "Default", "History"), "w") as f:
+            f.write("garbage")
+        with with_browserstate(**self._config()) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "second")
+
+    def test_packed_formats_fall_back(self):
+        from browserstate_nova_adapter import create_blob_store, with_browserstate
+
+        for storage_format in ("archive", "dedup"):
+            with self.subTest(storage_format=storage_format):
+                config = self._config(storage_format=storage_format, format_options={"compression": "gzip"})
+                for cookies in ("first", "second"):
+                    with with_browserstate(**config) as user_data_dir:
+                        _write(os.path.join(user_data_dir, "Default", "Cookies"), cookies * 5000)
+                blobs = create_blob_store("local", self.storage_path, namespace=storage_format)
+                if storage_format == "archive":
+                    index = ArchiveSessionStorage(blobs).read_index("user", "session")
+                    blobs.delete(index["chunks"][:1])
+                else:
+                    manifest = DedupSessionStorage(blobs).read_manifest("user", "session")
+                    digest = next(entry["chunks"][0] for entry in manifest["files"] if "chunks" in entry)
+                    blobs.put(f"chunks/{digest[:2]}/{digest}", b"N" + b"x" * 10)
+
+                with with_browserstate(**config) as user_data_dir:
+                    content = _read(os.path.join(user_data_dir, "Default", "Cookies"))
+                    self.assertEqual(content, "first" * 5000)
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisGenerations(unittest.TestCase):
+
+    def test_previous_generation_is_kept(self):
+        from browserstate_nova_adapter import create_session_storage
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        storage = create_session_storage(
+            "redis", redis_options={"key_prefix": "test", "ttl": 60}, redis_client=fakeredis.FakeRedis()
+        )
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cookies"), "first")
+        storage.upload("user", "session", source)
+        self.assertTrue(storage.keep_previous("user", "session"))
+        _write(os.path.join(source, "Default", "Cookies"), "second")
+        storage.upload("user", "session", source)
+
+        target = os.path.join(root, "target")
+        self.assertTrue(storage.download_previous("user", "session", target))
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), "first")
+        self.assertGreater(storage.client.ttl(storage.previous_key("user", "session")), 0)
+        self.assertFalse(storage.download_previous("user", "other", os.path.join(root, "other")))
+
+        storage.integrity.write("user", "session", {"version": "v", "files": {}})
+        self.assertEqual(storage.integrity.read("user", "session")["version"], "v")
+        self.assertIs(storage.integrity.blobs.client, storage.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter import storage as storage_module
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestLazyMount(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self, **kwargs):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=os.path.join(self.root, "storage"),
+            temp_dir=os.path.join(self.root, "mounts"),
+            **kwargs
+        )
+
+    def _seed(self, **kwargs):
+        from browserstate_nova_adapter import with_browserstate
+
+        with with_browserstate(**self._config(**kwargs)) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "logged-in")
+            _write(os.path.join(user_data_dir, "Default", "History"), "visited")
+            _write(os.path.join(user_data_dir, "Default", "Extensions", "ext", "manifest.json"), "{}")
+
+    def _held_merge(self):
+        # Keeps the background download from moving its files in until released
+        real_merge = storage_module._merge_into
+
+        def merge(source, target):
+            self.release.wait(10)
+            real_merge(source, target)
+
+        return patch.object(storage_module, "_merge_into", merge)
+
+    def test_critical_files_first(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        for storage_format in ("browserstate", "archive", "dedup"):
+            with self.subTest(storage_format=storage_format):
+                self.release.clear()
+                self._seed(storage_format=storage_format)
+                with self._held_merge():
+                    session = mount_browserstate_session(**self._config(storage_format=storage_format, lazy=True))
+                    self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), "logged-in")
+                    self.assertFalse(os.path.exists(os.path.join(session.path, "Default", "History")))
+                    self.assertFalse(session.wait_hydrated(timeout=0.05))
+
+                    self.release.set()
+                    self.assertTrue(session.wait_hydrated(timeout=10))
+                self.assertEqual(_read(os.path.join(session.path, "Default", "History")), "visited")
+                self.assertTrue(os.path.exists(os.path.join(session.path, "Default", "Extensions", "ext", "manifest.json")))
+                self.assertEqual([p for p in os.listdir(os.path.join(self.root, "mounts")) if p.endswith(".hydrate")], [])
+                session.unmount()
+
+    def test_browser_writes_win(self):
+        from browserstate_nova_adapter import with_browserstate, wait_hydrated
+
+        self._seed()
+        with self._held_merge():
+            with with_browserstate(**self._config(lazy=True)) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Default", "History"), "new tab")
+                self.release.set()
+                self.assertTrue(wait_hydrated(user_data_dir, timeout=10))
+                self.assertEqual(_read(os.path.join(user_data_dir, "Default", "History")), "new tab")
+
+        stored = os.path.join(self.root, "storage", "user", "session", "Default")
+        self.assertEqual(_read(os.path.join(stored, "History")), "new tab")
+        self.assertEqual(_read(os.path.join(stored, "Cookies")), "logged-in")
+
+    def test_unmount_waits_for_hydration(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        self._seed(delta=True)
+        with self._held_merge():
+            session = mount_browserstate_session(**self._config(lazy=True, delta=True))
+            _write(os.path.join(session.path, "Default", "Cookies"), "refreshed")
+            threading.Timer(0.05, self.release.set).start()
+            session.unmount()
+
+        stored = os.path.join(self.root, "storage", "user", "session", "Default")
+        self.assertEqual(_read(os.path.join(stored, "Cookies")), "refreshed")
+        # Files that arrived in the background are still stored
+        self.assertEqual(_read(os.path.join(stored, "History")), "visited")
+        self.assertTrue(os.path.exists(os.path.join(stored, "Extensions", "ext", "manifest.json")))
+
+    def test_failed_hydration_is_not_uploaded(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        self._seed()
+
+        def broken_merge(source, target):
+            raise IOError("disk full")
+
+        with patch.object(storage_module, "_merge_into", broken_merge):
+            session = mount_browserstate_session(**self._config(lazy=True))
+            with self.assertRaises(IOError):
+                session.wait_hydrated(timeout=10)
+            with self.assertRaises(IOError):
+                session.unmount()
+
+        self.assertFalse(os.path.exists(session.path))
+        stored = os.path.join(self.root, "storage", "user", "session", "Default")
+        self.assertEqual(_read(os.path.join(stored, "History")), "visited")
+
+    def test_custom_critical_set_and_new_session(self):
+        from browserstate_nova_adapter import ProfileFilter, mount_browserstate_session
+
+        session = mount_browserstate_session(**self._config(lazy=True))
+        self.assertTrue(session.wait_hydrated(timeout=0))
+        session.unmount()
+
+        self._seed()
+        with self._held_merge():
+            session = mount_browserstate_session(**self._config(lazy=ProfileFilter(include=("History",))))
+            self.assertTrue(os.path.exists(os.path.join(session.path, "Default", "History")))
+            self.assertFalse(os.path.exists(os.path.join(session.path, "Default", "Cookies")))
+            self.release.set()
+            session.wait_hydrated(timeout=10)
+        self.assertEqual(_read(os.path.join(session.path, "Default", "Cookies")), "logged-in")
+
+    def test_unknown_path(self):
+        from browserstate_nova_adapter import wait_hydrated
+
+        with self.assertRaises(ValueError):
+            wait_hydrated(os.path.join(self.root, "nothing"))
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisLazyDownload(unittest.TestCase):
+
+    def test_fetches_once(self):
+        from browserstate_nova_adapter import ProfileFilter, RedisSessionStorage
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        storage = RedisSessionStorage({"key_prefix": "test", "ttl": 60}, client=fakeredis.FakeRedis())
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cookies"), "logged-in")
+        _write(os.path.join(source, "Default", "History"), "visited")
+        version = storage.upload("user", "session", source)
+
+        target = os.path.join(root, "target")
+        with patch.object(storage.client, "getrange", wraps=storage.client.getrange) as getrange:
+            downloaded, download_rest = storage.download_lazily(
+                "user", "session", target, ProfileFilter.auth_state_only()
+            )
+            self.assertEqual(downloaded, version)
+            self.assertEqual(os.listdir(os.path.join(target, "Default")), ["Cookies"])
+            staged = []
+            download_rest(staged.append)
+        self.assertEqual(getrange.call_count, 1)
+        self.assertEqual(len(staged), 1)
+        self.assertEqual(_read(os.path.join(target, "Default", "History")), "visited")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.lease import LocalLeaseStore, RedisLeaseStore, acquire_lease
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestLocalLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = LocalLeaseStore(os.path.join(self.root, "leases"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_exclusive_until_released(self):
+        from browserstate_nova_adapter import LeaseTimeoutError
+
+        lease = acquire_lease(self.store, "user/session", ttl=5)
+        with self.assertRaises(LeaseTimeoutError):
+            acquire_lease(self.store, "user/session", ttl=5, timeout=0.1)
+        other = acquire_lease(self.store, "user/other", ttl=5, timeout=0)
+        lease.release()
+        lease.release()
+        again = acquire_lease(self.store, "user/session", ttl=5, timeout=0)
+        # Fencing numbers keep growing across releases
+        self.assertEqual((lease.fence, again.fence, other.fence), (1, 2, 1))
+        again.release()
+        other.release()
+
+    def test_waiter_is_woken_on_release(self):
+        lease = acquire_lease(self.store, "user/session", ttl=30)
+        granted = []
+
+        def wait():
+            granted.append(acquire_lease(self.store, "user/session", ttl=30, timeout=10))
+
+        thread = threading.Thread(target=wait)
+        with patch.object(self.store, "try_acquire", wraps=self.store.try_acquire) as try_acquire:
+            thread.start()
+            time.sleep(0.2)
+            started = time.monotonic()
+            lease.release()
+            thread.join()
+        self.assertLess(time.monotonic() - started, 0.4)
+        # Waiting, not spinning
+        self.assertLessEqual(try_acquire.call_count, 3)
+        self.assertEqual(granted[0].fence, 2)
+        granted[0].release()
+
+    def test_expired_lease_is_taken_over(self):
+        from browserstate_nova_adapter import LeaseLostError
+
+        lease = acquire_lease(self.store, "user/session", ttl=0.1)
+        # A worker that stopped renewing
+        from browserstate_nova_adapter.lease import _heartbeat
+        _heartbeat.remove(lease)
+        time.sleep(0.2)
+        successor = acquire_lease(self.store, "user/session", ttl=5, timeout=0)
+        with self.assertRaises(LeaseLostError):
+            lease.check()
+        self.assertTrue(lease.lost)
+        lease.release()
+        # Releasing the lost lease leaves the successor alone
+        successor.check()
+        successor.release()
+
+    def test_heartbeat_renews(self):
+        lease = acquire_lease(self.store, "user/session", ttl=0.3)
+        time.sleep(0.7)
+        lease.check()
+        self.assertFalse(lease.lost)
+        lease.release()
+
+
+class TestMountLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            try:
+                session.unmount()
+            except Exception:
+                pass
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _mount(self, **kwargs):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        return mount_browserstate_session(
+            user_id="user",
+            session_id="session",
+            storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            lease=True,
+            **kwargs
+        )
+
+    def test_second_mount_waits_for_unmount(self):
+        from browserstate_nova_adapter import LeaseTimeoutError
+
+        for options in ({}, {"delta": True}):
+            with self.subTest(**options):
+                session = self._mount(**options)
+                self.assertEqual(session.lease.key, "user/session")
+                with self.assertRaises(LeaseTimeoutError):
+                    self._mount(lease_options={"timeout": 0.1}, **options)
+                _write(os.path.join(session.path, "Default", "Cookies"), "first")
+                session.unmount()
+
+                second = self._mount(lease_options={"timeout": 1}, **options)
+                self.assertEqual(_read(os.path.join(second.path, "Default", "Cookies")), "first")
+                self.assertGreater(second.lease.fence, session.lease.fence)
+                second.unmount()
+
+    def test_lost_lease_is_not_uploaded(self):
+        from browserstate_nova_adapter import LeaseLostError, create_session_storage
+
+        session = self._mount(lease_options={"ttl": 0.1})
+        _write(os.path.join(session.path, "Default", "Cookies"), "stale")
+        from browserstate_nova_adapter.lease import _heartbeat
+        _heartbeat.remove(session.lease)
+        time.sleep(0.2)
+        successor = self._mount(lease_options={"timeout": 0})
+        _write(os.path.join(successor.path, "Default", "Cookies"), "current")
+        successor.unmount()
+
+        with self.assertRaises(LeaseLostError):
+            session.unmount()
+        self.assertFalse(os.path.exists(session.path))
+        storage = create_session_storage(storage_path=self.storage_path)
+        self.assertEqual(
+            _read(os.path.join(storage.session_path("user", "session"), "Default", "Cookies")), "current"
+        )
+
+    def test_unsupported_provider(self):
+        from browserstate_nova_adapter import create_lease_store
+
+        with self.assertRaises(ValueError):
+            create_lease_store("s3")
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisLeases(unittest.TestCase):
+
+    def test_set_nx_with_fencing(self):
+        from browserstate_nova_adapter import LeaseLostError, LeaseTimeoutError
+
+        client = fakeredis.FakeRedis()
+        store = RedisLeaseStore(client, "test:nova-lease:")
+        lease = acquire_lease(store, "user/session", ttl=5)
+        self.assertGreater(client.pttl("test:nova-lease:user/session"), 0)
+        with self.assertRaises(LeaseTimeoutError):
+            acquire_lease(store, "user/session", ttl=5, timeout=0.1)
+
+        granted = []
+        thread = threading.Thread(
+            target=lambda: granted.append(acquire_lease(store, "user/session", ttl=5, timeout=5))
+        )
+        thread.start()
+        time.sleep(0.2)
+        lease.release()
+        thread.join()
+        self.assertEqual((lease.fence, granted[0].fence), (1, 2))
+        self.assertFalse(store.renew("user/session", "someone-else", 5))
+
+        client.delete("test:nova-lease:user/session")
+        with self.assertRaises(LeaseLostError):
+            granted[0].check()
+        granted[0].release()
+
+
+if __name__ == '__main__':
+    unittest.main()
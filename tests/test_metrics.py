@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.events = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _add_hook(self, hook):
+        from browserstate_nova_adapter import add_metrics_hook, remove_metrics_hook
+
+        add_metrics_hook(hook)
+        self.addCleanup(remove_metrics_hook, hook)
+
+    def _config(self, **kwargs):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=os.path.join(self.root, "storage"),
+            temp_dir=os.path.join(self.root, "mounts"),
+            **kwargs
+        )
+
+    def test_disabled_without_hooks(self):
+        from browserstate_nova_adapter.metrics import start_operation
+
+        metrics = start_operation("mount", "user", "session", "local", "browserstate")
+        self.assertFalse(metrics.enabled)
+        with metrics.phase("download"):
+            pass
+        metrics.finish()
+
+    def test_callback_receives_phases_and_transfers(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        self._add_hook(self.events.append)
+        with with_browserstate(**self._config(delta=True)) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "x" * 100)
+            _write(os.path.join(user_data_dir, "Local State"), "{}")
+        with with_browserstate(**self._config(delta=True)) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "y" * 10)
+
+        self.assertEqual([event.operation for event in self.events], ["mount", "unmount"] * 2)
+        first_unmount = self.events[1]
+        self.assertEqual((first_unmount.files, first_unmount.bytes), (2, 102))
+        self.assertIn("upload", first_unmount.phases)
+        self.assertIn("manifest", first_unmount.phases)
+        self.assertGreaterEqual(first_unmount.duration, sum(first_unmount.phases.values()))
+
+        second_mount, second_unmount = self.events[2:]
+        self.assertEqual((second_mount.files, second_mount.bytes), (2, 102))
+        self.assertIn("download", second_mount.phases)
+        self.assertEqual((second_unmount.files, second_unmount.bytes), (1, 10))
+        self.assertEqual(second_unmount.provider, "local")
+        self.assertIsNone(second_unmount.error)
+
+    def test_registry_counts_cache_hits(self):
+        from browserstate_nova_adapter import MetricsRegistry, MountCache, with_browserstate
+
+        registry = MetricsRegistry()
+        self._add_hook(registry)
+        cache = MountCache(os.path.join(self.root, "cache"))
+        for _ in range(3):
+            with with_browserstate(**self._config(cache=cache)) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+
+        self.assertEqual(registry.get("operations_total", operation="mount", status="ok"), 3)
+        # The first mount finds nothing in storage, later ones the profile the previous unmount cached
+        self.assertEqual(registry.get("cache_requests_total", result="miss"), 1)
+        self.assertEqual(registry.get("cache_requests_total", result="hit"), 2)
+        self.assertEqual(registry.get("phase_seconds", operation="mount", phase="cache"), 2)
+
+        text = registry.render()
+        self.assertIn("# TYPE browserstate_nova_operation_seconds histogram", text)
+        self.assertIn(
+            'browserstate_nova_operations_total{operation="unmount",provider="local",'
+            'status="ok",storage_format="browserstate"} 3',
+            text,
+        )
+        self.assertIn('le="+Inf"', text)
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_failed_mount_is_reported(self, mock_browserstate):
+        from browserstate_nova_adapter import MetricsRegistry, mount_browserstate
+
+        mock_instance = MagicMock()
+        mock_instance.mount_session.side_effect = IOError("connection refused")
+        mock_browserstate.return_value = mock_instance
+
+        registry = MetricsRegistry()
+        self._add_hook(registry)
+        self._add_hook(self.events.append)
+        with self.assertRaises(IOError):
+            mount_browserstate(user_id="user", session_id="session", provider="redis")
+
+        self.assertIsInstance(self.events[0].error, IOError)
+        self.assertIn("setup", self.events[0].phases)
+        self.assertEqual(registry.get("operations_total", provider="redis", status="error"), 1)
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_logging_hook_and_failing_hooks(self, mock_browserstate):
+        from browserstate_nova_adapter import LoggingHook, with_browserstate
+
+        mock_instance = MagicMock()
+        mock_instance.mount_session.return_value = {"path": os.path.join(self.root, "mounted")}
+        mock_browserstate.return_value = mock_instance
+
+        def broken_hook(metrics):
+            raise RuntimeError("broken")
+
+        self._add_hook(broken_hook)
+        self._add_hook(LoggingHook())
+        with self.assertLogs("browserstate_nova_adapter.metrics", level="INFO") as logs:
+            with with_browserstate(user_id="user", session_id="session"):
+                pass
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn("mount of session session for user user done", logs.output[0])
+        self.assertEqual(logs.records[1].browserstate_metrics["operation"], "unmount")
+
+
+if __name__ == '__main__':
+    unittest.main()
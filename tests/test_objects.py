@@ -0,0 +1,280 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.manifest import ManifestDiff
+from browserstate_nova_adapter.objects import LocalObjectStore, S3ObjectStore
+from browserstate_nova_adapter.storage import ObjectSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _tree(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+class _FilesystemS3Client:
+    """The part of the boto3 S3 client API the adapter uses, backed by a directory."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    class meta:
+        endpoint_url = "file://"
+
+    def __init__(self, root):
+        self.objects = LocalObjectStore(root)
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                listed = sorted(client.objects.list(f"{Bucket}/{Prefix}").items())
+                # Two pages, like a truncated listing
+                middle = len(listed) // 2
+                for page in (listed[:middle], listed[middle:]):
+                    yield {"Contents": [{"Key": key[len(Bucket) + 1:], "Size": size} for key, size in page]}
+
+        return Paginator()
+
+    def get_object(self, Bucket, Key, Range=None):
+        start, end = 0, None
+        if Range is not None:
+            first, last = Range[len("bytes="):].split("-")
+            start, end = int(first), int(last) + 1 if last else None
+        data = self.objects.read(f"{Bucket}/{Key}", start, end)
+        if data is None:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(data)}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects.write(f"{Bucket}/{Key}", Body)
+
+    def delete_objects(self, Bucket, Delete):
+        self.objects.delete(f"{Bucket}/{entry['Key']}" for entry in Delete["Objects"])
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {"UploadId": self.objects.start_multipart(f"{Bucket}/{Key}")}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        return {"ETag": self.objects.write_part(f"{Bucket}/{Key}", UploadId, PartNumber, Body)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = [part["ETag"] for part in MultipartUpload["Parts"]]
+        self.objects.complete_multipart(f"{Bucket}/{Key}", UploadId, parts)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.objects.abort_multipart(f"{Bucket}/{Key}", UploadId)
+
+
+class TestObjectStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = LocalObjectStore(os.path.join(self.root, "bucket"))
+        self.profile = os.path.join(self.root, "profile")
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"logged-in")
+        _write(os.path.join(self.profile, "Default", "Cache", "data_1"), os.urandom(100 * 1024 + 7))
+        _write(os.path.join(self.profile, "Local State"), b"")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_round_trip_in_parts(self):
+        storage = ObjectSessionStorage(self.store, max_concurrency=4, part_size=16 * 1024)
+        with patch.object(self.store, "write_part", wraps=self.store.write_part) as write_part, \
+                patch.object(self.store, "read", wraps=self.store.read) as read:
+            version = storage.upload("user", "session", self.profile)
+            target = os.path.join(self.root, "target")
+            self.assertEqual(storage.download("user", "session", target), version)
+        self.assertEqual(write_part.call_count, 7)
+        self.assertEqual(sum(1 for call in read.call_args_list if call.args[0].endswith("data_1")), 7)
+        self.assertEqual(_tree(target), _tree(self.profile))
+        # The layout BrowserState reads
+        self.assertIn("user/session/Default/Cookies", self.store.list("user/"))
+        self.assertEqual(os.listdir(os.path.join(self.store.root, ".nova-parts")), [])
+
+        os.remove(os.path.join(self.profile, "Default", "Cookies"))
+        new_version = storage.upload("user", "session", self.profile)
+        self.assertNotEqual(new_version, version)
+        self.assertNotIn("user/session/Default/Cookies", self.store.list("user/"))
+        self.assertEqual(storage.list_sessions("user"), ["session"])
+        self.assertTrue(storage.delete("user", "session"))
+        self.assertFalse(storage.delete("user", "session"))
+        self.assertIsNone(storage.get_version("user", "session"))
+        self.assertEqual(storage.list_sessions("user"), [])
+
+    def test_transfers_run_in_parallel_up_to_the_limit(self):
+        for number in range(12):
+            _write(os.path.join(self.profile, "Default", "IndexedDB", f"{number}.ldb"), os.urandom(1024))
+        storage = ObjectSessionStorage(self.store, max_concurrency=3, part_size=16 * 1024)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def tracked(func):
+            def call(*args, **kwargs):
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                try:
+                    time.sleep(0.01)
+                    return func(*args, **kwargs)
+                finally:
+                    with lock:
+                        running.pop()
+            return call
+
+        with patch.object(self.store, "write", tracked(self.store.write)), \
+                patch.object(self.store, "write_part", tracked(self.store.write_part)):
+            storage.upload("user", "session", self.profile)
+        self.assertEqual(max(peak), 3)
+
+        peak.clear()
+        with patch.object(self.store, "read", tracked(self.store.read)):
+            storage.download("user", "session", os.path.join(self.root, "target"))
+        self.assertEqual(max(peak), 3)
+
+    def test_failed_part_aborts_the_upload(self):
+        storage = ObjectSessionStorage(self.store, part_size=16 * 1024)
+        version = storage.upload("user", "session", self.profile)
+        _write(os.path.join(self.profile, "Default", "Cache", "data_1"), os.urandom(100 * 1024))
+        real_write_part = self.store.write_part
+
+        def write_part(key, upload_id, number, data):
+            if number == 3:
+                raise IOError("connection reset")
+            return real_write_part(key, upload_id, number, data)
+
+        with patch.object(self.store, "write_part", side_effect=write_part):
+            with self.assertRaises(IOError):
+                storage.upload("user", "session", self.profile)
+        self.assertEqual(os.listdir(os.path.join(self.store.root, ".nova-parts")), [])
+        self.assertEqual(storage.get_version("user", "session"), version)
+
+    def test_upload_changes(self):
+        storage = ObjectSessionStorage(self.store)
+        version = storage.upload("user", "session", self.profile)
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"changed")
+        diff = ManifestDiff(["Default/Cookies"], ["Local State"])
+        with patch.object(self.store, "write", wraps=self.store.write) as write:
+            self.assertIsNone(storage.upload_changes("user", "session", self.profile, diff, "stale"))
+            new_version = storage.upload_changes("user", "session", self.profile, diff, version)
+        # The changed file and the version record
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(storage.get_version("user", "session"), new_version)
+        self.assertEqual(self.store.read("user/session/Default/Cookies"), b"changed")
+        self.assertIsNone(self.store.read("user/session/Local State"))
+
+    def test_sessions_written_by_browserstate(self):
+        storage = ObjectSessionStorage(self.store)
+        self.store.write("user/session/Default/Cookies", b"from browserstate")
+        version = storage.get_version("user", "session")
+        self.assertIsNotNone(version)
+        target = os.path.join(self.root, "target")
+        self.assertEqual(storage.download("user", "session", target), version)
+        self.assertEqual(_tree(target), {"Default/Cookies": b"from browserstate"})
+        self.store.write("user/session/Default/History", b"more")
+        self.assertNotEqual(storage.get_version("user", "session"), version)
+
+
+class TestS3Mounts(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_mount_with_s3_options(self):
+        from browserstate_nova_adapter import create_session_config, create_session_storage, with_browserstate
+
+        s3_options = {
+            "bucket_name": "profiles",
+            "client": _FilesystemS3Client(os.path.join(self.root, "s3")),
+            "max_concurrency": 4,
+            "part_size": 5 * 1024 * 1024,
+        }
+        config = create_session_config(
+            user_id="user", session_id="session", provider="s3", s3_options=s3_options,
+            temp_dir=os.path.join(self.root, "mounts"),
+        )
+        large = os.urandom(6 * 1024 * 1024)
+        with with_browserstate(**config) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), b"logged-in")
+            _write(os.path.join(user_data_dir, "Default", "Cache", "data_1"), large)
+
+        storage = create_session_storage("s3", s3_options=s3_options)
+        self.assertEqual(storage.list_sessions("user"), ["session"])
+        self.assertIsNotNone(storage.integrity.read("user", "session"))
+        with patch.object(S3ObjectStore, "read", autospec=True, side_effect=S3ObjectStore.read) as read:
+            with with_browserstate(**config) as user_data_dir:
+                self.assertEqual(_tree(user_data_dir)["Default/Cache/data_1"], large)
+        # Fetched as two ranges
+        self.assertEqual(sum(1 for call in read.call_args_list if call.args[1].endswith("data_1")), 2)
+        with with_browserstate(**dict(config, delta=True)) as user_data_dir:
+            self.assertEqual(_tree(user_data_dir)["Default/Cookies"], b"logged-in")
+
+    def test_unsupported_configuration(self):
+        from browserstate_nova_adapter import create_session_storage
+
+        with self.assertRaises(ValueError):
+            create_session_storage("s3", s3_options={})
+        with self.assertRaises(ValueError):
+            create_session_storage("gcs", gcs_options={})
+        with self.assertRaises(ValueError):
+            create_session_storage(
+                "s3", storage_format="dedup", s3_options={"bucket_name": "profiles", "client": object()}
+            )
+
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+@unittest.skipUnless(mock_aws, "moto is not installed")
+class TestMotoS3(unittest.TestCase):
+
+    def test_multipart_round_trip(self):
+        from browserstate_nova_adapter import create_session_storage
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cache", "data_1"), os.urandom(11 * 1024 * 1024))
+        _write(os.path.join(source, "Default", "Cookies"), b"logged-in")
+        with mock_aws():
+            client = boto3.client("s3", region_name="us-east-1")
+            client.create_bucket(Bucket="profiles")
+            storage = create_session_storage(
+                "s3", s3_options={"bucket_name": "profiles", "client": client, "part_size": 5 * 1024 * 1024}
+            )
+            version = storage.upload("user", "session", source)
+            target = os.path.join(root, "target")
+            self.assertEqual(storage.download("user", "session", target), version)
+        self.assertEqual(_tree(target), _tree(source))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.mounted = []
+        self.unmounted = []
+        patcher = patch('browserstate_nova_adapter.BrowserState', side_effect=self._create)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self, options):
+        instance = MagicMock()
+
+        def mount_session(session_id):
+            with self.lock:
+                self.mounted.append(session_id)
+            return {"path": f"/tmp/{options.user_id}/{session_id}"}
+
+        def unmount_session():
+            with self.lock:
+                self.unmounted.append(options.user_id)
+
+        instance.mount_session.side_effect = mount_session
+        instance.unmount_session.side_effect = unmount_session
+        return instance
+
+    def _wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail("condition not reached")
+
+    def test_prefetched_sessions_are_ready(self):
+        from browserstate_nova_adapter import SessionPool
+
+        with SessionPool(size=2, max_workers=2, provider="local") as pool:
+            for user_id in ("a", "b", "c"):
+                pool.prefetch(user_id=user_id, session_id="s")
+
+            # Only `size` sessions are mounted ahead of time
+            self._wait_for(lambda: len(self.mounted) == 2)
+            time.sleep(0.05)
+            self.assertEqual(len(self.mounted), 2)
+
+            with pool.session(user_id="a", session_id="s") as user_data_dir:
+                self.assertEqual(user_data_dir, "/tmp/a/s")
+                # Taking one out makes room to prefetch the next queued session
+                self._wait_for(lambda: len(self.mounted) == 3)
+
+            self._wait_for(lambda: "a" in self.unmounted)
+
+        # Closing unmounts the sessions that were prefetched but never used
+        self.assertEqual(sorted(self.unmounted), ["a", "b", "c"])
+
+    def test_unknown_session_is_mounted_on_demand(self):
+        from browserstate_nova_adapter import SessionPool
+
+        with SessionPool(size=1) as pool:
+            session = pool.acquire(user_id="x", session_id="s")
+            self.assertEqual(session.path, "/tmp/x/s")
+            pool.release(session)
+            pool.wait()
+            self.assertEqual(self.unmounted, ["x"])
+
+    def test_release_applies_backpressure(self):
+        from browserstate_nova_adapter import SessionPool
+
+        gate = threading.Event()
+
+        def slow_unmount(session):
+            gate.wait(timeout=5)
+
+        with SessionPool(size=1, max_workers=1, max_pending_unmounts=1) as pool:
+            first = pool.acquire(user_id="a", session_id="s")
+            second = pool.acquire(user_id="b", session_id="s")
+            with patch.object(type(first), "unmount", slow_unmount):
+                pool.release(first)
+                released = threading.Event()
+                thread = threading.Thread(target=lambda: (pool.release(second), released.set()))
+                thread.start()
+                # The second release waits for the first upload to finish
+                self.assertFalse(released.wait(timeout=0.1))
+                gate.set()
+                self.assertTrue(released.wait(timeout=5))
+                thread.join()
+                pool.wait()
+            first.unmount()
+            second.unmount()
+
+    def test_failed_unmount_is_recorded(self):
+        from browserstate_nova_adapter import SessionPool
+
+        with SessionPool(size=1) as pool:
+            session = pool.acquire(user_id="a", session_id="s")
+            session._browserstate.unmount_session.side_effect = IOError("upload failed")
+            pool.release(session)
+            pool.wait()
+            self.assertEqual(len(pool.errors), 1)
+            self.assertIsInstance(pool.errors[0], IOError)
+
+    def test_closed_pool_rejects_use(self):
+        from browserstate_nova_adapter import SessionPool
+
+        pool = SessionPool()
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            pool.acquire(user_id="a", session_id="s")
+
+        session = MagicMock()
+        with self.assertRaisesRegex(RuntimeError, "closed"):
+            pool.release(session)
+        session.unmount.assert_not_called()
+
+    def test_acquire_timeout_keeps_the_prefetched_session(self):
+        from browserstate_nova_adapter import SessionPool
+
+        mounting = threading.Event()
+        real_create = self._create
+
+        def slow_create(options):
+            instance = real_create(options)
+            mount_session = instance.mount_session.side_effect
+
+            def slow_mount(session_id):
+                mounting.wait(timeout=5)
+                return mount_session(session_id)
+
+            instance.mount_session.side_effect = slow_mount
+            return instance
+
+        with patch('browserstate_nova_adapter.BrowserState', side_effect=slow_create):
+            pool = SessionPool(size=1)
+            pool.prefetch(user_id="a", session_id="s")
+            with self.assertRaises(TimeoutError):
+                pool.acquire(user_id="a", session_id="s", timeout=0.05)
+            mounting.set()
+            session = pool.acquire(user_id="a", session_id="s", timeout=5)
+            self.assertEqual(session.path, "/tmp/a/s")
+            pool.release(session)
+
+            # A prefetch abandoned by a timeout is still unmounted when the pool closes
+            mounting.clear()
+            pool.prefetch(user_id="b", session_id="s")
+            with self.assertRaises(TimeoutError):
+                pool.acquire(user_id="b", session_id="s", timeout=0.05)
+            mounting.set()
+            pool.close()
+        self.assertEqual(sorted(self.unmounted), ["a", "b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
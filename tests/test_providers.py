@@ -48,11 +48,13 @@ class TestProvidersConfig(unittest.TestCase):
             "ttl": 3600
         }
         
+        # No Redis server to keep checksum records in while BrowserState is mocked
         result = mount_browserstate(
             user_id="test-user",
             session_id="test-session",
             provider="redis",
-            redis_options=redis_options
+            redis_options=redis_options,
+            verify=False
         )
         
         # Verify options
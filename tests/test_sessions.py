@@ -0,0 +1,139 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+def _mock_browserstate_factory(mock_browserstate):
+    """Make every BrowserState(...) call return a fresh mock mounted at a per-session path."""
+    instances = []
+
+    def create(options):
+        instance = MagicMock()
+        instance.mount_session.side_effect = lambda session_id: {
+            "path": f"/tmp/{options.user_id}/{session_id}"
+        }
+        instances.append(instance)
+        return instance
+
+    mock_browserstate.side_effect = create
+    return instances
+
+
+class TestSessionRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_mount_returns_handle(self, mock_browserstate):
+        from browserstate_nova_adapter import mount_browserstate_session, get_mounted_sessions
+
+        instances = _mock_browserstate_factory(mock_browserstate)
+
+        session = mount_browserstate_session(user_id="user", session_id="one")
+        self.assertEqual(session.path, "/tmp/user/one")
+        self.assertEqual(session.key, ("user", "one"))
+        self.assertTrue(session.mounted)
+        self.assertEqual(get_mounted_sessions(), [session])
+
+        session.unmount()
+        self.assertFalse(session.mounted)
+        self.assertEqual(get_mounted_sessions(), [])
+        instances[0].unmount_session.assert_called_once()
+
+        # Unmounting twice is a no-op
+        session.unmount()
+        instances[0].unmount_session.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_concurrent_sessions_unmount_independently(self, mock_browserstate):
+        from browserstate_nova_adapter import mount_browserstate, unmount_browserstate
+
+        instances = _mock_browserstate_factory(mock_browserstate)
+
+        first = mount_browserstate(user_id="user", session_id="one")
+        second = mount_browserstate(user_id="user", session_id="two")
+        self.assertEqual(first, "/tmp/user/one")
+        self.assertEqual(second, "/tmp/user/two")
+
+        unmount_browserstate(user_id="user", session_id="one")
+        instances[0].unmount_session.assert_called_once()
+        instances[1].unmount_session.assert_not_called()
+
+        # Without arguments the most recent mount is unmounted
+        unmount_browserstate()
+        instances[1].unmount_session.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_duplicate_mount_gets_own_handle(self, mock_browserstate):
+        from browserstate_nova_adapter import mount_browserstate_session, get_mounted_sessions
+
+        instances = _mock_browserstate_factory(mock_browserstate)
+
+        first = mount_browserstate_session(user_id="user", session_id="one")
+        with self.assertLogs(level="WARNING"):
+            second = mount_browserstate_session(user_id="user", session_id="one")
+        self.assertEqual(get_mounted_sessions(), [first, second])
+
+        first.unmount()
+        instances[0].unmount_session.assert_called_once()
+        instances[1].unmount_session.assert_not_called()
+        self.assertEqual(get_mounted_sessions(), [second])
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_failed_mount_releases_session(self, mock_browserstate):
+        from browserstate_nova_adapter import mount_browserstate_session, get_mounted_sessions
+
+        mock_browserstate.return_value.mount_session.side_effect = IOError("download failed")
+        with self.assertRaises(IOError):
+            mount_browserstate_session(user_id="user", session_id="one")
+        self.assertEqual(get_mounted_sessions(), [])
+
+        mock_browserstate.return_value.mount_session.side_effect = None
+        mock_browserstate.return_value.mount_session.return_value = {"path": "/tmp/user/one"}
+        mount_browserstate_session(user_id="user", session_id="one").unmount()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_with_browserstate_unmounts_only_its_session(self, mock_browserstate):
+        from browserstate_nova_adapter import with_browserstate, mount_browserstate
+
+        instances = _mock_browserstate_factory(mock_browserstate)
+
+        mount_browserstate(user_id="user", session_id="outer")
+        with with_browserstate(user_id="user", session_id="inner") as user_data_dir:
+            self.assertEqual(user_data_dir, "/tmp/user/inner")
+
+        instances[0].unmount_session.assert_not_called()
+        instances[1].unmount_session.assert_called_once()
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_threads_mount_in_parallel(self, mock_browserstate):
+        from browserstate_nova_adapter import with_browserstate, get_mounted_sessions
+
+        instances = _mock_browserstate_factory(mock_browserstate)
+        barrier = threading.Barrier(8)
+        paths = []
+
+        def worker(index):
+            with with_browserstate(user_id="user", session_id=f"s{index}") as user_data_dir:
+                # All workers hold their session at the same time
+                barrier.wait(timeout=5)
+                paths.append(user_data_dir)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(paths), sorted(f"/tmp/user/s{i}" for i in range(8)))
+        self.assertEqual(get_mounted_sessions(), [])
+        for instance in instances:
+            instance.unmount_session.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
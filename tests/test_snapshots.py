@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+
+    def tearDown(self):
+        from browserstate_nova_adapter import get_mounted_sessions
+
+        for session in get_mounted_sessions():
+            session.unmount()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self, session_id, **kwargs):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id=session_id,
+            storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            **kwargs
+        )
+
+    def _login(self, **kwargs):
+        from browserstate_nova_adapter import with_browserstate
+
+        with with_browserstate(**self._config("login", **kwargs)) as user_data_dir:
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "logged-in")
+            _write(os.path.join(user_data_dir, "Default", "History"), "visited")
+
+    def test_branches_share_files_until_written(self):
+        from browserstate_nova_adapter import (
+            branch_session,
+            create_snapshot,
+            delete_snapshot,
+            list_snapshots,
+            with_browserstate,
+        )
+
+        self._login()
+        snapshot_id = create_snapshot("user", "login", "signed-in", storage_path=self.storage_path)
+        self.assertEqual(snapshot_id, "signed-in")
+        for session_id in ("worker-1", "worker-2"):
+            branch_session("user", snapshot_id, session_id, storage_path=self.storage_path)
+
+        storage = LocalSessionStorage(self.storage_path)
+        cookies = [
+            os.stat(os.path.join(storage.session_path("user", session_id), "Default", "Cookies")).st_ino
+            for session_id in ("login", "worker-1", "worker-2")
+        ]
+        # Hard links to the same file, not copies
+        self.assertEqual(len(set(cookies)), 1)
+
+        with with_browserstate(**self._config("worker-1")) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+            _write(os.path.join(user_data_dir, "Default", "Cookies"), "worker-1")
+        with with_browserstate(**self._config("worker-2")) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+
+        self.assertEqual(list_snapshots("user", storage_path=self.storage_path), ["signed-in"])
+        self.assertEqual(storage.list_sessions("user"), ["login", "worker-1", "worker-2"])
+        self.assertTrue(delete_snapshot("user", snapshot_id, storage_path=self.storage_path))
+        self.assertFalse(delete_snapshot("user", snapshot_id, storage_path=self.storage_path))
+        self.assertEqual(list_snapshots("user", storage_path=self.storage_path), [])
+        # Branches outlive their snapshot
+        with with_browserstate(**self._config("worker-2")) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+
+    def test_missing_session_or_snapshot(self):
+        from browserstate_nova_adapter import branch_session, create_snapshot, mount_branches
+
+        with self.assertRaises(ValueError):
+            create_snapshot("user", "nothing", storage_path=self.storage_path)
+        with self.assertRaises(ValueError):
+            branch_session("user", "nothing", "worker", storage_path=self.storage_path)
+        with self.assertRaises(ValueError):
+            mount_branches("user", "nothing", ["worker"], storage_path=self.storage_path)
+        with self.assertRaises(ValueError):
+            create_snapshot("user", "login", provider="s3")
+
+    def test_mount_branches_downloads_once(self):
+        from browserstate_nova_adapter import create_snapshot, get_mounted_sessions, mount_branches, unmount_many
+
+        self._login()
+        snapshot_id = create_snapshot("user", "login", storage_path=self.storage_path)
+        real_download = LocalSessionStorage.download
+        with patch.object(LocalSessionStorage, "download", autospec=True, side_effect=real_download) as download:
+            sessions = mount_branches(
+                "user", snapshot_id, [f"worker-{n}" for n in range(3)],
+                storage_path=self.storage_path, temp_dir=os.path.join(self.root, "mounts"), delta=True
+            )
+        self.assertEqual(download.call_count, 1)
+        self.assertEqual([session.session_id for session in sessions], ["worker-0", "worker-1", "worker-2"])
+        self.assertEqual(len(get_mounted_sessions()), 3)
+        self.assertEqual(len({session.path for session in sessions}), 3)
+        for session in sessions:
+            self.assertIsNotNone(session._verified_record)
+            self.assertEqual(set(session._manifest), {"Default/Cookies", "Default/History"})
+            _write(os.path.join(session.path, "Default", "Cookies"), session.session_id)
+        self.assertEqual([r.error for r in unmount_many(sessions)], [None] * 3)
+        self.assertEqual(os.listdir(os.path.join(self.root, "mounts", "user")), [])
+
+        storage = LocalSessionStorage(self.storage_path)
+        for n in range(3):
+            stored = os.path.join(storage.session_path("user", f"worker-{n}"), "Default")
+            self.assertEqual(_read(os.path.join(stored, "Cookies")), f"worker-{n}")
+            self.assertEqual(_read(os.path.join(stored, "History")), "visited")
+        self.assertEqual(_read(os.path.join(storage.session_path("user", "login"), "Default", "Cookies")), "logged-in")
+
+    def test_corrupt_snapshot_is_not_mounted(self):
+        from browserstate_nova_adapter import (
+            IntegrityError,
+            create_session_storage,
+            create_snapshot,
+            get_mounted_sessions,
+            mount_branches,
+        )
+
+        self._login()
+        snapshot_id = create_snapshot("user", "login", storage_path=self.storage_path)
+        snapshot_path = create_session_storage(storage_path=self.storage_path).snapshots.session_path(
+            "user", snapshot_id
+        )
+        os.remove(os.path.join(snapshot_path, "Default", "History"))
+        _write(os.path.join(snapshot_path, "Default", "History"), "tampered")
+        with self.assertRaises(IntegrityError):
+            mount_branches("user", snapshot_id, ["a", "b"], storage_path=self.storage_path,
+                           temp_dir=os.path.join(self.root, "mounts"))
+        self.assertEqual(get_mounted_sessions(), [])
+        self.assertEqual(os.listdir(os.path.join(self.root, "mounts", "user")), [])
+
+        sessions = mount_branches("user", snapshot_id, ["a"], storage_path=self.storage_path, verify=False,
+                                  temp_dir=os.path.join(self.root, "mounts"))
+        self.assertEqual(_read(os.path.join(sessions[0].path, "Default", "History")), "tampered")
+
+    def test_packed_formats(self):
+        from browserstate_nova_adapter import (
+            branch_session,
+            create_blob_store,
+            create_snapshot,
+            delete_snapshot,
+            mount_branches,
+            with_browserstate,
+        )
+
+        for storage_format in ("archive", "dedup"):
+            with self.subTest(storage_format=storage_format):
+                options = {"storage_format": storage_format, "format_options": {"compression": "gzip"}}
+                self._login(**options)
+                blobs = create_blob_store("local", self.storage_path, namespace="dedup")
+                chunks = blobs.list("chunks/")
+                snapshot_id = create_snapshot("user", "login", storage_path=self.storage_path, **options)
+                if storage_format == "dedup":
+                    # Only references are added
+                    self.assertEqual(blobs.list("chunks/"), chunks)
+                branch_session("user", snapshot_id, "branch", storage_path=self.storage_path, **options)
+                with with_browserstate(**self._config("branch", **options)) as user_data_dir:
+                    self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+                    _write(os.path.join(user_data_dir, "Default", "Cookies"), "branch")
+
+                sessions = mount_branches("user", snapshot_id, ["fork"], storage_path=self.storage_path,
+                                          temp_dir=os.path.join(self.root, "mounts"), **options)
+                self.assertIsNotNone(sessions[0]._verified_record)
+                self.assertEqual(_read(os.path.join(sessions[0].path, "Default", "Cookies")), "logged-in")
+                sessions[0].unmount()
+                self.assertTrue(delete_snapshot("user", snapshot_id, storage_path=self.storage_path, **options))
+                with with_browserstate(**self._config("fork", **options)) as user_data_dir:
+                    self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), "logged-in")
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisSnapshots(unittest.TestCase):
+
+    def test_copied_on_the_server(self):
+        from browserstate_nova_adapter import create_session_storage
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        client = fakeredis.FakeRedis()
+        storage = create_session_storage("redis", redis_options={"key_prefix": "test"}, redis_client=client)
+        source = os.path.join(root, "source")
+        _write(os.path.join(source, "Default", "Cookies"), "logged-in")
+        version = storage.upload("user", "login", source)
+
+        with patch.object(storage, "download", side_effect=AssertionError("downloaded")):
+            snapshot_version = storage.copy_session("user", "login", storage.snapshots, "snap")
+            branch_version = storage.snapshots.copy_session("user", "snap", storage, "worker")
+        self.assertEqual(len({version, snapshot_version, branch_version}), 3)
+        self.assertEqual(storage.get_version("user", "worker"), branch_version)
+        self.assertEqual(storage.list_sessions("user"), ["login", "worker"])
+        self.assertEqual(storage.snapshots.list_sessions("user"), ["snap"])
+
+        target = os.path.join(root, "target")
+        storage.download("user", "worker", target)
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), "logged-in")
+        self.assertTrue(storage.snapshots.delete("user", "snap"))
+        self.assertIsNone(storage.snapshots.copy_session("user", "snap", storage, "other"))
+        self.assertEqual(storage.list_sessions("user"), ["login", "worker"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter import mount_browserstate_session
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TestRedisStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_streaming_mount_is_memory_bounded(self, mock_browserstate):
+        client = fakeredis.FakeRedis()
+        options = dict(
+            user_id="user", session_id="session", provider="redis",
+            redis_options={"key_prefix": "test"}, temp_dir=os.path.join(self.root, "mounts"),
+            format_options={"buffer_size": 64 * 1024}, streaming=True,
+        )
+        with patch("browserstate_nova_adapter.storage._redis_client", return_value=client):
+            session = mount_browserstate_session(**options)
+            os.makedirs(os.path.join(session.path, "Default"))
+            # Incompressible, so the archive is as large as the profile
+            with open(os.path.join(session.path, "Default", "Cache"), "wb") as f:
+                for _ in range(24):
+                    f.write(os.urandom(1024 * 1024))
+            session.unmount()
+            self.assertGreater(client.strlen("test:user:session"), 32 * 1024 * 1024)
+            self.assertEqual(client.keys("test:nova-upload:*"), [])
+
+            tracemalloc.start()
+            try:
+                session = mount_browserstate_session(**options)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(os.path.getsize(os.path.join(session.path, "Default", "Cache")), 24 * 1024 * 1024)
+            session.unmount()
+        self.assertLess(peak, 4 * 1024 * 1024)
+        # BrowserState would have loaded the whole archive into memory
+        mock_browserstate.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
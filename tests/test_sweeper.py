@@ -0,0 +1,136 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+from browserstate_nova_adapter.sweeper import SessionSweeper, main
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _age(storage, user_id, session_id, seconds):
+    """Pretend a session was last used the given number of seconds ago."""
+    then = time.time() - seconds
+    for path in (storage.session_path(user_id, session_id), storage.access_path(user_id, session_id)):
+        if os.path.exists(path):
+            os.utime(path, (then, then))
+
+
+class TestSessionSweeper(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = LocalSessionStorage(os.path.join(self.root, "storage"))
+        self.mounts = os.path.join(self.root, "mounts")
+        self.profile = os.path.join(self.root, "profile")
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"x" * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _sweeper(self, **kwargs):
+        return SessionSweeper(self.storage, temp_dirs=[self.mounts], **kwargs)
+
+    def test_incremental_scans_and_ttl(self):
+        for user_id, session_id in [("alice", "a"), ("alice", "b"), ("alice", "c"), ("bob", "a"), ("bob", "b")]:
+            self.storage.upload(user_id, session_id, self.profile)
+        _age(self.storage, "alice", "b", 7200)
+        _age(self.storage, "bob", "a", 7200)
+
+        sweeper = self._sweeper(batch_size=2, ttl=3600)
+        self.assertEqual(sweeper.scan(), 2)
+        self.assertEqual({(u.user_id, u.session_id) for u in sweeper.usage()}, {("alice", "a"), ("alice", "b")})
+        # A new sweeper picks up where the previous one stopped
+        sweeper = self._sweeper(batch_size=2, ttl=3600)
+        self.assertEqual(sweeper.scan(), 2)
+        self.assertEqual(sweeper.scan(), 2)
+        usage = sweeper.usage()
+        self.assertEqual(len(usage), 5)
+        self.assertEqual([(u.user_id, u.session_id) for u in usage[:2]], [("alice", "b"), ("bob", "a")])
+        self.assertTrue(all(u.size == 1000 for u in usage))
+
+        # Downloading a session counts as using it
+        self.storage.download("bob", "a", os.path.join(self.root, "target"))
+        expired, freed = sweeper.expire()
+        self.assertEqual(expired, [("alice", "b")])
+        self.assertEqual(freed, 1000)
+        self.assertEqual(self.storage.list_sessions("alice"), ["a", "c"])
+        self.assertFalse(os.path.exists(self.storage.access_path("alice", "b")))
+
+        # Sessions deleted behind the sweeper's back leave the index on the next scan
+        self.storage.delete("bob", "b")
+        sweeper.scan(limit=10)
+        self.assertEqual(len(sweeper.usage()), 3)
+
+    def test_size_budget_evicts_least_recently_used(self):
+        for number, session_id in enumerate(["old", "middle", "new"]):
+            self.storage.upload("user", session_id, self.profile)
+            _age(self.storage, "user", session_id, 300 - 100 * number)
+        result = self._sweeper(max_bytes=1500).sweep()
+        self.assertEqual(result.scanned, 3)
+        self.assertEqual(result.expired, [("user", "old"), ("user", "middle")])
+        self.assertEqual(result.freed_bytes, 2000)
+        self.assertEqual(self.storage.list_sessions("user"), ["new"])
+
+    def test_mounts_of_live_and_dead_processes(self):
+        from browserstate_nova_adapter import mount_browserstate_session
+
+        self.storage.upload("user", "session", self.profile)
+        session = mount_browserstate_session(
+            user_id="user", session_id="session", storage_path=self.storage.base_path,
+            temp_dir=self.mounts, delta=True,
+        )
+        _age(self.storage, "user", "session", 7200)
+        marker = os.path.join(os.path.dirname(session.path), f".{os.path.basename(session.path)}.owner")
+        self.assertTrue(os.path.isfile(marker))
+
+        # A worker that crashed with a session mounted
+        worker = subprocess.Popen([sys.executable, "-c", "pass"])
+        worker.wait()
+        crashed = os.path.join(self.mounts, "user", "other-0123abcd")
+        _write(os.path.join(crashed, "Default", "Cookies"), b"left behind")
+        with open(marker) as f:
+            owner = json.load(f)
+        _write(os.path.join(self.mounts, "user", ".other-0123abcd.owner"),
+               json.dumps(dict(owner, pid=worker.pid, session_id="other")).encode())
+
+        sweeper = self._sweeper(ttl=3600)
+        result = sweeper.sweep()
+        self.assertEqual(result.reclaimed_mounts, [crashed])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.mounts, "user"))),
+            sorted([os.path.basename(session.path), os.path.basename(marker)]),
+        )
+        self.assertTrue(os.path.isdir(session.path))
+        # Mounted sessions are never expired
+        self.assertEqual(result.expired, [])
+
+        session.unmount()
+        self.assertEqual(os.listdir(os.path.join(self.mounts, "user")), [])
+
+    def test_command_line(self):
+        self.storage.upload("user", "session", self.profile)
+        _age(self.storage, "user", "session", 7200)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = main([
+                "--storage-path", self.storage.base_path, "--ttl", "3600", "--temp-dir", self.mounts,
+            ])
+        self.assertEqual(status, 0)
+        self.assertIn("expired 1 (1000 bytes)", output.getvalue())
+        self.assertEqual(self.storage.list_sessions("user"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from browserstate_nova_adapter.blobs import LocalBlobStore
+from browserstate_nova_adapter.objects import LocalObjectStore
+from browserstate_nova_adapter.storage import LocalSessionStorage, ObjectSessionStorage
+from browserstate_nova_adapter.tiered import TieredSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TestTieredStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.profile = os.path.join(self.root, "profile")
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"logged-in")
+        _write(os.path.join(self.profile, "Local State"), b"{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _storage(self, **kwargs):
+        hot = LocalSessionStorage(os.path.join(self.root, "hot"))
+        cold = ObjectSessionStorage(LocalObjectStore(os.path.join(self.root, "bucket")))
+        index = LocalBlobStore(os.path.join(self.root, "hot", ".nova-tiers"))
+        return TieredSessionStorage(hot, cold, index, **kwargs)
+
+    def test_write_back_and_fresh_reads(self):
+        storage = self._storage()
+        version = storage.upload("user", "session", self.profile)
+        self.assertTrue(storage.flush(timeout=10))
+        self.assertEqual(storage.hot.get_version("user", "session"), version)
+        self.assertIsNotNone(storage.cold.get_version("user", "session"))
+        self.assertEqual(storage.get_version("user", "session"), version)
+
+        with patch.object(storage.cold, "download", wraps=storage.cold.download) as cold_download:
+            target = os.path.join(self.root, "target")
+            self.assertEqual(storage.download("user", "session", target), version)
+        cold_download.assert_not_called()
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), b"logged-in")
+
+        # Another worker replaced the session in the cold tier
+        _write(os.path.join(self.profile, "Default", "Cookies"), b"elsewhere")
+        storage.cold.upload("user", "session", self.profile)
+        target = os.path.join(self.root, "target-2")
+        new_version = storage.download("user", "session", target)
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), b"elsewhere")
+        self.assertEqual(storage.list_sessions("user"), ["session"])
+
+        self.assertTrue(storage.delete("user", "session"))
+        self.assertIsNone(storage.get_version("user", "session"))
+        self.assertEqual(storage.list_sessions("user"), [])
+
+    def test_unreplicated_sessions_stay_hot(self):
+        storage = self._storage(max_retries=0)
+        with patch.object(storage.cold, "upload", side_effect=IOError("network down")):
+            version = storage.upload("user", "session", self.profile)
+            storage.flush(timeout=10)
+        self.assertTrue(storage.errors)
+        self.assertIsNone(storage.cold.get_version("user", "session"))
+        # The hot copy is the only one, so it is served and kept
+        self.assertEqual(storage.get_version("user", "session"), version)
+        self.assertEqual(storage.evict(max_bytes=0), [])
+        self.assertEqual(storage.download("user", "session", os.path.join(self.root, "target")), version)
+
+        self.assertEqual(storage.replicate_pending(), 1)
+        self.assertTrue(storage.flush(timeout=10))
+        self.assertIsNotNone(storage.cold.get_version("user", "session"))
+        self.assertEqual(storage.replicate_pending(), 0)
+
+    def test_eviction_by_size_and_age(self):
+        storage = self._storage()
+        for session_id in ("old", "middle", "new"):
+            storage.upload("user", session_id, self.profile)
+            storage.flush(timeout=10)
+            time.sleep(0.01)
+        self.assertEqual(storage.evict(max_bytes=15), [("user", "old"), ("user", "middle")])
+        self.assertEqual(storage.hot.list_sessions("user"), ["new"])
+        self.assertEqual(storage.list_sessions("user"), ["middle", "new", "old"])
+
+        # Evicted sessions come back from the cold tier
+        target = os.path.join(self.root, "target")
+        self.assertIsNotNone(storage.download("user", "old", target))
+        self.assertEqual(_read(os.path.join(target, "Default", "Cookies")), b"logged-in")
+        self.assertEqual(storage.hot.list_sessions("user"), ["new", "old"])
+
+        self.assertEqual(storage.evict(max_age=0), [("user", "new"), ("user", "old")])
+        self.assertEqual(storage.hot.list_sessions("user"), [])
+
+    def test_mount_with_tiered_provider(self):
+        from browserstate_nova_adapter import create_session_config, create_session_storage, with_browserstate
+
+        bucket = LocalObjectStore(os.path.join(self.root, "bucket"))
+        config = create_session_config(
+            user_id="user", session_id="session", provider="tiered",
+            storage_path=os.path.join(self.root, "hot"), temp_dir=os.path.join(self.root, "mounts"),
+            s3_options={"bucket_name": "profiles"}, tier_options={"hot": "local", "max_bytes": 1024 ** 3},
+        )
+        with patch("browserstate_nova_adapter.storage.create_object_store", return_value=bucket):
+            with with_browserstate(**config) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Default", "Cookies"), b"logged-in")
+            storage = create_session_storage(
+                "tiered", os.path.join(self.root, "hot"), s3_options={"bucket_name": "profiles"}
+            )
+            self.assertTrue(storage.flush(timeout=10))
+            self.assertEqual(bucket.read("user/session/Default/Cookies"), b"logged-in")
+            self.assertIsNotNone(storage.cold.integrity.read("user", "session"))
+
+            # A worker without the hot copy mounts from the bucket and verifies it
+            storage.evict(max_age=0)
+            self.assertEqual(storage.hot.list_sessions("user"), [])
+            with patch("browserstate_nova_adapter._fall_back") as fall_back:
+                with with_browserstate(**config) as user_data_dir:
+                    self.assertEqual(_read(os.path.join(user_data_dir, "Default", "Cookies")), b"logged-in")
+            fall_back.assert_not_called()
+            self.assertEqual(storage.hot.list_sessions("user"), ["session"])
+            self.assertIsNotNone(storage.integrity.read("user", "session"))
+
+    def test_unsupported_tiers(self):
+        from browserstate_nova_adapter import create_session_storage
+
+        with self.assertRaises(ValueError):
+            create_session_storage("tiered", tier_options={"hot": "s3"}, s3_options={"bucket_name": "profiles"})
+        with self.assertRaises(ValueError):
+            create_session_storage("tiered", tier_options={"cold": "local"})
+
+
+if __name__ == '__main__':
+    unittest.main()
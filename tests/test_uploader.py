@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from browserstate_nova_adapter.storage import LocalSessionStorage
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestBackgroundUploader(unittest.TestCase):
+
+    def setUp(self):
+        from browserstate_nova_adapter import BackgroundUploader
+
+        self.root = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.root, "storage")
+        self.staging_dir = os.path.join(self.root, "staging")
+        self.uploader = BackgroundUploader(self.staging_dir, retry_delay=0)
+        self.stored_cookies = os.path.join(self.storage_path, "user", "session", "Cookies")
+
+    def tearDown(self):
+        self.uploader.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _config(self, uploader=None):
+        from browserstate_nova_adapter import create_session_config
+
+        return create_session_config(
+            user_id="user",
+            session_id="session",
+            storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"),
+            delta=True,
+            uploader=uploader or self.uploader,
+        )
+
+    def test_exit_does_not_wait_for_upload(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        release = threading.Event()
+        real_upload = LocalSessionStorage.upload
+
+        def blocked_upload(storage, *args):
+            release.wait(timeout=5)
+            return real_upload(storage, *args)
+
+        with patch.object(LocalSessionStorage, "upload", blocked_upload):
+            with with_browserstate(**self._config()) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+            # The profile moved to the staging area and the mount directory is gone
+            self.assertFalse(os.path.exists(user_data_dir))
+            self.assertFalse(os.path.exists(self.stored_cookies))
+            self.assertEqual(len(os.listdir(self.staging_dir)), 1)
+
+            release.set()
+            self.assertTrue(self.uploader.flush(timeout=5))
+
+        self.assertEqual(_read(self.stored_cookies), "logged-in")
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_failed_upload_is_retried(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        real_upload = LocalSessionStorage.upload
+        attempts = []
+
+        def flaky_upload(storage, *args):
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise IOError("connection reset")
+            return real_upload(storage, *args)
+
+        with patch.object(LocalSessionStorage, "upload", flaky_upload):
+            with with_browserstate(**self._config()) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+            self.uploader.flush()
+
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(self.uploader.errors, [])
+        self.assertEqual(_read(self.stored_cookies), "logged-in")
+
+    def test_flush_returns_after_the_error_is_recorded(self):
+        import time
+        from browserstate_nova_adapter import BackgroundUploader, with_browserstate
+
+        failing = BackgroundUploader(self.staging_dir, max_retries=0)
+
+        def slow_log(*args, **kwargs):
+            # Widens the gap between the upload failing and its error being recorded
+            time.sleep(0.2)
+
+        with patch.object(LocalSessionStorage, "upload", side_effect=IOError("offline")):
+            with patch("logging.error", slow_log):
+                with with_browserstate(**self._config(failing)) as user_data_dir:
+                    _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+                self.assertTrue(failing.flush())
+                self.assertEqual(len(failing.errors), 1)
+        failing.close()
+
+    def test_lease_is_kept_across_retries(self):
+        from browserstate_nova_adapter import create_session_config, mount_browserstate_session, with_browserstate
+
+        real_upload_changes = LocalSessionStorage.upload_changes
+        attempts = []
+
+        def flaky_upload_changes(storage, *args):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise IOError("connection reset")
+            return real_upload_changes(storage, *args)
+
+        LocalSessionStorage(self.storage_path).upload("user", "session", self._profile("logged-out"))
+        config = dict(self._config(), lease=True)
+        with patch.object(LocalSessionStorage, "upload_changes", flaky_upload_changes):
+            with with_browserstate(**config) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+            self.assertTrue(self.uploader.flush(timeout=10))
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self.uploader.errors, [])
+        self.assertEqual(_read(self.stored_cookies), "logged-in")
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        # Released once uploaded
+        session = mount_browserstate_session(**create_session_config(
+            user_id="user", session_id="session", storage_path=self.storage_path,
+            temp_dir=os.path.join(self.root, "mounts"), delta=True, lease=True, lease_options={"timeout": 0},
+        ))
+        session.unmount()
+
+    def _profile(self, cookies):
+        path = os.path.join(self.root, "profile")
+        _write(os.path.join(path, "Cookies"), cookies)
+        return path
+
+    def test_staged_upload_is_recovered(self):
+        from browserstate_nova_adapter import BackgroundUploader, with_browserstate
+
+        failing = BackgroundUploader(self.staging_dir, max_retries=1, retry_delay=0)
+        with patch.object(LocalSessionStorage, "upload", side_effect=IOError("offline")):
+            with with_browserstate(**self._config(failing)) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "logged-in")
+            failing.close()
+        self.assertEqual(len(failing.errors), 1)
+        [name] = os.listdir(self.staging_dir)
+        # The job file names the session but holds no storage settings
+        with open(os.path.join(self.staging_dir, name, "job.json")) as f:
+            self.assertEqual(json.load(f), {
+                "user_id": "user", "session_id": "session", "provider": "local", "storage_format": "browserstate",
+            })
+
+        # Jobs of other storage are left alone
+        self.assertEqual(self.uploader.recover(dict(self._config(), storage_format="archive")), 0)
+        # A later uploader (e.g. after a restart) picks the staged job up with the storage settings
+        self.assertEqual(self.uploader.recover(self._config()), 1)
+        self.uploader.flush()
+        self.assertEqual(self.uploader.errors, [])
+        self.assertEqual(_read(self.stored_cookies), "logged-in")
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        # Uploaded in full with a new checksum record, so verified mounts accept it
+        with with_browserstate(**self._config()) as user_data_dir:
+            self.assertEqual(_read(os.path.join(user_data_dir, "Cookies")), "logged-in")
+
+    def test_remount_waits_for_pending_upload(self):
+        from browserstate_nova_adapter import with_browserstate
+
+        release = threading.Event()
+        real_upload = LocalSessionStorage.upload
+
+        def blocked_upload(storage, *args):
+            release.wait(timeout=5)
+            return real_upload(storage, *args)
+
+        with patch.object(LocalSessionStorage, "upload", blocked_upload):
+            with with_browserstate(**self._config()) as user_data_dir:
+                _write(os.path.join(user_data_dir, "Cookies"), "first")
+            threading.Timer(0.1, release.set).start()
+            with with_browserstate(**self._config()) as user_data_dir:
+                self.assertEqual(_read(os.path.join(user_data_dir, "Cookies")), "first")
+
+    @patch('browserstate_nova_adapter.BrowserState')
+    def test_browserstate_sessions_unmount_in_background(self, mock_browserstate):
+        from browserstate_nova_adapter import with_browserstate
+
+        release = threading.Event()
+        mock_instance = MagicMock()
+        mock_instance.mount_session.return_value = {"path": "/tmp/browser_data"}
+        mock_instance.unmount_session.side_effect = lambda: release.wait(timeout=5)
+        mock_browserstate.return_value = mock_instance
+
+        with with_browserstate(user_id="user", session_id="session", uploader=self.uploader):
+            pass
+        self.assertFalse(self.uploader.flush(timeout=0.05))
+        release.set()
+        self.assertTrue(self.uploader.flush(timeout=5))
+        mock_instance.unmount_session.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()